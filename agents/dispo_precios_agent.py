@@ -11,13 +11,15 @@ import json
 import datetime
 import asyncio
 import re
-from langchain_openai import ChatOpenAI
 from langchain.agents import create_openai_tools_agent, AgentExecutor
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.tools import Tool
 
 # Core imports
+from core.agent_context import turn_scratch
+from core.availability_cache import availability_cache, availability_key
 from core.mcp_client import get_tools
+from core.pms_token_cache import get_pms_token, invoke_with_pms_token
 from core.utils.normalize_reply import normalize_reply
 from core.utils.utils_prompt import load_prompt
 from core.utils.time_context import get_time_context
@@ -40,11 +42,9 @@ class DispoPreciosAgent:
         memory_manager: instancia opcional de MemoryManager
         model_name / temperature: opcionales. Si no se pasan, se leen de ModelConfig (SUBAGENT).
         """
-        self._last_chat_history = []
-        self._last_rooms = []
-        self._last_dates = None
-        self._last_occupancy = None
-        self._current_chat_id = None
+        # Estado por consulta; si hay un turno del MainAgent enlazado vive en el turno
+        # para que la instancia pueda compartirse entre chats concurrentes.
+        self._local_state = self._empty_state()
         # ✅ Modelo centralizado + posibilidad de override
         if model_name is not None or temperature is not None:
             default_name, default_temp = ModelConfig.get_model(ModelTier.SUBAGENT)
@@ -52,7 +52,7 @@ class DispoPreciosAgent:
                 model_name = default_name
             if temperature is None:
                 temperature = default_temp
-            self.llm = ChatOpenAI(model=model_name, temperature=temperature)
+            self.llm = ModelConfig.get_custom_llm(model_name, temperature, label=ModelTier.SUBAGENT.value)
             self.model_name = model_name
             self.temperature = temperature
         else:
@@ -63,11 +63,8 @@ class DispoPreciosAgent:
 
         self.memory_manager = memory_manager
 
-        # 🧩 Construcción inicial del prompt con contexto temporal
-        base_prompt = load_prompt("dispo_precios_prompt.txt") or self._get_default_prompt()
-        self.prompt_text = f"{get_time_context()}\n\n{base_prompt.strip()}"
-
-        # Inicialización de tools y agente
+        # Inicialización de tools y agente (una sola vez). El system prompt con el
+        # contexto temporal y dinámico se pasa en cada invocación.
         self.tools = [self._build_tool()]
         self.agent_executor = self._build_agent_executor()
 
@@ -76,6 +73,65 @@ class DispoPreciosAgent:
             f"(modelo={self.model_name}, temp={self.temperature})"
         )
 
+    # ----------------------------------------------------------
+    @staticmethod
+    def _empty_state() -> dict:
+        return {
+            "chat_id": None,
+            "chat_history": [],
+            "rooms": [],
+            "dates": None,
+            "occupancy": None,
+        }
+
+    def _state(self) -> dict:
+        scratch = turn_scratch("dispo_precios")
+        if scratch is None:
+            return self._local_state
+        if not scratch:
+            scratch.update(self._empty_state())
+        return scratch
+
+    @property
+    def _current_chat_id(self):
+        return self._state()["chat_id"]
+
+    @_current_chat_id.setter
+    def _current_chat_id(self, value):
+        self._state()["chat_id"] = value
+
+    @property
+    def _last_chat_history(self):
+        return self._state()["chat_history"]
+
+    @_last_chat_history.setter
+    def _last_chat_history(self, value):
+        self._state()["chat_history"] = value
+
+    @property
+    def _last_rooms(self):
+        return self._state()["rooms"]
+
+    @_last_rooms.setter
+    def _last_rooms(self, value):
+        self._state()["rooms"] = value
+
+    @property
+    def _last_dates(self):
+        return self._state()["dates"]
+
+    @_last_dates.setter
+    def _last_dates(self, value):
+        self._state()["dates"] = value
+
+    @property
+    def _last_occupancy(self):
+        return self._state()["occupancy"]
+
+    @_last_occupancy.setter
+    def _last_occupancy(self, value):
+        self._state()["occupancy"] = value
+
     # ----------------------------------------------------------
     def _get_default_prompt(self) -> str:
         """Prompt por defecto si no existe el archivo en disco."""
@@ -115,14 +171,12 @@ class DispoPreciosAgent:
                     except Exception:
                         instance_url = None
 
-                # Obtener token de acceso
-                token_payload = {"instance_url": instance_url} if instance_url else {}
-                token_raw = await token_tool.ainvoke(token_payload)
-                token_data = json.loads(token_raw) if isinstance(token_raw, str) else token_raw
-                token = (
-                    token_data[0].get("key") if isinstance(token_data, list)
-                    else token_data.get("key")
-                )
+                # Obtener token de acceso (cacheado por instance_url)
+                token_instance_url = instance_url
+                try:
+                    token = await get_pms_token(token_tool, token_instance_url)
+                except ValueError:
+                    token = None
 
                 if not token:
                     log.error("❌ No se pudo obtener el token de acceso.")
@@ -185,17 +239,35 @@ class DispoPreciosAgent:
                         "En cuanto lo reciba, continúo."
                     )
 
+                async def _load_availability():
+                    raw_reply = await invoke_with_pms_token(
+                        token_tool,
+                        token_instance_url,
+                        lambda key: dispo_tool.ainvoke({**params, "key": key}),
+                        token=token,
+                    )
+                    return json.loads(raw_reply) if isinstance(raw_reply, str) else raw_reply
+
+                async def _query_availability():
+                    # Caché compartida entre conversaciones (misma propiedad, fechas y ocupación).
+                    cache_key = availability_key(
+                        params["instance_url"],
+                        params["property_id"],
+                        checkin,
+                        checkout,
+                        params["occupancy"],
+                    )
+                    return await availability_cache.get_or_load(cache_key, _load_availability)
+
                 # Reutiliza la última respuesta si coincide fechas/occupancy.
                 if self._last_rooms and self._last_dates and self._last_occupancy:
                     if self._is_same_request(query, self._last_rooms, self._last_dates, self._last_occupancy):
                         rooms = self._last_rooms
                         log.info("♻️ Reutilizando última respuesta de disponibilidad (sin nueva llamada).")
                     else:
-                        raw_reply = await dispo_tool.ainvoke(params)
-                        rooms = json.loads(raw_reply) if isinstance(raw_reply, str) else raw_reply
+                        rooms = await _query_availability()
                 else:
-                    raw_reply = await dispo_tool.ainvoke(params)
-                    rooms = json.loads(raw_reply) if isinstance(raw_reply, str) else raw_reply
+                    rooms = await _query_availability()
 
                 # Guarda contexto de la última consulta satisfactoria
                 if rooms and isinstance(rooms, list):
@@ -241,11 +313,23 @@ class DispoPreciosAgent:
             return_direct=True,
         )
 
+    # ----------------------------------------------------------
+    def _build_system_prompt(self, chat_id: str = None) -> str:
+        """System prompt del turno: contexto temporal + prompt base + contexto dinámico del chat."""
+        base_prompt = load_prompt("dispo_precios_prompt.txt") or self._get_default_prompt()
+        prompt_text = f"{get_time_context()}\n\n{base_prompt.strip()}"
+        dynamic_context = build_dynamic_context_from_memory(self.memory_manager, chat_id)
+        if dynamic_context:
+            prompt_text = f"{prompt_text}\n\n{dynamic_context}"
+        # Antes el prompt se usaba como plantilla: "{{" llegaba al LLM como "{".
+        return prompt_text.replace("{{", "{").replace("}}", "}")
+
     # ----------------------------------------------------------
     def _build_agent_executor(self) -> AgentExecutor:
         """Crea el AgentExecutor con control de iteraciones y sin pasos intermedios."""
+        # El system prompt entra como variable: cambia en cada turno sin reconstruir el executor.
         prompt = ChatPromptTemplate.from_messages([
-            ("system", self.prompt_text),
+            ("system", "{system_prompt}"),
             MessagesPlaceholder("chat_history"),
             ("user", "{input}"),
             MessagesPlaceholder("agent_scratchpad"),
@@ -536,7 +620,7 @@ class DispoPreciosAgent:
             self._current_chat_id = chat_id
             if not chat_history and self.memory_manager and chat_id:
                 try:
-                    chat_history = self.memory_manager.get_memory_as_messages(
+                    chat_history = await self.memory_manager.aget_memory_as_messages(
                         conversation_id=chat_id,
                         limit=20,
                     )
@@ -547,16 +631,9 @@ class DispoPreciosAgent:
             # Guarda el historial para que la tool pueda reutilizarlo (fechas/ocupación).
             self._last_chat_history = chat_history or []
 
-            # 🔁 Refrescar contexto temporal antes de cada ejecución
-            base_prompt = load_prompt("dispo_precios_prompt.txt") or self._get_default_prompt()
-            dynamic_context = build_dynamic_context_from_memory(self.memory_manager, chat_id)
-            if dynamic_context:
-                self.prompt_text = f"{get_time_context()}\n\n{base_prompt.strip()}\n\n{dynamic_context}"
-            else:
-                self.prompt_text = f"{get_time_context()}\n\n{base_prompt.strip()}"
-            self.agent_executor = self._build_agent_executor()
-
+            # 🔁 Contexto temporal y dinámico refrescado en cada ejecución
             result = await self.agent_executor.ainvoke({
+                "system_prompt": self._build_system_prompt(chat_id),
                 "input": pregunta.strip(),
                 "chat_history": chat_history or [],
             })
@@ -11,6 +11,7 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
+import os
 import re
 from typing import ClassVar, List, Optional, Tuple
 
@@ -20,16 +21,24 @@ from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
 from core.config import ModelConfig, ModelTier
+from core.kb_retrieval_cache import kb_key, kb_retrieval_cache
 from core.language_manager import language_manager
 from core.mcp_client import get_tools
+from core.utils.env import env_bool
 from core.utils.normalize_reply import normalize_reply
 from core.utils.time_context import get_time_context
 from core.utils.utils_prompt import load_prompt
 from core.utils.dynamic_context import build_dynamic_context_from_memory
+from core.utils.kb_rerank import is_ambiguous, rank_chunks
 
 log = logging.getLogger("InfoAgent")
 
 ESCALATION_TOKEN = "ESCALATION_REQUIRED"
+# Tiempo máximo de la búsqueda en KB (todas las variantes en paralelo).
+KB_SEARCH_BUDGET_S = float(os.getenv("KB_SEARCH_BUDGET_S", "8"))
+# Rerank de fragmentos: léxico (BM25) por defecto; LLM solo si se activa y el corte es dudoso.
+KB_RERANK_LLM_FALLBACK = env_bool("KB_RERANK_LLM_FALLBACK", False)
+KB_RERANK_MIN_GAP = float(os.getenv("KB_RERANK_MIN_GAP", "0.1"))
 
 
 async def _invoke_google_search(query: str) -> Optional[str]:
@@ -177,6 +186,13 @@ class KBSearchTool(BaseTool):
             return []
         if len(clean_chunks) <= top_k:
             return clean_chunks
+        ranked = rank_chunks(question, clean_chunks)
+        if KB_RERANK_LLM_FALLBACK and is_ambiguous(ranked, top_k, KB_RERANK_MIN_GAP):
+            log.debug("KBSearchTool: puntuaciones léxicas igualadas, rerank con LLM.")
+            return await self._llm_rerank_chunks(question, clean_chunks, top_k=top_k)
+        return [clean_chunks[i] for i, _ in ranked[:top_k]]
+
+    async def _llm_rerank_chunks(self, question: str, clean_chunks: List[str], top_k: int = 3) -> List[str]:
         try:
             llm = ModelConfig.get_llm(ModelTier.SUBAGENT)
             chunk_block = "\n\n".join(f"[{i}] {c}" for i, c in enumerate(clean_chunks))
@@ -202,7 +218,8 @@ class KBSearchTool(BaseTool):
             return [clean_chunks[i] for i in top_indices]
         except Exception as exc:
             log.debug("KBSearchTool: rerank fallback por error: %s", exc)
-            return clean_chunks[:top_k]
+            ranked = rank_chunks(question, clean_chunks)
+            return [clean_chunks[i] for i, _ in ranked[:top_k]]
 
     async def _arun(self, query: str) -> Optional[str]:
         question = (query or "").strip()
@@ -247,20 +264,6 @@ class KBSearchTool(BaseTool):
             one_line = " ".join((text or "").split())
             return (one_line[:max_len] + "…") if len(one_line) > max_len else one_line
 
-        def _dedupe_keep_order(items: List[str]) -> List[str]:
-            seen = set()
-            out: List[str] = []
-            for item in items:
-                value = (item or "").strip()
-                if not value:
-                    continue
-                key = value.lower()
-                if key in seen:
-                    continue
-                seen.add(key)
-                out.append(value)
-            return out
-
         try:
             tools = await get_tools(server_name="InfoAgent")
             if not tools:
@@ -272,23 +275,6 @@ class KBSearchTool(BaseTool):
                 log.warning("KBSearchTool: no se encontró la herramienta de conocimientos.")
                 return None
 
-            detected_lang = "es"
-            translated_to_es = ""
-            try:
-                detected_lang = language_manager.detect_language(question, prev_lang="es")
-                if detected_lang != "es":
-                    translated_to_es = language_manager.translate_if_needed(question, detected_lang, "es").strip()
-            except Exception as lang_exc:
-                log.debug("KBSearchTool: no se pudo detectar/traducir idioma: %s", lang_exc)
-
-            query_variants = _dedupe_keep_order([question, translated_to_es])
-            if detected_lang != "es":
-                log.info(
-                    "KBSearchTool: consulta multilenguaje detectada lang=%s variantes=%s",
-                    detected_lang,
-                    len(query_variants),
-                )
-
             payload = {"input": question}
             if self.memory_manager and self.chat_id:
                 try:
@@ -319,6 +305,12 @@ class KBSearchTool(BaseTool):
 
             base_payload = payload.copy()
 
+            cache_key = kb_key(payload.get("instance_url"), payload.get("property_id"), payload.get("kb"), question)
+            cached = kb_retrieval_cache.get(cache_key)
+            if cached:
+                log.info("KBSearchTool: respuesta servida desde caché KB (preview): %s", _preview(cached))
+                return cached
+
             def _is_invalid(text: str) -> Tuple[bool, str]:
                 if not text or len(text) < 10:
                     return True, "empty_or_short"
@@ -356,61 +348,112 @@ class KBSearchTool(BaseTool):
                 ]
                 return any(m in lowered for m in markers)
 
-            for variant in query_variants:
+            async def _search(variant: str) -> str:
                 attempt_payload = base_payload.copy()
                 attempt_payload["input"] = variant
                 raw_reply = await kb_tool.ainvoke(attempt_payload)
                 ranked_chunks: List[str] = []
                 if isinstance(raw_reply, list):
-                    log.info("KBSearchTool: chunks recuperados=%s", len(raw_reply))
+                    log.info("KBSearchTool: chunks recuperados=%s (%s)", len(raw_reply), _preview(variant, 60))
                     normalized_chunks = [
                         normalize_reply(item, variant, "InfoAgent").strip()
                         for item in raw_reply
                     ]
                     normalized_chunks = [c for c in normalized_chunks if c]
                     ranked_chunks = await self._rerank_chunks(variant, normalized_chunks, top_k=3)
-
-                cleaned = (
+                return (
                     "\n\n".join(ranked_chunks).strip()
                     if ranked_chunks
                     else normalize_reply(raw_reply, variant, "InfoAgent").strip()
                 )
-                is_invalid, invalid_reason = _is_invalid(cleaned)
-                log.info("KBSearchTool: respuesta KB (preview): %s", _preview(cleaned))
-                fallback_needed = is_invalid or _looks_like_no_answer(cleaned)
-
-                if not fallback_needed:
-                    log.info("KBSearchTool: información obtenida correctamente.")
-                    return cleaned
 
+            async def _translated_variant() -> str:
+                try:
+                    detected_lang = await language_manager.adetect_language(question, prev_lang="es")
+                    if detected_lang != "es":
+                        log.info("KBSearchTool: consulta multilenguaje detectada lang=%s", detected_lang)
+                        return (
+                            await language_manager.atranslate_if_needed(question, detected_lang, "es")
+                        ).strip()
+                except Exception as lang_exc:
+                    log.debug("KBSearchTool: no se pudo detectar/traducir idioma: %s", lang_exc)
+                return ""
+
+            # Todas las variantes (pregunta original, traducción al español y sus
+            # términos focales) se lanzan en paralelo. Gana la primera variante
+            # completa válida; los términos focales solo se usan si ninguna lo es.
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + KB_SEARCH_BUDGET_S
+            attempts: dict[asyncio.Task, Tuple[str, str]] = {}
+            launched: set[str] = set()
+
+            def _launch(variant: str) -> None:
+                variant = (variant or "").strip()
+                if not variant:
+                    return
+                candidates = [("variant", variant)]
                 focus = _extract_focus_term(variant)
-                if focus and focus != variant.strip().lower():
-                    log.info("KBSearchTool: reintentando KB con término focal '%s'", focus)
-                    retry_payload = base_payload.copy()
-                    retry_payload["input"] = focus
-                    raw_retry = await kb_tool.ainvoke(retry_payload)
-                    ranked_retry_chunks: List[str] = []
-                    if isinstance(raw_retry, list):
-                        log.info("KBSearchTool: chunks recuperados (reintento)=%s", len(raw_retry))
-                        normalized_retry_chunks = [
-                            normalize_reply(item, focus, "InfoAgent").strip()
-                            for item in raw_retry
-                        ]
-                        normalized_retry_chunks = [c for c in normalized_retry_chunks if c]
-                        ranked_retry_chunks = await self._rerank_chunks(focus, normalized_retry_chunks, top_k=3)
-                    cleaned_retry = (
-                        "\n\n".join(ranked_retry_chunks).strip()
-                        if ranked_retry_chunks
-                        else normalize_reply(raw_retry, focus, "InfoAgent").strip()
-                    )
-                    retry_invalid, retry_reason = _is_invalid(cleaned_retry)
-                    log.info("KBSearchTool: respuesta KB reintento (preview): %s", _preview(cleaned_retry))
-                    if not retry_invalid:
-                        log.info("KBSearchTool: información obtenida correctamente (reintento).")
-                        return cleaned_retry
-                    log.info("KBSearchTool: reintento inválido (motivo=%s).", retry_reason)
-
-                log.info("KBSearchTool: intento inválido (motivo=%s).", invalid_reason)
+                if focus and focus != variant.lower():
+                    candidates.append(("focus", focus))
+                for kind, text in candidates:
+                    key = text.lower()
+                    if key in launched:
+                        continue
+                    launched.add(key)
+                    attempts[asyncio.create_task(_search(text))] = (kind, text)
+
+            _launch(question)
+            lang_task: Optional[asyncio.Task] = asyncio.create_task(_translated_variant())
+            focus_result: Optional[str] = None
+
+            try:
+                while attempts or lang_task is not None:
+                    pending = set(attempts)
+                    if lang_task is not None:
+                        pending.add(lang_task)
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        log.warning(
+                            "KBSearchTool: presupuesto de latencia agotado (%.1fs); devolviendo mejor resultado.",
+                            KB_SEARCH_BUDGET_S,
+                        )
+                        break
+                    done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task is lang_task:
+                            lang_task = None
+                            _launch(task.result())
+                            continue
+                        kind, text = attempts.pop(task)
+                        try:
+                            cleaned = task.result()
+                        except Exception as attempt_exc:
+                            log.warning("KBSearchTool: error consultando KB (%s): %s", kind, attempt_exc)
+                            continue
+                        is_invalid, invalid_reason = _is_invalid(cleaned)
+                        log.info("KBSearchTool: respuesta KB %s (preview): %s", kind, _preview(cleaned))
+                        if kind == "variant":
+                            if not is_invalid and not _looks_like_no_answer(cleaned):
+                                log.info("KBSearchTool: información obtenida correctamente.")
+                                kb_retrieval_cache.set(cache_key, cleaned)
+                                return cleaned
+                        elif not is_invalid:
+                            if focus_result is None:
+                                log.info("KBSearchTool: resultado válido con término focal '%s'.", text)
+                                focus_result = cleaned
+                            continue
+                        log.info("KBSearchTool: intento inválido (%s, motivo=%s).", kind, invalid_reason)
+            finally:
+                for task in list(attempts) + ([lang_task] if lang_task is not None else []):
+                    if task.done() and not task.cancelled():
+                        task.exception()
+                    else:
+                        task.cancel()
+
+            if focus_result:
+                log.info("KBSearchTool: información obtenida correctamente (término focal).")
+                kb_retrieval_cache.set(cache_key, focus_result)
+                return focus_result
 
             log.info("KBSearchTool: KB no tiene información útil tras variantes/reintentos.")
             return None
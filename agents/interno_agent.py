@@ -33,6 +33,8 @@ from core.instance_context import (
 )
 from core.language_manager import language_manager
 from core.socket_manager import emit_event
+from core.speculation import commit_barrier
+from core.timer_wheel import timer_wheel
 from core.utils.time_context import get_time_context
 from core.utils.utils_prompt import load_prompt
 from tools.interno_tool import (
@@ -488,13 +490,15 @@ class InternoAgent:
         context: str,
         property_id: Optional[str | int] = None,
     ) -> str:
-        def _guest_lang() -> str:
+        await commit_barrier("interno.escalate")
+
+        async def _guest_lang() -> str:
             msg = (guest_message or "").strip()
             fresh_lang = None
             # Detecta idioma del mensaje actual sin arrastrar histórico.
             if msg:
                 try:
-                    fresh_lang = (language_manager.detect_language(msg, prev_lang=None) or "").strip().lower()
+                    fresh_lang = (await language_manager.adetect_language(msg, prev_lang=None) or "").strip().lower()
                 except Exception:
                     fresh_lang = None
             try:
@@ -515,17 +519,17 @@ class InternoAgent:
                 return fresh_lang
             return "es"
 
-        def _needs_action_es(lang: str) -> str:
+        async def _needs_action_es(lang: str) -> str:
             raw = (reason or "").strip() or (guest_message or "").strip()
             if not raw:
                 return ""
             text_es = raw
             if lang != "es":
                 try:
-                    text_es = language_manager.ensure_language(raw, "es").strip() or raw
+                    text_es = (await language_manager.aensure_language(raw, "es")).strip() or raw
                 except Exception:
                     try:
-                        text_es = language_manager.translate_if_needed(raw, lang, "es").strip() or raw
+                        text_es = (await language_manager.atranslate_if_needed(raw, lang, "es")).strip() or raw
                     except Exception:
                         text_es = raw
             return f"El huésped solicita: {text_es} (Idioma huésped: {lang})"
@@ -632,7 +636,7 @@ class InternoAgent:
             if reuse_existing
             else f"esc_{clean_chat_id}_{int(datetime.utcnow().timestamp())}"
         )
-        guest_lang = _guest_lang()
+        guest_lang = await _guest_lang()
         needs_action_reason = None
         # Persistimos la escalación antes de emitir eventos para evitar
         # parpadeos en Chatter por carreras entre socket y lectura REST.
@@ -787,7 +791,7 @@ class InternoAgent:
                 "chat.updated",
                 {
                     "chat_id": clean_chat_id,
-                    "needs_action": _needs_action_es(guest_lang),
+                    "needs_action": await _needs_action_es(guest_lang),
                     "needs_action_type": escalation_type,
                     "needs_action_reason": needs_action_reason,
                     "timestamp": esc_record.timestamp,
@@ -1267,16 +1271,14 @@ Responde:
         if not self.memory_manager:
             return
 
-        async def cleanup():
-            await asyncio.sleep(delay)
+        def cleanup():
             try:
                 self.memory_manager.clear_flag(chat_id, "escalation_in_progress")
             except Exception:
                 pass
 
         try:
-            loop = asyncio.get_running_loop()
-            loop.create_task(cleanup())
+            timer_wheel.call_later(("flag_cleanup", chat_id, "escalation_in_progress"), delay, cleanup)
         except RuntimeError:
             pass
 
@@ -11,6 +11,7 @@ from langchain.agents import AgentExecutor, create_openai_tools_agent
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from core.config import ModelConfig, ModelTier, Settings
+from core.ttl_cache import TTLCache
 from core.utils.time_context import get_time_context
 from core.utils.utils_prompt import load_prompt
 from core.utils.dynamic_context import build_dynamic_context_from_memory
@@ -43,21 +44,28 @@ class OnboardingAgent:
         self.memory_manager = memory_manager
         self.llm = ModelConfig.get_llm(ModelTier.SUBAGENT)
         self.allow_reservation_creation = Settings.ONBOARDING_RESERVATION_CREATION_ENABLED
-        self.prompt_text = self._build_prompt()
+        # Las tools van ligadas al chat: un executor por chat, reutilizado entre turnos.
+        # El system prompt entra en cada invocación, así que no hay estado compartido mutable.
+        self._executors = TTLCache("onboarding_executors", max_entries=2000, ttl_seconds=3600)
         log.info(
             "OnboardingAgent inicializado (modelo: %s, create_enabled=%s)",
             self.llm.model_name,
             self.allow_reservation_creation,
         )
 
-    def _build_prompt(self) -> str:
+    def _build_prompt(self, chat_id: Optional[str] = None) -> str:
         base_prompt = load_prompt("onboarding_prompt.txt") or self._DEFAULT_PROMPT
-        return f"{get_time_context()}\n{base_prompt.strip()}"
+        prompt_text = f"{get_time_context()}\n{base_prompt.strip()}"
+        dynamic_context = build_dynamic_context_from_memory(self.memory_manager, chat_id) if chat_id else ""
+        if dynamic_context:
+            prompt_text = f"{prompt_text}\n\n{dynamic_context}"
+        # Antes el prompt se usaba como plantilla: "{{" llegaba al LLM como "{".
+        return prompt_text.replace("{{", "{").replace("}}", "}")
 
     def _build_executor(self, tools) -> AgentExecutor:
         prompt = ChatPromptTemplate.from_messages(
             [
-                ("system", self.prompt_text),
+                ("system", "{system_prompt}"),
                 MessagesPlaceholder(variable_name="chat_history", optional=True),
                 ("human", "{input}"),
                 MessagesPlaceholder(variable_name="agent_scratchpad"),
@@ -81,12 +89,25 @@ class OnboardingAgent:
         chat_history: Optional[list[Any]] = None,
     ) -> str:
         """Punto de entrada para SubAgentTool."""
-        base_prompt = load_prompt("onboarding_prompt.txt") or self._DEFAULT_PROMPT
-        dynamic_context = build_dynamic_context_from_memory(self.memory_manager, chat_id)
-        if dynamic_context:
-            self.prompt_text = f"{get_time_context()}\n{base_prompt.strip()}\n\n{dynamic_context}"
-        else:
-            self.prompt_text = f"{get_time_context()}\n{base_prompt.strip()}"
+        result = await self._get_executor(chat_id).ainvoke(
+            input={
+                "system_prompt": self._build_prompt(chat_id),
+                "input": pregunta,
+                "chat_history": chat_history or [],
+            }
+        )
+        output = (result.get("output") or "").strip()
+        return output
+
+    def _get_executor(self, chat_id: str) -> AgentExecutor:
+        key = str(chat_id or "")
+        executor = self._executors.get(key)
+        if executor is None:
+            executor = self._build_executor(self._build_tools(chat_id))
+            self._executors[key] = executor
+        return executor
+
+    def _build_tools(self, chat_id: str) -> list:
         tools = []
         if self.allow_reservation_creation:
             tools.extend(
@@ -108,12 +129,4 @@ class OnboardingAgent:
                 ),
             ]
         )
-        executor = self._build_executor(tools)
-        result = await executor.ainvoke(
-            input={
-                "input": pregunta,
-                "chat_history": chat_history or [],
-            }
-        )
-        output = (result.get("output") or "").strip()
-        return output
+        return tools
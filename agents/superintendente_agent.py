@@ -29,6 +29,7 @@ import boto3
 from botocore.config import Config as BotoConfig
 
 from core.config import ModelConfig, ModelTier, Settings
+from core.kb_retrieval_cache import invalidate_kb_retrieval
 from core.db import get_active_chat_reservation
 from core.utils.time_context import get_time_context
 from core.utils.utils_prompt import load_prompt
@@ -1013,6 +1014,7 @@ class SuperintendenteAgent:
                 source_type=source,
                 use_env=False,
             )
+            self._invalidate_kb_retrieval(encargado_id)
 
             try:
                 from core.db import add_kb_daily_cache
@@ -1274,6 +1276,22 @@ class SuperintendenteAgent:
         }
         return payload
 
+    def _invalidate_kb_retrieval(self, encargado_id: str) -> None:
+        """Descarta las búsquedas KB cacheadas de la propiedad del encargado (o todas si no se conoce)."""
+        property_id = None
+        kb_name = None
+        if self.memory_manager and encargado_id:
+            try:
+                property_id = self.memory_manager.get_flag(encargado_id, "property_id")
+                kb_name = self.memory_manager.get_flag(encargado_id, "kb") or self.memory_manager.get_flag(
+                    encargado_id,
+                    "knowledge_base",
+                )
+            except Exception:
+                property_id = None
+                kb_name = None
+        invalidate_kb_retrieval(property_id=property_id, kb_name=kb_name)
+
     async def handle_kb_removal(
         self,
         hotel_name: str,
@@ -1342,6 +1360,8 @@ class SuperintendenteAgent:
         except Exception as exc:
             raise RuntimeError(f"No se pudo subir el documento actualizado a S3 ({bucket}/{key_used}): {exc}")
 
+        self._invalidate_kb_retrieval(encargado_id)
+
         header_lines = [
             f"🧹 Eliminados {len(removed)} registros de la base de conocimientos.",
             f"Criterio: {criteria or 'sin especificar'}",
@@ -2,6 +2,7 @@ import json
 import logging
 import re
 from datetime import datetime, timezone
+from typing import Any, Optional
 from fastmcp import FastMCP
 from core.config import ModelConfig, ModelTier
 from core.escalation_db import get_latest_pending_escalation
@@ -20,6 +21,9 @@ llm = ModelConfig.get_llm(ModelTier.SUPERVISOR)
 with open("prompts/supervisor_output_prompt.txt", "r", encoding="utf-8") as f:
     SUPERVISOR_OUTPUT_PROMPT = f.read()
 
+with open("prompts/supervisor_output_unified_prompt.txt", "r", encoding="utf-8") as f:
+    SUPERVISOR_OUTPUT_UNIFIED_PROMPT = f.read()
+
 # =============================================================
 # 🧠 FUNCIÓN PRINCIPAL DE AUDITORÍA
 # =============================================================
@@ -117,82 +121,126 @@ class SupervisorOutputAgent:
         ]
         return any(re.search(p, normalized, re.IGNORECASE) for p in done_patterns)
 
-    async def validate(self, user_input: str, agent_response: str, chat_id: str = None) -> dict:
-        """Evalúa la respuesta y aplica reglas de tolerancia + detección de loops."""
-        try:
-            if is_whatsapp_healthcheck_response(agent_response):
-                log.info("✅ Healthcheck de WhatsApp aprobado automáticamente por SupervisorOutput.")
+    def _precheck(self, agent_response: str, chat_id: str = None) -> Optional[dict]:
+        """Reglas deterministas previas al auditor LLM (None si no deciden)."""
+        if is_whatsapp_healthcheck_response(agent_response):
+            log.info("✅ Healthcheck de WhatsApp aprobado automáticamente por SupervisorOutput.")
+            return {
+                "estado": "Aprobado",
+                "motivo": "Respuesta de healthcheck permitida",
+                "response": agent_response,
+                "sugerencia": None,
+            }
+
+        if self._claims_human_contact_already_done(agent_response):
+            if not self._has_recent_pending_escalation(chat_id):
+                log.warning(
+                    "🚨 Afirmación de contacto humano sin evidencia de escalación activa (chat_id=%s).",
+                    chat_id,
+                )
                 return {
-                    "estado": "Aprobado",
-                    "motivo": "Respuesta de healthcheck permitida",
-                    "response": agent_response,
-                    "sugerencia": None,
+                    "estado": "Rechazado",
+                    "motivo": (
+                        "La respuesta afirma que ya se contactó al encargado, "
+                        "pero no hay escalación activa verificable."
+                    ),
+                    "sugerencia": (
+                        "No afirmar acciones ya realizadas sin evidencia. "
+                        "Pedir confirmación para escalar o usar formulación condicional."
+                    ),
                 }
 
-            if self._claims_human_contact_already_done(agent_response):
-                if not self._has_recent_pending_escalation(chat_id):
-                    log.warning(
-                        "🚨 Afirmación de contacto humano sin evidencia de escalación activa (chat_id=%s).",
-                        chat_id,
-                    )
-                    return {
-                        "estado": "Rechazado",
-                        "motivo": (
-                            "La respuesta afirma que ya se contactó al encargado, "
-                            "pero no hay escalación activa verificable."
-                        ),
-                        "sugerencia": (
-                            "No afirmar acciones ya realizadas sin evidencia. "
-                            "Pedir confirmación para escalar o usar formulación condicional."
-                        ),
-                    }
+        # =====================================================
+        # 🚨 DETECCIÓN DE BUCLES DE INCISOS / REPETICIÓN
+        # =====================================================
+        inciso_pattern = re.compile(
+            r"(estoy consultando|voy a consultar|un momento|permíteme|déjame).*encargado", re.IGNORECASE
+        )
+        repetitions = len(re.findall(inciso_pattern, agent_response))
+
+        if repetitions >= 3:
+            log.warning("♻️ Posible loop de incisos detectado → marcar como error controlado.")
+            return {
+                "estado": "Rechazado",
+                "motivo": "Loop detectado (repetición excesiva de incisos)",
+                "sugerencia": "Detener ejecución y escalar al encargado",
+            }
 
-            # =====================================================
-            # 🚨 DETECCIÓN DE BUCLES DE INCISOS / REPETICIÓN
-            # =====================================================
-            inciso_pattern = re.compile(
-                r"(estoy consultando|voy a consultar|un momento|permíteme|déjame).*encargado", re.IGNORECASE
-            )
-            repetitions = len(re.findall(inciso_pattern, agent_response))
+        # =====================================================
+        # 🚀 DETECTOR DE MENSAJES DE ESCALACIÓN LEGÍTIMOS
+        # =====================================================
+        ESCALATION_PATTERNS = [
+            r"(un momento|déjame|voy a|permíteme|contactando|consultando).*(encargado|equipo|gerente|hotel)",
+            r"(estoy|comunicando|contactar).*(encargado|equipo|hotel)",
+            r"(dame|dame un).*(momento|segundo|instante).*consult",
+        ]
 
-            if repetitions >= 3:
-                log.warning("♻️ Posible loop de incisos detectado → marcar como error controlado.")
+        for pattern in ESCALATION_PATTERNS:
+            if re.search(pattern, agent_response.lower()):
+                log.info("✅ Mensaje de acompañamiento / escalación legítimo → aprobado automáticamente.")
                 return {
-                    "estado": "Rechazado",
-                    "motivo": "Loop detectado (repetición excesiva de incisos)",
-                    "sugerencia": "Detener ejecución y escalar al encargado",
+                    "estado": "Aprobado",
+                    "motivo": "Mensaje de cortesía o escalación válido",
+                    "response": agent_response,
+                    "sugerencia": None,
                 }
+        return None
 
-            # =====================================================
-            # 🚀 DETECTOR DE MENSAJES DE ESCALACIÓN LEGÍTIMOS
-            # =====================================================
-            ESCALATION_PATTERNS = [
-                r"(un momento|déjame|voy a|permíteme|contactando|consultando).*(encargado|equipo|gerente|hotel)",
-                r"(estoy|comunicando|contactar).*(encargado|equipo|hotel)",
-                r"(dame|dame un).*(momento|segundo|instante).*consult",
-            ]
+    def _tone(self, chat_id: str = None) -> Optional[str]:
+        if not (self.memory_manager and chat_id):
+            return None
+        try:
+            return self.memory_manager.get_flag(chat_id, "tone")
+        except Exception:
+            return None
+
+    def _recent_history_text(self, chat_id: str = None) -> str:
+        historial = ""
+        if self.memory_manager and chat_id:
+            try:
+                conv = self.memory_manager.get_memory(chat_id, limit=6)
+                if conv:
+                    formatted = []
+                    for m in conv:
+                        role_val = m.get("role")
+                        if role_val == "guest":
+                            role = "Huésped"
+                        elif role_val == "user":
+                            role = "Hotel"
+                        elif role_val in {"assistant", "bookai"}:
+                            role = "BookAI"
+                        else:
+                            role = "BookAI"
+                        content = m.get("content", "").strip()
+                        formatted.append(f"{role}: {content}")
+                    historial = "\n".join(formatted)
+            except Exception as e:
+                log.warning(f"⚠️ No se pudo recuperar historial para el contexto: {e}")
+        return historial
+
+    def _textual_rejection(self, agent_response: str, chat_id: str = None, motivo: str = "Modelo marcó rechazo textual") -> dict:
+        historial = self._recent_history_text(chat_id)
+        contexto_extendido = (
+            f"Respuesta rechazada: {agent_response}\n\n"
+            f"Historial reciente:\n{historial if historial else '(sin historial disponible)'}"
+        )
+        return {
+            "estado": "Rechazado",
+            "motivo": motivo,
+            "context": contexto_extendido,  # <— 🔥 clave: esto es lo que InternoAgent usa
+        }
 
-            for pattern in ESCALATION_PATTERNS:
-                if re.search(pattern, agent_response.lower()):
-                    log.info("✅ Mensaje de acompañamiento / escalación legítimo → aprobado automáticamente.")
-                    return {
-                        "estado": "Aprobado",
-                        "motivo": "Mensaje de cortesía o escalación válido",
-                        "response": agent_response,
-                        "sugerencia": None,
-                    }
+    async def validate(self, user_input: str, agent_response: str, chat_id: str = None) -> dict:
+        """Evalúa la respuesta y aplica reglas de tolerancia + detección de loops."""
+        try:
+            prechecked = self._precheck(agent_response, chat_id)
+            if prechecked is not None:
+                return prechecked
 
             # =====================================================
             # 🧠 ANÁLISIS CON EL LLM (modo auditor)
             # =====================================================
-            tone = None
-            if self.memory_manager and chat_id:
-                try:
-                    tone = self.memory_manager.get_flag(chat_id, "tone")
-                except Exception:
-                    tone = None
-
-            raw = await _auditar_respuesta_func(user_input, agent_response, tone=tone)
+            raw = await _auditar_respuesta_func(user_input, agent_response, tone=self._tone(chat_id))
             salida = (raw or "").strip()
 
             if self.memory_manager and chat_id:
@@ -239,41 +287,7 @@ class SupervisorOutputAgent:
             # =====================================================
             if "rechazado" in salida.lower():
                 log.warning("🚨 Rechazo textual detectado por modelo auditor.")
-
-                # 🧾 Recuperar historial reciente (si existe en memoria)
-                historial = ""
-                if self.memory_manager and chat_id:
-                    try:
-                        conv = self.memory_manager.get_memory(chat_id, limit=6)
-                        if conv:
-                            formatted = []
-                            for m in conv:
-                                role_val = m.get("role")
-                                if role_val == "guest":
-                                    role = "Huésped"
-                                elif role_val == "user":
-                                    role = "Hotel"
-                                elif role_val in {"assistant", "bookai"}:
-                                    role = "BookAI"
-                                else:
-                                    role = "BookAI"
-                                content = m.get("content", "").strip()
-                                formatted.append(f"{role}: {content}")
-                            historial = "\n".join(formatted)
-                    except Exception as e:
-                        log.warning(f"⚠️ No se pudo recuperar historial para el contexto: {e}")
-
-                # 🧠 Construir contexto extendido (como antes)
-                contexto_extendido = (
-                    f"Respuesta rechazada: {agent_response}\n\n"
-                    f"Historial reciente:\n{historial if historial else '(sin historial disponible)'}"
-                )
-
-                return {
-                    "estado": "Rechazado",
-                    "motivo": "Modelo marcó rechazo textual",
-                    "context": contexto_extendido,  # <— 🔥 clave: esto es lo que InternoAgent usa
-                }
+                return self._textual_rejection(agent_response, chat_id)
 
             # =====================================================
             # 🩵 Caso 4: Aprobado por defecto
@@ -285,6 +299,137 @@ class SupervisorOutputAgent:
             log.error(f"⚠️ Error en validate (output): {e}", exc_info=True)
             return {"estado": "Aprobado", "motivo": "Error interno, aprobado por seguridad"}
 
+    # =====================================================
+    # 🛡️ EVALUACIÓN UNIFICADA (una sola llamada LLM)
+    # =====================================================
+    async def evaluate(
+        self,
+        user_input: str,
+        agent_response: str,
+        chat_id: str = None,
+        *,
+        target_lang: str = "es",
+        check_human_promise: bool = False,
+        pending_offer: Optional[dict] = None,
+    ) -> Optional[dict]:
+        """
+        Resuelve en una sola llamada los guardrails post-generación: promesa de
+        escalación humana (con reescritura honesta), consistencia con la oferta
+        pendiente y auditoría de salida. Devuelve None si el modelo falla o no
+        devuelve JSON válido; el pipeline recurre entonces a los controles separados.
+        """
+        checks = ["auditoria"]
+        if check_human_promise:
+            checks.append("promesa_humana")
+        if pending_offer:
+            checks.append("oferta")
+        tone = self._tone(chat_id)
+
+        system_prompt = SUPERVISOR_OUTPUT_PROMPT
+        if str(tone or "").strip():
+            system_prompt = f"{system_prompt}\n\nTono de la property para esta revisión: {str(tone).strip()}"
+        system_prompt = f"{system_prompt}\n\n{SUPERVISOR_OUTPUT_UNIFIED_PROMPT}"
+        content = (
+            f"Controles solicitados: {', '.join(checks)}\n"
+            f"Idioma objetivo: {target_lang or 'es'}\n"
+        )
+        if pending_offer:
+            content += f"Oferta pendiente: {json.dumps(pending_offer, ensure_ascii=False)}\n"
+        content += (
+            f"\nMensaje del huésped:\n{user_input}\n\n"
+            f"Respuesta del agente:\n{agent_response}"
+        )
+
+        with ls_context(
+            name="SupervisorOutputAgent.evaluate",
+            metadata={"input_usuario": user_input, "respuesta_agente": agent_response, "checks": checks},
+            tags=["supervisor", "output", "unified"],
+        ):
+            try:
+                response = await llm.ainvoke([
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": content},
+                ])
+                output = (getattr(response, "content", None) or "").strip()
+            except Exception as e:
+                log.warning(f"⚠️ Evaluación unificada fallida, se usarán los controles separados: {e}")
+                return None
+
+        data = _parse_json_object(output)
+        if data is None or not str(data.get("estado") or "").strip():
+            log.warning("⚠️ Evaluación unificada sin JSON válido, se usarán los controles separados.")
+            return None
+        log.info(f"🧠 [SupervisorOutputAgent] evaluación unificada:\n{output}")
+
+        promise_confidence = _as_float(data.get("promise_confidence"))
+        promises_human = bool(check_human_promise and _as_bool(data.get("promises_human_escalation"), False))
+        # Mismo umbral que el clasificador binario del pipeline (confianza 0 = sin calibrar).
+        if promises_human and 0.0 < promise_confidence < 0.45:
+            promises_human = False
+        rewrite = str(data.get("rewrite") or "").strip() if promises_human else ""
+        audited_response = rewrite or agent_response
+
+        if self.memory_manager and chat_id:
+            self.memory_manager.update_memory(
+                chat_id,
+                f"[SupervisorOutput] Validando respuesta:\n{user_input}",
+                f"Salida modelo:\n{output}"
+            )
+
+        audit = self._precheck(audited_response, chat_id)
+        if audit is None:
+            estado = str(data.get("estado") or "").lower()
+            motivo = str(data.get("motivo") or "").strip()
+            if "rechazado" in estado:
+                log.warning("🚨 Rechazo detectado por evaluación unificada.")
+                audit = self._textual_rejection(audited_response, chat_id, motivo=motivo or "Modelo marcó rechazo")
+            else:
+                # Igual que en validate(): "Revisión Necesaria" no bloquea la respuesta.
+                audit = {"estado": "Aprobado", "motivo": motivo or "Sin indicios negativos detectados"}
+
+        return {
+            "checks": checks,
+            "promises_human_escalation": promises_human,
+            "promise_confidence": promise_confidence,
+            "rewrite": rewrite,
+            "offer": {
+                "is_consistent": _as_bool(data.get("offer_consistent"), True) if pending_offer else True,
+                "reason": str(data.get("offer_reason") or "").strip(),
+                "confidence": _as_float(data.get("offer_confidence")),
+            },
+            "audit": audit,
+            "audited_response": audited_response,
+        }
+
+
+def _parse_json_object(raw: str) -> Optional[dict]:
+    match = re.search(r"\{[\s\S]*\}", raw or "")
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _as_bool(value: Any, default: bool) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value or "").strip().lower()
+    if text in {"true", "1", "yes", "si", "sí"}:
+        return True
+    if text in {"false", "0", "no"}:
+        return False
+    return default
+
+
+def _as_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
 
 # =============================================================
 # 🚀 ENTRYPOINT MCP
@@ -6,6 +6,7 @@ import json
 import logging
 import re
 import time
+from collections.abc import Mapping
 from urllib.parse import unquote
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Literal, Optional, Tuple
@@ -15,7 +16,15 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
 from core.config import Settings, ModelConfig, ModelTier
-from core.db import supabase, is_chat_visible_in_list
+from core.db import (
+    supabase,
+    is_chat_visible_in_list,
+    async_is_chat_visible_in_list,
+    async_wait_for_chat_history,
+    invalidate_chat_visibility,
+    run_db_call,
+    wait_for_chat_history,
+)
 from core.escalation_db import (
     get_escalation,
     get_latest_escalation_for_chat,
@@ -51,7 +60,7 @@ from core.template_button_url import (
     to_folio_dynamic_part,
 )
 from tools.superintendente_tool import create_consulta_reserva_persona_tool
-from core.db import upsert_chat_reservation, get_active_chat_reservation
+from core.db import get_active_chat_reservation, async_upsert_chat_reservation
 
 log = logging.getLogger("ChatterRoutes")
 _INSTANCE_CHAT_SETS_TTL_SECONDS = 5
@@ -914,7 +923,7 @@ def _latest_pending(escs: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
     return escs[-1]
 
 
-def _pending_actions(grouped: Dict[str, List[Dict[str, Any]]], memory_manager: Any = None) -> Dict[str, str]:
+async def _pending_actions(grouped: Dict[str, List[Dict[str, Any]]], memory_manager: Any = None) -> Dict[str, str]:
     result: Dict[str, str] = {}
     for guest_id, escs in grouped.items():
         latest = _latest_pending(escs) or {}
@@ -924,12 +933,12 @@ def _pending_actions(grouped: Dict[str, List[Dict[str, Any]]], memory_manager: A
         )
         if not action_text:
             continue
-        guest_lang = _resolve_guest_lang(latest, memory_manager=memory_manager)
+        guest_lang = await _resolve_guest_lang(latest, memory_manager=memory_manager)
         question_es = action_text
         if guest_lang != "es":
             try:
                 question_es = (
-                    language_manager.translate_if_needed(action_text, guest_lang, "es").strip()
+                    (await language_manager.atranslate_if_needed(action_text, guest_lang, "es")).strip()
                     or action_text
                 )
             except Exception:
@@ -938,7 +947,7 @@ def _pending_actions(grouped: Dict[str, List[Dict[str, Any]]], memory_manager: A
     return result
 
 
-def _resolve_guest_lang(latest: Dict[str, Any], memory_manager: Any = None) -> str:
+async def _resolve_guest_lang(latest: Dict[str, Any], memory_manager: Any = None) -> str:
     guest_chat_id = str(
         latest.get("guest_chat_id")
         or latest.get("chat_id")
@@ -957,7 +966,7 @@ def _resolve_guest_lang(latest: Dict[str, Any], memory_manager: Any = None) -> s
     sample = (latest.get("guest_message") or "").strip()
     if sample:
         try:
-            return (language_manager.detect_language(sample, prev_lang="es") or "es").strip().lower()
+            return (await language_manager.adetect_language(sample, prev_lang="es") or "es").strip().lower()
         except Exception:
             pass
     return "es"
@@ -1053,7 +1062,7 @@ def _pending_property_for_guest(
     return value
 
 
-def _pending_snapshot_for_chat(
+async def _pending_snapshot_for_chat(
     chat_id: str,
     property_id: Optional[str | int],
     instance_id: Optional[str] = None,
@@ -1085,7 +1094,7 @@ def _pending_snapshot_for_chat(
 
     key = _pending_compound_key(chat_id, property_id)
     grouped = {key: pending}
-    pending_map = _pending_actions(grouped, memory_manager=memory_manager)
+    pending_map = await _pending_actions(grouped, memory_manager=memory_manager)
     pending_reason_map = _pending_reasons(grouped, memory_manager=memory_manager)
     pending_type_map = _pending_types(grouped)
     proposed_map = _pending_responses(grouped)
@@ -1611,7 +1620,7 @@ def _related_memory_ids(state, chat_id: str) -> list[str]:
 
     for store_name in ("state_flags", "runtime_memory"):
         store = getattr(memory_manager, store_name, None)
-        if isinstance(store, dict):
+        if isinstance(store, Mapping):
             for key in list(store.keys()):
                 if isinstance(key, str) and key.endswith(suffix):
                     ids.add(key)
@@ -1760,7 +1769,7 @@ def _normalize_language_confidence(value: Any, default: float = 0.0) -> float:
     return confidence
 
 
-def _resolve_guest_lang_meta_for_chat(
+async def _resolve_guest_lang_meta_for_chat(
     state,
     chat_id: str,
     context_id: Optional[str] = None,
@@ -1821,7 +1830,7 @@ def _resolve_guest_lang_meta_for_chat(
             if not sample:
                 continue
             try:
-                lang, confidence = language_manager.detect_language_with_confidence(
+                lang, confidence = await language_manager.adetect_language_with_confidence(
                     sample,
                     prev_lang=None,
                 )
@@ -1840,22 +1849,22 @@ def _resolve_guest_lang_meta_for_chat(
     return "es", 0.0
 
 
-def _resolve_guest_lang_for_chat(state, chat_id: str, context_id: Optional[str] = None) -> str:
+async def _resolve_guest_lang_for_chat(state, chat_id: str, context_id: Optional[str] = None) -> str:
     """Resuelve idioma huésped priorizando flags de memoria y aliases del chat."""
-    lang, _ = _resolve_guest_lang_meta_for_chat(state, chat_id, context_id=context_id)
+    lang, _ = await _resolve_guest_lang_meta_for_chat(state, chat_id, context_id=context_id)
     return lang
 
 
-def _ensure_guest_language_for_outgoing(state, chat_id: str, text: str, context_id: Optional[str] = None) -> str:
+async def _ensure_guest_language_for_outgoing(state, chat_id: str, text: str, context_id: Optional[str] = None) -> str:
     """Ajusta mensaje saliente al idioma del huésped para envíos manuales."""
     raw = (text or "").strip()
     if not raw:
         return ""
-    guest_lang = _resolve_guest_lang_for_chat(state, chat_id, context_id=context_id)
+    guest_lang = await _resolve_guest_lang_for_chat(state, chat_id, context_id=context_id)
     if guest_lang == "es":
         return raw
     try:
-        return language_manager.ensure_language(raw, guest_lang).strip() or raw
+        return (await language_manager.aensure_language(raw, guest_lang)).strip() or raw
     except Exception:
         return raw
 
@@ -2052,12 +2061,12 @@ def register_chatter_routes(app, state) -> None:
                 "chat_id": clean_id,
                 "property_id": normalized_property_id,
                 "read_status": True,
-                **_pending_snapshot_for_chat(
+                **(await _pending_snapshot_for_chat(
                     clean_id,
                     normalized_property_id,
                     instance_id=instance_id,
                     memory_manager=getattr(state, "memory_manager", None),
-                ),
+                )),
             },
         )
         return True
@@ -2140,6 +2149,7 @@ def register_chatter_routes(app, state) -> None:
         original_clean = str(original_chat_id or "").replace("+", "").strip()
 
         try:
+            wait_for_chat_history(clean_id, original_clean)
             if original_clean:
                 (
                     supabase.table("chat_history")
@@ -2157,6 +2167,7 @@ def register_chatter_routes(app, state) -> None:
                 .eq("channel", current_channel)
                 .execute()
             )
+            invalidate_chat_visibility(clean_id, original_clean)
             return True
         except Exception:
             return False
@@ -2305,7 +2316,7 @@ def register_chatter_routes(app, state) -> None:
             instance_id=instance_id,
             allowed_chat_ids=allowed_chat_ids,
         )
-        pending_map = _pending_actions(
+        pending_map = await _pending_actions(
             pending_grouped,
             memory_manager=getattr(state, "memory_manager", None),
         )
@@ -2395,7 +2406,7 @@ def register_chatter_routes(app, state) -> None:
                             try:
                                 # Para el listado de chats priorizamos el idioma real del último mensaje guest,
                                 # sin arrastre del idioma previo, para evitar falsos "es" en saludos tipo "hello".
-                                lang, confidence = language_manager.detect_language_with_confidence(
+                                lang, confidence = await language_manager.adetect_language_with_confidence(
                                     sample,
                                     prev_lang=None,
                                 )
@@ -2582,7 +2593,7 @@ def register_chatter_routes(app, state) -> None:
             client_language = "es"
             client_language_confidence = 0.0
             try:
-                client_language, client_language_confidence = _resolve_guest_lang_meta_for_chat(
+                client_language, client_language_confidence = await _resolve_guest_lang_meta_for_chat(
                     state,
                     cid,
                     context_id=context_id,
@@ -2733,6 +2744,8 @@ def register_chatter_routes(app, state) -> None:
         tail_clean = _clean_chat_id(tail) or tail
         if tail_clean:
             id_candidates.add(tail_clean)
+        # Incluye los mensajes recién enviados que siguen en la cola de escritura diferida.
+        await async_wait_for_chat_history(*id_candidates)
         offset = (page - 1) * page_size
         like_patterns = {f"%:{candidate}" for candidate in id_candidates}
 
@@ -3108,7 +3121,7 @@ def register_chatter_routes(app, state) -> None:
             final_phone_id or "missing",
         )
 
-        outgoing_message = _ensure_guest_language_for_outgoing(
+        outgoing_message = await _ensure_guest_language_for_outgoing(
             state,
             chat_id,
             outgoing_message,
@@ -3190,7 +3203,7 @@ def register_chatter_routes(app, state) -> None:
                         resolved_original_chat_id = built_ctx.strip()
                 except Exception:
                     pass
-            chat_visible_before = is_chat_visible_in_list(
+            chat_visible_before = await async_is_chat_visible_in_list(
                 chat_id,
                 property_id=property_id,
                 channel=payload.channel.lower(),
@@ -3204,7 +3217,7 @@ def register_chatter_routes(app, state) -> None:
                 resolved_original_chat_id,
                 chat_visible_before,
             )
-            state.memory_manager.save(
+            await state.memory_manager.asave(
                 session_id,
                 role,
                 outgoing_message,
@@ -3267,7 +3280,8 @@ def register_chatter_routes(app, state) -> None:
         rooms = _rooms(chat_id, property_id, payload.channel.lower())
         visibility_restored = False
         if not chat_visible_before:
-            visibility_restored = _restore_chat_visibility(
+            visibility_restored = await run_db_call(
+                _restore_chat_visibility,
                 chat_id,
                 property_id=property_id,
                 channel=payload.channel.lower(),
@@ -3280,7 +3294,7 @@ def register_chatter_routes(app, state) -> None:
                 payload.channel.lower(),
                 visibility_restored,
             )
-        chat_visible_after = is_chat_visible_in_list(
+        chat_visible_after = await async_is_chat_visible_in_list(
             chat_id,
             property_id=property_id,
             channel=payload.channel.lower(),
@@ -3353,7 +3367,7 @@ def register_chatter_routes(app, state) -> None:
         else:
             sender_for_ui = "bookai"
         try:
-            client_language, client_language_confidence = _resolve_guest_lang_meta_for_chat(
+            client_language, client_language_confidence = await _resolve_guest_lang_meta_for_chat(
                 state,
                 chat_id,
                 context_id=session_id,
@@ -3441,12 +3455,12 @@ def register_chatter_routes(app, state) -> None:
                         "whatsapp_window": whatsapp_window,
                         "bookai_enabled": bool(bookai_resolution.get("value")),
                         "unread_count": 0,
-                        **_pending_snapshot_for_chat(
+                        **(await _pending_snapshot_for_chat(
                             chat_id,
                             property_id,
                             instance_id=instance_id,
                             memory_manager=getattr(state, "memory_manager", None),
-                        ),
+                        )),
                         "folio_id": folio_id,
                     },
                 },
@@ -3502,12 +3516,12 @@ def register_chatter_routes(app, state) -> None:
                 "last_message": outgoing_message,
                 "last_message_at": now_iso,
                 "whatsapp_window": whatsapp_window,
-                **_pending_snapshot_for_chat(
+                **(await _pending_snapshot_for_chat(
                     chat_id,
                     property_id,
                     instance_id=instance_id,
                     memory_manager=getattr(state, "memory_manager", None),
-                ),
+                )),
             },
         )
         log.info(
@@ -4342,6 +4356,8 @@ def register_chatter_routes(app, state) -> None:
                     target_original_chat_id = candidate_original
                     break
         now_iso = datetime.now(timezone.utc).isoformat()
+        # Que los mensajes aún en cola queden incluidos en el UPDATE.
+        await async_wait_for_chat_history(clean_id, target_original_chat_id)
         if target_original_chat_id:
             (
                 supabase.table("chat_history")
@@ -4358,6 +4374,9 @@ def register_chatter_routes(app, state) -> None:
             .eq("channel", channel)
             .execute()
         )
+        invalidate_chat_visibility(clean_id, target_original_chat_id)
+        if getattr(state, "memory_manager", None):
+            state.memory_manager.invalidate_history(clean_id, target_original_chat_id)
 
         last = summary_row or {}
         prop_id = property_id
@@ -4421,7 +4440,7 @@ def register_chatter_routes(app, state) -> None:
             original_chat_id=str(last.get("original_chat_id") or "").strip() or None,
         )
         try:
-            client_language, client_language_confidence = _resolve_guest_lang_meta_for_chat(
+            client_language, client_language_confidence = await _resolve_guest_lang_meta_for_chat(
                 state,
                 clean_id,
                 context_id=str(last.get("original_chat_id") or "").strip() or None,
@@ -4463,12 +4482,12 @@ def register_chatter_routes(app, state) -> None:
                         "whatsapp_window": whatsapp_window,
                         "bookai_enabled": bool(bookai_resolution.get("value")),
                         "unread_count": 0,
-                        **_pending_snapshot_for_chat(
+                        **(await _pending_snapshot_for_chat(
                             clean_id,
                             prop_id,
                             instance_id=instance_id,
                             memory_manager=memory_manager,
-                        ),
+                        )),
                         "folio_id": folio_id,
                     },
                 },
@@ -4567,6 +4586,8 @@ def register_chatter_routes(app, state) -> None:
                     target_original_chat_id = candidate_original
                     break
         now_iso = datetime.now(timezone.utc).isoformat()
+        # Que los mensajes aún en cola queden incluidos en el UPDATE.
+        await async_wait_for_chat_history(clean_id, target_original_chat_id)
         if target_original_chat_id:
             (
                 supabase.table("chat_history")
@@ -4583,6 +4604,9 @@ def register_chatter_routes(app, state) -> None:
             .eq("channel", channel)
             .execute()
         )
+        invalidate_chat_visibility(clean_id, target_original_chat_id)
+        if getattr(state, "memory_manager", None):
+            state.memory_manager.invalidate_history(clean_id, target_original_chat_id)
 
         last = summary_row or {}
         prop_id = property_id
@@ -4646,7 +4670,7 @@ def register_chatter_routes(app, state) -> None:
             original_chat_id=str(last.get("original_chat_id") or "").strip() or None,
         )
         try:
-            client_language, client_language_confidence = _resolve_guest_lang_meta_for_chat(
+            client_language, client_language_confidence = await _resolve_guest_lang_meta_for_chat(
                 state,
                 clean_id,
                 context_id=str(last.get("original_chat_id") or "").strip() or None,
@@ -4688,12 +4712,12 @@ def register_chatter_routes(app, state) -> None:
                         "whatsapp_window": whatsapp_window,
                         "bookai_enabled": bool(bookai_resolution.get("value")),
                         "unread_count": 0,
-                        **_pending_snapshot_for_chat(
+                        **(await _pending_snapshot_for_chat(
                             clean_id,
                             prop_id,
                             instance_id=instance_id,
                             memory_manager=memory_manager,
-                        ),
+                        )),
                         "folio_id": folio_id,
                     },
                 },
@@ -4977,7 +5001,7 @@ def register_chatter_routes(app, state) -> None:
                     property_id,
                     instance_id,
                 )
-                upsert_chat_reservation(
+                await async_upsert_chat_reservation(
                     chat_id=chat_id,
                     folio_id=folio_id,
                     checkin=checkin,
@@ -5026,7 +5050,7 @@ def register_chatter_routes(app, state) -> None:
                     if locator:
                         state.memory_manager.set_flag(chat_id, "reservation_locator", locator)
                     if folio_id and folio_from_params:
-                        upsert_chat_reservation(
+                        await async_upsert_chat_reservation(
                             chat_id=chat_id,
                             folio_id=folio_id,
                             checkin=ci or checkin,
@@ -5082,7 +5106,7 @@ def register_chatter_routes(app, state) -> None:
                     log.warning("No se pudo extraer folio/checkin/checkout desde rendered: %s", exc)
             if reservation_locator and folio_id and folio_from_params:
                 try:
-                    upsert_chat_reservation(
+                    await async_upsert_chat_reservation(
                         chat_id=chat_id,
                         folio_id=folio_id,
                         checkin=checkin,
@@ -5099,7 +5123,7 @@ def register_chatter_routes(app, state) -> None:
             for mem_id in [session_id, chat_id]:
                 if mem_id:
                     state.memory_manager.set_flag(mem_id, "default_channel", "whatsapp")
-            chat_visible_before = is_chat_visible_in_list(
+            chat_visible_before = await async_is_chat_visible_in_list(
                 chat_id,
                 property_id=property_id,
                 channel="whatsapp",
@@ -5125,7 +5149,7 @@ def register_chatter_routes(app, state) -> None:
             structured_csv = extract_structured_csv(structured_payload)
             if property_id is not None:
                 state.memory_manager.set_flag(chat_id, "property_id", property_id)
-            state.memory_manager.save(
+            await state.memory_manager.asave(
                 session_id,
                 role="bookai",
                 content=rendered or template_name,
@@ -5149,14 +5173,14 @@ def register_chatter_routes(app, state) -> None:
 
         now_iso = datetime.now(timezone.utc).isoformat()
         rooms = _rooms(chat_id, property_id, "whatsapp")
-        chat_visible_after = is_chat_visible_in_list(
+        chat_visible_after = await async_is_chat_visible_in_list(
             chat_id,
             property_id=property_id,
             channel="whatsapp",
             original_chat_id=context_id or None,
         )
         try:
-            client_language, client_language_confidence = _resolve_guest_lang_meta_for_chat(
+            client_language, client_language_confidence = await _resolve_guest_lang_meta_for_chat(
                 state,
                 chat_id,
                 context_id=context_id or None,
@@ -5235,12 +5259,12 @@ def register_chatter_routes(app, state) -> None:
                         "whatsapp_window": whatsapp_window,
                         "bookai_enabled": bool(bookai_resolution.get("value")),
                         "unread_count": 0,
-                        **_pending_snapshot_for_chat(
+                        **(await _pending_snapshot_for_chat(
                             chat_id,
                             property_id,
                             instance_id=instance_id,
                             memory_manager=getattr(state, "memory_manager", None),
-                        ),
+                        )),
                         "folio_id": folio_id,
                     },
                 },
@@ -5282,12 +5306,12 @@ def register_chatter_routes(app, state) -> None:
                 "last_message": template_preview or rendered or template_name,
                 "last_message_at": now_iso,
                 "whatsapp_window": whatsapp_window,
-                **_pending_snapshot_for_chat(
+                **(await _pending_snapshot_for_chat(
                     chat_id,
                     property_id,
                     instance_id=instance_id,
                     memory_manager=getattr(state, "memory_manager", None),
-                ),
+                )),
             },
         )
 
@@ -1856,7 +1856,7 @@ def register_superintendente_routes(app, state) -> None:
         if state.memory_manager:
             try:
                 prev_owner_lang = state.memory_manager.get_flag(session_key, "owner_lang")
-                owner_lang = language_manager.detect_language(message, prev_lang=prev_owner_lang)
+                owner_lang = await language_manager.adetect_language(message, prev_lang=prev_owner_lang)
                 owner_lang = (owner_lang or prev_owner_lang or "es").strip().lower() or "es"
                 state.memory_manager.set_flag(session_key, "owner_lang", owner_lang)
                 if alt_key:
@@ -6,6 +6,7 @@ from datetime import datetime, timezone
 import json
 import logging
 import re
+from collections.abc import Mapping
 from typing import Any, Dict, Optional
 
 from fastapi import APIRouter, Depends, Header, HTTPException
@@ -21,7 +22,13 @@ from api.chatter_routes import (
     _to_international_phone,
 )
 from core.config import Settings
-from core.db import is_chat_visible_in_list, supabase
+from core.db import (
+    invalidate_chat_visibility,
+    is_chat_visible_in_list,
+    run_db_call,
+    supabase,
+    wait_for_chat_history,
+)
 from core.template_registry import TemplateRegistry
 from core.instance_context import (
     ensure_instance_credentials,
@@ -475,7 +482,7 @@ def _resolve_whatsapp_context_id(
 
     for store_name in ("state_flags", "runtime_memory"):
         store = getattr(memory_manager, store_name, None)
-        if isinstance(store, dict):
+        if isinstance(store, Mapping):
             for key in list(store.keys()):
                 if isinstance(key, str) and key.endswith(suffix):
                     candidate = key.strip()
@@ -576,6 +583,7 @@ def _restore_chat_visibility(
     original_clean = str(original_chat_id or "").replace("+", "").strip()
 
     try:
+        wait_for_chat_history(clean_id, original_clean)
         if original_clean:
             (
                 supabase.table("chat_history")
@@ -593,6 +601,7 @@ def _restore_chat_visibility(
             .eq("channel", current_channel)
             .execute()
         )
+        invalidate_chat_visibility(clean_id, original_clean)
         return True
     except Exception:
         return False
@@ -1174,7 +1183,8 @@ def register_template_routes(app, state) -> None:
             rooms = _rooms(state, chat_id, property_id, "whatsapp", context_id=context_id)
             visibility_restored = False
             if not chat_visible_before:
-                visibility_restored = _restore_chat_visibility(
+                visibility_restored = await run_db_call(
+                    _restore_chat_visibility,
                     chat_id,
                     property_id=property_id,
                     channel="whatsapp",
@@ -1261,12 +1271,12 @@ def register_template_routes(app, state) -> None:
                             "whatsapp_window": whatsapp_window,
                             "bookai_enabled": bool(bookai_resolution.get("value")),
                             "unread_count": 0,
-                            **_pending_snapshot_for_chat(
+                            **(await _pending_snapshot_for_chat(
                                 chat_id,
                                 property_id,
                                 instance_id=instance_id,
                                 memory_manager=getattr(state, "memory_manager", None),
-                            ),
+                            )),
                             "folio_id": folio_id,
                         },
                     },
@@ -1324,12 +1334,12 @@ def register_template_routes(app, state) -> None:
                     "last_message": template_preview or rendered or wa_template,
                     "last_message_at": now_iso,
                     "whatsapp_window": whatsapp_window,
-                    **_pending_snapshot_for_chat(
+                    **(await _pending_snapshot_for_chat(
                         chat_id,
                         property_id,
                         instance_id=instance_id,
                         memory_manager=getattr(state, "memory_manager", None),
-                    ),
+                    )),
                 },
             )
             log.info(
@@ -0,0 +1,42 @@
+"""
+🛫 Endpoints del flight recorder
+Cascada de latencias (spans) de los últimos bloques procesados por chat.
+Un token asociado a una instancia solo ve las trazas de esa instancia.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from api.chatter_routes import _verify_bearer
+from core.flight_recorder import recorder
+
+
+def register_trace_routes(app, state) -> None:
+    router = APIRouter(prefix="/api/v1/traces", tags=["traces"])
+
+    def _token_instance(auth_ctx: Dict[str, Optional[str]]) -> Optional[str]:
+        return str((auth_ctx or {}).get("instance_id") or "").strip() or None
+
+    @router.get("/id/{trace_id}")
+    async def get_trace(
+        trace_id: str,
+        auth_ctx: Dict[str, Optional[str]] = Depends(_verify_bearer),
+    ):
+        trace = recorder.get(trace_id, instance_id=_token_instance(auth_ctx))
+        if not trace:
+            raise HTTPException(status_code=404, detail="Traza no encontrada")
+        return trace
+
+    @router.get("/{chat_id}")
+    async def list_chat_traces(
+        chat_id: str,
+        limit: int = Query(20, ge=1, le=200),
+        auth_ctx: Dict[str, Optional[str]] = Depends(_verify_bearer),
+    ):
+        traces = recorder.for_chat(chat_id, limit=limit, instance_id=_token_instance(auth_ctx))
+        return {"chat_id": chat_id, "count": len(traces), "traces": traces, "recorder": recorder.stats()}
+
+    app.include_router(router)
@@ -0,0 +1,122 @@
+"""
+⏱️ Soak: memoria del estado por conversación con 100k conversaciones sintéticas
+======================================================================================
+Pasa N conversaciones distintas por las mismas estructuras que usa un turno real:
+flags y RAM del MemoryManager, buffer de WhatsApp, lock del MainAgent, anti-duplicados
+del ChannelManager e idioma por chat. Cada conversación escribe sus flags, 6 mensajes
+en RAM, un bloque del buffer y un envío, y luego queda inactiva.
+
+Compara RSS y entradas vivas cada 10k conversaciones:
+- dict: diccionarios sin límite (comportamiento anterior)
+- ttl: contenedores TTL + LRU (core/ttl_cache.py) con tope reducido para el soak
+
+Uso:
+    python benchmarks/bench_conversation_state_soak.py [conversaciones] [tope_por_contenedor]
+"""
+
+import asyncio
+import gc
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Valores dummy para poder importar módulos que validan el entorno al cargar.
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("ENDPOINT_MCP", "http://localhost:8001")
+
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+from core.memory_manager import MemoryManager  # noqa: E402
+from core.message_buffer import MessageBufferManager  # noqa: E402
+from core.ttl_cache import TTLCache, process_rss_bytes  # noqa: E402
+
+REPORT_EVERY = 10_000
+MESSAGES_PER_CONVERSATION = 6
+
+
+def _stores(mode: str, cap: int):
+    memory = MemoryManager()
+    buffer = MessageBufferManager(idle_seconds=1)
+    if mode == "dict":
+        memory.runtime_memory = {}
+        memory.state_flags = {}
+        buffer._convs = {}
+        locks, recent_sends, chat_lang = {}, {}, {}
+    else:
+        memory.runtime_memory = TTLCache("soak_runtime_memory", max_entries=cap)
+        memory.state_flags = TTLCache("soak_state_flags", max_entries=cap, on_evict=memory._archive_flags)
+        memory._flag_archive = TTLCache("soak_flag_archive", max_entries=cap * 4)
+        buffer._convs = TTLCache("soak_buffer", max_entries=cap, can_evict=buffer._idle_state)
+        locks = TTLCache("soak_locks", max_entries=cap, can_evict=lambda _k, lock: not lock.locked())
+        recent_sends = TTLCache("soak_recent_sends", max_entries=cap)
+        chat_lang = TTLCache("soak_chat_lang", max_entries=cap)
+    return memory, buffer, locks, recent_sends, chat_lang
+
+
+def _conversation(i: int, memory, buffer, locks, recent_sends, chat_lang) -> None:
+    cid = f"34{600000000 + i}"
+    memory.set_flag(cid, "property_id", 100 + i % 50)
+    memory.set_flag(cid, "instance_id", f"inst-{i % 7}")
+    memory.set_flag(cid, "guest_lang", "es")
+    memory.set_flag(cid, "last_memory_id", f"{i % 50}:{cid}")
+    memory.set_flag(cid, "super_offer_pending", {"offer_type": "upgrade", "text": "x" * 120})
+    for n in range(MESSAGES_PER_CONVERSATION):
+        memory.runtime_memory.setdefault(cid, []).append(
+            {"role": "guest" if n % 2 == 0 else "bookai", "content": f"mensaje {n} " + "y" * 80, "created_at": time.time()}
+        )
+    state = buffer._get_state(cid)
+    state.version += 1
+    locks[cid] = asyncio.Lock()
+    recent_sends[("whatsapp", cid)] = ("respuesta " + "z" * 60, time.monotonic())
+    chat_lang[cid] = "es"
+
+
+def _live_entries(memory, buffer, locks, recent_sends, chat_lang) -> int:
+    return sum(len(store) for store in (memory.runtime_memory, memory.state_flags, buffer._convs, locks, recent_sends, chat_lang))
+
+
+def _soak(mode: str, conversations: int, cap: int) -> tuple:
+    gc.collect()
+    stores = _stores(mode, cap)
+    base_rss = process_rss_bytes() or 0
+    rows = []
+    for i in range(1, conversations + 1):
+        _conversation(i, *stores)
+        if i % REPORT_EVERY == 0:
+            gc.collect()
+            rss = (process_rss_bytes() or 0) - base_rss
+            rows.append((i, rss / 1e6, _live_entries(*stores)))
+    # Una conversación ya expulsada de la RAM vuelve: sus flags persistentes siguen ahí.
+    memory = stores[0]
+    returning = conversations - 2 * cap
+    restored = memory.get_flag(f"34{600000000 + returning}", "property_id")
+    archived = len(getattr(memory, "_flag_archive", {}))
+    del stores
+    gc.collect()
+    return rows, returning, restored, archived
+
+
+def main() -> None:
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    cap = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    print(f"Soak: {conversations} conversaciones, tope por contenedor={cap} (modo ttl)")
+    for mode in ("ttl", "dict"):
+        rows, returning, restored, archived = _soak(mode, conversations, cap)
+        print(f"\n[{mode}] conversaciones | ΔRSS (MB) | entradas vivas")
+        for count, rss_mb, live in rows:
+            print(f"  {count:>9} | {rss_mb:9.1f} | {live:>9}")
+        print(
+            f"  conversación {returning} al volver: property_id={restored} "
+            f"(esperado {100 + returning % 50}); flags archivados={archived}"
+        )
+
+
+if __name__ == "__main__":
+    main()
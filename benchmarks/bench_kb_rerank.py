@@ -0,0 +1,122 @@
+"""
+⏱️ Benchmark: rerank de fragmentos de la KB (léxico vs LLM)
+======================================================================================
+Sobre una KB de ejemplo (benchmarks/fixtures/kb_hotel.json) simula lo que devuelve el
+MCP: 8 fragmentos candidatos por pregunta en un orden poco fiable, con el fragmento
+correcto en una posición aleatoria. Compara calidad (hit@3 y MRR) y latencia de:
+
+- orden del recuperador (sin rerank)
+- reranker léxico (core.utils.kb_rerank)
+- rerank por LLM (solo con --llm; requiere OPENAI_API_KEY real y red)
+
+Uso:
+    python benchmarks/bench_kb_rerank.py [--llm] [repeticiones]
+"""
+
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Valores dummy para poder importar módulos que validan el entorno al cargar.
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("ENDPOINT_MCP", "http://localhost:8001")
+
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+from core.utils.kb_rerank import rank_chunks  # noqa: E402
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "kb_hotel.json"
+CANDIDATES = 8
+TOP_K = 3
+
+
+def _candidate_sets(data: dict, seed: int = 7) -> list[tuple[str, list[str], int]]:
+    rng = random.Random(seed)
+    chunks = data["chunks"]
+    cases = []
+    for item in data["queries"]:
+        relevant = item["relevant"]
+        others = rng.sample([i for i in range(len(chunks)) if i != relevant], CANDIDATES - 1)
+        order = others[:]
+        order.insert(rng.randrange(CANDIDATES), relevant)
+        cases.append((item["q"], [chunks[i] for i in order], order.index(relevant)))
+    return cases
+
+
+def _quality(rankings: list[tuple[list[int], int]]) -> tuple[float, float]:
+    hits = 0
+    rr = 0.0
+    for ranking, relevant in rankings:
+        pos = ranking.index(relevant)
+        hits += pos < TOP_K
+        rr += 1 / (pos + 1)
+    return hits / len(rankings), rr / len(rankings)
+
+
+def _report(label: str, samples_ms: list[float], quality: tuple[float, float]) -> None:
+    ordered = sorted(samples_ms)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{label:<12} hit@{TOP_K}={quality[0]:.2f} MRR={quality[1]:.2f} "
+        f"media={statistics.mean(samples_ms):9.3f}ms p50={statistics.median(samples_ms):9.3f}ms p95={p95:9.3f}ms"
+    )
+
+
+async def _llm_rankings(cases) -> tuple[list[float], list[tuple[list[int], int]]]:
+    from agents.info_agent import KBSearchTool
+
+    tool = KBSearchTool()
+    samples, rankings = [], []
+    for question, chunks, relevant in cases:
+        start = time.perf_counter()
+        top = await tool._llm_rerank_chunks(question, chunks, top_k=CANDIDATES)
+        samples.append((time.perf_counter() - start) * 1000)
+        ranking = [chunks.index(c) for c in top if c in chunks]
+        ranking += [i for i in range(len(chunks)) if i not in ranking]
+        rankings.append((ranking, relevant))
+    return samples, rankings
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if a != "--llm"]
+    repetitions = int(args[0]) if args else 200
+    cases = _candidate_sets(json.loads(FIXTURE.read_text(encoding="utf-8")))
+
+    baseline = [(list(range(CANDIDATES)), relevant) for _, _, relevant in cases]
+
+    lexical_samples = []
+    lexical = []
+    for _ in range(repetitions):
+        for question, chunks, relevant in cases:
+            start = time.perf_counter()
+            rank_chunks(question, chunks)
+            lexical_samples.append((time.perf_counter() - start) * 1000)
+    for question, chunks, relevant in cases:
+        lexical.append(([i for i, _ in rank_chunks(question, chunks)], relevant))
+
+    print(f"Rerank KB: {len(cases)} preguntas, {CANDIDATES} candidatos cada una")
+    _report("recuperador", [0.0], _quality(baseline))
+    _report("léxico", lexical_samples, _quality(lexical))
+    for (question, _, _), (ranking, relevant) in zip(cases, lexical):
+        if ranking.index(relevant) >= TOP_K:
+            print(f"  fallo léxico: {question!r} (posición {ranking.index(relevant) + 1})")
+
+    if "--llm" in sys.argv:
+        logging.disable(logging.NOTSET)
+        samples, rankings = asyncio.run(_llm_rankings(cases))
+        _report("llm", samples, _quality(rankings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+⏱️ Benchmark: coste de preparación del MainAgent por mensaje
+======================================================================================
+Compara el camino antiguo (MainAgent + sub-agentes + tools + AgentExecutor nuevos en
+cada mensaje) con la factoría compartida (grafo construido una vez y turno enlazado
+vía core.agent_context). No realiza llamadas a OpenAI ni a MCP: solo mide la
+construcción de objetos y clientes.
+
+Uso:
+    python benchmarks/bench_main_agent_setup.py [iteraciones]
+"""
+
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Valores dummy para poder importar módulos que validan el entorno al cargar.
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("ENDPOINT_MCP", "http://localhost:8001")
+
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+from langchain.agents import AgentExecutor, create_openai_tools_agent  # noqa: E402
+
+from core.agent_context import bind_turn  # noqa: E402
+from core.main_agent import MainAgent, MainAgentFactory  # noqa: E402
+from core.memory_manager import MemoryManager  # noqa: E402
+
+
+def _legacy_setup(memory_manager, chat_id: str) -> None:
+    """Réplica del camino previo: todo se construía por mensaje."""
+    agent = MainAgent(memory_manager=memory_manager)
+    tools = agent.build_tools(chat_id, "Hotel")
+    chain_agent = create_openai_tools_agent(
+        llm=agent.llm,
+        tools=tools,
+        prompt=agent.create_prompt_template(),
+    )
+    AgentExecutor(
+        agent=chain_agent,
+        tools=tools,
+        verbose=True,
+        max_iterations=25,
+        return_intermediate_steps=True,
+        max_execution_time=90,
+        handle_parsing_errors=True,
+    )
+
+
+def _factory_setup(factory: MainAgentFactory, memory_manager, chat_id: str) -> None:
+    agent = factory.get(memory_manager=memory_manager)
+    agent._get_executor()
+    with bind_turn(chat_id, hotel_name="Hotel"):
+        pass
+
+
+def _measure(fn, iterations: int) -> list[float]:
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(f"3460000{i:04d}")
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float]) -> None:
+    ordered = sorted(samples)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{label:<10} media={statistics.mean(samples):8.3f}ms "
+        f"p50={statistics.median(samples):8.3f}ms p95={p95:8.3f}ms"
+    )
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    memory_manager = MemoryManager()
+    factory = MainAgentFactory()
+
+    legacy = _measure(lambda cid: _legacy_setup(memory_manager, cid), iterations)
+    # La primera llamada de la factoría incluye la construcción del grafo.
+    factory_samples = _measure(lambda cid: _factory_setup(factory, memory_manager, cid), iterations)
+
+    print(f"Preparación del MainAgent por mensaje ({iterations} iteraciones)")
+    _report("legacy", legacy)
+    _report("factoría", factory_samples)
+    print(f"primera llamada factoría (construye grafo): {factory_samples[0]:.3f}ms")
+    speedup = statistics.mean(legacy) / max(statistics.mean(factory_samples[1:] or factory_samples), 1e-6)
+    print(f"mejora en régimen estable: x{speedup:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+⏱️ Benchmark: etapas previas al MainAgent (secuencial vs grafo concurrente)
+======================================================================================
+Reproduce el grafo `pre_agent` de core.pipeline.process_user_message con latencias
+simuladas de Supabase y de las llamadas LLM internas, y mide el tiempo hasta que el
+MainAgent puede arrancar (todas las etapas que necesita resueltas):
+
+- secuencial: StageGraph(parallel=False), equivalente al flujo anterior
+- concurrente: StageGraph(parallel=True)
+
+Uso:
+    python benchmarks/bench_pipeline_pre_agent.py [repeticiones]
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Valores dummy para poder importar módulos que validan el entorno al cargar.
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("ENDPOINT_MCP", "http://localhost:8001")
+
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+from core.stage_graph import StageGraph  # noqa: E402
+
+# Latencias típicas (ms): media y desviación.
+DB_MS = (35.0, 10.0)
+LLM_MS = (450.0, 120.0)
+
+
+async def _latency(profile):
+    mean, stdev = profile
+    await asyncio.sleep(max(1.0, random.gauss(mean, stdev)) / 1000)
+
+
+async def _db(value=None):
+    await _latency(DB_MS)
+    return value
+
+
+async def _llm(value=None):
+    await _latency(LLM_MS)
+    return value
+
+
+def _build(parallel: bool, with_offer: bool) -> StageGraph:
+    graph = StageGraph("pre_agent", parallel=parallel)
+    graph.add("chat_visible", lambda: _db(True))
+    graph.add("recent_guest_messages", lambda: _db([]))
+    graph.add("guest_lang", lambda recent: _llm(("es", 0.9)), deps=("recent_guest_messages",))
+    graph.add("supervisor_input", lambda: _llm({"estado": "Aprobado"}))
+    graph.add("history", lambda: _db([]))
+    graph.add("recent_history", lambda: _db([]))
+    graph.add("locator_history", lambda: _db([]))
+    if with_offer:
+        graph.add("offer_intent", lambda: _llm({"intent": "none"}))
+    return graph
+
+
+async def _one_turn(parallel: bool, with_offer: bool) -> float:
+    started = time.perf_counter()
+    graph = _build(parallel, with_offer).start()
+    await graph.get("guest_lang")
+    await graph.get("supervisor_input")
+    await graph.gather("history", "recent_history", "locator_history")
+    if with_offer:
+        await graph.get("offer_intent")
+    elapsed = (time.perf_counter() - started) * 1000
+    graph.cancel()
+    return elapsed
+
+
+def _report(label: str, samples):
+    ordered = sorted(samples)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{label:<28} mean={statistics.mean(samples):8.1f} ms  "
+        f"p50={statistics.median(samples):8.1f} ms  p95={p95:8.1f} ms"
+    )
+
+
+async def main(repeats: int) -> None:
+    random.seed(7)
+    for with_offer in (False, True):
+        suffix = " + oferta" if with_offer else ""
+        for parallel in (False, True):
+            samples = [await _one_turn(parallel, with_offer) for _ in range(repeats)]
+            _report(("concurrente" if parallel else "secuencial") + suffix, samples)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 30))
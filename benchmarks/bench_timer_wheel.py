@@ -0,0 +1,131 @@
+"""
+⏱️ Benchmark: debounce del buffer con 10k conversaciones (Task por mensaje vs timer wheel)
+======================================================================================
+Simula ráfagas de WhatsApp: N conversaciones activas a la vez, cada una con varios
+mensajes separados por menos de `idle_seconds`. Compara:
+
+- legacy: cancelar y crear una Task dormida por cada mensaje (implementación anterior)
+- wheel: MessageBufferManager sobre el timer wheel compartido
+
+Mide coste por `add_message`, Tasks vivas en el pico y tiempo hasta vaciar el buffer.
+
+Uso:
+    python benchmarks/bench_timer_wheel.py [conversaciones] [mensajes_por_conversación]
+"""
+
+import asyncio
+import gc
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Valores dummy para poder importar módulos que validan el entorno al cargar.
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("ENDPOINT_MCP", "http://localhost:8001")
+
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+from core.message_buffer import MessageBufferManager  # noqa: E402
+from core.timer_wheel import TimerWheel  # noqa: E402
+
+IDLE_SECONDS = 1.0
+GAP_SECONDS = 0.2
+
+
+class LegacyBuffer(MessageBufferManager):
+    """Reproduce el temporizador anterior: una Task con asyncio.sleep por mensaje."""
+
+    def __init__(self, idle_seconds: float):
+        super().__init__(idle_seconds=idle_seconds)
+        self._timers = {}
+
+    async def add_message(self, conversation_id, text, process_callback):
+        state = self._get_state(conversation_id)
+        async with state.lock:
+            if not state.messages:
+                state.first_message_at = time.monotonic()
+            state.messages.append(text.strip())
+            state.version += 1
+            previous = self._timers.get(conversation_id)
+            if previous and not previous.done():
+                previous.cancel()
+            self._timers[conversation_id] = asyncio.create_task(
+                self._sleep_then_flush(conversation_id, state.version, process_callback)
+            )
+
+    async def _sleep_then_flush(self, conversation_id, version, process_callback):
+        try:
+            await asyncio.sleep(self.idle_seconds)
+        except asyncio.CancelledError:
+            return
+        await self._flush(conversation_id, version, process_callback)
+
+
+async def _scenario(buffer: MessageBufferManager, conversations: int, messages: int) -> dict:
+    done = asyncio.Event()
+    processed = 0
+
+    async def _process(cid, combined, version):
+        nonlocal processed
+        processed += 1
+        if processed == conversations:
+            done.set()
+
+    add_samples = []
+    peak_tasks = 0
+    started = time.perf_counter()
+    for burst in range(messages):
+        for i in range(conversations):
+            t0 = time.perf_counter()
+            await buffer.add_message(f"3460{i:07d}", f"mensaje {burst}", _process)
+            add_samples.append((time.perf_counter() - t0) * 1e6)
+        peak_tasks = max(peak_tasks, len(asyncio.all_tasks()))
+        await asyncio.sleep(GAP_SECONDS)
+    sent_at = time.perf_counter()
+    await asyncio.wait_for(done.wait(), timeout=IDLE_SECONDS * 10 + 30)
+    return {
+        "add_samples": add_samples,
+        "peak_tasks": peak_tasks,
+        "flush_s": time.perf_counter() - sent_at,
+        "total_s": time.perf_counter() - started,
+    }
+
+
+def _report(label: str, result: dict) -> None:
+    samples = result["add_samples"]
+    ordered = sorted(samples)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(
+        f"{label:<7} add_message media={statistics.mean(samples):7.2f}µs p50={statistics.median(samples):7.2f}µs "
+        f"p95={p95:7.2f}µs | tasks pico={result['peak_tasks']:6d} | vaciado={result['flush_s']:.2f}s "
+        f"total={result['total_s']:.2f}s"
+    )
+
+
+def main() -> None:
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    print(
+        f"Buffer: {conversations} conversaciones × {messages} mensajes "
+        f"(idle={IDLE_SECONDS}s, hueco entre mensajes={GAP_SECONDS}s)"
+    )
+    gc.collect()
+    _report("legacy", asyncio.run(_scenario(LegacyBuffer(IDLE_SECONDS), conversations, messages)))
+    gc.collect()
+    wheel = TimerWheel()
+    buffer = MessageBufferManager(idle_seconds=IDLE_SECONDS, scheduler=wheel)
+    _report("wheel", asyncio.run(_scenario(buffer, conversations, messages)))
+    print(f"timer wheel: {wheel.stats()}")
+
+
+if __name__ == "__main__":
+    main()
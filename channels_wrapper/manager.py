@@ -7,6 +7,10 @@ import asyncio
 import time
 from channels_wrapper.base_channel import BaseChannel  # 👈 Verificación de herencia
 from core.message_backup import schedule_message_backup
+from core.flight_recorder import span
+from core.metrics import time_stage
+from core.speculation import commit_barrier
+from core.ttl_cache import TTLCache
 
 log = logging.getLogger("ChannelManager")
 
@@ -21,8 +25,9 @@ class ChannelManager:
     def __init__(self, memory_manager=None):
         self.channels = {}
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self._recent_sends = {}  # {(channel, chat_id): (message, timestamp)}
         self._dedup_window = 8.0
+        # {(channel, chat_id): (message, timestamp)}; pasada la ventana de dedupe ya no sirven.
+        self._recent_sends = TTLCache("channel_recent_sends", ttl_seconds=self._dedup_window * 2)
         self.memory_manager = memory_manager
         self._load_channels()
 
@@ -142,6 +147,7 @@ class ChannelManager:
         Envía un mensaje al canal especificado (WhatsApp, Telegram, etc.).
         Soporta métodos síncronos y asíncronos.
         """
+        await commit_barrier("channel.send")
         try:
             channel_obj = self.channels.get(channel)
             if not channel_obj:
@@ -215,10 +221,11 @@ class ChannelManager:
                 setattr(channel_obj, "_raise_on_send_error", raise_on_error)
 
             try:
-                if asyncio.iscoroutinefunction(send_fn):
-                    await send_fn(chat_id, message)
-                else:
-                    send_fn(chat_id, message)
+                with time_stage("channel_send"), span("channel.send", channel=channel):
+                    if asyncio.iscoroutinefunction(send_fn):
+                        await send_fn(chat_id, message)
+                    else:
+                        send_fn(chat_id, message)
             finally:
                 if channel == "whatsapp":
                     if previous_raise_on_send_error is None:
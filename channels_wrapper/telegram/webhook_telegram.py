@@ -1425,7 +1425,7 @@ def register_telegram_routes(app, state):
                 if getattr(state, "memory_manager", None):
                     try:
                         prev_owner_lang = state.memory_manager.get_flag(chat_id, "owner_lang")
-                        owner_lang = language_manager.detect_language(payload or text, prev_lang=prev_owner_lang)
+                        owner_lang = await language_manager.adetect_language(payload or text, prev_lang=prev_owner_lang)
                         owner_lang = (owner_lang or prev_owner_lang or "es").strip().lower() or "es"
                         state.memory_manager.set_flag(chat_id, "owner_lang", owner_lang)
                     except Exception:
@@ -2,7 +2,8 @@ import re
 import random
 import asyncio
 import logging
-from langchain_openai import ChatOpenAI
+
+from core.config import ModelConfig
 
 log = logging.getLogger("fragmentation")
 _CUT_MARKER = "<<BOOKAI_CUT>>"
@@ -100,7 +101,7 @@ async def fragment_text_with_ai(text: str, max_fragments: int = 9) -> list[str]:
     if len(raw_text) < 40:
         return [raw_text]
 
-    llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0)
+    llm = ModelConfig.get_custom_llm("gpt-4.1-mini", 0, label="fragmenter")
     prompt = f"""
 Tu única tarea es insertar el marcador {_CUT_MARKER} en el texto original para indicar cortes naturales.
 
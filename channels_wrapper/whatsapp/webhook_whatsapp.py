@@ -12,7 +12,9 @@ from fastapi import Request
 from fastapi.responses import JSONResponse, PlainTextResponse
 
 from channels_wrapper.utils.text_utils import send_fragmented_async
+from core.context_prefetch import context_prefetcher
 from core.db import is_chat_visible_in_list
+from core.flight_recorder import trace_message
 from core.message_backup import schedule_message_backup
 from core.pipeline import process_user_message, _resolve_bookai_enabled
 from core.language_manager import language_manager
@@ -440,7 +442,7 @@ def register_whatsapp_routes(app, state):
                     or state.memory_manager.get_flag(clean_chat_id, "guest_lang")
                     or state.memory_manager.get_flag(sender, "guest_lang")
                 )
-                detected_lang, detected_confidence = language_manager.detect_language_with_confidence(
+                detected_lang, detected_confidence = await language_manager.adetect_language_with_confidence(
                     text,
                     prev_lang=prev_lang,
                 )
@@ -821,6 +823,11 @@ def register_whatsapp_routes(app, state):
                 )
 
             async def _process_buffered(cid: str, combined_text: str, version: int):
+                # Una traza por bloque combinado: agrupa pipeline, tools, LLM, MCP y envíos.
+                with trace_message("whatsapp.buffered_block", cid, sender, channel="whatsapp", version=version):
+                    await _process_buffered_block(cid, combined_text, version)
+
+            async def _process_buffered_block(cid: str, combined_text: str, version: int):
                 buffered_healthcheck = detect_whatsapp_healthcheck(combined_text)
                 log.info(
                     "🧠 Procesando lote buffered v%s → %s\n🧩 Mensajes combinados:\n%s",
@@ -888,7 +895,16 @@ def register_whatsapp_routes(app, state):
                         buffered_healthcheck.get("path"),
                     )
 
-            await state.buffer_manager.add_message(memory_id, text, _process_buffered)
+            await state.buffer_manager.add_message(
+                memory_id,
+                text,
+                _process_buffered,
+                on_first_message=lambda cid: context_prefetcher.prefetch(
+                    state,
+                    cid,
+                    instance_number=normalized_instance_number,
+                ),
+            )
 
             return JSONResponse({"status": "queued"})
 
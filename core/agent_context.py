@@ -0,0 +1,65 @@
+"""
+🧵 Contexto por turno del MainAgent
+======================================================================================
+El grafo estático del agente (LLM, sub-agentes, tools y AgentExecutor) se construye
+una sola vez por proceso. Lo que cambia en cada mensaje (chat_id, hotel, callback de
+envío y estado efímero de las tools) se enlaza aquí mediante un ContextVar, de modo
+que cada tarea asyncio ve únicamente su propio turno.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+@dataclass
+class AgentTurnContext:
+    """Estado por chat/turno que las tools compartidas leen en tiempo de ejecución."""
+
+    chat_id: str
+    hotel_name: str = ""
+    send_callback: Optional[Callable] = None
+    # Estado efímero del turno (p.ej. caché de disponibilidad, anti-spam de incisos).
+    scratch: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+
+_current_turn: ContextVar[Optional[AgentTurnContext]] = ContextVar("agent_turn", default=None)
+
+
+def current_turn() -> Optional[AgentTurnContext]:
+    """Devuelve el turno enlazado a la tarea actual (o None fuera del MainAgent)."""
+    return _current_turn.get()
+
+
+def current_chat_id(default: str = "") -> str:
+    turn = _current_turn.get()
+    return turn.chat_id if turn and turn.chat_id else default
+
+
+def turn_scratch(namespace: str) -> Optional[Dict[str, Any]]:
+    """
+    Diccionario mutable del turno actual para `namespace`.
+    Al ser mutable se comparte entre las tareas que LangChain crea a partir del turno.
+    """
+    turn = _current_turn.get()
+    if turn is None:
+        return None
+    return turn.scratch.setdefault(namespace, {})
+
+
+@contextmanager
+def bind_turn(
+    chat_id: str,
+    hotel_name: str = "",
+    send_callback: Optional[Callable] = None,
+) -> Iterator[AgentTurnContext]:
+    """Enlaza el turno a la tarea actual mientras dura el bloque `with`."""
+    turn = AgentTurnContext(chat_id=chat_id, hotel_name=hotel_name, send_callback=send_callback)
+    token = _current_turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _current_turn.reset(token)
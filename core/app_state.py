@@ -17,6 +17,7 @@ from core.config import Settings
 from core.template_registry import TemplateRegistry
 from core.memory_manager import MemoryManager
 from core.message_buffer import MessageBufferManager
+from core.ttl_cache import TTLCache
 from core.db import supabase
 
 TRACK_FILE = "/tmp/escalation_tracking.pkl"
@@ -47,7 +48,12 @@ class AppState:
         except Exception:
             effective_idle = float(idle_seconds)
         self.buffer_manager = MessageBufferManager(idle_seconds=effective_idle)
-        self.log.info("🕒 Message buffer idle_seconds=%.2f", effective_idle)
+        self.log.info(
+            "🕒 Message buffer idle_seconds=%.2f adaptive=%s speculative=%s",
+            effective_idle,
+            self.buffer_manager.adaptive,
+            self.buffer_manager.speculative,
+        )
         self.interno_agent = InternoAgent(
             memory_manager=self.memory_manager,
             channel_manager=self.channel_manager,
@@ -61,7 +67,7 @@ class AppState:
         )
 
         # Estado efímero de la sesión
-        self.chat_lang: dict[str, str] = {}
+        self.chat_lang: TTLCache = TTLCache("chat_lang")
         self.telegram_pending_confirmations: dict = {}
         self.telegram_pending_kb_addition: dict = {}
         self.telegram_pending_kb_removal: dict = {}
@@ -0,0 +1,151 @@
+"""
+🛏️ Caché compartida de disponibilidad y precios
+======================================================================================
+Respuestas de `Disponibilidad_y_precios` compartidas entre conversaciones, con clave
+(instance_url, property_id, checkin, checkout, occupancy):
+
+- TTL corto (AVAILABILITY_CACHE_TTL) para no servir precios desactualizados.
+- Single-flight: consultas idénticas concurrentes (p.ej. tras un envío masivo de
+  campaña) esperan a una única llamada MCP.
+- Límite de entradas (LRU) y métricas de aciertos/fallos.
+
+Solo se cachean respuestas válidas (listas); los errores nunca se guardan.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+log = logging.getLogger("AvailabilityCache")
+
+AVAILABILITY_CACHE_TTL = float(os.getenv("AVAILABILITY_CACHE_TTL", "60"))
+AVAILABILITY_CACHE_MAXSIZE = int(os.getenv("AVAILABILITY_CACHE_MAXSIZE", "2048"))
+
+AvailabilityKey = Tuple[str, str, str, str, int]
+
+
+def availability_key(
+    instance_url: Optional[str],
+    property_id: Any,
+    checkin: Any,
+    checkout: Any,
+    occupancy: Any,
+) -> AvailabilityKey:
+    """Normaliza los parámetros de la consulta para usarlos como clave."""
+    try:
+        occupancy = int(occupancy or 0)
+    except (TypeError, ValueError):
+        occupancy = 0
+    return (
+        (instance_url or "").strip().rstrip("/").lower(),
+        str(property_id if property_id is not None else "").strip(),
+        str(checkin)[:10],
+        str(checkout)[:10],
+        occupancy,
+    )
+
+
+class AvailabilityCache:
+    """Caché TTL + LRU con coalescencia de peticiones idénticas en vuelo."""
+
+    def __init__(self, ttl: float = AVAILABILITY_CACHE_TTL, maxsize: int = AVAILABILITY_CACHE_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = max(1, maxsize)
+        self._entries: "OrderedDict[AvailabilityKey, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[AvailabilityKey, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "loads": 0, "errors": 0, "evictions": 0}
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[stat] += amount
+
+    def get(self, key: AvailabilityKey) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: AvailabilityKey, rooms: Any) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, rooms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    async def _load(self, key: AvailabilityKey, loader: Callable[[], Awaitable[Any]]) -> Any:
+        self._count("loads")
+        rooms = await loader()
+        if isinstance(rooms, list):
+            self.set(key, rooms)
+        return rooms
+
+    async def get_or_load(self, key: AvailabilityKey, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Devuelve la respuesta cacheada o ejecuta `loader` una sola vez por clave."""
+        cached = self.get(key)
+        if cached is not None:
+            self._count("hits")
+            log.info("♻️ Disponibilidad servida desde caché compartida: %s", key)
+            return cached
+
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is not None and not task.done() and task.get_loop() is loop:
+            self._count("coalesced")
+        else:
+            self._count("misses")
+            task = loop.create_task(self._load(key, loader))
+            self._inflight[key] = task
+
+            def _done(t: asyncio.Task) -> None:
+                if self._inflight.get(key) is t:
+                    self._inflight.pop(key, None)
+                if not t.cancelled() and t.exception() is not None:
+                    self._count("errors")
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    def invalidate(self, instance_url: Optional[str] = None, property_id: Any = None) -> int:
+        """Descarta entradas de una instancia/propiedad (o todas si no se indica nada)."""
+        prefix_url = (instance_url or "").strip().rstrip("/").lower()
+        prefix_prop = str(property_id).strip() if property_id is not None else None
+        with self._lock:
+            doomed = [
+                key
+                for key in self._entries
+                if (not prefix_url or key[0] == prefix_url) and (prefix_prop is None or key[1] == prefix_prop)
+            ]
+            for key in doomed:
+                self._entries.pop(key, None)
+        return len(doomed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["coalesced"]) / lookups, 4) if lookups else 0.0
+        stats["ttl_s"] = self.ttl
+        return stats
+
+
+availability_cache = AvailabilityCache()
+
+
+def get_availability_cache_stats() -> Dict[str, Any]:
+    return availability_cache.stats()
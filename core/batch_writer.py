@@ -0,0 +1,315 @@
+"""
+📦 Escritor en segundo plano por lotes
+======================================================================================
+Cola + un único hilo que agrupa escrituras llegadas en una ventana corta
+(`batch_ms`) o hasta `max_batch` elementos y las entrega juntas a `flush(batch)`.
+Sustituye a las escrituras síncronas "una petición por fila" (p.ej. `chat_history`).
+
+- `submit(item)`: encola y vuelve al instante. El orden de llegada se conserva: un solo
+  hilo escribe los lotes en secuencia.
+- `keys(item)`: claves (p.ej. conversación) con escrituras pendientes; `pending(key)` y
+  `wait_for(*keys)` permiten leer-tus-escrituras antes de consultar la BD.
+- `flush()` espera a vaciar la cola; `close()` la vacía y para el hilo (shutdown).
+
+Opcional:
+- Cola acotada (`max_queue`) con política de desbordamiento: "drop_new" descarta lo
+  que llega, "drop_oldest" lo más antiguo, "block" espera hueco (nunca desde el loop).
+  Lo descartado se entrega a `on_drop(items)` (p.ej. para volcarlo a disco).
+- Reintentos con backoff exponencial y jitter (`retries`); agotados, el lote va a
+  `on_failure(batch)`. Si `flush` escribe solo parte del lote puede lanzar
+  `PartialBatchError(remaining, cause)`: se reintenta (y se entrega a `on_failure`)
+  únicamente lo que quedó sin escribir.
+- `on_written(size, lag_seconds)`: tras cada lote escrito, con la espera del más antiguo.
+
+Un fallo de `flush` se registra y no detiene el hilo.
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+log = logging.getLogger("BatchWriter")
+
+_STOP = object()
+
+
+class PartialBatchError(Exception):
+    """`flush` escribió parte del lote; `remaining` son los elementos que no llegaron a la BD."""
+
+    def __init__(self, remaining: List[Any], cause: BaseException):
+        super().__init__(str(cause))
+        self.remaining = list(remaining)
+        self.cause = cause
+
+
+class BatchWriter:
+    """Hilo escritor con lotes por ventana de tiempo y seguimiento de pendientes por clave."""
+
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[List[Any]], None],
+        *,
+        batch_ms: float = 20.0,
+        max_batch: int = 200,
+        keys: Optional[Callable[[Any], Iterable[Hashable]]] = None,
+        max_queue: int = 0,
+        overflow: str = "drop_new",
+        on_drop: Optional[Callable[[List[Any]], None]] = None,
+        retries: int = 0,
+        retry_base_ms: float = 200.0,
+        on_failure: Optional[Callable[[List[Any]], None]] = None,
+        on_written: Optional[Callable[[int, float], None]] = None,
+    ):
+        if overflow not in {"drop_new", "drop_oldest", "block"}:
+            raise ValueError(f"overflow no soportado: {overflow}")
+        self.name = name
+        self._flush = flush
+        self.batch_seconds = max(0.0, batch_ms / 1000)
+        self.max_batch = max(1, int(max_batch))
+        self._keys = keys
+        self.max_queue = max(0, int(max_queue))
+        self.overflow = overflow
+        self._on_drop = on_drop
+        self.retries = max(0, int(retries))
+        self.retry_base = max(0.0, retry_base_ms / 1000)
+        self._on_failure = on_failure
+        self._on_written = on_written
+        # Elementos como (encolado_en, item) para medir el retraso de escritura.
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=self.max_queue)
+        self._pending: Counter = Counter()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "errors": 0,
+            "retries": 0,
+            "failed": 0,
+            "dropped": 0,
+            "max_batch_seen": 0,
+            "last_lag_ms": 0.0,
+            "max_lag_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def submit(self, item: Any) -> bool:
+        """Encola `item`. False si la cola estaba llena y se descartó (política "drop_new")."""
+        if self._closed:
+            # Tras el cierre (shutdown) se escribe en el acto para no perder nada.
+            self._write([(time.monotonic(), item)])
+            return True
+        self._ensure_thread()
+        with self._cond:
+            self._in_flight += 1
+            for key in self._item_keys(item):
+                self._pending[key] += 1
+            self._stats["submitted"] += 1
+        entry = (time.monotonic(), item)
+        try:
+            if self.overflow == "block":
+                self._queue.put(entry)
+            else:
+                self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            pass
+        if self.overflow == "drop_oldest":
+            try:
+                oldest = self._queue.get_nowait()
+            except queue.Empty:
+                oldest = None
+            if oldest is not None and oldest is not _STOP:
+                self._dropped([oldest])
+            try:
+                self._queue.put_nowait(entry)
+                return True
+            except queue.Full:
+                pass
+        self._dropped([entry])
+        return False
+
+    def pending(self, *keys: Hashable) -> int:
+        with self._cond:
+            return sum(self._pending.get(key, 0) for key in keys if key)
+
+    def wait_for(self, *keys: Hashable, timeout: float = 2.0) -> bool:
+        """Espera a que no queden escrituras pendientes de `keys`. False si vence el timeout."""
+        keys = tuple(key for key in keys if key)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while any(self._pending.get(key, 0) for key in keys):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Espera a que se escriba todo lo encolado hasta ahora."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Vacía la cola y para el hilo. Las escrituras posteriores son síncronas."""
+        self._closed = True
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            self._drain_inline()
+            return True
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._drain_inline()
+        return not thread.is_alive()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = self._in_flight
+            stats["depth"] = self._queue.qsize()
+            stats["max_queue"] = self.max_queue or None
+            stats["pending_keys"] = len(self._pending)
+        stats["name"] = self.name
+        stats["avg_batch"] = round(stats["written"] / stats["batches"], 2) if stats["batches"] else None
+        return stats
+
+    # ------------------------------------------------------------------
+    # Hilo escritor
+    # ------------------------------------------------------------------
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f"batch-writer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.batch_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._write(batch, tracked=True)
+            if stop:
+                return
+
+    def _drain_inline(self) -> None:
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        for start in range(0, len(batch), self.max_batch):
+            self._write(batch[start:start + self.max_batch], tracked=True)
+
+    def _write(self, entries: List[Any], tracked: bool = False) -> None:
+        batch = [item for _, item in entries]
+        # Lo que aún no está escrito: se reduce si `flush` confirma escrituras parciales.
+        unwritten = batch
+        ok = False
+        for attempt in range(self.retries + 1):
+            try:
+                self._flush(unwritten)
+                ok = True
+                break
+            except Exception as exc:
+                if isinstance(exc, PartialBatchError):
+                    unwritten = exc.remaining
+                with self._cond:
+                    self._stats["errors"] += 1
+                if attempt >= self.retries:
+                    log.error("⚠️ [%s] Error escribiendo lote de %s elementos: %s", self.name, len(unwritten), exc, exc_info=True)
+                    break
+                delay = self.retry_base * (2 ** attempt) * random.uniform(0.5, 1.5)
+                log.warning("⚠️ [%s] Lote fallido (%s); reintento en %.2fs", self.name, exc, delay)
+                with self._cond:
+                    self._stats["retries"] += 1
+                time.sleep(delay)
+        if not ok and self._on_failure is not None:
+            try:
+                self._on_failure(unwritten)
+            except Exception as exc:
+                log.error("⚠️ [%s] Error en on_failure: %s", self.name, exc, exc_info=True)
+        lag = time.monotonic() - min(queued_at for queued_at, _ in entries)
+        with self._cond:
+            self._stats["batches"] += 1
+            if ok:
+                self._stats["written"] += len(batch)
+                self._stats["last_lag_ms"] = round(lag * 1000, 2)
+                self._stats["max_lag_ms"] = max(self._stats["max_lag_ms"], self._stats["last_lag_ms"])
+            else:
+                self._stats["written"] += len(batch) - len(unwritten)
+                self._stats["failed"] += len(unwritten)
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(batch))
+            if tracked:
+                self._release(batch)
+            self._cond.notify_all()
+        if ok and self._on_written is not None:
+            try:
+                self._on_written(len(batch), lag)
+            except Exception:
+                pass
+
+    def _dropped(self, entries: List[Any]) -> None:
+        items = [item for _, item in entries]
+        with self._cond:
+            self._stats["dropped"] += len(items)
+            self._release(items)
+            self._cond.notify_all()
+        log.warning("⚠️ [%s] Cola llena (%s): %s elementos descartados", self.name, self.max_queue, len(items))
+        if self._on_drop is not None:
+            try:
+                self._on_drop(items)
+            except Exception as exc:
+                log.error("⚠️ [%s] Error en on_drop: %s", self.name, exc, exc_info=True)
+
+    def _release(self, items: List[Any]) -> None:
+        """Con `_cond` tomado: descuenta elementos ya escritos o descartados."""
+        self._in_flight -= len(items)
+        for item in items:
+            for key in self._item_keys(item):
+                self._pending[key] -= 1
+                if self._pending[key] <= 0:
+                    del self._pending[key]
+
+    def _item_keys(self, item: Any) -> Iterable[Hashable]:
+        if self._keys is None:
+            return ()
+        try:
+            return [key for key in self._keys(item) if key]
+        except Exception:
+            return ()
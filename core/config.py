@@ -7,21 +7,23 @@ Lee todo desde el archivo .env al inicio del sistema.
 """
 
 import os
+import threading
 from enum import Enum
+from typing import Any, Dict
 from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
 from langchain_openai import ChatOpenAI
 
+from core.llm_pool import get_llm_pool_stats, llm_client_pool
+from core.metrics import record_llm_tokens
+from core.speculation import note_llm_tokens
+from core.utils.env import env_bool as _env_bool
+
 # Cargar variables del .env
 load_dotenv()
 
 
-def _env_bool(name: str, default: bool = False) -> bool:
-    raw = os.getenv(name)
-    if raw is None:
-        return default
-    return str(raw).strip().lower() in {"1", "true", "yes", "on", "si", "sí"}
-
-
 # =============================================================
 # ⚙️ CONFIGURACIÓN GENERAL (.env)
 # =============================================================
@@ -148,6 +150,34 @@ class ModelTier(str, Enum):
     SUPERINTENDENTE = "superintendente"  # Gestión de conocimiento/estrategia
 
 
+# =============================================================
+# 📈 CONSUMO DE TOKENS POR TIER
+# =============================================================
+class _TokenUsageCallback(BaseCallbackHandler):
+    """Suma los tokens de cada llamada del ChatOpenAI de un tier en core.metrics."""
+
+    run_inline = True
+
+    def __init__(self, tier: str):
+        self.tier = tier
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        try:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt = int(usage.get("prompt_tokens") or 0)
+            completion = int(usage.get("completion_tokens") or 0)
+            if not (prompt or completion):
+                for generations in response.generations:
+                    for generation in generations:
+                        metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                        prompt += int(metadata.get("input_tokens") or 0)
+                        completion += int(metadata.get("output_tokens") or 0)
+            record_llm_tokens(self.tier, prompt, completion)
+            note_llm_tokens(prompt, completion)
+        except Exception:
+            pass
+
+
 # =============================================================
 # 🧠 CONFIGURACIÓN CENTRALIZADA DE MODELOS LLM
 # =============================================================
@@ -155,8 +185,12 @@ class ModelConfig:
     """
     Configuración centralizada de modelos LLM.
     Lee todo desde Settings (.env) y genera objetos ChatOpenAI uniformes.
+    Los clientes se registran por tier y comparten el pool HTTP de core.llm_pool.
     """
 
+    _registry: Dict[tuple, ChatOpenAI] = {}
+    _registry_lock = threading.Lock()
+
     MODELS = {
         ModelTier.MAIN: {
             "name": Settings.MODEL_MAIN,
@@ -190,9 +224,35 @@ class ModelConfig:
 
     @classmethod
     def get_llm(cls, tier: ModelTier) -> ChatOpenAI:
-        """Devuelve un ChatOpenAI configurado con el modelo y temperatura del tier."""
+        """Devuelve el ChatOpenAI compartido del tier (modelo + temperatura del tier)."""
         name, temp = cls.get_model(tier)
-        return ChatOpenAI(model=name, temperature=temp)
+        return cls._get_registered(tier.value, name, temp)
+
+    @classmethod
+    def get_custom_llm(cls, model: str, temperature: float, label: str = "custom") -> ChatOpenAI:
+        """ChatOpenAI compartido para modelos fuera de los tiers (p.ej. idioma o Think)."""
+        return cls._get_registered(label, model, temperature)
+
+    @classmethod
+    def _get_registered(cls, label: str, model: str, temperature: float) -> ChatOpenAI:
+        key = (label, model, float(temperature))
+        with cls._registry_lock:
+            llm = cls._registry.get(key)
+            if llm is None:
+                llm = ChatOpenAI(
+                    model=model,
+                    temperature=temperature,
+                    http_client=llm_client_pool.sync_client(label),
+                    http_async_client=llm_client_pool.async_client(label),
+                    callbacks=[_TokenUsageCallback(label)],
+                )
+                cls._registry[key] = llm
+            return llm
+
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        """Estadísticas del pool HTTP compartido y de uso por tier."""
+        return get_llm_pool_stats()
 
 
 # =============================================================
@@ -0,0 +1,305 @@
+"""
+🔮 Precarga de contexto durante la espera del buffer
+======================================================================================
+Mientras el buffer de WhatsApp espera a que el huésped termine de escribir (segundos),
+el primer mensaje del bloque lanza en segundo plano las lecturas que el pipeline hará
+igualmente al despachar el bloque:
+
+- `hydrate_dynamic_context` (instancia/property → flags), en el pool de BD
+- el `ConversationContext` del turno en una sola petición (core/conversation_context.py):
+  filas de historial (se fusionan con la RAM al consumirlas y se siembran en la caché de
+  historial de MemoryManager), visibilidad en el listado, reserva activa del chat
+  (MainAgent) y última escalación pendiente (anti-duplicado de escalaciones)
+
+`process_user_message` consume el snapshot con `take()` y lo descarta si está obsoleto:
+demasiado antiguo, con escrituras en el historial posteriores a la lectura o con otro
+`property_id`. Una precarga en curso se espera (nunca tarda más que repetir la lectura).
+Sin precarga válida, `load()` hace la misma lectura en línea: el turno sigue resolviendo
+su contexto en una sola petición en vez de las consultas sueltas.
+
+Opt-out con PREFETCH_ENABLED=false (la carga en línea sigue activa salvo
+PREFETCH_LOAD_ON_MISS=false). Edad máxima: PREFETCH_MAX_AGE_SECONDS.
+Métrica: `bookai_context_prefetch_total{result}` (hit/stale/miss/error/loaded).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.conversation_context import (
+    ConversationContext,
+    ConversationContextLoader,
+    ConversationContextRequest,
+    conversation_context_loader,
+)
+from core.db import run_db_call
+from core.instance_context import hydrate_dynamic_context
+from core.memory_manager import HISTORY_CACHE_FETCH_LIMIT
+from core.metrics import CONTEXT_PREFETCH_TOTAL
+from core.ttl_cache import TTLCache
+from core.utils.env import env_bool
+
+log = logging.getLogger("ContextPrefetch")
+
+PREFETCH_ENABLED = env_bool("PREFETCH_ENABLED", True)
+PREFETCH_MAX_AGE_SECONDS = float(os.getenv("PREFETCH_MAX_AGE_SECONDS", "120"))
+PREFETCH_LOAD_ON_MISS = env_bool("PREFETCH_LOAD_ON_MISS", True)
+# Mayor límite de historial que pide el pipeline (history/locator_history = 30).
+PREFETCH_HISTORY_LIMIT = int(os.getenv("PREFETCH_HISTORY_LIMIT", "30"))
+
+_MISSING = object()
+_active: contextvars.ContextVar[Optional["ContextSnapshot"]] = contextvars.ContextVar(
+    "bookai_context_snapshot", default=None
+)
+
+
+@dataclass
+class ContextSnapshot:
+    """Lecturas precargadas para una conversación y la versión del historial en que se hicieron."""
+
+    mem_id: str
+    history_version: int
+    property_id: Any
+    created_at: float = field(default_factory=time.monotonic)
+    instance_number: Optional[str] = None
+    hydrated: bool = False
+    db_history: Optional[List[Dict[str, Any]]] = None
+    reservation: Any = _MISSING
+    reservation_instance_id: Any = None
+    escalation: Any = _MISSING
+    context: Optional[ConversationContext] = None
+
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+    def history(self, memory_manager: Any, limit: int, as_messages: bool = False):
+        """Historial como `aget_memory(limit)`; None si no se precargó o el límite es mayor."""
+        if self.db_history is None or limit > PREFETCH_HISTORY_LIMIT:
+            return None
+        # Como `aget_memory(limit)`: la consulta devuelve las `limit` filas más antiguas.
+        return memory_manager.history_from_rows(self.mem_id, self.db_history[:limit], limit, as_messages=as_messages)
+
+    def reservation_for(self, instance_id: Any) -> Tuple[bool, Optional[dict]]:
+        """(hay dato, reserva) si se leyó con el mismo instance_id."""
+        if self.reservation is _MISSING or instance_id != self.reservation_instance_id:
+            return False, None
+        return True, self.reservation
+
+    def escalation_for(self, property_id: Any) -> Tuple[bool, Optional[dict]]:
+        """(hay dato, escalación pendiente) si se leyó con el mismo property_id."""
+        if self.escalation is _MISSING or property_id != self.property_id:
+            return False, None
+        return True, self.escalation
+
+    def visible_for(self, conversation_id: Any, property_id: Any, channel: Optional[str], original_chat_id: Optional[str]):
+        """(hay dato, visible en el listado) si se calculó con los mismos filtros."""
+        if self.context is None:
+            return False, None
+        return self.context.visible_for(conversation_id, property_id, channel, original_chat_id)
+
+
+def current_snapshot(chat_id: Optional[str] = None) -> Optional[ContextSnapshot]:
+    """Snapshot consumido por el pipeline en curso (misma Task), opcionalmente para `chat_id`."""
+    snapshot = _active.get()
+    if snapshot is None or (chat_id is not None and snapshot.mem_id != chat_id):
+        return None
+    return snapshot
+
+
+class ContextPrefetcher:
+    """Una precarga en vuelo por conversación; el pipeline la recoge una sola vez."""
+
+    def __init__(
+        self,
+        enabled: bool = PREFETCH_ENABLED,
+        max_age_seconds: float = PREFETCH_MAX_AGE_SECONDS,
+        loader: Optional[ConversationContextLoader] = None,
+        load_on_miss: bool = PREFETCH_LOAD_ON_MISS,
+    ):
+        self.enabled = enabled
+        self.load_on_miss = load_on_miss
+        self.loader = loader or conversation_context_loader
+        self.max_age = max(0.0, float(max_age_seconds))
+        self._pending: TTLCache = TTLCache(
+            "context_prefetch",
+            ttl_seconds=max(self.max_age * 2, 1.0),
+            on_evict=self._on_evict,
+        )
+        self._stats = {"started": 0, "coalesced": 0, "hit": 0, "stale": 0, "miss": 0, "error": 0, "loaded": 0}
+
+    # ------------------------------------------------------------------
+    # Lanzar
+    # ------------------------------------------------------------------
+    def prefetch(self, state: Any, mem_id: str, instance_number: Optional[str] = None) -> bool:
+        """Lanza la precarga de `mem_id` en segundo plano (no bloquea). False si no se lanzó."""
+        if not self.enabled or not mem_id or not getattr(state, "memory_manager", None):
+            return False
+        running = self._pending.peek(mem_id)
+        if running is not None and not running.done():
+            self._stats["coalesced"] += 1
+            return False
+        try:
+            task = asyncio.get_running_loop().create_task(
+                self._fetch(state, mem_id, instance_number),
+                name=f"context-prefetch:{mem_id}",
+            )
+        except RuntimeError:
+            return False
+        self._pending[mem_id] = task
+        self._stats["started"] += 1
+        return True
+
+    async def _fetch(self, state: Any, mem_id: str, instance_number: Optional[str]) -> ContextSnapshot:
+        mm = state.memory_manager
+        snapshot = ContextSnapshot(
+            mem_id=mem_id,
+            history_version=mm.history_version(mem_id),
+            property_id=None,
+            instance_number=instance_number,
+        )
+        try:
+            await run_db_call(
+                hydrate_dynamic_context,
+                state=state,
+                chat_id=mem_id,
+                instance_number=instance_number,
+            )
+            snapshot.hydrated = True
+        except Exception as exc:
+            log.debug("Precarga: no se pudo hidratar contexto de %s: %s", mem_id, exc)
+
+        property_id = mm.get_flag(mem_id, "property_id")
+        instance_id = mm.get_flag(mem_id, "instance_id") or mm.get_flag(mem_id, "instance_hotel_code")
+        snapshot.property_id = property_id
+        snapshot.reservation_instance_id = instance_id
+        filters = mm.history_filters(mem_id)
+        request = ConversationContextRequest(
+            conversation_id=filters["conversation_id"],
+            original_chat_id=filters["original_chat_id"],
+            memory_id=mem_id,
+            property_id=property_id,
+            instance_id=instance_id,
+            history_table=filters["table"],
+            history_limit=max(PREFETCH_HISTORY_LIMIT, HISTORY_CACHE_FETCH_LIMIT),
+            history_days=mm.db_history_days,
+        )
+        try:
+            context = await self.loader.load(request)
+        except Exception as exc:
+            log.debug("Precarga: no se pudo cargar el contexto de %s: %s", mem_id, exc)
+            return snapshot
+
+        snapshot.context = context
+        snapshot.db_history = context.history_rows()
+        snapshot.reservation = context.reservation_dict()
+        if property_id is None and context.property_hint is not None:
+            # Lo mismo que haría `_aresolve_property_id`; la escalación se leyó sin filtro
+            # de property, así que no vale para el property_id resultante.
+            mm._remember_inferred_property_id(mem_id, context.property_hint)
+            snapshot.property_id = mm.get_flag(mem_id, "property_id")
+        else:
+            snapshot.escalation = context.escalation_dict()
+        mm.seed_history(
+            mem_id,
+            context.property_id,
+            snapshot.db_history,
+            request.history_limit,
+            fallback=context.history_fallback,
+            history_version=snapshot.history_version,
+        )
+        return snapshot
+
+    # ------------------------------------------------------------------
+    # Consumir
+    # ------------------------------------------------------------------
+    async def take(self, state: Any, mem_id: str) -> Optional[ContextSnapshot]:
+        """
+        Recoge (y retira) la precarga de `mem_id`. Devuelve el snapshot si sigue vigente y
+        lo deja activo para el resto de la Task (`current_snapshot`); si no, None.
+        """
+        # La Task del bloque siguiente copia el contexto de la anterior: nunca heredar su snapshot.
+        _active.set(None)
+        task = self._pending.pop(mem_id, None) if mem_id else None
+        if task is None:
+            self._count("miss")
+            return None
+        try:
+            snapshot = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            log.warning("⚠️ Precarga de contexto fallida para %s: %s", mem_id, exc)
+            self._count("error")
+            return None
+
+        reason = self._stale_reason(state, snapshot)
+        if reason:
+            log.debug("Precarga descartada para %s (%s)", mem_id, reason)
+            self._count("stale")
+            return None
+        self._count("hit")
+        _active.set(snapshot)
+        return snapshot
+
+    async def load(self, state: Any, mem_id: str, instance_number: Optional[str] = None) -> Optional[ContextSnapshot]:
+        """
+        Sin precarga válida: hidrata y carga el contexto en línea (una petición) y lo deja
+        activo como haría `take()`. None si está desactivado o no hay memoria.
+        """
+        _active.set(None)
+        if not self.load_on_miss or not mem_id or not getattr(state, "memory_manager", None):
+            return None
+        try:
+            snapshot = await self._fetch(state, mem_id, instance_number)
+        except Exception as exc:
+            log.warning("⚠️ Carga de contexto en línea fallida para %s: %s", mem_id, exc)
+            return None
+        if snapshot.context is None:
+            return None
+        self._count("loaded")
+        _active.set(snapshot)
+        return snapshot
+
+    def _stale_reason(self, state: Any, snapshot: ContextSnapshot) -> Optional[str]:
+        mm = state.memory_manager
+        if snapshot.age() > self.max_age:
+            return "antiguo"
+        if mm.history_version(snapshot.mem_id) != snapshot.history_version:
+            return "historial modificado"
+        if mm.get_flag(snapshot.mem_id, "property_id") != snapshot.property_id:
+            return "property_id distinto"
+        return None
+
+    def discard(self, mem_id: str) -> None:
+        task = self._pending.pop(mem_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def _on_evict(self, _mem_id: str, task: asyncio.Task, _reason: str) -> None:
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # evita "Task exception was never retrieved"
+
+    def _count(self, result: str) -> None:
+        self._stats[result] += 1
+        CONTEXT_PREFETCH_TOTAL.inc(result=result)
+
+    def stats(self) -> Dict[str, Any]:
+        consumed = self._stats["hit"] + self._stats["stale"] + self._stats["miss"] + self._stats["error"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "load_on_miss": self.load_on_miss,
+            "in_flight": sum(1 for task in self._pending.values() if not task.done()),
+            "hit_rate": round(self._stats["hit"] / consumed, 4) if consumed else None,
+        }
+
+
+context_prefetcher = ContextPrefetcher()
@@ -0,0 +1,475 @@
+"""
+🧾 Contexto de conversación en una sola petición
+======================================================================================
+Al empezar cada turno el pipeline necesita, para la misma conversación:
+
+- pista de property_id (último property_id del historial)
+- filas de historial (con el fallback sin property_id)
+- visibilidad del chat en el listado (chat_last_message + archivado/oculto)
+- reservas del chat (`chat_reservations`) → reserva activa
+- escalaciones pendientes → la más reciente sin enviar
+
+Las filas de instancia y property no se incluyen: las resuelve antes la hidratación
+(`hydrate_dynamic_context`, servida por el registro en memoria).
+
+Por separado son ~8 consultas en serie. `ConversationContextLoader.load(request)` las
+resuelve en una sola llamada a la función Postgres CONVERSATION_CONTEXT_RPC
+(sql/bookai_conversation_context.sql) y devuelve un `ConversationContext` inmutable.
+Las reglas de selección (reserva activa, escalación pendiente) se aplican aquí, con las
+mismas funciones que las consultas sueltas. La tabla de historial (`history_table`, p.ej.
+la del superintendente) viaja a la RPC como `p_history_table`.
+
+Si la RPC no está desplegada o falla, se usan las consultas de siempre en paralelo y no
+se vuelve a intentar la RPC hasta pasados CONVERSATION_CONTEXT_RPC_RETRY_SECONDS.
+`InMemoryContextBackend` implementa la misma respuesta sobre tablas en memoria (tests y
+desarrollo local sin Supabase).
+
+Métrica: `bookai_conversation_context_loads_total{source}` (rpc/queries/fake).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from core.config import Settings
+from core.db import (
+    _normalize_chat_id,
+    async_get_conversation_history,
+    async_wait_for_chat_history,
+    get_last_property_id_for_conversation,
+    get_last_property_id_for_original_chat,
+    is_chat_visible_in_list,
+    run_db_call,
+    select_active_reservation,
+    supabase,
+)
+from core.escalation_db import _pending_chat_candidates, select_pending_escalation
+from core.metrics import CONVERSATION_CONTEXT_LOADS_TOTAL
+
+log = logging.getLogger("ConversationContext")
+
+CONVERSATION_CONTEXT_RPC = os.getenv("CONVERSATION_CONTEXT_RPC", "bookai_conversation_context").strip()
+CONVERSATION_CONTEXT_RPC_RETRY_SECONDS = float(os.getenv("CONVERSATION_CONTEXT_RPC_RETRY_SECONDS", "300"))
+
+_RESERVATIONS_LIMIT = 20
+_ESCALATIONS_LIMIT = 20
+
+
+def _frozen(row: Any) -> Optional[Mapping[str, Any]]:
+    if not isinstance(row, Mapping):
+        return None
+    return MappingProxyType(dict(row))
+
+
+def _plain(row: Optional[Mapping[str, Any]]) -> Optional[dict]:
+    return dict(row) if row is not None else None
+
+
+@dataclass(frozen=True)
+class ConversationContextRequest:
+    """Filtros de un turno. `property_id` None → la RPC usa la pista del historial."""
+
+    conversation_id: str
+    original_chat_id: Optional[str] = None
+    memory_id: Optional[str] = None
+    property_id: Any = None
+    instance_id: Optional[str] = None
+    channel: str = "whatsapp"
+    history_table: str = "chat_history"
+    history_limit: int = 40
+    history_days: int = 7
+
+    @property
+    def reservation_chat_id(self) -> str:
+        return _normalize_chat_id(self.memory_id or self.conversation_id)
+
+    @property
+    def escalation_filters(self) -> Tuple[List[str], str]:
+        candidates, clean = _pending_chat_candidates(self.memory_id or self.conversation_id)
+        return sorted(candidates), (f"%:{clean}" if clean else "")
+
+    @property
+    def hint_by_original(self) -> bool:
+        return ":" in str(self.memory_id or "")
+
+    def since(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(days=self.history_days)
+
+    def rpc_params(self) -> Dict[str, Any]:
+        candidates, like = self.escalation_filters
+        return {
+            "p_conversation_id": self.conversation_id,
+            "p_original_chat_id": self.original_chat_id,
+            "p_hint_original_chat_id": self.memory_id if self.hint_by_original else None,
+            "p_property_id": None if self.property_id is None else str(self.property_id),
+            "p_instance_id": self.instance_id,
+            "p_channel": self.channel,
+            "p_history_limit": self.history_limit,
+            "p_since": self.since().isoformat(),
+            "p_reservation_chat_id": self.reservation_chat_id,
+            "p_reservation_original_chat_id": (
+                self.memory_id if self.hint_by_original and not self.instance_id else None
+            ),
+            "p_escalation_chat_ids": candidates,
+            "p_escalation_like": like or None,
+            "p_history_table": self.history_table,
+        }
+
+
+@dataclass(frozen=True)
+class ConversationContext:
+    """Snapshot inmutable del contexto de un turno (filas de solo lectura)."""
+
+    request: ConversationContextRequest
+    property_id: Any
+    property_hint: Any
+    history: Tuple[Mapping[str, Any], ...]
+    history_fallback: bool
+    visible: Optional[bool]
+    reservation: Optional[Mapping[str, Any]]
+    escalation: Optional[Mapping[str, Any]]
+    source: str
+    round_trips: int
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def from_raw(
+        cls,
+        request: ConversationContextRequest,
+        raw: Mapping[str, Any],
+        *,
+        source: str,
+        round_trips: int,
+    ) -> "ConversationContext":
+        visible = raw.get("visible")
+        return cls(
+            request=request,
+            property_id=raw.get("property_id"),
+            property_hint=raw.get("property_hint"),
+            history=tuple(_frozen(row) for row in raw.get("history") or () if isinstance(row, Mapping)),
+            history_fallback=bool(raw.get("history_fallback")),
+            visible=None if visible is None else bool(visible),
+            reservation=_frozen(select_active_reservation(list(raw.get("reservations") or []))),
+            escalation=_frozen(select_pending_escalation(list(raw.get("escalations") or []))),
+            source=source,
+            round_trips=round_trips,
+        )
+
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+    def history_rows(self) -> List[Dict[str, Any]]:
+        """Copias mutables de las filas de historial (orden ascendente)."""
+        return [dict(row) for row in self.history]
+
+    def reservation_dict(self) -> Optional[dict]:
+        return _plain(self.reservation)
+
+    def escalation_dict(self) -> Optional[dict]:
+        return _plain(self.escalation)
+
+    def visible_for(
+        self,
+        conversation_id: Any,
+        property_id: Any,
+        channel: Optional[str],
+        original_chat_id: Optional[str],
+    ) -> Tuple[bool, Optional[bool]]:
+        """(hay dato, visible) si se calculó con los mismos filtros que pide el llamador."""
+        if self.visible is None or property_id is None:
+            return False, None
+        same = (
+            str(conversation_id or "") == self.request.conversation_id
+            and str(property_id) == str(self.property_id)
+            and (channel or "whatsapp") == self.request.channel
+            and str(original_chat_id or "").replace("+", "").strip() == str(self.request.original_chat_id or "")
+        )
+        return (True, self.visible) if same else (False, None)
+
+
+# =============================================================
+# 🔌 Backends de una sola petición
+# =============================================================
+class RpcContextBackend:
+    """Llama a la función Postgres (una petición PostgREST `/rpc/<function>`)."""
+
+    name = "rpc"
+
+    def __init__(self, function: str = CONVERSATION_CONTEXT_RPC, client: Any = None):
+        self.function = function
+        self._client = client
+
+    def load(self, request: ConversationContextRequest) -> Dict[str, Any]:
+        client = self._client if self._client is not None else supabase
+        data = client.rpc(self.function, request.rpc_params()).execute().data
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        if not isinstance(data, Mapping):
+            raise ValueError(f"Respuesta inesperada de {self.function}: {type(data).__name__}")
+        return dict(data)
+
+
+class InMemoryContextBackend:
+    """Misma respuesta que la RPC sobre tablas en memoria (tests / desarrollo local)."""
+
+    name = "fake"
+
+    def __init__(self, tables: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {name: list(rows) for name, rows in (tables or {}).items()}
+        self.calls = 0
+
+    def _rows(self, table: str) -> List[Dict[str, Any]]:
+        return self.tables.get(table, [])
+
+    @staticmethod
+    def _ts(row: Mapping[str, Any], column: str) -> str:
+        return str(row.get(column) or "")
+
+    def load(self, request: ConversationContextRequest) -> Dict[str, Any]:
+        self.calls += 1
+        history_table = self._rows(request.history_table)
+        hint_column, hint_value = (
+            ("original_chat_id", request.memory_id) if request.hint_by_original else ("conversation_id", request.conversation_id)
+        )
+        hint = next(
+            (
+                row.get("property_id")
+                for row in sorted(history_table, key=lambda r: self._ts(r, "created_at"), reverse=True)
+                if row.get(hint_column) == hint_value and row.get("property_id") not in (None, "")
+            ),
+            None,
+        )
+        property_id = request.property_id if request.property_id is not None else hint
+
+        since = request.since()
+
+        def history(prop: Any) -> List[Dict[str, Any]]:
+            rows = [
+                row
+                for row in history_table
+                if row.get("conversation_id") == request.conversation_id
+                and (prop is None or str(row.get("property_id")) == str(prop))
+                and (not request.original_chat_id or row.get("original_chat_id") == request.original_chat_id)
+                and datetime.fromisoformat(self._ts(row, "created_at")) >= since
+            ]
+            rows.sort(key=lambda r: self._ts(r, "created_at"))
+            return [
+                {key: row.get(key) for key in ("role", "content", "created_at", "structured_payload")}
+                for row in rows[: request.history_limit]
+            ]
+
+        history_rows = history(property_id)
+        fallback = False
+        if property_id is not None and not history_rows:
+            history_rows, fallback = history(None), True
+
+        reservations = [
+            row
+            for row in self._rows(Settings.CHAT_RESERVATIONS_TABLE)
+            if row.get("chat_id") == request.reservation_chat_id
+            and (not request.instance_id or row.get("instance_id") == request.instance_id)
+            and (
+                request.instance_id
+                or not request.hint_by_original
+                or row.get("original_chat_id") == request.memory_id
+            )
+        ]
+        reservations.sort(key=lambda r: self._ts(r, "updated_at"), reverse=True)
+
+        candidates, like = request.escalation_filters
+        like_suffix = like[1:] if like else None
+        escalations = [
+            row
+            for row in self._rows("escalations")
+            if row.get("manager_confirmed") is False
+            and (
+                row.get("guest_chat_id") in candidates
+                or (like_suffix and str(row.get("guest_chat_id") or "").endswith(like_suffix))
+            )
+            and (request.property_id is None or str(row.get("property_id")) == str(request.property_id))
+        ]
+        escalations.sort(key=lambda r: self._ts(r, "timestamp"), reverse=True)
+
+        return {
+            "property_id": property_id,
+            "property_hint": hint,
+            "history": history_rows,
+            "history_fallback": fallback,
+            "visible": self._visible(request, property_id),
+            "reservations": reservations[:_RESERVATIONS_LIMIT],
+            "escalations": escalations[:_ESCALATIONS_LIMIT],
+        }
+
+    def _visible(self, request: ConversationContextRequest, property_id: Any) -> bool:
+        if property_id is None:
+            return False
+        summary = self._rows("chat_last_message")
+
+        def same(row: Mapping[str, Any]) -> bool:
+            return str(row.get("property_id")) == str(property_id) and row.get("channel") == request.channel
+
+        rows = [row for row in summary if same(row) and row.get("conversation_id") == request.conversation_id]
+        if not rows and request.original_chat_id:
+            rows = [row for row in summary if same(row) and row.get("original_chat_id") == request.original_chat_id]
+        if not rows:
+            return False
+        latest = max(rows, key=lambda r: self._ts(r, "created_at"))
+        effective_original = latest.get("original_chat_id") or request.original_chat_id
+        for row in self._rows("chat_history"):
+            if not same(row) or not (row.get("archived_at") or row.get("hidden_at")):
+                continue
+            if row.get("conversation_id") == request.conversation_id:
+                return False
+            if effective_original and row.get("original_chat_id") == effective_original:
+                return False
+        return True
+
+
+# =============================================================
+# 🧾 Cargador
+# =============================================================
+class ConversationContextLoader:
+    """Una petición por turno (RPC); consultas sueltas en paralelo si la RPC no está disponible."""
+
+    def __init__(self, backend: Any = None, retry_seconds: float = CONVERSATION_CONTEXT_RPC_RETRY_SECONDS):
+        if backend is None and CONVERSATION_CONTEXT_RPC:
+            backend = RpcContextBackend(CONVERSATION_CONTEXT_RPC)
+        self.backend = backend
+        self.retry_seconds = max(0.0, float(retry_seconds))
+        self._backend_down_until = 0.0
+        self._stats = {"loads": 0, "backend": 0, "queries": 0, "backend_errors": 0, "round_trips": 0}
+
+    async def load(self, request: ConversationContextRequest) -> ConversationContext:
+        self._stats["loads"] += 1
+        # Leer-tus-escrituras: la versión del historial ya cuenta los mensajes en cola.
+        await async_wait_for_chat_history(request.conversation_id, request.original_chat_id)
+        backend = self.backend
+        if backend is not None and time.monotonic() >= self._backend_down_until:
+            try:
+                raw = await run_db_call(backend.load, request)
+                return self._done(ConversationContext.from_raw(request, raw, source=backend.name, round_trips=1))
+            except Exception as exc:
+                self._stats["backend_errors"] += 1
+                self._backend_down_until = time.monotonic() + self.retry_seconds
+                log.warning(
+                    "⚠️ Contexto de conversación: backend %s no disponible (%s); consultas sueltas durante %.0fs",
+                    backend.name,
+                    exc,
+                    self.retry_seconds,
+                )
+        raw, round_trips = await self._load_queries(request)
+        return self._done(ConversationContext.from_raw(request, raw, source="queries", round_trips=round_trips))
+
+    def _done(self, context: ConversationContext) -> ConversationContext:
+        self._stats["backend" if context.source != "queries" else "queries"] += 1
+        self._stats["round_trips"] += context.round_trips
+        CONVERSATION_CONTEXT_LOADS_TOTAL.inc(source=context.source)
+        return context
+
+    async def _load_queries(self, request: ConversationContextRequest) -> Tuple[Dict[str, Any], int]:
+        """Las consultas de siempre, en paralelo salvo la pista de property (la necesitan las demás)."""
+        round_trips = 0
+        hint = None
+        property_id = request.property_id
+        if property_id is None:
+            if request.hint_by_original:
+                hint = await run_db_call(
+                    get_last_property_id_for_original_chat, request.memory_id, table=request.history_table
+                )
+            else:
+                hint = await run_db_call(
+                    get_last_property_id_for_conversation, request.conversation_id, table=request.history_table
+                )
+            round_trips += 1
+            property_id = hint
+
+        async def history() -> Tuple[List[Dict[str, Any]], bool, int]:
+            kwargs = {
+                "limit": request.history_limit,
+                "since": request.since(),
+                "original_chat_id": request.original_chat_id,
+                "table": request.history_table,
+            }
+            rows = await async_get_conversation_history(request.conversation_id, property_id=property_id, **kwargs) or []
+            if property_id is not None and not rows:
+                rows = await async_get_conversation_history(request.conversation_id, property_id=None, **kwargs) or []
+                return rows, True, 2
+            return rows, False, 1
+
+        def reservations() -> List[Dict[str, Any]]:
+            query = (
+                supabase.table(Settings.CHAT_RESERVATIONS_TABLE)
+                .select("*")
+                .eq("chat_id", request.reservation_chat_id)
+                .order("updated_at", desc=True)
+                .limit(_RESERVATIONS_LIMIT)
+            )
+            if request.instance_id:
+                query = query.eq("instance_id", request.instance_id)
+            elif request.hint_by_original:
+                query = query.eq("original_chat_id", request.memory_id)
+            return query.execute().data or []
+
+        def escalations() -> List[Dict[str, Any]]:
+            candidates, like = request.escalation_filters
+            or_filters = [f"guest_chat_id.eq.{cand}" for cand in candidates]
+            if like:
+                or_filters.append(f"guest_chat_id.like.{like}")
+            if not or_filters:
+                return []
+            query = supabase.table("escalations").select("*").eq("manager_confirmed", False).or_(",".join(or_filters))
+            if request.property_id is not None:
+                query = query.eq("property_id", request.property_id)
+            return query.order("timestamp", desc=True).limit(_ESCALATIONS_LIMIT).execute().data or []
+
+        results = await asyncio.gather(
+            history(),
+            run_db_call(
+                is_chat_visible_in_list,
+                request.conversation_id,
+                property_id=property_id,
+                channel=request.channel,
+                original_chat_id=request.original_chat_id,
+            ),
+            run_db_call(reservations),
+            run_db_call(escalations),
+            return_exceptions=True,
+        )
+        history_result, visible, reservation_rows, escalation_rows = (
+            None if isinstance(result, BaseException) else result for result in results
+        )
+        for label, result in zip(("historial", "visibilidad", "reservas", "escalaciones"), results):
+            if isinstance(result, BaseException):
+                log.debug("Contexto de conversación: fallo leyendo %s de %s: %s", label, request.conversation_id, result)
+        rows, fallback, history_reads = history_result or ([], False, 1)
+        round_trips += history_reads + 3
+        return {
+            "property_id": property_id,
+            "property_hint": hint,
+            "history": rows,
+            "history_fallback": fallback,
+            "visible": visible,
+            "reservations": reservation_rows or [],
+            "escalations": escalation_rows or [],
+        }, round_trips
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["backend_name"] = getattr(self.backend, "name", None)
+        stats["backend_available"] = self.backend is not None and time.monotonic() >= self._backend_down_until
+        stats["avg_round_trips"] = round(stats["round_trips"] / stats["loads"], 2) if stats["loads"] else None
+        return stats
+
+
+conversation_context_loader = ConversationContextLoader()
+
+
+def get_conversation_context_stats() -> Dict[str, Any]:
+    return conversation_context_loader.stats()
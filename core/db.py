@@ -1,11 +1,22 @@
+import asyncio
+import functools
 import os
 import logging
 import re
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Callable, TypeVar
 
 import pytz
 
+from core.batch_writer import BatchWriter
 from core.config import Settings
+from core.kb_retrieval_cache import invalidate_kb_retrieval
+from core.metrics import instrument_supabase
+from core.ttl_cache import TTLCache
+from core.utils.env import env_bool
 from core.utils.time_context import DEFAULT_TZ
 from supabase import create_client, Client
 
@@ -20,6 +31,21 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 logging.info("✅ Conexión con Supabase inicializada correctamente.")
+try:
+    instrument_supabase(supabase)
+except Exception as exc:
+    logging.warning("No se pudieron registrar las métricas de Supabase: %s", exc)
+
+# Pool acotado para ejecutar el cliente síncrono fuera del event loop.
+# El cliente PostgREST reutiliza su pool HTTP interno entre hilos.
+try:
+    SUPABASE_MAX_WORKERS = max(1, int(os.getenv("SUPABASE_MAX_WORKERS", "8")))
+except ValueError:
+    SUPABASE_MAX_WORKERS = 8
+
+_db_executor: ThreadPoolExecutor | None = None
+
+T = TypeVar("T")
 
 _INTERNAL_CONTROL_MARKER_RE = re.compile(r"^__[A-Z0-9_]+__$")
 
@@ -83,6 +109,8 @@ def add_kb_daily_cache(
         supabase.table(Settings.TEMP_KB_TABLE).insert(payload).execute()
     except Exception as exc:
         logging.warning("⚠️ No se pudo guardar cache temporal KB: %s", exc)
+    # La KB de la propiedad ha cambiado: descarta búsquedas cacheadas.
+    invalidate_kb_retrieval(property_id=property_id, kb_name=kb_name)
 
 
 def fetch_kb_daily_cache(
@@ -120,6 +148,294 @@ def fetch_kb_daily_cache(
 # ======================================================
 # 💾 Guardar mensaje (sin embeddings)
 # ======================================================
+# Escritura diferida: los mensajes se encolan y un hilo los inserta por lotes
+# (core/batch_writer.py). false = INSERT síncrono por mensaje (comportamiento anterior).
+CHAT_HISTORY_WRITE_BEHIND = env_bool("CHAT_HISTORY_WRITE_BEHIND", True)
+CHAT_HISTORY_BATCH_MS = float(os.getenv("CHAT_HISTORY_BATCH_MS", "20"))
+CHAT_HISTORY_BATCH_MAX = int(os.getenv("CHAT_HISTORY_BATCH_MAX", "200"))
+# Espera máxima de una lectura de historial a que se escriban sus mensajes pendientes.
+CHAT_HISTORY_READ_WAIT_SECONDS = float(os.getenv("CHAT_HISTORY_READ_WAIT_SECONDS", "2"))
+# Vigencia del estado archived_at/hidden_at cacheado por chat (otros procesos pueden cambiarlo).
+CHAT_VISIBILITY_CACHE_TTL_SECONDS = float(os.getenv("CHAT_VISIBILITY_CACHE_TTL_SECONDS", "300"))
+
+# (table, conversation_id, original_chat_id, property_id) → ({archived_at, hidden_at}, leído en)
+_chat_visibility_cache: TTLCache = TTLCache("chat_history_visibility", ttl_seconds=CHAT_VISIBILITY_CACHE_TTL_SECONDS)
+_chat_visibility_stats = {"hits": 0, "lookups": 0}
+_last_created_at: datetime | None = None
+_created_at_lock = threading.Lock()
+
+# Columnas opcionales que se descartan si el INSERT falla (esquemas antiguos).
+_OPTIONAL_HISTORY_COLUMNS = (
+    "escalation_id",
+    "client_name",
+    "user_id",
+    "user_first_name",
+    "user_last_name",
+    "user_last_name2",
+)
+
+
+def _next_created_at() -> str:
+    """created_at estrictamente creciente: los lotes conservan el orden de los mensajes."""
+    global _last_created_at
+    with _created_at_lock:
+        now = datetime.now(dt_timezone.utc)
+        if _last_created_at is not None and now <= _last_created_at:
+            now = _last_created_at + timedelta(microseconds=1)
+        _last_created_at = now
+        return now.isoformat()
+
+
+def build_chat_history_row(
+    conversation_id: str,
+    role: str,
+    content: str,
+    escalation_id: str | None = None,
+    client_name: str | None = None,
+    user_id: int | str | None = None,
+    user_first_name: str | None = None,
+    user_last_name: str | None = None,
+    user_last_name2: str | None = None,
+    channel: str | None = None,
+    property_id: str | int | None = None,
+    original_chat_id: str | None = None,
+    structured_payload: dict | list | None = None,
+) -> dict | None:
+    """Fila de `chat_history` para un mensaje (None si es un mensaje interno no persistible)."""
+    if _is_internal_non_persistable_message(content):
+        logging.info("🧹 Mensaje interno omitido (no persistido en chat_history).")
+        return None
+
+    normalized_role = (role or "").strip().lower()
+    if normalized_role in {"assistant", "system", "tool"}:
+        normalized_role = "bookai"
+    if normalized_role not in {"guest", "user", "bookai"}:
+        normalized_role = "bookai"
+
+    clean_id = str(conversation_id).replace("+", "").strip()
+    original_clean = str(original_chat_id).replace("+", "").strip() if original_chat_id else clean_id
+
+    data = {
+        "conversation_id": clean_id,
+        "role": normalized_role or "bookai",
+        "content": content,
+        "read_status": False,
+        "original_chat_id": original_clean,
+    }
+    if escalation_id:
+        data["escalation_id"] = escalation_id
+    if client_name:
+        data["client_name"] = client_name
+    if user_id is not None and str(user_id).strip() != "":
+        try:
+            data["user_id"] = int(str(user_id).strip())
+        except Exception:
+            logging.warning("⚠️ user_id no numérico, se omite: %s", user_id)
+    if user_first_name:
+        data["user_first_name"] = str(user_first_name)
+    if user_last_name:
+        data["user_last_name"] = str(user_last_name)
+    if user_last_name2:
+        data["user_last_name2"] = str(user_last_name2)
+    if channel:
+        data["channel"] = channel
+    if property_id is not None:
+        data["property_id"] = property_id
+    if structured_payload is not None:
+        data["structured_payload"] = structured_payload
+    return data
+
+
+def _select_chat_visibility(table: str, clean_id: str, original_clean: str, property_id) -> dict:
+    """archived_at/hidden_at de la última fila del chat (hasta tres SELECT)."""
+    state_rows = []
+    if property_id is not None:
+        state_rows = (
+            supabase.table(table)
+            .select("archived_at, hidden_at")
+            .eq("conversation_id", clean_id)
+            .eq("property_id", property_id)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+            .data
+            or []
+        )
+    if not state_rows and original_clean:
+        state_rows = (
+            supabase.table(table)
+            .select("archived_at, hidden_at")
+            .eq("original_chat_id", original_clean)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+            .data
+            or []
+        )
+    if not state_rows:
+        state_rows = (
+            supabase.table(table)
+            .select("archived_at, hidden_at")
+            .eq("conversation_id", clean_id)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+            .data
+            or []
+        )
+    row = state_rows[0] if state_rows else {}
+    return {"archived_at": row.get("archived_at"), "hidden_at": row.get("hidden_at")}
+
+
+def _chat_visibility_key(table: str, data: dict) -> tuple:
+    property_id = data.get("property_id")
+    return (
+        table,
+        data.get("conversation_id") or "",
+        data.get("original_chat_id") or "",
+        str(property_id) if property_id is not None else None,
+    )
+
+
+def _chat_visibility(table: str, data: dict) -> dict:
+    """
+    Estado archived_at/hidden_at a copiar en una fila nueva. Se cachea por chat: las filas
+    que insertamos lo heredan, así que solo cambia al archivar/ocultar/restaurar
+    (`invalidate_chat_visibility`) o desde otro proceso (TTL).
+    """
+    key = _chat_visibility_key(table, data)
+    _chat_visibility_stats["lookups"] += 1
+    cached = _chat_visibility_cache.peek(key)
+    if cached is not None and time.monotonic() - cached[1] <= CHAT_VISIBILITY_CACHE_TTL_SECONDS:
+        _chat_visibility_stats["hits"] += 1
+        return cached[0]
+    state = _select_chat_visibility(table, key[1], key[2], data.get("property_id"))
+    _chat_visibility_cache[key] = (state, time.monotonic())
+    return state
+
+
+def invalidate_chat_visibility(conversation_id: str | None = None, original_chat_id: str | None = None) -> int:
+    """Descarta el estado cacheado de un chat tras archivarlo, ocultarlo o restaurarlo."""
+    clean_id = str(conversation_id or "").replace("+", "").strip()
+    original_clean = str(original_chat_id or "").replace("+", "").strip()
+    doomed = [
+        key
+        for key in list(_chat_visibility_cache)
+        if (clean_id and clean_id in (key[1], key[2])) or (original_clean and original_clean in (key[1], key[2]))
+    ]
+    for key in doomed:
+        _chat_visibility_cache.pop(key, None)
+    return len(doomed)
+
+
+def _apply_chat_visibility(table: str, data: dict) -> None:
+    try:
+        state = _chat_visibility(table, data)
+    except Exception:
+        return
+    if state.get("archived_at") is not None:
+        data["archived_at"] = state["archived_at"]
+    if state.get("hidden_at") is not None:
+        data["hidden_at"] = state["hidden_at"]
+
+
+def _insert_chat_history_row(table: str, data: dict) -> None:
+    """INSERT de una fila degradando columnas opcionales si el esquema no las admite."""
+    try:
+        supabase.table(table).insert(data).execute()
+    except Exception as exc:
+        err = str(exc).lower()
+        retry = False
+        for column in _OPTIONAL_HISTORY_COLUMNS:
+            if column in data:
+                data.pop(column, None)
+                retry = True
+        # Conservar property_id salvo error explícito de esa columna.
+        if "property_id" in data and "property_id" in err:
+            data.pop("property_id", None)
+            retry = True
+        if "original_chat_id" in data:
+            data.pop("original_chat_id", None)
+            retry = True
+        # Solo degradar structured_payload si el error apunta a esa columna.
+        if "structured_payload" in data and "structured_payload" in err:
+            logging.warning(
+                "⚠️ structured_payload no persistido (columna ausente/incompatible). "
+                "Aplica ALTER TABLE ... ADD COLUMN structured_payload jsonb."
+            )
+            data.pop("structured_payload", None)
+            retry = True
+        if retry:
+            supabase.table(table).insert(data).execute()
+        else:
+            raise
+    logging.info(f"💾 Mensaje guardado correctamente en conversación {data.get('conversation_id')}")
+
+
+def _write_chat_history_batch(batch: list[tuple[str, dict]]) -> None:
+    """
+    Inserta un lote de la cola: un INSERT multi-fila por tabla y juego de columnas.
+    El orden lo fija `created_at`; si el INSERT agrupado falla, se reintenta fila a fila
+    con la degradación de columnas de `_insert_chat_history_row`.
+    """
+    groups: dict[tuple[str, tuple[str, ...]], list[dict]] = {}
+    for table, data in batch:
+        _apply_chat_visibility(table, data)
+        groups.setdefault((table, tuple(sorted(data))), []).append(data)
+    for (table, _columns), rows in groups.items():
+        try:
+            if len(rows) == 1:
+                _insert_chat_history_row(table, rows[0])
+                continue
+            supabase.table(table).insert(rows).execute()
+            logging.info("💾 %s mensajes guardados en %s (lote)", len(rows), table)
+        except Exception as exc:
+            logging.warning("⚠️ INSERT por lotes en %s fallido (%s); se reintenta fila a fila", table, exc)
+            for data in rows:
+                try:
+                    _insert_chat_history_row(table, data)
+                except Exception as row_exc:
+                    logging.error(f"⚠️ Error guardando mensaje en Supabase: {row_exc}", exc_info=True)
+
+
+chat_history_writer = BatchWriter(
+    "chat_history",
+    _write_chat_history_batch,
+    batch_ms=CHAT_HISTORY_BATCH_MS,
+    max_batch=CHAT_HISTORY_BATCH_MAX,
+    keys=lambda item: (item[1].get("conversation_id"), item[1].get("original_chat_id")),
+)
+
+
+def wait_for_chat_history(*conversation_ids: str | None, timeout: float = CHAT_HISTORY_READ_WAIT_SECONDS) -> bool:
+    """Leer-tus-escrituras: espera a que se inserten los mensajes encolados de esos chats."""
+    keys = [str(cid).replace("+", "").strip() for cid in conversation_ids if cid]
+    if not keys or not chat_history_writer.pending(*keys):
+        return True
+    return chat_history_writer.wait_for(*keys, timeout=timeout)
+
+
+async def async_wait_for_chat_history(
+    *conversation_ids: str | None,
+    timeout: float = CHAT_HISTORY_READ_WAIT_SECONDS,
+) -> bool:
+    """Versión awaitable de `wait_for_chat_history`: la espera no bloquea el event loop."""
+    keys = [str(cid).replace("+", "").strip() for cid in conversation_ids if cid]
+    if not keys or not chat_history_writer.pending(*keys):
+        return True
+    # Fuera del pool de Supabase: esperar al escritor no debe ocupar un hilo de consultas.
+    return await asyncio.to_thread(chat_history_writer.wait_for, *keys, timeout=timeout)
+
+
+def get_chat_history_writer_stats() -> dict:
+    return {
+        **chat_history_writer.stats(),
+        "write_behind": CHAT_HISTORY_WRITE_BEHIND,
+        "visibility_lookups": _chat_visibility_stats["lookups"],
+        "visibility_cache_hits": _chat_visibility_stats["hits"],
+    }
+
+
 def save_message(
     conversation_id: str,
     role: str,
@@ -144,138 +460,34 @@ def save_message(
     - role: 'user'/'assistant' o alias (ej. 'guest'/'bookai')
     - content: texto del mensaje
     - table: tabla destino en Supabase
+    Con CHAT_HISTORY_WRITE_BEHIND el mensaje se encola y se inserta por lotes.
     """
     try:
-        if _is_internal_non_persistable_message(content):
-            logging.info("🧹 Mensaje interno omitido (no persistido en chat_history).")
+        data = build_chat_history_row(
+            conversation_id,
+            role,
+            content,
+            escalation_id=escalation_id,
+            client_name=client_name,
+            user_id=user_id,
+            user_first_name=user_first_name,
+            user_last_name=user_last_name,
+            user_last_name2=user_last_name2,
+            channel=channel,
+            property_id=property_id,
+            original_chat_id=original_chat_id,
+            structured_payload=structured_payload,
+        )
+        if data is None:
             return
-
-        normalized_role = (role or "").strip().lower()
-        if normalized_role in {"assistant", "system", "tool"}:
-            normalized_role = "bookai"
-        if normalized_role not in {"guest", "user", "bookai"}:
-            normalized_role = "bookai"
-
-        clean_id = str(conversation_id).replace("+", "").strip()
-        original_clean = str(original_chat_id).replace("+", "").strip() if original_chat_id else clean_id
-
-        data = {
-            "conversation_id": clean_id,
-            "role": normalized_role or "bookai",
-            "content": content,
-            "read_status": False,
-            "original_chat_id": original_clean,
-        }
-        if escalation_id:
-            data["escalation_id"] = escalation_id
-        if client_name:
-            data["client_name"] = client_name
-        if user_id is not None and str(user_id).strip() != "":
-            try:
-                data["user_id"] = int(str(user_id).strip())
-            except Exception:
-                logging.warning("⚠️ user_id no numérico, se omite: %s", user_id)
-        if user_first_name:
-            data["user_first_name"] = str(user_first_name)
-        if user_last_name:
-            data["user_last_name"] = str(user_last_name)
-        if user_last_name2:
-            data["user_last_name2"] = str(user_last_name2)
-        if channel:
-            data["channel"] = channel
-        if property_id is not None:
-            data["property_id"] = property_id
-        if structured_payload is not None:
-            data["structured_payload"] = structured_payload
-        try:
-            state_query = supabase.table(table).select("archived_at, hidden_at")
-            state_rows = []
-            if property_id is not None:
-                state_rows = (
-                    state_query
-                    .eq("conversation_id", clean_id)
-                    .eq("property_id", property_id)
-                    .order("created_at", desc=True)
-                    .limit(1)
-                    .execute()
-                    .data
-                    or []
-                )
-            if not state_rows and original_clean:
-                state_rows = (
-                    supabase.table(table)
-                    .select("archived_at, hidden_at")
-                    .eq("original_chat_id", original_clean)
-                    .order("created_at", desc=True)
-                    .limit(1)
-                    .execute()
-                    .data
-                    or []
-                )
-            if not state_rows:
-                state_rows = (
-                    supabase.table(table)
-                    .select("archived_at, hidden_at")
-                    .eq("conversation_id", clean_id)
-                    .order("created_at", desc=True)
-                    .limit(1)
-                    .execute()
-                    .data
-                    or []
-                )
-            if state_rows:
-                archived_at = state_rows[0].get("archived_at")
-                hidden_at = state_rows[0].get("hidden_at")
-                if archived_at is not None:
-                    data["archived_at"] = archived_at
-                if hidden_at is not None:
-                    data["hidden_at"] = hidden_at
-        except Exception:
-            pass
-
-        try:
-            supabase.table(table).insert(data).execute()
-        except Exception as exc:
-            err = str(exc).lower()
-            retry = False
-            if "escalation_id" in data:
-                data.pop("escalation_id", None)
-                retry = True
-            if "client_name" in data:
-                data.pop("client_name", None)
-                retry = True
-            if "user_id" in data:
-                data.pop("user_id", None)
-                retry = True
-            if "user_first_name" in data:
-                data.pop("user_first_name", None)
-                retry = True
-            if "user_last_name" in data:
-                data.pop("user_last_name", None)
-                retry = True
-            if "user_last_name2" in data:
-                data.pop("user_last_name2", None)
-                retry = True
-            # Conservar property_id salvo error explícito de esa columna.
-            if "property_id" in data and "property_id" in err:
-                data.pop("property_id", None)
-                retry = True
-            if "original_chat_id" in data:
-                data.pop("original_chat_id", None)
-                retry = True
-            # Solo degradar structured_payload si el error apunta a esa columna.
-            if "structured_payload" in data and "structured_payload" in err:
-                logging.warning(
-                    "⚠️ structured_payload no persistido (columna ausente/incompatible). "
-                    "Aplica ALTER TABLE ... ADD COLUMN structured_payload jsonb."
-                )
-                data.pop("structured_payload", None)
-                retry = True
-            if retry:
-                supabase.table(table).insert(data).execute()
-            else:
-                raise
-        logging.info(f"💾 Mensaje guardado correctamente en conversación {clean_id}")
+        data["created_at"] = _next_created_at()
+        if CHAT_HISTORY_WRITE_BEHIND:
+            # El estado se vuelve a leer al escribir el lote (ya con lo anterior en BD).
+            _chat_visibility_cache.pop(_chat_visibility_key(table, data), None)
+            chat_history_writer.submit((table, data))
+            return
+        _apply_chat_visibility(table, data)
+        _insert_chat_history_row(table, data)
 
     except Exception as e:
         logging.error(f"⚠️ Error guardando mensaje en Supabase: {e}", exc_info=True)
@@ -299,6 +511,8 @@ def is_chat_visible_in_list(
 
     current_channel = str(channel or "whatsapp").strip() or "whatsapp"
     original_clean = str(original_chat_id or "").replace("+", "").strip()
+    # chat_last_message y archived/hidden dependen de los mensajes aún en cola.
+    wait_for_chat_history(clean_id, original_clean)
 
     try:
         summary_rows = (
@@ -393,6 +607,8 @@ def get_conversation_history(
     """
     try:
         clean_id = str(conversation_id).replace("+", "").strip()
+        # Incluye los mensajes aún en la cola de escritura diferida.
+        wait_for_chat_history(clean_id, original_chat_id)
 
         select_fields = "role, content, created_at, structured_payload"
         query = supabase.table(table).select(select_fields)
@@ -815,6 +1031,14 @@ def get_active_chat_reservation(
         logging.warning("⚠️ No se pudo leer chat_reservations: %s", exc)
         return None
 
+    return select_active_reservation(rows)
+
+
+def select_active_reservation(rows: list[dict]) -> dict | None:
+    """
+    Regla de reserva "activa" sobre filas ordenadas por updated_at desc:
+    checkin más próximo >= hoy; si no, la más reciente.
+    """
     if not rows:
         return None
 
@@ -868,3 +1092,79 @@ def clear_conversation(
         logging.info(f"🧹 Conversación {clean_id} eliminada correctamente.")
     except Exception as e:
         logging.error(f"⚠️ Error eliminando conversación {conversation_id}: {e}", exc_info=True)
+
+
+
+# ======================================================
+# ⚡ Capa async (no bloquea el event loop)
+# ======================================================
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(
+            max_workers=SUPABASE_MAX_WORKERS,
+            thread_name_prefix="supabase-db",
+        )
+    return _db_executor
+
+
+async def run_db_call(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Ejecuta una función síncrona de acceso a datos en el pool acotado de Supabase.
+    Si no hay loop activo (scripts), la ejecuta directamente.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return func(*args, **kwargs)
+    return await loop.run_in_executor(
+        _get_db_executor(),
+        functools.partial(func, *args, **kwargs),
+    )
+
+
+def shutdown_db_executor(wait: bool = True) -> None:
+    """Cierra el pool de hilos de Supabase (útil en shutdown)."""
+    global _db_executor
+    # Antes que nada, los mensajes de chat_history aún en cola.
+    if not chat_history_writer.close(timeout=10):
+        logging.warning("⚠️ La cola de chat_history no se vació a tiempo en el shutdown")
+    executor = _db_executor
+    _db_executor = None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+async def async_save_message(*args: Any, **kwargs: Any) -> None:
+    """Versión awaitable de `save_message`."""
+    return await run_db_call(save_message, *args, **kwargs)
+
+
+async def async_is_chat_visible_in_list(*args: Any, **kwargs: Any) -> bool:
+    """Versión awaitable de `is_chat_visible_in_list`."""
+    return await run_db_call(is_chat_visible_in_list, *args, **kwargs)
+
+
+async def async_get_conversation_history(*args: Any, **kwargs: Any):
+    """Versión awaitable de `get_conversation_history`."""
+    return await run_db_call(get_conversation_history, *args, **kwargs)
+
+
+async def async_get_last_property_id_for_conversation(*args: Any, **kwargs: Any) -> str | int | None:
+    """Versión awaitable de `get_last_property_id_for_conversation`."""
+    return await run_db_call(get_last_property_id_for_conversation, *args, **kwargs)
+
+
+async def async_get_last_property_id_for_original_chat(*args: Any, **kwargs: Any) -> str | int | None:
+    """Versión awaitable de `get_last_property_id_for_original_chat`."""
+    return await run_db_call(get_last_property_id_for_original_chat, *args, **kwargs)
+
+
+async def async_upsert_chat_reservation(**kwargs: Any) -> None:
+    """Versión awaitable de `upsert_chat_reservation`."""
+    return await run_db_call(upsert_chat_reservation, **kwargs)
+
+
+async def async_get_active_chat_reservation(**kwargs: Any) -> dict | None:
+    """Versión awaitable de `get_active_chat_reservation`."""
+    return await run_db_call(get_active_chat_reservation, **kwargs)
@@ -320,6 +320,14 @@ def list_pending_escalations_for_chat(guest_chat_id: str, limit: int = 20, prope
 # ======================================================
 # 🔎 Última escalación pendiente por chat
 # ======================================================
+def select_pending_escalation(rows: list[dict]) -> dict | None:
+    """Primera escalación sin enviar al huésped (filas no confirmadas, timestamp desc)."""
+    for row in rows or []:
+        if not bool((row or {}).get("sent_to_guest")):
+            return row
+    return None
+
+
 def get_latest_pending_escalation(guest_chat_id: str, property_id=None) -> dict | None:
     """Devuelve la escalación pendiente más reciente para un chat específico."""
     if not guest_chat_id:
@@ -340,11 +348,7 @@ def get_latest_pending_escalation(guest_chat_id: str, property_id=None) -> dict
         if property_id is not None:
             query = query.eq("property_id", property_id)
         res = query.order("timestamp", desc=True).limit(20).execute()
-        data = res.data or []
-        for row in data:
-            if not bool((row or {}).get("sent_to_guest")):
-                return row
-        return None
+        return select_pending_escalation(res.data or [])
     except Exception as e:
         log.error(
             "⚠️ Error obteniendo escalación pendiente para %s: %s",
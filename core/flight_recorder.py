@@ -0,0 +1,408 @@
+"""
+🛫 Flight recorder: cascada de latencias por mensaje
+======================================================================================
+Cada bloque de mensajes procesado recibe un `trace_id`. Los spans (pipeline, etapas
+previas, MainAgent, tools de sub-agente, LLM, MCP, envío por canal, emisiones socket)
+se anidan mediante ContextVars, así que se propagan solos a las tareas hijas del
+mismo turno sin pasar ids por parámetro.
+
+- Las trazas terminadas se guardan en un ring buffer acotado (TRACE_RING_SIZE).
+- Sink local opcional (TRACE_SINK): "jsonl:/ruta/traces.jsonl" o "sqlite:/ruta/traces.db".
+  La escritura se hace fuera del event loop.
+- `GET /api/v1/traces/{chat_id}` (api/trace_routes.py) devuelve la cascada. Las trazas
+  llevan el `instance_id` del chat (`annotate_trace`) y un token de instancia solo ve
+  las suyas.
+
+A diferencia del muestreo de LangSmith (todo o nada), aquí se registran todas las
+trazas con coste mínimo y se inspeccionan solo las lentas.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from core.utils.env import env_bool
+
+log = logging.getLogger("FlightRecorder")
+
+TRACE_RECORDER_ENABLED = env_bool("TRACE_RECORDER_ENABLED", True)
+TRACE_RING_SIZE = int(os.getenv("TRACE_RING_SIZE", "500"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "400"))
+TRACE_SINK = os.getenv("TRACE_SINK", "").strip()
+
+
+def _chat_digits(value: Any) -> str:
+    return re.sub(r"\D", "", str(value or ""))
+
+
+def _clean_attrs(attrs: Dict[str, Any]) -> Dict[str, Any]:
+    clean = {}
+    for key, value in attrs.items():
+        if value is None:
+            continue
+        clean[key] = value if isinstance(value, (bool, int, float)) else str(value)[:200]
+    return clean
+
+
+# =============================================================
+# 🧱 Trazas y spans
+# =============================================================
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "status", "attrs")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, attrs: Dict[str, Any]):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.status = "ok"
+        self.attrs = attrs
+
+
+class Trace:
+    """Spans de un bloque de mensajes, con tiempos relativos al inicio de la traza."""
+
+    def __init__(self, name: str, chat_ids: List[str], attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.chat_ids = [cid for cid in dict.fromkeys(str(c).strip() for c in chat_ids) if cid]
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.status = "ok"
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def open_span(self, name: str, parent_id: Optional[int], attrs: Dict[str, Any]) -> Optional[Span]:
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped_spans += 1
+                return None
+            span = Span(next(self._ids), parent_id, name, attrs)
+            self.spans.append(span)
+            return span
+
+    def annotate(self, attrs: Dict[str, Any]) -> None:
+        with self._lock:
+            self.attrs.update(_clean_attrs(attrs))
+
+    def matches_chat(self, chat_id: str) -> bool:
+        target = str(chat_id or "").strip()
+        digits = _chat_digits(target)
+        for cid in self.chat_ids:
+            if cid == target or (digits and _chat_digits(cid) == digits):
+                return True
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.perf_counter()
+        end = self.end if self.end is not None else now
+
+        def _ms(value: float) -> float:
+            return round((value - self.start) * 1000, 2)
+
+        with self._lock:
+            spans = list(self.spans)
+        depth: Dict[int, int] = {}
+        rendered = []
+        for span in sorted(spans, key=lambda s: (s.start, s.span_id)):
+            depth[span.span_id] = depth.get(span.parent_id, -1) + 1 if span.parent_id else 0
+            span_end = span.end if span.end is not None else now
+            rendered.append(
+                {
+                    "id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "depth": depth[span.span_id],
+                    "name": span.name,
+                    "start_ms": _ms(span.start),
+                    "duration_ms": round((span_end - span.start) * 1000, 2),
+                    "status": span.status if span.end is not None else "open",
+                    "attrs": span.attrs,
+                }
+            )
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "chat_ids": self.chat_ids,
+            "started_at": datetime.fromtimestamp(self.started_at, tz=timezone.utc).isoformat(),
+            "duration_ms": round((end - self.start) * 1000, 2),
+            "status": self.status if self.end is not None else "open",
+            "attrs": self.attrs,
+            "dropped_spans": self.dropped_spans,
+            "spans": rendered,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("flight_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("flight_span", default=None)
+
+
+def _status_for(exc: BaseException) -> str:
+    return "cancelled" if isinstance(exc, asyncio.CancelledError) else "error"
+
+
+def _owned_by(attrs: Dict[str, Any], instance_id: Optional[str]) -> bool:
+    """Sin `instance_id` (token global) todo es visible; si no, solo la misma instancia."""
+    if not instance_id:
+        return True
+    return str(attrs.get("instance_id") or "").strip() == str(instance_id).strip()
+
+
+# =============================================================
+# 💾 Sinks locales
+# =============================================================
+class _JsonlSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, payload: Dict[str, Any]) -> None:
+        line = json.dumps(payload, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+    def query(self, chat_id: str, limit: int) -> List[Dict[str, Any]]:
+        return []
+
+
+class _SqliteSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS traces ("
+                "trace_id TEXT PRIMARY KEY, chat_ids TEXT, started_at REAL, duration_ms REAL, payload TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS traces_started ON traces(started_at)")
+            self._conn.commit()
+
+    def write(self, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?, ?)",
+                (
+                    payload["trace_id"],
+                    "|" + "|".join(payload["chat_ids"]) + "|",
+                    datetime.fromisoformat(payload["started_at"]).timestamp(),
+                    payload["duration_ms"],
+                    json.dumps(payload, ensure_ascii=False),
+                ),
+            )
+            self._conn.commit()
+
+    def query(self, chat_id: str, limit: int) -> List[Dict[str, Any]]:
+        pattern = f"%{_chat_digits(chat_id) or str(chat_id).strip()}|%"
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM traces WHERE chat_ids LIKE ? ORDER BY started_at DESC LIMIT ?",
+                (pattern, limit),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+def _build_sink(spec: str):
+    if not spec:
+        return None
+    kind, _, path = spec.partition(":")
+    try:
+        if kind == "jsonl" and path:
+            return _JsonlSink(path)
+        if kind == "sqlite" and path:
+            return _SqliteSink(path)
+    except Exception as exc:
+        log.warning("No se pudo abrir el sink de trazas %s: %s", spec, exc)
+        return None
+    log.warning("TRACE_SINK no reconocido (%s); usa jsonl:<ruta> o sqlite:<ruta>.", spec)
+    return None
+
+
+# =============================================================
+# 🛫 Recorder
+# =============================================================
+class FlightRecorder:
+    """Ring buffer de trazas terminadas + sink opcional."""
+
+    def __init__(self, size: int = TRACE_RING_SIZE, sink_spec: str = TRACE_SINK, enabled: bool = TRACE_RECORDER_ENABLED):
+        self.enabled = enabled
+        self._ring: "deque[Trace]" = deque(maxlen=max(1, size))
+        self._active: Dict[str, Trace] = {}
+        self._lock = threading.Lock()
+        self._sink = _build_sink(sink_spec) if enabled else None
+        self._stats = {"traces": 0, "spans": 0, "sink_writes": 0, "sink_errors": 0}
+
+    @contextmanager
+    def trace(self, name: str, *chat_ids: Any, **attrs: Any) -> Iterator[Optional[Trace]]:
+        """
+        Abre una traza raíz para el bloque. Si ya hay una traza activa en el contexto
+        (p.ej. process_user_message llamado desde el webhook) se abre un span en ella.
+        """
+        if not self.enabled:
+            yield None
+            return
+        parent = _current_trace.get()
+        if parent is not None:
+            with self.span(name, **attrs):
+                yield parent
+            return
+
+        trace = Trace(name, [str(c) for c in chat_ids if c], _clean_attrs(attrs))
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        with self._lock:
+            self._active[trace.trace_id] = trace
+        try:
+            yield trace
+        except BaseException as exc:
+            trace.status = _status_for(exc)
+            raise
+        finally:
+            trace.end = time.perf_counter()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._finish(trace)
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+        trace = _current_trace.get() if self.enabled else None
+        if trace is None:
+            yield None
+            return
+        span = trace.open_span(name, _current_span.get(), _clean_attrs(attrs))
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span.span_id)
+        try:
+            yield span
+        except BaseException as exc:
+            span.status = _status_for(exc)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+
+    def _finish(self, trace: Trace) -> None:
+        with self._lock:
+            self._active.pop(trace.trace_id, None)
+            self._ring.append(trace)
+            self._stats["traces"] += 1
+            self._stats["spans"] += len(trace.spans)
+        if self._sink is None:
+            return
+        payload = trace.to_dict()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_sink(payload)
+            return
+        loop.run_in_executor(None, self._write_sink, payload)
+
+    def _write_sink(self, payload: Dict[str, Any]) -> None:
+        try:
+            self._sink.write(payload)
+            with self._lock:
+                self._stats["sink_writes"] += 1
+        except Exception as exc:
+            with self._lock:
+                self._stats["sink_errors"] += 1
+            log.debug("No se pudo escribir la traza %s: %s", payload.get("trace_id"), exc)
+
+    def for_chat(
+        self,
+        chat_id: str,
+        limit: int = 20,
+        include_active: bool = True,
+        instance_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Trazas más recientes primero (ring buffer y, si hace falta, sink SQLite).
+        Con `instance_id` solo se devuelven las trazas anotadas con esa instancia.
+        """
+        with self._lock:
+            candidates = list(self._ring)
+            if include_active:
+                candidates.extend(self._active.values())
+        matches = [
+            trace
+            for trace in candidates
+            if trace.matches_chat(chat_id) and _owned_by(trace.attrs, instance_id)
+        ]
+        matches.sort(key=lambda t: t.started_at, reverse=True)
+        result = [trace.to_dict() for trace in matches[:limit]]
+        if len(result) < limit and self._sink is not None:
+            seen = {item["trace_id"] for item in result}
+            try:
+                for item in self._sink.query(chat_id, limit):
+                    if item["trace_id"] in seen or not _owned_by(item.get("attrs") or {}, instance_id):
+                        continue
+                    if len(result) < limit:
+                        result.append(item)
+            except Exception as exc:
+                log.debug("No se pudo consultar el sink de trazas: %s", exc)
+        return result
+
+    def get(self, trace_id: str, instance_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for trace in itertools.chain(self._active.values(), reversed(self._ring)):
+                if trace.trace_id == trace_id:
+                    return trace.to_dict() if _owned_by(trace.attrs, instance_id) else None
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "ring_size": len(self._ring),
+                "ring_capacity": self._ring.maxlen,
+                "active": len(self._active),
+                "sink": TRACE_SINK.partition(":")[0] if self._sink is not None else None,
+            }
+
+
+recorder = FlightRecorder()
+
+
+def trace_message(name: str, *chat_ids: Any, **attrs: Any):
+    return recorder.trace(name, *chat_ids, **attrs)
+
+
+def span(name: str, **attrs: Any):
+    return recorder.span(name, **attrs)
+
+
+def annotate_trace(**attrs: Any) -> None:
+    """Añade atributos a la traza raíz activa (p.ej. `instance_id` una vez resuelto)."""
+    trace = _current_trace.get() if recorder.enabled else None
+    if trace is not None:
+        trace.annotate(attrs)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
@@ -13,6 +13,7 @@ from typing import Any, Dict, Optional
 import requests
 from core.async_bridge import run_coro_sync
 from core.config import Settings
+from core.instance_registry import instance_registry
 
 try:
     from core.db import supabase
@@ -447,6 +448,9 @@ def _fetch_properties_by_code_mcp(table: str, instance_id: str) -> list[Dict[str
 
 def fetch_instance_by_number(whatsapp_number: str) -> Dict[str, Any]:
     normalized = _normalize_phone_number(whatsapp_number or "")
+    cached = instance_registry.instance_by_number(normalized)
+    if cached is not None:
+        return cached
     payload = {"whatsApp_number": normalized or whatsapp_number}
     data = _post_json(INSTANCE_LOOKUP_WEBHOOK, payload)
     if data:
@@ -480,6 +484,8 @@ def fetch_instance_by_number(whatsapp_number: str) -> Dict[str, Any]:
                     .execute()
                 )
             rows = resp.data or []
+            if rows:
+                instance_registry.request_refresh()
             return rows[0] if rows else {}
         except Exception as exc:
             log.warning("Fallback supabase instances (numero) fallo: %s", exc)
@@ -489,6 +495,9 @@ def fetch_instance_by_number(whatsapp_number: str) -> Dict[str, Any]:
 def fetch_instance_by_phone_id(whatsapp_phone_id: str) -> Dict[str, Any]:
     if not whatsapp_phone_id:
         return {}
+    cached = instance_registry.instance_by_phone_id(whatsapp_phone_id)
+    if cached is not None:
+        return cached
     payload = {"whatsapp_phone_id": whatsapp_phone_id}
     data = _post_json(INSTANCE_LOOKUP_WEBHOOK, payload)
     if data:
@@ -503,6 +512,8 @@ def fetch_instance_by_phone_id(whatsapp_phone_id: str) -> Dict[str, Any]:
                 .execute()
             )
             rows = resp.data or []
+            if rows:
+                instance_registry.request_refresh()
             return rows[0] if rows else {}
         except Exception as exc:
             log.warning("Fallback supabase instances (phone_id) fallo: %s", exc)
@@ -510,6 +521,9 @@ def fetch_instance_by_phone_id(whatsapp_phone_id: str) -> Dict[str, Any]:
 
 
 def fetch_instance_by_code(instance_id: str) -> Dict[str, Any]:
+    cached = instance_registry.instance_by_code(instance_id)
+    if cached is not None:
+        return cached
     payload = {"instance_id": instance_id}
     data = _post_json(INSTANCE_BY_CODE_WEBHOOK, payload)
     if data:
@@ -527,6 +541,7 @@ def fetch_instance_by_code(instance_id: str) -> Dict[str, Any]:
             rows = resp.data or []
             if rows:
                 log.info("✅ Instance found in Supabase: instance_id=%s", instance_id)
+                instance_registry.request_refresh()
             return rows[0] if rows else {}
         except Exception as exc:
             log.warning("Fallback supabase instances fallo: %s", exc)
@@ -534,6 +549,9 @@ def fetch_instance_by_code(instance_id: str) -> Dict[str, Any]:
 
 
 def fetch_property_by_name(table: str, name: str) -> Dict[str, Any]:
+    cached = instance_registry.property_by_name(table, name)
+    if cached is not None:
+        return cached
     if supabase:
         try:
             resp = (
@@ -565,8 +583,11 @@ def fetch_property_by_code(table: str, instance_id: str) -> Dict[str, Any]:
 def fetch_properties_by_code(table: str, instance_id: str) -> list[Dict[str, Any]]:
     """
     Devuelve multiples properties por instance_id si existen.
-    Prioriza MCP y cae a Supabase cuando sea necesario.
+    Prioriza el registro en memoria, luego MCP y cae a Supabase cuando sea necesario.
     """
+    cached = instance_registry.properties_by_instance(table, instance_id)
+    if cached is not None:
+        return cached
     mcp_rows = _fetch_properties_by_code_mcp(table, instance_id)
     if mcp_rows:
         return mcp_rows
@@ -582,6 +603,7 @@ def fetch_properties_by_code(table: str, instance_id: str) -> list[Dict[str, Any
             )
             rows = resp.data or []
             if rows:
+                instance_registry.request_refresh()
                 return rows
         except Exception as exc:
             log.warning("Fallback supabase properties by code fallo: %s", exc)
@@ -600,6 +622,7 @@ def fetch_properties_by_code(table: str, instance_id: str) -> list[Dict[str, Any
                 )
                 rows = resp.data or []
                 if rows:
+                    instance_registry.request_refresh()
                     return rows
         except Exception as exc:
             log.warning("Fallback supabase properties by hostname fallo: %s", exc)
@@ -615,6 +638,9 @@ def fetch_properties_by_query(table: str, query: str) -> list[Dict[str, Any]]:
     q = str(query).strip()
     if not q:
         return []
+    cached = instance_registry.properties_by_query(table, q, limit=10)
+    if cached is not None:
+        return cached
     if supabase:
         try:
             pattern = f"%{q}%"
@@ -634,24 +660,41 @@ def fetch_properties_by_query(table: str, query: str) -> list[Dict[str, Any]]:
     return []
 
 
-def fetch_property_by_id(table: str, property_id: Any, instance_id: Optional[str] = None) -> Dict[str, Any]:
-    def _matches_instance(row: Dict[str, Any], expected_instance: Optional[str]) -> bool:
-        if not expected_instance:
-            return True
-        expected = str(expected_instance or "").strip()
-        candidate = str(row.get("instance_id") or row.get("instance_url") or "").strip()
-        if not candidate:
-            return False
-        if candidate == expected:
-            return True
-        try:
-            expected_host = (urlsplit(expected).hostname or "").strip().lower()
-            candidate_host = (urlsplit(candidate).hostname or "").strip().lower()
-            if expected_host and candidate_host and expected_host == candidate_host:
-                return True
-        except Exception:
-            pass
+def _property_matches_instance(row: Dict[str, Any], expected_instance: Optional[str]) -> bool:
+    if not expected_instance:
+        return True
+    expected = str(expected_instance or "").strip()
+    candidate = str(row.get("instance_id") or row.get("instance_url") or "").strip()
+    if not candidate:
         return False
+    if candidate == expected:
+        return True
+    try:
+        expected_host = (urlsplit(expected).hostname or "").strip().lower()
+        candidate_host = (urlsplit(candidate).hostname or "").strip().lower()
+        if expected_host and candidate_host and expected_host == candidate_host:
+            return True
+    except Exception:
+        pass
+    return False
+
+
+def _pick_property(rows: list[Dict[str, Any]], instance_id: Optional[str]) -> Dict[str, Any]:
+    """Fila de la instancia esperada; si no la hay y solo existe una, esa."""
+    for row in rows:
+        if isinstance(row, dict) and _property_matches_instance(row, instance_id):
+            return row
+    if len(rows) == 1:
+        return rows[0]
+    return {}
+
+
+def fetch_property_by_id(table: str, property_id: Any, instance_id: Optional[str] = None) -> Dict[str, Any]:
+    for column in ("property_id", "id"):
+        cached = instance_registry.properties_by_column(table, column, property_id)
+        row = _pick_property(cached or [], instance_id)
+        if row:
+            return row
 
     if supabase:
         try:
@@ -662,20 +705,16 @@ def fetch_property_by_id(table: str, property_id: Any, instance_id: Optional[str
                 .limit(20)
                 .execute()
             )
-            rows = resp.data or []
-            if rows:
-                for row in rows:
-                    if isinstance(row, dict) and _matches_instance(row, instance_id):
-                        log.info(
-                            "✅ Property found in Supabase: table=%s property_id=%s instance_id=%s",
-                            table,
-                            property_id,
-                            instance_id,
-                        )
-                        return row
-                if len(rows) == 1:
-                    log.info("✅ Property found in Supabase: table=%s property_id=%s", table, property_id)
-                    return rows[0]
+            row = _pick_property(resp.data or [], instance_id)
+            if row:
+                log.info(
+                    "✅ Property found in Supabase: table=%s property_id=%s instance_id=%s",
+                    table,
+                    property_id,
+                    instance_id,
+                )
+                instance_registry.request_refresh()
+                return row
         except Exception as exc:
             log.warning("Fallback supabase property_by_id fallo: %s", exc)
         try:
@@ -686,20 +725,16 @@ def fetch_property_by_id(table: str, property_id: Any, instance_id: Optional[str
                 .limit(20)
                 .execute()
             )
-            rows = resp.data or []
-            if rows:
-                for row in rows:
-                    if isinstance(row, dict) and _matches_instance(row, instance_id):
-                        log.info(
-                            "✅ Property found in Supabase by id: table=%s id=%s instance_id=%s",
-                            table,
-                            property_id,
-                            instance_id,
-                        )
-                        return row
-                if len(rows) == 1:
-                    log.info("✅ Property found in Supabase by id: table=%s id=%s", table, property_id)
-                    return rows[0]
+            row = _pick_property(resp.data or [], instance_id)
+            if row:
+                log.info(
+                    "✅ Property found in Supabase by id: table=%s id=%s instance_id=%s",
+                    table,
+                    property_id,
+                    instance_id,
+                )
+                instance_registry.request_refresh()
+                return row
         except Exception:
             pass
     payload = {"tabla": table, "property_id": property_id}
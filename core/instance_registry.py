@@ -0,0 +1,461 @@
+"""
+🗂️ Registro en memoria de instancias y properties
+======================================================================================
+Las tablas `instances` y de properties son pequeñas y cambian poco, pero los fetchers de
+`core.instance_context` (por número, phone_id, código, property_id, nombre...) las
+consultaban en casi cada webhook, envío y listado de chats.
+
+`InstanceRegistry` carga una foto completa de esas tablas al arrancar (main.py) y la
+refresca cada INSTANCE_REGISTRY_REFRESH_SECONDS. La foto (`RegistrySnapshot`) es
+inmutable y se sustituye de golpe; las búsquedas son O(1) sobre índices por:
+
+- instancias: whatsapp_phone_id, whatsapp_number normalizado (solo dígitos) e instance_id
+- properties (por tabla): property_id, id, instance_id/instance_url, hostname de la
+  instance_url, nombre exacto y tokens de name/property_name
+
+Cada búsqueda devuelve None cuando el registro no puede responder (desactivado, sin
+cargar, tabla no cargada o sin coincidencia) y el fetcher cae a Supabase como antes. Si
+esa consulta encuentra algo que el registro no tenía, `request_refresh()` lanza una
+recarga en segundo plano (como mucho una cada INSTANCE_REGISTRY_MIN_REFRESH_SECONDS).
+Las filas se devuelven como copias: quien las modifique no altera la foto.
+
+Métrica: `bookai_instance_registry_lookups_total{kind,result}`; resumen en
+`GET /health/registry`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from core.metrics import INSTANCE_REGISTRY_LOOKUPS_TOTAL
+from core.utils.env import env_bool
+
+log = logging.getLogger("InstanceRegistry")
+
+INSTANCE_REGISTRY_ENABLED = env_bool("INSTANCE_REGISTRY_ENABLED", True)
+INSTANCE_REGISTRY_REFRESH_SECONDS = float(os.getenv("INSTANCE_REGISTRY_REFRESH_SECONDS", "300"))
+INSTANCE_REGISTRY_MIN_REFRESH_SECONDS = float(os.getenv("INSTANCE_REGISTRY_MIN_REFRESH_SECONDS", "30"))
+# Por encima de este tamaño la tabla no se indexa (sus búsquedas van a Supabase).
+INSTANCE_REGISTRY_MAX_ROWS = int(os.getenv("INSTANCE_REGISTRY_MAX_ROWS", "20000"))
+
+_PAGE_SIZE = 1000
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+Row = Dict[str, Any]
+
+
+def _digits(value: Any) -> str:
+    return re.sub(r"\D", "", str(value or ""))
+
+
+def _key(value: Any) -> str:
+    return str(value if value is not None else "").strip()
+
+
+def _hostname(value: Any) -> str:
+    try:
+        return (urlsplit(_key(value)).hostname or "").strip().lower()
+    except Exception:
+        return ""
+
+
+def _copy(row: Optional[Row]) -> Optional[Row]:
+    return dict(row) if row is not None else None
+
+
+def _add(index: Dict[str, List[Row]], key: str, row: Row) -> None:
+    if key:
+        index.setdefault(key, []).append(row)
+
+
+# =============================================================
+# 📸 Foto inmutable con índices
+# =============================================================
+
+
+@dataclass(frozen=True)
+class PropertyIndex:
+    """Índices de una tabla de properties (filas en el orden de carga)."""
+
+    rows: Tuple[Row, ...]
+    by_property_id: Dict[str, List[Row]]
+    by_id: Dict[str, List[Row]]
+    by_instance: Dict[str, List[Row]]
+    by_host: Dict[str, List[Row]]
+    by_name: Dict[str, List[Row]]
+    by_token: Dict[str, List[int]]
+
+    @classmethod
+    def build(cls, rows: Iterable[Row]) -> "PropertyIndex":
+        ordered = tuple(row for row in rows if isinstance(row, dict))
+        by_property_id: Dict[str, List[Row]] = {}
+        by_id: Dict[str, List[Row]] = {}
+        by_instance: Dict[str, List[Row]] = {}
+        by_host: Dict[str, List[Row]] = {}
+        by_name: Dict[str, List[Row]] = {}
+        by_token: Dict[str, List[int]] = {}
+        for pos, row in enumerate(ordered):
+            _add(by_property_id, _key(row.get("property_id")), row)
+            _add(by_id, _key(row.get("id")), row)
+            instance_id = _key(row.get("instance_id"))
+            instance_url = _key(row.get("instance_url"))
+            _add(by_instance, instance_id, row)
+            if instance_url and instance_url != instance_id:
+                _add(by_instance, instance_url, row)
+            _add(by_host, _hostname(instance_url), row)
+            if row.get("name") is not None:
+                _add(by_name, str(row.get("name")), row)
+            tokens = set()
+            for column in ("name", "property_name"):
+                tokens.update(_TOKEN_RE.findall(str(row.get(column) or "").lower()))
+            for token in tokens:
+                by_token.setdefault(token, []).append(pos)
+        return cls(ordered, by_property_id, by_id, by_instance, by_host, by_name, by_token)
+
+    def search(self, query: str, limit: int) -> List[Row]:
+        """
+        Coincidencia parcial sin distinguir mayúsculas en name/property_name (como el ilike
+        '%query%'). Cada token de la consulta debe estar contenido en algún token de la
+        fila: se filtra por el vocabulario de tokens y solo se verifican esas filas.
+        """
+        needle = query.strip().lower()
+        if not needle:
+            return []
+        query_tokens = _TOKEN_RE.findall(needle)
+        if query_tokens:
+            candidates: Optional[set] = None
+            for q_token in query_tokens:
+                positions = set()
+                for token, rows in self.by_token.items():
+                    if q_token in token:
+                        positions.update(rows)
+                candidates = positions if candidates is None else candidates & positions
+                if not candidates:
+                    return []
+            positions_iter: Iterable[int] = sorted(candidates or ())
+        else:
+            positions_iter = range(len(self.rows))
+        matches: List[Row] = []
+        for pos in positions_iter:
+            row = self.rows[pos]
+            if any(needle in str(row.get(column) or "").lower() for column in ("name", "property_name")):
+                matches.append(row)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+@dataclass(frozen=True)
+class RegistrySnapshot:
+    """Foto de `instances` y de las tablas de properties cargadas."""
+
+    instances: Tuple[Row, ...]
+    by_phone_id: Dict[str, Row]
+    by_number: Dict[str, Row]
+    by_code: Dict[str, Row]
+    properties: Dict[str, PropertyIndex]
+    loaded_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def build(cls, instances: Iterable[Row], properties: Dict[str, Iterable[Row]]) -> "RegistrySnapshot":
+        ordered = tuple(row for row in instances or () if isinstance(row, dict))
+        by_phone_id: Dict[str, Row] = {}
+        by_number: Dict[str, Row] = {}
+        by_code: Dict[str, Row] = {}
+        for row in ordered:
+            # setdefault: ante duplicados gana la primera fila, como `.limit(1)`.
+            phone_id = _key(row.get("whatsapp_phone_id"))
+            if phone_id:
+                by_phone_id.setdefault(phone_id, row)
+                by_phone_id.setdefault(_digits(phone_id) or phone_id, row)
+            number = _digits(row.get("whatsapp_number"))
+            if number:
+                by_number.setdefault(number, row)
+            code = _key(row.get("instance_id"))
+            if code:
+                by_code.setdefault(code, row)
+        return cls(
+            instances=ordered,
+            by_phone_id=by_phone_id,
+            by_number=by_number,
+            by_code=by_code,
+            properties={table: PropertyIndex.build(rows) for table, rows in (properties or {}).items()},
+        )
+
+
+# =============================================================
+# 🗂️ Registro
+# =============================================================
+
+
+def _default_client() -> Any:
+    try:
+        from core.db import supabase
+
+        return supabase
+    except Exception:
+        return None
+
+
+def _default_property_tables(instances: Iterable[Row]) -> List[str]:
+    from core.instance_context import DEFAULT_PROPERTY_TABLE, _resolve_property_table
+
+    tables = [DEFAULT_PROPERTY_TABLE] if DEFAULT_PROPERTY_TABLE else []
+    for row in instances:
+        table = _resolve_property_table(row)
+        if table and table not in tables:
+            tables.append(table)
+    return tables
+
+
+class InstanceRegistry:
+    """Foto de instancias/properties con refresco periódico y bajo demanda."""
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = INSTANCE_REGISTRY_ENABLED,
+        refresh_seconds: float = INSTANCE_REGISTRY_REFRESH_SECONDS,
+        min_refresh_seconds: float = INSTANCE_REGISTRY_MIN_REFRESH_SECONDS,
+        max_rows: int = INSTANCE_REGISTRY_MAX_ROWS,
+        client: Any = None,
+        property_tables: Optional[Callable[[Iterable[Row]], List[str]]] = None,
+    ):
+        self.enabled = enabled
+        self.refresh_seconds = max(1.0, refresh_seconds)
+        self.min_refresh_seconds = max(0.0, min_refresh_seconds)
+        self.max_rows = max(1, int(max_rows))
+        self._client = client
+        self._property_tables = property_tables or _default_property_tables
+        self._snapshot: Optional[RegistrySnapshot] = None
+        self._refresh_lock = threading.Lock()
+        self._last_refresh_attempt = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._lookups: Counter = Counter()
+        self._stats = {"refreshes": 0, "refresh_errors": 0, "refresh_requests": 0, "last_refresh_ms": None}
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # ------------------------------------------------------------------
+    # Carga
+    # ------------------------------------------------------------------
+    def load(self, instances: Iterable[Row], properties: Dict[str, Iterable[Row]]) -> RegistrySnapshot:
+        """Sustituye la foto por una construida con estas filas."""
+        snapshot = RegistrySnapshot.build(instances, properties)
+        self._snapshot = snapshot
+        return snapshot
+
+    def refresh(self) -> bool:
+        """Recarga completa desde Supabase (síncrona: desde hilos o `run_db_call`)."""
+        client = self._client if self._client is not None else _default_client()
+        if not self.enabled or client is None:
+            return False
+        if not self._refresh_lock.acquire(blocking=False):
+            return False  # ya hay una recarga en curso
+        started = time.perf_counter()
+        self._last_refresh_attempt = time.monotonic()
+        try:
+            instances = self._read_table(client, "instances")
+            if instances is None:
+                raise RuntimeError("tabla instances demasiado grande para el registro")
+            properties: Dict[str, List[Row]] = {}
+            for table in self._property_tables(instances):
+                try:
+                    rows = self._read_table(client, table)
+                except Exception as exc:
+                    log.warning("⚠️ Registro: no se pudo cargar la tabla %s: %s", table, exc)
+                    continue
+                if rows is None:
+                    log.warning("⚠️ Registro: tabla %s supera %s filas; no se indexa", table, self.max_rows)
+                    continue
+                properties[table] = rows
+            snapshot = self.load(instances, properties)
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+            self._stats["refreshes"] += 1
+            self._stats["last_refresh_ms"] = elapsed_ms
+            log.info(
+                "🗂️ Registro de instancias cargado: %s instancias, %s tablas de properties (%sms)",
+                len(snapshot.instances),
+                len(snapshot.properties),
+                elapsed_ms,
+            )
+            return True
+        except Exception as exc:
+            self._stats["refresh_errors"] += 1
+            log.warning("⚠️ Registro de instancias: recarga fallida (se mantiene la foto anterior): %s", exc)
+            return False
+        finally:
+            self._refresh_lock.release()
+
+    def _read_table(self, client: Any, table: str) -> Optional[List[Row]]:
+        rows: List[Row] = []
+        start = 0
+        while True:
+            resp = client.table(table).select("*").range(start, start + _PAGE_SIZE - 1).execute()
+            page = resp.data or []
+            rows.extend(row for row in page if isinstance(row, dict))
+            if len(rows) > self.max_rows:
+                return None
+            if len(page) < _PAGE_SIZE:
+                return rows
+            start += _PAGE_SIZE
+
+    def request_refresh(self) -> bool:
+        """Recarga en segundo plano tras detectar la foto desfasada (con límite de frecuencia)."""
+        if not self.enabled or not self.loaded:
+            return False
+        if time.monotonic() - self._last_refresh_attempt < self.min_refresh_seconds:
+            return False
+        self._last_refresh_attempt = time.monotonic()
+        self._stats["refresh_requests"] += 1
+        threading.Thread(target=self.refresh, name="instance-registry-refresh", daemon=True).start()
+        return True
+
+    def invalidate(self) -> None:
+        """Descarta la foto: todas las búsquedas vuelven a Supabase hasta la próxima recarga."""
+        self._snapshot = None
+
+    async def start(self) -> None:
+        """Carga inicial (en el pool de BD) y refresco periódico en una Task."""
+        if not self.enabled or self.running:
+            return
+        from core.db import run_db_call
+
+        await run_db_call(self.refresh)
+        self._task = asyncio.create_task(self._refresh_loop(), name="instance-registry")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self) -> None:
+        from core.db import run_db_call
+
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            await run_db_call(self.refresh)
+
+    # ------------------------------------------------------------------
+    # Búsquedas (None = el registro no responde; usar Supabase)
+    # ------------------------------------------------------------------
+    def _snapshot_for(self, kind: str) -> Optional[RegistrySnapshot]:
+        snapshot = self._snapshot if self.enabled else None
+        if snapshot is None:
+            self._record(kind, "bypass")
+        return snapshot
+
+    def _table_for(self, kind: str, table: str) -> Optional[PropertyIndex]:
+        snapshot = self._snapshot_for(kind)
+        if snapshot is None:
+            return None
+        index = snapshot.properties.get(table)
+        if index is None:
+            self._record(kind, "bypass")
+        return index
+
+    def _record(self, kind: str, result: str) -> None:
+        self._lookups[(kind, result)] += 1
+        INSTANCE_REGISTRY_LOOKUPS_TOTAL.inc(kind=kind, result=result)
+
+    def _found(self, kind: str, value: Any) -> Any:
+        self._record(kind, "hit" if value else "miss")
+        return value or None
+
+    def instance_by_number(self, whatsapp_number: Any) -> Optional[Row]:
+        snapshot = self._snapshot_for("instance_by_number")
+        if snapshot is None:
+            return None
+        return _copy(self._found("instance_by_number", snapshot.by_number.get(_digits(whatsapp_number))))
+
+    def instance_by_phone_id(self, whatsapp_phone_id: Any) -> Optional[Row]:
+        snapshot = self._snapshot_for("instance_by_phone_id")
+        if snapshot is None:
+            return None
+        key = _key(whatsapp_phone_id)
+        row = snapshot.by_phone_id.get(key) or snapshot.by_phone_id.get(_digits(key))
+        return _copy(self._found("instance_by_phone_id", row))
+
+    def instance_by_code(self, instance_id: Any) -> Optional[Row]:
+        snapshot = self._snapshot_for("instance_by_code")
+        if snapshot is None:
+            return None
+        return _copy(self._found("instance_by_code", snapshot.by_code.get(_key(instance_id))))
+
+    def property_by_name(self, table: str, name: Any) -> Optional[Row]:
+        index = self._table_for("property_by_name", table)
+        if index is None:
+            return None
+        rows = index.by_name.get(str(name)) or []
+        return _copy(self._found("property_by_name", rows[0] if rows else None))
+
+    def properties_by_column(self, table: str, column: str, value: Any) -> Optional[List[Row]]:
+        """Filas con `column` (property_id/id) igual a `value`."""
+        index = self._table_for(f"property_by_{column}", table)
+        if index is None:
+            return None
+        source = index.by_property_id if column == "property_id" else index.by_id
+        rows = self._found(f"property_by_{column}", source.get(_key(value)))
+        return [dict(row) for row in rows] if rows else None
+
+    def properties_by_instance(self, table: str, instance_id: Any) -> Optional[List[Row]]:
+        """Filas con instance_id o instance_url igual; si no hay, por hostname de la URL."""
+        index = self._table_for("properties_by_code", table)
+        if index is None:
+            return None
+        key = _key(instance_id)
+        rows = index.by_instance.get(key) or index.by_host.get(_hostname(key))
+        rows = self._found("properties_by_code", rows)
+        return [dict(row) for row in rows] if rows else None
+
+    def properties_by_query(self, table: str, query: Any, limit: int = 10) -> Optional[List[Row]]:
+        index = self._table_for("properties_by_query", table)
+        if index is None:
+            return None
+        rows = self._found("properties_by_query", index.search(str(query or ""), limit))
+        return [dict(row) for row in rows] if rows else None
+
+    # ------------------------------------------------------------------
+    # Estado
+    # ------------------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["enabled"] = self.enabled
+        stats["running"] = self.running
+        stats["loaded"] = snapshot is not None
+        if snapshot is not None:
+            stats["age_seconds"] = round(time.time() - snapshot.loaded_at, 1)
+            stats["instances"] = len(snapshot.instances)
+            stats["property_tables"] = {table: len(index.rows) for table, index in snapshot.properties.items()}
+        lookups: Dict[str, Dict[str, int]] = {}
+        for (kind, result), count in sorted(self._lookups.items()):
+            lookups.setdefault(kind, {})[result] = count
+        stats["lookups"] = lookups
+        return stats
+
+
+instance_registry = InstanceRegistry()
+
+
+def get_instance_registry_stats() -> Dict[str, Any]:
+    return instance_registry.stats()
@@ -0,0 +1,141 @@
+"""
+📚 Caché de recuperación de la base de conocimientos
+======================================================================================
+Las mismas preguntas ("¿a qué hora es el checkout?", "¿hay parking?") llegan cientos
+de veces al día por propiedad. Se guardan los fragmentos ya ordenados que devolvió
+KBSearchTool con clave (instance_url, property_id, kb, pregunta normalizada).
+
+- Se invalida por propiedad/KB cuando cambia su contenido (add_kb_daily_cache y
+  altas/bajas del superintendente), con un TTL de seguridad (KB_RETRIEVAL_CACHE_TTL).
+- Límite de entradas (LRU) y métricas de aciertos/fallos/invalidaciones.
+- Solo se guardan respuestas útiles; los "sin información" siguen su flujo normal.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+log = logging.getLogger("KBRetrievalCache")
+
+KB_RETRIEVAL_CACHE_TTL = float(os.getenv("KB_RETRIEVAL_CACHE_TTL", "1800"))
+KB_RETRIEVAL_CACHE_MAXSIZE = int(os.getenv("KB_RETRIEVAL_CACHE_MAXSIZE", "4096"))
+
+KBKey = Tuple[str, str, str, str]
+
+
+def normalize_question(text: str) -> str:
+    """Minúsculas, sin acentos ni signos de puntuación y espacios colapsados."""
+    folded = unicodedata.normalize("NFKD", (text or "").lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    folded = re.sub(r"check[\s\-_]*(in|out)", r"check\1", folded)
+    return " ".join(re.findall(r"[a-z0-9]+", folded))
+
+
+def _norm_scope(value: Any) -> str:
+    return str(value).strip().rstrip("/").lower() if value not in (None, "") else ""
+
+
+def kb_key(instance_url: Any, property_id: Any, kb_name: Any, question: str) -> KBKey:
+    return (
+        _norm_scope(instance_url),
+        _norm_scope(property_id),
+        _norm_scope(kb_name),
+        normalize_question(question),
+    )
+
+
+class KBRetrievalCache:
+    """Caché TTL + LRU de resultados de búsqueda en KB con invalidación por propiedad."""
+
+    def __init__(self, ttl: float = KB_RETRIEVAL_CACHE_TTL, maxsize: int = KB_RETRIEVAL_CACHE_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = max(1, maxsize)
+        self._entries: "OrderedDict[KBKey, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, key: KBKey) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                self._entries.pop(key, None)
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: KBKey, result: str) -> None:
+        if self.ttl <= 0 or not key[3] or not result:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(
+        self,
+        *,
+        property_id: Any = None,
+        kb_name: Any = None,
+        instance_url: Any = None,
+    ) -> int:
+        """
+        Descarta las entradas de la propiedad o KB indicadas (basta con que coincida
+        una de las dos). Sin argumentos vacía la caché completa.
+        """
+        prop = _norm_scope(property_id)
+        kb = _norm_scope(kb_name)
+        url = _norm_scope(instance_url)
+        with self._lock:
+            if not (prop or kb or url):
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                doomed = [
+                    key
+                    for key in self._entries
+                    if (not url or key[0] == url) and ((prop and key[1] == prop) or (kb and key[2] == kb) or not (prop or kb))
+                ]
+                for key in doomed:
+                    self._entries.pop(key, None)
+                removed = len(doomed)
+            self._stats["invalidations"] += 1
+        if removed:
+            log.info("📚 Caché KB invalidada (property_id=%s kb=%s): %s entradas", property_id, kb_name, removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["ttl_s"] = self.ttl
+        return stats
+
+
+kb_retrieval_cache = KBRetrievalCache()
+
+
+def invalidate_kb_retrieval(property_id: Any = None, kb_name: Any = None, instance_url: Any = None) -> int:
+    try:
+        return kb_retrieval_cache.invalidate(property_id=property_id, kb_name=kb_name, instance_url=instance_url)
+    except Exception as exc:
+        log.warning("No se pudo invalidar la caché de KB: %s", exc)
+        return 0
+
+
+def get_kb_retrieval_stats() -> Dict[str, Any]:
+    return kb_retrieval_cache.stats()
@@ -2,13 +2,16 @@
 import json
 import os
 import re
+import threading
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Optional, Tuple
+from typing import Generator, Optional, Tuple
 
-from langchain_openai import ChatOpenAI
+from core.config import ModelConfig
 from langdetect import DetectorFactory, LangDetectException, detect_langs
 
 OPENAI_MODEL = "gpt-4.1-mini"
+DETECT_CACHE_MAXSIZE = 4096
 
 # Fijamos seed para resultados deterministas en langdetect
 DetectorFactory.seed = 0
@@ -278,7 +281,10 @@ class LanguageManager:
     """
 
     def __init__(self, model: Optional[str] = None, temperature: float = 0.0):
-        self.llm = ChatOpenAI(model=model or OPENAI_MODEL, temperature=temperature)
+        self.llm = ModelConfig.get_custom_llm(model or OPENAI_MODEL, temperature, label="language")
+        # Caché LRU compartida por detect_language / adetect_language
+        self._detect_cache: "OrderedDict[tuple[str, Optional[str]], str]" = OrderedDict()
+        self._detect_cache_lock = threading.Lock()
 
     @staticmethod
     def _normalize_confidence(value: float, default: float = 0.0) -> float:
@@ -315,31 +321,25 @@ class LanguageManager:
 
         return _normalize_iso_lang_code(str(candidate or "")) or fallback
 
-    def resolve_response_language(
+    # ==========================================================
+    # 🧭 Resolución del idioma de respuesta
+    # ==========================================================
+    def _prepare_router(
         self,
         latest_guest_message: str,
-        recent_guest_messages: Optional[list[str]] = None,
-        guest_language_hint: Optional[str] = None,
-        guest_language_confidence: Optional[float] = None,
-        last_resolved_language: Optional[str] = None,
-    ) -> Tuple[str, float]:
+        recent_guest_messages: Optional[list[str]],
+        detected_lang: str,
+        detected_confidence: float,
+        hint: Optional[str],
+        hint_conf: float,
+        last_lang: str,
+    ) -> Tuple[str, float, Optional[list[dict]], str, float]:
         """
-        Resuelve el idioma de respuesta con contexto real de conversación.
-        El LLM decide con esta jerarquía:
-          1. idioma observable en el último mensaje del huésped,
-          2. idioma predominante en mensajes recientes del huésped,
-          3. guest_language_confidence / hint como señal auxiliar,
-          4. último idioma ya resuelto si sigue habiendo ambigüedad.
+        Prepara el prompt del router de idioma.
+        Devuelve (fallback, support_conf, prompt|None, detected, detected_conf);
+        si el prompt es None no hace falta consultar al LLM.
         """
         latest = (latest_guest_message or "").strip()
-        hint = _normalize_iso_lang_code(guest_language_hint or "")
-        last_lang = _normalize_iso_lang_code(last_resolved_language or "") or hint or "es"
-        hint_conf = self._normalize_confidence(guest_language_confidence, default=0.0)
-
-        detected_lang, detected_confidence = self.detect_language_with_confidence(
-            latest,
-            prev_lang=last_lang,
-        )
         detected = _normalize_iso_lang_code(detected_lang or "") or last_lang
         detected_conf = self._normalize_confidence(detected_confidence, default=0.0)
         fallback = detected or hint or last_lang or "es"
@@ -349,7 +349,7 @@ class LanguageManager:
                 detected_conf if detected == fallback else 0.0,
                 hint_conf if hint == fallback else 0.0,
             )
-            return fallback, support_conf
+            return fallback, support_conf, None, detected, detected_conf
 
         recent = []
         for msg in recent_guest_messages or []:
@@ -393,6 +393,53 @@ class LanguageManager:
                 ),
             },
         ]
+        return fallback, 0.0, router_prompt, detected, detected_conf
+
+    @staticmethod
+    def _support_confidence(
+        resolved: str,
+        detected: str,
+        detected_conf: float,
+        hint: Optional[str],
+        hint_conf: float,
+    ) -> float:
+        support_conf = 0.0
+        if detected == resolved:
+            support_conf = max(support_conf, detected_conf)
+        if hint and hint == resolved:
+            support_conf = max(support_conf, hint_conf)
+        return support_conf
+
+    def resolve_response_language(
+        self,
+        latest_guest_message: str,
+        recent_guest_messages: Optional[list[str]] = None,
+        guest_language_hint: Optional[str] = None,
+        guest_language_confidence: Optional[float] = None,
+        last_resolved_language: Optional[str] = None,
+    ) -> Tuple[str, float]:
+        """
+        Resuelve el idioma de respuesta con contexto real de conversación.
+        El LLM decide con esta jerarquía:
+          1. idioma observable en el último mensaje del huésped,
+          2. idioma predominante en mensajes recientes del huésped,
+          3. guest_language_confidence / hint como señal auxiliar,
+          4. último idioma ya resuelto si sigue habiendo ambigüedad.
+        """
+        latest = (latest_guest_message or "").strip()
+        hint = _normalize_iso_lang_code(guest_language_hint or "")
+        last_lang = _normalize_iso_lang_code(last_resolved_language or "") or hint or "es"
+        hint_conf = self._normalize_confidence(guest_language_confidence, default=0.0)
+
+        detected_lang, detected_confidence = self.detect_language_with_confidence(
+            latest,
+            prev_lang=last_lang,
+        )
+        fallback, support_conf, router_prompt, detected, detected_conf = self._prepare_router(
+            latest, recent_guest_messages, detected_lang, detected_confidence, hint, hint_conf, last_lang
+        )
+        if router_prompt is None:
+            return fallback, support_conf
 
         try:
             raw = self.llm.invoke(router_prompt).content.strip()
@@ -400,16 +447,46 @@ class LanguageManager:
         except Exception:
             resolved = fallback
 
-        support_conf = 0.0
-        if detected == resolved:
-            support_conf = max(support_conf, detected_conf)
-        if hint and hint == resolved:
-            support_conf = max(support_conf, hint_conf)
+        return resolved, self._support_confidence(resolved, detected, detected_conf, hint, hint_conf)
 
-        return resolved, support_conf
+    async def aresolve_response_language(
+        self,
+        latest_guest_message: str,
+        recent_guest_messages: Optional[list[str]] = None,
+        guest_language_hint: Optional[str] = None,
+        guest_language_confidence: Optional[float] = None,
+        last_resolved_language: Optional[str] = None,
+    ) -> Tuple[str, float]:
+        """Versión async de `resolve_response_language` (no bloquea el event loop)."""
+        latest = (latest_guest_message or "").strip()
+        hint = _normalize_iso_lang_code(guest_language_hint or "")
+        last_lang = _normalize_iso_lang_code(last_resolved_language or "") or hint or "es"
+        hint_conf = self._normalize_confidence(guest_language_confidence, default=0.0)
 
-    def _llm_detect_lang_code(self, text: str, fallback: str = "es") -> str:
-        prompt = [
+        detected_lang, detected_confidence = await self.adetect_language_with_confidence(
+            latest,
+            prev_lang=last_lang,
+        )
+        fallback, support_conf, router_prompt, detected, detected_conf = self._prepare_router(
+            latest, recent_guest_messages, detected_lang, detected_confidence, hint, hint_conf, last_lang
+        )
+        if router_prompt is None:
+            return fallback, support_conf
+
+        try:
+            raw = (await self.llm.ainvoke(router_prompt)).content.strip()
+            resolved = self._parse_router_lang(raw, fallback=fallback)
+        except Exception:
+            resolved = fallback
+
+        return resolved, self._support_confidence(resolved, detected, detected_conf, hint, hint_conf)
+
+    # ==========================================================
+    # 🔍 Detección de idioma
+    # ==========================================================
+    @staticmethod
+    def _detect_lang_prompt(text: str, fallback: str) -> list[dict]:
+        return [
             {
                 "role": "system",
                 "content": (
@@ -420,15 +497,51 @@ class LanguageManager:
             },
             {"role": "user", "content": f"Fallback: {fallback}\nText:\n{text}"},
         ]
+
+    @staticmethod
+    def _parse_detected_lang(raw: str, fallback: str) -> str:
+        out = (raw or "").strip().lower()
+        out = out.split()[0].strip(" .,:;|[](){}\"'") if out else fallback
+        return _normalize_iso_lang_code(out) or (fallback or "es")
+
+    def _llm_detect_lang_code(self, text: str, fallback: str = "es") -> str:
         try:
-            out = self.llm.invoke(prompt).content.strip().lower()
-            out = out.split()[0].strip(" .,:;|[](){}\"'") if out else fallback
-            return _normalize_iso_lang_code(out) or (fallback or "es")
+            out = self.llm.invoke(self._detect_lang_prompt(text, fallback)).content
+            return self._parse_detected_lang(out, fallback)
         except Exception:
             return fallback or "es"
 
-    @lru_cache(maxsize=4096)
-    def detect_language(self, text: str, prev_lang: Optional[str] = None) -> str:
+    async def _allm_detect_lang_code(self, text: str, fallback: str = "es") -> str:
+        try:
+            out = (await self.llm.ainvoke(self._detect_lang_prompt(text, fallback))).content
+            return self._parse_detected_lang(out, fallback)
+        except Exception:
+            return fallback or "es"
+
+    def _detect_cache_get(self, key: tuple[str, Optional[str]]) -> Optional[str]:
+        with self._detect_cache_lock:
+            value = self._detect_cache.get(key)
+            if value is not None:
+                self._detect_cache.move_to_end(key)
+            return value
+
+    def _detect_cache_put(self, key: tuple[str, Optional[str]], value: str) -> None:
+        with self._detect_cache_lock:
+            self._detect_cache[key] = value
+            self._detect_cache.move_to_end(key)
+            while len(self._detect_cache) > DETECT_CACHE_MAXSIZE:
+                self._detect_cache.popitem(last=False)
+
+    def _detect_language_steps(
+        self,
+        text: str,
+        prev_lang: Optional[str] = None,
+    ) -> Generator[Tuple[str, str], str, str]:
+        """
+        Heurísticas de detección compartidas por la versión sync y async.
+        Cuando necesita al LLM hace `yield (texto, fallback)` y recibe el código
+        detectado; el valor final se devuelve vía StopIteration.
+        """
         raw_text = (text or "").strip()
         # Si vienen varios mensajes combinados (con saltos de línea), usa la última línea real.
         # Pero si esa última línea es demasiado "telegráfica" (ej. "y parking?"),
@@ -494,7 +607,7 @@ class LanguageManager:
             if prev_lang:
                 return base_lang
             # como último recurso, intenta con LLM breve
-            normalized = self._llm_detect_lang_code(text, fallback=base_lang)
+            normalized = yield (text, base_lang)
             if normalized:
                 return normalized
             return base_lang
@@ -518,7 +631,7 @@ class LanguageManager:
                 # Verificación con LLM cuando el detector difiere del idioma previo
                 # o cuando la confianza no es alta, para evitar falsos positivos.
                 if normalized and (normalized != base_lang or prob < 0.90):
-                    llm_code = self._llm_detect_lang_code(text, fallback=normalized)
+                    llm_code = yield (text, normalized)
                     if llm_code and llm_code != normalized:
                         normalized = llm_code
                 if prev_lang and normalized and normalized != base_lang and _is_low_information_followup(text):
@@ -527,30 +640,57 @@ class LanguageManager:
             # Con baja confianza, permite pasar a la validación LLM
             # para no quedar anclados al idioma previo en mensajes informativos.
 
+        normalized = yield (text, base_lang)
+        if not normalized:
+            return base_lang
+        if prev_lang and normalized != base_lang and (
+            _is_short_ambiguous_snippet(text) or _is_low_information_followup(text)
+        ):
+            return base_lang
+        return normalized
+
+    def detect_language(self, text: str, prev_lang: Optional[str] = None) -> str:
+        key = (text, prev_lang)
+        cached = self._detect_cache_get(key)
+        if cached is not None:
+            return cached
+
+        steps = self._detect_language_steps(text, prev_lang)
         try:
-            normalized = self._llm_detect_lang_code(text, fallback=base_lang)
-            if not normalized:
-                return base_lang
-            if prev_lang and normalized != base_lang and (
-                _is_short_ambiguous_snippet(text) or _is_low_information_followup(text)
-            ):
-                return base_lang
-            return normalized
+            request = next(steps)
+            while True:
+                request = steps.send(self._llm_detect_lang_code(*request))
+        except StopIteration as stop:
+            result = stop.value
         except Exception as e:
             print(f"⚠️ Error detectando idioma: {e}")
-            return base_lang
+            return _normalize_iso_lang_code(prev_lang or "") or "es"
 
-    def detect_language_with_confidence(self, text: str, prev_lang: Optional[str] = None) -> Tuple[str, float]:
-        """
-        Detecta idioma reutilizando `detect_language` (incluye fallback LLM) y
-        devuelve una confianza [0,1] basada en langdetect cuando está disponible.
-        """
-        detected = (
-            self.detect_language(text, prev_lang=prev_lang)
-            or _normalize_iso_lang_code(prev_lang or "")
-            or "es"
-        ).strip().lower()
+        self._detect_cache_put(key, result)
+        return result
+
+    async def adetect_language(self, text: str, prev_lang: Optional[str] = None) -> str:
+        """Versión async de `detect_language`; comparte heurísticas y caché."""
+        key = (text, prev_lang)
+        cached = self._detect_cache_get(key)
+        if cached is not None:
+            return cached
+
+        steps = self._detect_language_steps(text, prev_lang)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await self._allm_detect_lang_code(*request))
+        except StopIteration as stop:
+            result = stop.value
+        except Exception as e:
+            print(f"⚠️ Error detectando idioma: {e}")
+            return _normalize_iso_lang_code(prev_lang or "") or "es"
 
+        self._detect_cache_put(key, result)
+        return result
+
+    def _confidence_for(self, text: str, detected: str) -> Tuple[str, float]:
         raw = (text or "").strip()
         if not raw:
             return detected, 0.0
@@ -578,12 +718,37 @@ class LanguageManager:
 
         return detected, 0.8
 
-    def ensure_language(self, text: str, lang_code: str) -> str:
-        if not text:
-            return text
+    def detect_language_with_confidence(self, text: str, prev_lang: Optional[str] = None) -> Tuple[str, float]:
+        """
+        Detecta idioma reutilizando `detect_language` (incluye fallback LLM) y
+        devuelve una confianza [0,1] basada en langdetect cuando está disponible.
+        """
+        detected = (
+            self.detect_language(text, prev_lang=prev_lang)
+            or _normalize_iso_lang_code(prev_lang or "")
+            or "es"
+        ).strip().lower()
+        return self._confidence_for(text, detected)
 
-        lang_code = _normalize_iso_lang_code(lang_code or "") or "es"
-        prompt = [
+    async def adetect_language_with_confidence(
+        self,
+        text: str,
+        prev_lang: Optional[str] = None,
+    ) -> Tuple[str, float]:
+        """Versión async de `detect_language_with_confidence`."""
+        detected = (
+            await self.adetect_language(text, prev_lang=prev_lang)
+            or _normalize_iso_lang_code(prev_lang or "")
+            or "es"
+        ).strip().lower()
+        return self._confidence_for(text, detected)
+
+    # ==========================================================
+    # 🌐 Reescritura / traducción
+    # ==========================================================
+    @staticmethod
+    def _ensure_language_prompt(text: str, lang_code: str) -> list[dict]:
+        return [
             {
                 "role": "system",
                 "content": (
@@ -602,8 +767,24 @@ class LanguageManager:
             },
         ]
 
+    def ensure_language(self, text: str, lang_code: str) -> str:
+        if not text:
+            return text
+
+        lang_code = _normalize_iso_lang_code(lang_code or "") or "es"
         try:
-            return self.llm.invoke(prompt).content.strip()
+            return self.llm.invoke(self._ensure_language_prompt(text, lang_code)).content.strip()
+        except Exception as e:
+            print(f"⚠️ Error forzando idioma: {e}")
+            return text
+
+    async def aensure_language(self, text: str, lang_code: str) -> str:
+        if not text:
+            return text
+
+        lang_code = _normalize_iso_lang_code(lang_code or "") or "es"
+        try:
+            return (await self.llm.ainvoke(self._ensure_language_prompt(text, lang_code))).content.strip()
         except Exception as e:
             print(f"⚠️ Error forzando idioma: {e}")
             return text
@@ -615,9 +796,16 @@ class LanguageManager:
             return text
         return self.ensure_language(text, lt or "es")
 
-    def short_phrase(self, meaning: str, lang_code: str) -> str:
-        lang_code = (lang_code or "es").lower().strip()
-        prompt = [
+    async def atranslate_if_needed(self, text: str, lang_from: str, lang_to: str) -> str:
+        lf = (lang_from or "").strip().lower()
+        lt = (lang_to or "").strip().lower()
+        if lf and lt and lf == lt:
+            return text
+        return await self.aensure_language(text, lt or "es")
+
+    @staticmethod
+    def _short_phrase_prompt(meaning: str, lang_code: str) -> list[dict]:
+        return [
             {
                 "role": "system",
                 "content": (
@@ -635,25 +823,25 @@ class LanguageManager:
             },
         ]
 
+    def short_phrase(self, meaning: str, lang_code: str) -> str:
+        lang_code = (lang_code or "es").lower().strip()
         try:
-            return self.llm.invoke(prompt).content.strip()
+            return self.llm.invoke(self._short_phrase_prompt(meaning, lang_code)).content.strip()
         except Exception as e:
             print(f"⚠️ Error generando frase corta: {e}")
             return meaning
 
-    def polish_for_guest(self, raw_message: str, guest_lang: str) -> str:
-        """
-        Pulido diplomático:
-        - Mantiene el mismo mensaje base.
-        - Tono profesional, calmado y respetuoso estilo atención hotelera.
-        - Firme si hace falta poner límites.
-        - Nada de regañinas agresivas tipo 'no son formas'.
-        - Sin disculparse en exceso ni humillarse.
-        - Devuelve SOLO el mensaje final en el idioma guest_lang.
-        """
-        guest_lang = (guest_lang or "es").strip().lower()
+    async def ashort_phrase(self, meaning: str, lang_code: str) -> str:
+        lang_code = (lang_code or "es").lower().strip()
+        try:
+            return (await self.llm.ainvoke(self._short_phrase_prompt(meaning, lang_code))).content.strip()
+        except Exception as e:
+            print(f"⚠️ Error generando frase corta: {e}")
+            return meaning
 
-        prompt = [
+    @staticmethod
+    def _polish_prompt(raw_message: str, guest_lang: str) -> list[dict]:
+        return [
             {
                 "role": "system",
                 "content": (
@@ -676,13 +864,33 @@ class LanguageManager:
             },
         ]
 
+    def polish_for_guest(self, raw_message: str, guest_lang: str) -> str:
+        """
+        Pulido diplomático:
+        - Mantiene el mismo mensaje base.
+        - Tono profesional, calmado y respetuoso estilo atención hotelera.
+        - Firme si hace falta poner límites.
+        - Nada de regañinas agresivas tipo 'no son formas'.
+        - Sin disculparse en exceso ni humillarse.
+        - Devuelve SOLO el mensaje final en el idioma guest_lang.
+        """
+        guest_lang = (guest_lang or "es").strip().lower()
         try:
-            return self.llm.invoke(prompt).content.strip()
+            return self.llm.invoke(self._polish_prompt(raw_message, guest_lang)).content.strip()
         except Exception as e:
             print(f"⚠️ Error puliendo respuesta del encargado: {e}")
             # fallback: si algo peta, mandamos el mensaje tal cual
             return raw_message
 
+    async def apolish_for_guest(self, raw_message: str, guest_lang: str) -> str:
+        """Versión async de `polish_for_guest`."""
+        guest_lang = (guest_lang or "es").strip().lower()
+        try:
+            return (await self.llm.ainvoke(self._polish_prompt(raw_message, guest_lang))).content.strip()
+        except Exception as e:
+            print(f"⚠️ Error puliendo respuesta del encargado: {e}")
+            return raw_message
+
 
 # singleton global
 language_manager = LanguageManager()
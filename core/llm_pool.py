@@ -0,0 +1,293 @@
+"""
+🔌 Pool HTTP compartido para clientes LLM
+======================================================================================
+Todos los ChatOpenAI del sistema comparten un único pool de conexiones httpx
+(keep-alive + HTTP/2 cuando está disponible). Cada tier usa su propio cliente
+ligero sobre ese pool para poder medir peticiones, concurrencia y latencia por tier.
+
+- Async: el pool se mantiene por event loop (las conexiones asyncio no pueden
+  reutilizarse entre loops; p.ej. los `_sync_run` de algunos agentes crean loops
+  efímeros). En el loop principal de uvicorn hay, por tanto, un solo pool.
+- Sync: un único `httpx.HTTPTransport` thread-safe para las llamadas `.invoke`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Dict
+
+import httpx
+
+from core.flight_recorder import span
+from core.metrics import record_llm_request
+from core.utils.env import env_bool
+
+log = logging.getLogger("LLMPool")
+
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "30"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+LLM_HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10"))
+LLM_HTTP2_ENABLED = env_bool("LLM_HTTP2_ENABLED", True)
+
+
+def _http2_available() -> bool:
+    if not LLM_HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        log.info("ℹ️ Paquete 'h2' no instalado: el pool LLM usará HTTP/1.1 con keep-alive.")
+        return False
+    return True
+
+
+HTTP2 = _http2_available()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_HTTP_TIMEOUT, connect=LLM_HTTP_CONNECT_TIMEOUT)
+
+
+def _pool_connections(transport: Any) -> Dict[str, int]:
+    """Cuenta conexiones abiertas/ociosas del pool httpcore subyacente."""
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", None) or [])
+    idle = 0
+    for conn in connections:
+        try:
+            if conn.is_idle():
+                idle += 1
+        except Exception:
+            continue
+    return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+# =============================================================
+# 🔁 Transportes compartidos
+# =============================================================
+class _LoopAwareAsyncTransport(httpx.AsyncBaseTransport):
+    """Transporte async que reutiliza un pool por event loop."""
+
+    def __init__(self):
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def _get(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = httpx.AsyncHTTPTransport(limits=_limits(), http2=HTTP2)
+                self._transports[loop] = transport
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._get().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+    def connection_stats(self) -> Dict[str, int]:
+        totals = {"loops": 0, "open": 0, "idle": 0, "active": 0}
+        with self._lock:
+            transports = list(self._transports.values())
+        for transport in transports:
+            stats = _pool_connections(transport)
+            totals["loops"] += 1
+            for key in ("open", "idle", "active"):
+                totals[key] += stats[key]
+        return totals
+
+
+_async_transport = _LoopAwareAsyncTransport()
+_sync_transport = httpx.HTTPTransport(limits=_limits(), http2=HTTP2)
+
+
+# =============================================================
+# 📊 Estadísticas por tier
+# =============================================================
+class _TierStats:
+    def __init__(self, tier: str):
+        self.tier = tier
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self._lock = threading.Lock()
+
+    def started(self) -> float:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def finished(self, started_at: float, ok: bool) -> None:
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        record_llm_request(self.tier, elapsed_ms / 1000, ok)
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.total_latency_ms += elapsed_ms
+            self.max_latency_ms = max(self.max_latency_ms, elapsed_ms)
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = max(self.requests - self.in_flight, 0)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                # Tiempo hasta cabeceras de respuesta (sin incluir lectura del cuerpo).
+                "avg_latency_ms": round(self.total_latency_ms / completed, 2) if completed else 0.0,
+                "max_latency_ms": round(self.max_latency_ms, 2),
+            }
+
+
+class _TierAsyncTransport(httpx.AsyncBaseTransport):
+    """Envuelve el transporte async compartido midiendo las peticiones de un tier."""
+
+    def __init__(self, stats: _TierStats):
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started_at = self.stats.started()
+        ok = False
+        try:
+            with span(f"llm.{self.stats.tier}") as llm_span:
+                response = await _async_transport.handle_async_request(request)
+                ok = response.status_code < 400
+                if llm_span is not None and not ok:
+                    llm_span.status = "error"
+            return response
+        finally:
+            self.stats.finished(started_at, ok)
+
+    async def aclose(self) -> None:
+        # El pool es compartido: no se cierra al cerrar un cliente de tier.
+        return None
+
+
+class _TierSyncTransport(httpx.BaseTransport):
+    """Equivalente sync de _TierAsyncTransport."""
+
+    def __init__(self, stats: _TierStats):
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started_at = self.stats.started()
+        ok = False
+        try:
+            response = _sync_transport.handle_request(request)
+            ok = response.status_code < 400
+            return response
+        finally:
+            self.stats.finished(started_at, ok)
+
+    def close(self) -> None:
+        return None
+
+
+class LLMClientPool:
+    """Registro de clientes httpx por tier sobre los transportes compartidos."""
+
+    def __init__(self):
+        self._stats: Dict[str, _TierStats] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._sync_clients: Dict[str, httpx.Client] = {}
+        self._lock = threading.Lock()
+
+    def _tier_stats(self, tier: str) -> _TierStats:
+        stats = self._stats.get(tier)
+        if stats is None:
+            stats = _TierStats(tier)
+            self._stats[tier] = stats
+        return stats
+
+    def async_client(self, tier: str) -> httpx.AsyncClient:
+        with self._lock:
+            client = self._async_clients.get(tier)
+            if client is None:
+                client = httpx.AsyncClient(
+                    transport=_TierAsyncTransport(self._tier_stats(tier)),
+                    timeout=_timeout(),
+                )
+                self._async_clients[tier] = client
+            return client
+
+    def sync_client(self, tier: str) -> httpx.Client:
+        with self._lock:
+            client = self._sync_clients.get(tier)
+            if client is None:
+                client = httpx.Client(
+                    transport=_TierSyncTransport(self._tier_stats(tier)),
+                    timeout=_timeout(),
+                )
+                self._sync_clients[tier] = client
+            return client
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {tier: stats.snapshot() for tier, stats in self._stats.items()}
+        return {
+            "config": {
+                "max_connections": LLM_POOL_MAX_CONNECTIONS,
+                "max_keepalive_connections": LLM_POOL_MAX_KEEPALIVE,
+                "keepalive_expiry_s": LLM_POOL_KEEPALIVE_EXPIRY,
+                "http2": HTTP2,
+            },
+            "connections": {
+                "async": _async_transport.connection_stats(),
+                "sync": _pool_connections(_sync_transport),
+            },
+            "tiers": tiers,
+        }
+
+    async def aclose(self) -> None:
+        """Cierra el pool del loop actual y el transporte sync (shutdown)."""
+        try:
+            await _async_transport.aclose()
+        except Exception as exc:
+            log.debug("No se pudo cerrar el pool async LLM: %s", exc)
+        try:
+            _sync_transport.close()
+        except Exception as exc:
+            log.debug("No se pudo cerrar el pool sync LLM: %s", exc)
+
+
+llm_client_pool = LLMClientPool()
+
+
+def get_llm_pool_stats() -> Dict[str, Any]:
+    return llm_client_pool.stats()
+
+
+async def shutdown_llm_pool() -> None:
+    await llm_client_pool.aclose()
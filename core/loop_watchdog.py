@@ -0,0 +1,226 @@
+"""
+🐕 Watchdog del event loop
+======================================================================================
+Mide el retraso (lag) del event loop de forma continua y, cuando supera un umbral,
+muestrea la pila del hilo del loop desde un hilo aparte para nombrar la llamada que lo
+está bloqueando (p.ej. `core.db.save_message → ssl.read`).
+
+- Latido async: duerme LOOP_WATCHDOG_INTERVAL_MS y mide cuánto tarda de más en despertar.
+- Hilo monitor: si el último latido es más antiguo que el umbral, captura la pila del
+  hilo del loop (`sys._current_frames`) y acumula la función bloqueante.
+- Al volver el latido se registra el bloqueo (log WARNING + métricas) con su duración real.
+
+Opt-in con LOOP_WATCHDOG_ENABLED=true (se arranca en main.py). Exporta
+`bookai_event_loop_lag_seconds` y `bookai_event_loop_stalls_total{blocker}` en
+`/metrics`, y percentiles en `GET /health/loop`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from pathlib import Path
+from types import FrameType
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS_TOTAL
+from core.utils.env import env_bool
+
+log = logging.getLogger("LoopWatchdog")
+
+LOOP_WATCHDOG_ENABLED = env_bool("LOOP_WATCHDOG_ENABLED", False)
+LOOP_WATCHDOG_INTERVAL_MS = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "100"))
+LOOP_WATCHDOG_THRESHOLD_MS = float(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", "250"))
+LOOP_WATCHDOG_SAMPLE_MS = float(os.getenv("LOOP_WATCHDOG_SAMPLE_MS", "50"))
+LOOP_WATCHDOG_WINDOW = int(os.getenv("LOOP_WATCHDOG_WINDOW", "2048"))
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[1]
+_THIS_FILE = str(Path(__file__).resolve())
+
+
+def _module_name(filename: str) -> Optional[str]:
+    """Nombre de módulo si el fichero es código del proyecto (no librerías instaladas)."""
+    try:
+        path = Path(filename).resolve()
+        relative = path.relative_to(_PROJECT_ROOT)
+    except (ValueError, OSError):
+        return None
+    if "site-packages" in relative.parts or str(path) == _THIS_FILE:
+        return None
+    return ".".join(relative.with_suffix("").parts)
+
+
+def describe_blocker(frame: Optional[FrameType]) -> Tuple[str, str]:
+    """
+    (blocker, stack) para la pila del loop: la función del proyecto más interna que
+    está ejecutando y, si la llamada bloqueante es de una librería, la hoja de la pila.
+    """
+    if frame is None:
+        return "desconocido", ""
+    leaf = frame
+    project_fn = None
+    current: Optional[FrameType] = frame
+    while current is not None:
+        module = _module_name(current.f_code.co_filename)
+        if module:
+            project_fn = f"{module}.{current.f_code.co_name}"
+            break
+        current = current.f_back
+    leaf_is_project = current is leaf
+    leaf_name = f"{Path(leaf.f_code.co_filename).stem}.{leaf.f_code.co_name}"
+    if project_fn is None:
+        blocker = leaf_name
+    elif leaf_is_project:
+        blocker = project_fn
+    else:
+        blocker = f"{project_fn} → {leaf_name}"
+    stack = "".join(traceback.format_stack(frame, limit=15))
+    return blocker, stack
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoopWatchdog:
+    """Latido en el loop + hilo monitor que muestrea la pila cuando el loop se bloquea."""
+
+    def __init__(
+        self,
+        interval_ms: float = LOOP_WATCHDOG_INTERVAL_MS,
+        threshold_ms: float = LOOP_WATCHDOG_THRESHOLD_MS,
+        sample_ms: float = LOOP_WATCHDOG_SAMPLE_MS,
+        window: int = LOOP_WATCHDOG_WINDOW,
+    ):
+        self.interval = max(0.001, interval_ms / 1000)
+        self.threshold = max(0.001, threshold_ms / 1000)
+        self.sample = max(0.001, sample_ms / 1000)
+        self._lags: "deque[float]" = deque(maxlen=max(16, window))
+        self._lock = threading.Lock()
+        self._beat = time.perf_counter()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stall_samples: Counter = Counter()
+        self._stall_stack = ""
+        self._blockers: Counter = Counter()
+        self._stalls = 0
+        self._last_stall: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        log.info(
+            "🐕 Watchdog del event loop activo (intervalo=%.0f ms, umbral=%.0f ms)",
+            self.interval * 1000,
+            self.threshold * 1000,
+        )
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    # ------------------------------------------------------------------
+    # Latido (event loop)
+    # ------------------------------------------------------------------
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            self._beat = now
+            self._record_lag(lag)
+
+    def _record_lag(self, lag: float) -> None:
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        with self._lock:
+            self._lags.append(lag)
+            if lag < self.threshold:
+                self._stall_samples.clear()
+                self._stall_stack = ""
+                return
+            samples = self._stall_samples.most_common()
+            stack = self._stall_stack
+            self._stall_samples.clear()
+            self._stall_stack = ""
+            blocker = samples[0][0] if samples else "desconocido"
+            self._stalls += 1
+            self._blockers[blocker] += 1
+            self._last_stall = {
+                "lag_ms": round(lag * 1000, 1),
+                "blocker": blocker,
+                "samples": dict(samples),
+                "at": time.time(),
+            }
+        EVENT_LOOP_STALLS_TOTAL.inc(blocker=blocker)
+        log.warning("🐢 Event loop bloqueado %.0f ms en %s", lag * 1000, blocker)
+        if stack:
+            log.debug("Pila del bloqueo (%s):\n%s", blocker, stack)
+
+    # ------------------------------------------------------------------
+    # Monitor (hilo aparte)
+    # ------------------------------------------------------------------
+    def _monitor(self) -> None:
+        while not self._stop.wait(self.sample):
+            if time.perf_counter() - self._beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            blocker, stack = describe_blocker(frame)
+            del frame
+            with self._lock:
+                self._stall_samples[blocker] += 1
+                if not self._stall_stack:
+                    self._stall_stack = stack
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._lags)
+            top = self._blockers.most_common(10)
+            return {
+                "enabled": self.running,
+                "interval_ms": self.interval * 1000,
+                "threshold_ms": self.threshold * 1000,
+                "samples": len(ordered),
+                "lag_ms": {
+                    "p50": round(_percentile(ordered, 0.50) * 1000, 2),
+                    "p95": round(_percentile(ordered, 0.95) * 1000, 2),
+                    "p99": round(_percentile(ordered, 0.99) * 1000, 2),
+                    "max": round((ordered[-1] if ordered else 0.0) * 1000, 2),
+                },
+                "stalls": self._stalls,
+                "top_blockers": [{"blocker": name, "stalls": count} for name, count in top],
+                "last_stall": self._last_stall,
+            }
+
+
+loop_watchdog = LoopWatchdog()
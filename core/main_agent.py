@@ -8,10 +8,11 @@
 
 import logging
 import asyncio
+import threading
 import unicodedata
 import re
 import json
-from typing import Optional, List, Callable
+from typing import Any, Dict, Optional, List, Callable, Tuple
 
 from langchain.agents import create_openai_tools_agent, AgentExecutor
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
@@ -34,7 +35,11 @@ from core.utils.utils_prompt import load_prompt
 from core.utils.time_context import get_time_context
 from core.utils.dynamic_context import build_dynamic_context_from_memory
 from core.memory_manager import MemoryManager
+from core.ttl_cache import TTLCache
+from core.agent_context import bind_turn
 from core.config import ModelConfig, ModelTier
+from core.flight_recorder import span
+from core.context_prefetch import current_snapshot
 from core.instance_context import (
     DEFAULT_PROPERTY_TABLE,
     fetch_property_by_id,
@@ -62,10 +67,13 @@ class MainAgent:
         self.memory_manager = memory_manager
         self.send_callback = send_message_callback
         self.interno_agent = interno_agent
-        self.locks = {}
+        # Un lock por chat; los inactivos (y no tomados) se expulsan solos.
+        self.locks: TTLCache = TTLCache("main_agent_locks", can_evict=lambda _chat, lock: not lock.locked())
 
-        base_prompt = load_prompt("main_prompt.txt") or self._get_default_prompt()
-        self.system_prompt = f"{get_time_context()}\n\n{base_prompt.strip()}"
+        # Grafo estático (sub-agentes, tools, AgentExecutor): se construye una vez
+        # y se reutiliza entre chats; el estado por chat va en core.agent_context.
+        self._sub_agents: Optional[Dict[str, Any]] = None
+        self._graph: Optional[Tuple[List[BaseTool], AgentExecutor]] = None
 
         log.info("✅ MainAgent inicializado (GPT-4.1 + arquitectura modular + flags persistentes)")
 
@@ -83,14 +91,28 @@ class MainAgent:
             "NO generes respuestas por tu cuenta. SOLO invoca tools."
         )
 
-    def build_tools(self, chat_id: str, hotel_name: str) -> List[BaseTool]:
+    def _get_sub_agents(self) -> Dict[str, Any]:
+        if self._sub_agents is None:
+            self._sub_agents = {
+                "disponibilidad_precios": DispoPreciosAgent(memory_manager=self.memory_manager),
+                "base_conocimientos": InfoAgent(memory_manager=self.memory_manager),
+                "onboarding_reservas": OnboardingAgent(memory_manager=self.memory_manager),
+            }
+        return self._sub_agents
+
+    def build_tools(self, chat_id: str = "", hotel_name: str = "") -> List[BaseTool]:
+        """
+        Construye las tools del agente.
+        Con chat_id/hotel_name vacíos las tools leen el chat del turno enlazado
+        (core.agent_context), por lo que pueden compartirse entre conversaciones.
+        """
         tools: List[BaseTool] = []
+        sub_agents = self._get_sub_agents()
 
         tools.append(create_think_tool(model_name="gpt-4.1"))
         tools.append(create_inciso_tool(send_callback=self.send_callback))
         tools.append(create_property_context_tool(memory_manager=self.memory_manager, chat_id=chat_id))
 
-        dispo_agent = DispoPreciosAgent(memory_manager=self.memory_manager)
         tools.append(
             create_sub_agent_tool(
                 name="disponibilidad_precios",
@@ -98,14 +120,13 @@ class MainAgent:
                     "Consulta disponibilidad, tipos de habitaciones y precios. "
                     "Úsala para fechas, tarifas y tipos de habitación."
                 ),
-                sub_agent=dispo_agent,
+                sub_agent=sub_agents["disponibilidad_precios"],
                 memory_manager=self.memory_manager,
                 chat_id=chat_id,
                 hotel_name=hotel_name,
             )
         )
 
-        info_agent = InfoAgent(memory_manager=self.memory_manager)
         tools.append(
             create_sub_agent_tool(
                 name="base_conocimientos",
@@ -113,14 +134,13 @@ class MainAgent:
                     "Busca información factual del hotel. Intenta primero la base de conocimientos y, "
                     "si no hay datos, recurre a Google antes de escalar."
                 ),
-                sub_agent=info_agent,
+                sub_agent=sub_agents["base_conocimientos"],
                 memory_manager=self.memory_manager,
                 chat_id=chat_id,
                 hotel_name=hotel_name,
             )
         )
 
-        onboarding_agent = OnboardingAgent(memory_manager=self.memory_manager)
         tools.append(
             create_sub_agent_tool(
                 name="onboarding_reservas",
@@ -129,7 +149,7 @@ class MainAgent:
                     "y consulta reservas propias del huésped. Úsala cuando el huésped quiera confirmar "
                     "una reserva con datos concretos o revisar su reserva."
                 ),
-                sub_agent=onboarding_agent,
+                sub_agent=sub_agents["onboarding_reservas"],
                 memory_manager=self.memory_manager,
                 chat_id=chat_id,
                 hotel_name=hotel_name,
@@ -151,17 +171,45 @@ class MainAgent:
                 )
             )
 
-        log.info("🔧 Tools cargadas para %s: %s", chat_id, [t.name for t in tools])
+        log.info("🔧 Tools cargadas para %s: %s", chat_id or "(turno enlazado)", [t.name for t in tools])
         return tools
 
     def create_prompt_template(self) -> ChatPromptTemplate:
+        # El system prompt entra como variable: cambia en cada turno sin reconstruir el grafo.
         return ChatPromptTemplate.from_messages([
-            ("system", self.system_prompt),
+            ("system", "{system_prompt}"),
             MessagesPlaceholder(variable_name="chat_history", optional=True),
             ("human", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ])
 
+    @staticmethod
+    def _literal_system_prompt(text: str) -> str:
+        # Antes el prompt se usaba como plantilla: "{{ $now }}" llegaba al LLM como "{ $now }".
+        return (text or "").replace("{{", "{").replace("}}", "}")
+
+    def _get_executor(self) -> Tuple[List[BaseTool], AgentExecutor]:
+        """Devuelve (tools, executor) compartidos; se construyen en la primera llamada."""
+        if self._graph is None:
+            tools = self.build_tools()
+            chain_agent = create_openai_tools_agent(
+                llm=self.llm,
+                tools=tools,
+                prompt=self.create_prompt_template(),
+            )
+            executor = AgentExecutor(
+                agent=chain_agent,
+                tools=tools,
+                verbose=True,
+                max_iterations=25,
+                return_intermediate_steps=True,
+                max_execution_time=90,
+                handle_parsing_errors=True,
+            )
+            self._graph = (tools, executor)
+            log.info("🧱 Grafo del MainAgent construido (se reutiliza entre mensajes)")
+        return self._graph
+
     async def _handle_pending_confirmation(self, chat_id: str, user_input: str) -> Optional[str]:
         if not self.memory_manager:
             return None
@@ -199,7 +247,7 @@ class MainAgent:
                     else "Si quieres que lo consulte luego, solo dímelo."
                 )
             )
-            return self._localize(chat_id, text)
+            return await self._localize(chat_id, text)
 
         reply = self._generate_reply(chat_id=chat_id, intent="escalation_confirm")
         text = reply or (
@@ -207,7 +255,7 @@ class MainAgent:
             if self._uses_formal_tone(chat_id)
             else "Solo para confirmar: ¿quieres que lo consulte? Responde con 'sí' o 'no'."
         )
-        return self._localize(chat_id, text)
+        return await self._localize(chat_id, text)
 
     def _interpret_confirmation(self, text: str) -> Optional[bool]:
         t = (text or "").strip().lower()
@@ -240,7 +288,7 @@ class MainAgent:
         except Exception:
             return None
 
-    def _request_escalation_confirmation(self, chat_id: str, user_input: str, motivo: str) -> str:
+    async def _request_escalation_confirmation(self, chat_id: str, user_input: str, motivo: str) -> str:
         self.memory_manager.set_flag(
             chat_id,
             FLAG_ESCALATION_CONFIRMATION_PENDING,
@@ -259,7 +307,7 @@ class MainAgent:
                 else "¿Quieres que lo consulte? Responde con 'sí' o 'no'."
             )
         )
-        return self._localize(chat_id, text)
+        return await self._localize(chat_id, text)
 
     def _should_attach_to_pending_escalation(self, chat_id: str, user_input: str) -> bool:
         text = (user_input or "").strip()
@@ -420,14 +468,13 @@ class MainAgent:
 
         return (guest_msgs or fallback_user_msgs)[-limit:]
 
-    def _get_guest_lang(self, chat_id: str, user_input: Optional[str] = None) -> str:
+    def _cached_guest_lang(self, chat_id: str, user_input: Optional[str]) -> Optional[str]:
+        """Devuelve el idioma ya resuelto si no hace falta volver a consultar al router."""
         if not self.memory_manager or not chat_id:
             return "es"
         prev = self.memory_manager.get_flag(chat_id, "guest_lang")
-        if user_input is None:
-            return (prev or "es").strip().lower() or "es"
         current_input = str(user_input or "").strip()
-        if not current_input:
+        if user_input is None or not current_input:
             return (prev or "es").strip().lower() or "es"
 
         last_resolved_message = self.memory_manager.get_flag(chat_id, "guest_lang_last_message")
@@ -438,43 +485,74 @@ class MainAgent:
             and prev.strip()
         ):
             return prev.strip().lower()
+        return None
+
+    def _store_guest_lang(self, chat_id: str, user_input: str, resolved_lang: str, resolved_confidence: float) -> str:
+        prev = self.memory_manager.get_flag(chat_id, "guest_lang")
+        if resolved_lang:
+            self.memory_manager.set_flag(chat_id, "guest_lang", resolved_lang)
+            self.memory_manager.set_flag(chat_id, "guest_lang_confidence", resolved_confidence)
+            self.memory_manager.set_flag(chat_id, "guest_lang_last_message", str(user_input or "").strip())
+            return resolved_lang
+        return (prev or "es").strip().lower() or "es"
+
+    def _get_guest_lang(self, chat_id: str, user_input: Optional[str] = None) -> str:
+        cached = self._cached_guest_lang(chat_id, user_input)
+        if cached:
+            return cached
 
+        prev = self.memory_manager.get_flag(chat_id, "guest_lang")
         prev_confidence = self.memory_manager.get_flag(chat_id, "guest_lang_confidence")
         resolved_lang, resolved_confidence = language_manager.resolve_response_language(
-            latest_guest_message=current_input,
+            latest_guest_message=str(user_input or "").strip(),
             recent_guest_messages=self._recent_guest_messages(chat_id),
             guest_language_hint=prev,
             guest_language_confidence=prev_confidence,
             last_resolved_language=prev,
         )
-        if resolved_lang:
-            self.memory_manager.set_flag(chat_id, "guest_lang", resolved_lang)
-            self.memory_manager.set_flag(chat_id, "guest_lang_confidence", resolved_confidence)
-            self.memory_manager.set_flag(chat_id, "guest_lang_last_message", current_input)
-            return resolved_lang
-        return (prev or "es").strip().lower() or "es"
+        return self._store_guest_lang(chat_id, user_input, resolved_lang, resolved_confidence)
+
+    async def _aget_guest_lang(self, chat_id: str, user_input: Optional[str] = None) -> str:
+        cached = self._cached_guest_lang(chat_id, user_input)
+        if cached:
+            return cached
+
+        prev = self.memory_manager.get_flag(chat_id, "guest_lang")
+        prev_confidence = self.memory_manager.get_flag(chat_id, "guest_lang_confidence")
+        resolved_lang, resolved_confidence = await language_manager.aresolve_response_language(
+            latest_guest_message=str(user_input or "").strip(),
+            recent_guest_messages=self._recent_guest_messages(chat_id),
+            guest_language_hint=prev,
+            guest_language_confidence=prev_confidence,
+            last_resolved_language=prev,
+        )
+        return self._store_guest_lang(chat_id, user_input, resolved_lang, resolved_confidence)
 
-    def _localize(self, chat_id: str, text: str) -> str:
+    async def _localize(self, chat_id: str, text: str) -> str:
         lang = self._get_guest_lang(chat_id)
         if not text or lang == "es":
             return text
-        return language_manager.ensure_language(text, lang)
+        return await language_manager.aensure_language(text, lang)
 
-    def _get_intent_text_es(self, chat_id: Optional[str], text: str) -> str:
+    async def _get_intent_text_es(self, chat_id: Optional[str], text: str) -> str:
         raw = (text or "").strip()
         if not raw:
             return ""
         if not self.memory_manager or not chat_id:
-            lang = language_manager.detect_language(raw, prev_lang=None)
+            lang = await language_manager.adetect_language(raw, prev_lang=None)
             if lang and lang != "es":
-                return language_manager.translate_if_needed(raw, lang, "es")
+                return await language_manager.atranslate_if_needed(raw, lang, "es")
             return raw
         cache = self.memory_manager.get_flag(chat_id, "intent_text_es")
         if isinstance(cache, dict) and cache.get("src") == raw and cache.get("text"):
             return cache.get("text")
         prev_lang = self.memory_manager.get_flag(chat_id, "guest_lang")
-        lang = language_manager.detect_language(raw, prev_lang=prev_lang)
-        translated = language_manager.translate_if_needed(raw, lang, "es") if lang and lang != "es" else raw
+        lang = await language_manager.adetect_language(raw, prev_lang=prev_lang)
+        translated = (
+            await language_manager.atranslate_if_needed(raw, lang, "es")
+            if lang and lang != "es"
+            else raw
+        )
         self.memory_manager.set_flag(chat_id, "intent_text_es", {"src": raw, "text": translated, "lang": lang})
         return translated
 
@@ -486,10 +564,13 @@ class MainAgent:
                 self.memory_manager.get_flag(chat_id, "instance_id")
                 or self.memory_manager.get_flag(chat_id, "instance_hotel_code")
             )
-            reservation = get_active_chat_reservation(
-                chat_id=chat_id,
-                instance_id=instance_id,
-            )
+            snapshot = current_snapshot(chat_id)
+            prefetched, reservation = snapshot.reservation_for(instance_id) if snapshot else (False, None)
+            if not prefetched:
+                reservation = get_active_chat_reservation(
+                    chat_id=chat_id,
+                    instance_id=instance_id,
+                )
         except Exception:
             return False
         if not reservation:
@@ -619,8 +700,8 @@ class MainAgent:
         else:
             self.memory_manager.clear_flag(chat_id, "tone")
 
-    def _is_new_reservation_intent(self, text: str, chat_id: Optional[str] = None) -> bool:
-        t = self._normalize_text(self._get_intent_text_es(chat_id, text))
+    async def _is_new_reservation_intent(self, text: str, chat_id: Optional[str] = None) -> bool:
+        t = self._normalize_text(await self._get_intent_text_es(chat_id, text))
         if not t:
             return False
         triggers = [
@@ -691,7 +772,7 @@ class MainAgent:
         except Exception:
             return False
 
-    def _should_require_availability_before_onboarding(
+    async def _should_require_availability_before_onboarding(
         self,
         chat_id: str,
         user_input: str,
@@ -706,7 +787,7 @@ class MainAgent:
         if not intermediate_steps:
             return False
         # Solo aplica a intención de NUEVA reserva, no a consultas de reservas existentes.
-        if not self._is_new_reservation_intent(user_input, chat_id):
+        if not await self._is_new_reservation_intent(user_input, chat_id):
             return False
 
         used_onboarding = False
@@ -728,7 +809,7 @@ class MainAgent:
         try:
             history_text = ""
             if self.memory_manager and chat_id:
-                recent = self.memory_manager.get_memory(chat_id, limit=10) or []
+                recent = await self.memory_manager.aget_memory(chat_id, limit=10) or []
                 lines = []
                 for msg in recent:
                     role = str((msg or {}).get("role") or "")
@@ -752,7 +833,7 @@ class MainAgent:
                 f"Historial reciente:\n{history_text}\n\n"
                 "Etiqueta:"
             )
-            raw = llm.invoke(
+            raw = await llm.ainvoke(
                 [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt},
@@ -815,218 +896,286 @@ class MainAgent:
         chat_id: str,
         hotel_name: str = "Hotel",
         chat_history: Optional[List] = None,
+        send_callback: Optional[Callable] = None,
     ) -> str:
 
         if not self.memory_manager:
             raise RuntimeError("MemoryManager no configurado en MainAgent")
 
-        if chat_id not in self.locks:
-            self.locks[chat_id] = asyncio.Lock()
+        lock = self.locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[chat_id] = lock
 
-        async with self.locks[chat_id]:
+        send_callback = send_callback or self.send_callback
+        async with lock:
+            with bind_turn(chat_id, hotel_name=hotel_name, send_callback=send_callback):
+                return await self._ainvoke_turn(
+                    user_input=user_input,
+                    chat_id=chat_id,
+                    chat_history=chat_history,
+                    send_callback=send_callback,
+                )
 
-            try:
-                self._get_guest_lang(chat_id, user_input)
-                if self.memory_manager.get_flag(chat_id, "escalation_in_progress"):
-                    if self._should_attach_to_pending_escalation(chat_id, user_input):
-                        candidate = (user_input or "").strip()
-                        last_forwarded = (
-                            self.memory_manager.get_flag(chat_id, "last_escalation_followup_message")
-                            if self.memory_manager
-                            else None
-                        )
-                        if candidate and candidate != str(last_forwarded or "").strip():
-                            await self._delegate_escalation_to_interno(
-                                user_input=candidate,
-                                chat_id=chat_id,
-                                motivo="Ampliación del huésped mientras la escalación está en curso",
-                                escalation_type="info_not_found",
-                                context="Escalación en progreso: incorporar esta nueva petición al hilo pendiente",
-                            )
-                            self.memory_manager.set_flag(
-                                chat_id,
-                                "last_escalation_followup_message",
-                                candidate,
-                            )
-                        return self._localize(chat_id, "Un momento, sigo consultándolo.")
-
-                pending = await self._handle_pending_confirmation(chat_id, user_input)
-                if pending is not None:
-                    self.memory_manager.save(chat_id, "user", user_input)
-                    self.memory_manager.save(chat_id, "assistant", pending)
-                    return pending
-
-                if (
-                    not self._is_new_reservation_intent(user_input, chat_id)
-                    and not self._has_real_property_context(chat_id)
-                ):
-                    self._hydrate_context_from_active_reservation(chat_id)
-
-                if not self._has_real_property_context(chat_id):
-                    await self._resolve_property_from_message(chat_id, user_input)
-
-                base_prompt = load_prompt("main_prompt.txt") or self._get_default_prompt()
-                dynamic_context = build_dynamic_context_from_memory(self.memory_manager, chat_id)
-                if dynamic_context:
-                    self.system_prompt = (
-                        f"{get_time_context()}\n\n{base_prompt.strip()}\n\n{dynamic_context}"
+    async def _ainvoke_turn(
+        self,
+        user_input: str,
+        chat_id: str,
+        chat_history: Optional[List],
+        send_callback: Optional[Callable],
+    ) -> str:
+        try:
+            await self._aget_guest_lang(chat_id, user_input)
+            if self.memory_manager.get_flag(chat_id, "escalation_in_progress"):
+                if self._should_attach_to_pending_escalation(chat_id, user_input):
+                    candidate = (user_input or "").strip()
+                    last_forwarded = (
+                        self.memory_manager.get_flag(chat_id, "last_escalation_followup_message")
+                        if self.memory_manager
+                        else None
                     )
-                else:
-                    self.system_prompt = f"{get_time_context()}\n\n{base_prompt.strip()}"
+                    if candidate and candidate != str(last_forwarded or "").strip():
+                        await self._delegate_escalation_to_interno(
+                            user_input=candidate,
+                            chat_id=chat_id,
+                            motivo="Ampliación del huésped mientras la escalación está en curso",
+                            escalation_type="info_not_found",
+                            context="Escalación en progreso: incorporar esta nueva petición al hilo pendiente",
+                        )
+                        self.memory_manager.set_flag(
+                            chat_id,
+                            "last_escalation_followup_message",
+                            candidate,
+                        )
+                    return await self._localize(chat_id, "Un momento, sigo consultándolo.")
+
+            pending = await self._handle_pending_confirmation(chat_id, user_input)
+            if pending is not None:
+                await self.memory_manager.asave(chat_id, "user", user_input)
+                await self.memory_manager.asave(chat_id, "assistant", pending)
+                return pending
+
+            if (
+                not await self._is_new_reservation_intent(user_input, chat_id)
+                and not self._has_real_property_context(chat_id)
+            ):
+                self._hydrate_context_from_active_reservation(chat_id)
+
+            if not self._has_real_property_context(chat_id):
+                await self._resolve_property_from_message(chat_id, user_input)
+
+            base_prompt = load_prompt("main_prompt.txt") or self._get_default_prompt()
+            dynamic_context = build_dynamic_context_from_memory(self.memory_manager, chat_id)
+            if dynamic_context:
+                system_prompt = (
+                    f"{get_time_context()}\n\n{base_prompt.strip()}\n\n{dynamic_context}"
+                )
+            else:
+                system_prompt = f"{get_time_context()}\n\n{base_prompt.strip()}"
 
-                if chat_history is None:
-                    chat_history = self.memory_manager.get_memory_as_messages(chat_id, limit=30)
-                chat_history = chat_history or []
+            if chat_history is None:
+                chat_history = await self.memory_manager.aget_memory_as_messages(chat_id, limit=30)
+            chat_history = chat_history or []
 
-                tools = self.build_tools(chat_id, hotel_name)
-                prompt_template = self.create_prompt_template()
+            tools, executor = self._get_executor()
 
-                chain_agent = create_openai_tools_agent(
-                    llm=self.llm,
-                    tools=tools,
-                    prompt=prompt_template,
-                )
+            inciso_flag = self.memory_manager.get_flag(chat_id, "inciso_enviado")
+            consulta_flag = self.memory_manager.get_flag(chat_id, "consulta_base_realizada")
 
-                executor = AgentExecutor(
-                    agent=chain_agent,
-                    tools=tools,
-                    verbose=True,
-                    max_iterations=25,
-                    return_intermediate_steps=True,
-                    max_execution_time=90,
-                    handle_parsing_errors=True,
+            if consulta_flag and not self.memory_manager.get_flag(chat_id, FLAG_ESCALATION_CONFIRMATION_PENDING):
+                return await self._request_escalation_confirmation(
+                    chat_id,
+                    user_input,
+                    motivo="Consulta repetida sin información",
                 )
 
-                inciso_flag = self.memory_manager.get_flag(chat_id, "inciso_enviado")
-                consulta_flag = self.memory_manager.get_flag(chat_id, "consulta_base_realizada")
-
-                if consulta_flag and not self.memory_manager.get_flag(chat_id, FLAG_ESCALATION_CONFIRMATION_PENDING):
-                    return self._request_escalation_confirmation(
-                        chat_id,
-                        user_input,
-                        motivo="Consulta repetida sin información",
-                    )
-
+            with span("main_agent.executor"):
                 result = await executor.ainvoke(
-                    input={"input": user_input, "chat_history": chat_history},
+                    input={
+                        "input": user_input,
+                        "chat_history": chat_history,
+                        "system_prompt": self._literal_system_prompt(system_prompt),
+                    },
                     config={"callbacks": []},
                 )
 
-                response = (result.get("output") or "").strip()
-                intermediate_steps = result.get("intermediate_steps") or []
+            response = (result.get("output") or "").strip()
+            intermediate_steps = result.get("intermediate_steps") or []
 
-                if self._should_require_availability_before_onboarding(
-                    chat_id=chat_id,
-                    user_input=user_input,
-                    intermediate_steps=intermediate_steps,
-                ):
-                    dispo_tool = next(
-                        (t for t in tools if getattr(t, "name", "") == "disponibilidad_precios"),
-                        None,
-                    )
-                    if dispo_tool is not None:
-                        try:
-                            forced_dispo = await dispo_tool.ainvoke(
-                                {"query": user_input, "pregunta": user_input}
-                            )
-                            forced_text = (forced_dispo or "").strip()
-                            if forced_text:
-                                response = forced_text
-                        except Exception as exc:
-                            log.warning(
-                                "No se pudo redirigir de onboarding a disponibilidad: %s",
-                                exc,
-                            )
-
-                if self._should_force_kb_when_no_tools(
-                    chat_id=chat_id,
-                    user_input=user_input,
-                    response=response,
-                    intermediate_steps=intermediate_steps,
-                ):
-                    kb_tool = next((t for t in tools if getattr(t, "name", "") == "base_conocimientos"), None)
-                    if kb_tool is not None:
-                        try:
-                            forced = await kb_tool.ainvoke({"query": user_input, "pregunta": user_input})
-                            forced_text = (forced or "").strip()
-                            if forced_text and forced_text.upper() != "ESCALATION_REQUIRED":
-                                response = forced_text
-                        except Exception as exc:
-                            log.warning("No se pudo forzar llamada a base_conocimientos: %s", exc)
-
-                if (
-                    not response
-                    or "no hay información disponible" in response.lower()
-                    or response.upper() == "ESCALATION_REQUIRED"
-                ):
-                    self.memory_manager.set_flag(chat_id, "consulta_base_realizada", True)
-
-                    if not inciso_flag and self.send_callback:
-                        wait_msg = self._generate_reply(chat_id=chat_id, intent="inciso_wait") or (
-                            "Un momento, estoy revisando internamente cómo ayudarle mejor."
-                            if self._uses_formal_tone(chat_id)
-                            else "Dame un momento, estoy revisando internamente cómo ayudarte mejor."
+            if await self._should_require_availability_before_onboarding(
+                chat_id=chat_id,
+                user_input=user_input,
+                intermediate_steps=intermediate_steps,
+            ):
+                dispo_tool = next(
+                    (t for t in tools if getattr(t, "name", "") == "disponibilidad_precios"),
+                    None,
+                )
+                if dispo_tool is not None:
+                    try:
+                        forced_dispo = await dispo_tool.ainvoke(
+                            {"query": user_input, "pregunta": user_input}
+                        )
+                        forced_text = (forced_dispo or "").strip()
+                        if forced_text:
+                            response = forced_text
+                    except Exception as exc:
+                        log.warning(
+                            "No se pudo redirigir de onboarding a disponibilidad: %s",
+                            exc,
                         )
-                        await self.send_callback(wait_msg)
-                        self.memory_manager.set_flag(chat_id, "inciso_enviado", True)
 
-                    return self._request_escalation_confirmation(
-                        chat_id,
-                        user_input,
-                        motivo="Sin resultados en knowledge_base",
+            if self._should_force_kb_when_no_tools(
+                chat_id=chat_id,
+                user_input=user_input,
+                response=response,
+                intermediate_steps=intermediate_steps,
+            ):
+                kb_tool = next((t for t in tools if getattr(t, "name", "") == "base_conocimientos"), None)
+                if kb_tool is not None:
+                    try:
+                        forced = await kb_tool.ainvoke({"query": user_input, "pregunta": user_input})
+                        forced_text = (forced or "").strip()
+                        if forced_text and forced_text.upper() != "ESCALATION_REQUIRED":
+                            response = forced_text
+                    except Exception as exc:
+                        log.warning("No se pudo forzar llamada a base_conocimientos: %s", exc)
+
+            if (
+                not response
+                or "no hay información disponible" in response.lower()
+                or response.upper() == "ESCALATION_REQUIRED"
+            ):
+                self.memory_manager.set_flag(chat_id, "consulta_base_realizada", True)
+
+                if not inciso_flag and send_callback:
+                    wait_msg = self._generate_reply(chat_id=chat_id, intent="inciso_wait") or (
+                        "Un momento, estoy revisando internamente cómo ayudarle mejor."
+                        if self._uses_formal_tone(chat_id)
+                        else "Dame un momento, estoy revisando internamente cómo ayudarte mejor."
                     )
+                    await send_callback(wait_msg)
+                    self.memory_manager.set_flag(chat_id, "inciso_enviado", True)
+
+                return await self._request_escalation_confirmation(
+                    chat_id,
+                    user_input,
+                    motivo="Sin resultados en knowledge_base",
+                )
 
-                self.memory_manager.save(chat_id, "user", user_input)
-                final_response = self._localize(chat_id, response)
-                self.memory_manager.save(chat_id, "assistant", final_response)
+            await self.memory_manager.asave(chat_id, "user", user_input)
+            final_response = await self._localize(chat_id, response)
+            await self.memory_manager.asave(chat_id, "assistant", final_response)
 
-                self.memory_manager.clear_flag(chat_id, "inciso_enviado")
-                self.memory_manager.clear_flag(chat_id, "consulta_base_realizada")
+            self.memory_manager.clear_flag(chat_id, "inciso_enviado")
+            self.memory_manager.clear_flag(chat_id, "consulta_base_realizada")
 
-                return final_response
+            return final_response
 
-            except Exception as e:
-                log.error(f"❌ Error en MainAgent ({chat_id}): {e}", exc_info=True)
+        except Exception as e:
+            log.error(f"❌ Error en MainAgent ({chat_id}): {e}", exc_info=True)
 
-                await self._delegate_escalation_to_interno(
-                    user_input=user_input,
-                    chat_id=chat_id,
-                    motivo=str(e),
-                    escalation_type="error",
-                    context="Escalación por excepción en MainAgent",
+            await self._delegate_escalation_to_interno(
+                user_input=user_input,
+                chat_id=chat_id,
+                motivo=str(e),
+                escalation_type="error",
+                context="Escalación por excepción en MainAgent",
+            )
+            fallback_msg = await self._localize(
+                chat_id,
+                (
+                    "Ha ocurrido un problema interno y ya lo estoy revisando. "
+                    "Le aviso en breve."
                 )
-                fallback_msg = self._localize(
-                    chat_id,
-                    (
-                        "Ha ocurrido un problema interno y ya lo estoy revisando. "
-                        "Le aviso en breve."
-                    )
-                    if self._uses_formal_tone(chat_id)
-                    else (
-                        "Ha ocurrido un problema interno y ya lo estoy revisando. "
-                        "Te aviso en breve."
-                    )
+                if self._uses_formal_tone(chat_id)
+                else (
+                    "Ha ocurrido un problema interno y ya lo estoy revisando. "
+                    "Te aviso en breve."
                 )
+            )
+
+            # Guarda el intercambio aunque haya error para no perder contexto
+            try:
+                if self.memory_manager:
+                    await self.memory_manager.asave(chat_id, "user", user_input)
+                    await self.memory_manager.asave(chat_id, "assistant", fallback_msg)
+            except Exception:
+                log.debug("No se pudo guardar en memoria tras excepción", exc_info=True)
+
+            # Mensaje determinista → evita duplicados por variaciones aleatorias
+            return fallback_msg
+
+
+# =====================================================================
+# 🏭 Factoría de MainAgent (grafo reutilizable por proceso)
+# =====================================================================
+class BoundMainAgent:
+    """Vista ligera de un MainAgent compartido con el callback de envío de un chat."""
+
+    __slots__ = ("agent", "send_callback")
+
+    def __init__(self, agent: MainAgent, send_callback: Optional[Callable] = None):
+        self.agent = agent
+        self.send_callback = send_callback
+
+    async def ainvoke(
+        self,
+        user_input: str,
+        chat_id: str,
+        hotel_name: str = "Hotel",
+        chat_history: Optional[List] = None,
+    ) -> str:
+        return await self.agent.ainvoke(
+            user_input=user_input,
+            chat_id=chat_id,
+            hotel_name=hotel_name,
+            chat_history=chat_history,
+            send_callback=self.send_callback,
+        )
+
+    def __getattr__(self, name: str):
+        return getattr(self.agent, name)
+
+
+class MainAgentFactory:
+    """
+    Mantiene un MainAgent por (memory_manager, interno_agent).
+    El prompt principal se recarga en cada turno como variable, así que no
+    hace falta reconstruir el grafo; `invalidate()` fuerza la reconstrucción.
+    """
+
+    def __init__(self):
+        self._agents: Dict[Tuple[int, int], Tuple[Any, Any, MainAgent]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        memory_manager: Optional[MemoryManager] = None,
+        interno_agent: Optional[InternoAgent] = None,
+    ) -> MainAgent:
+        key = (id(memory_manager), id(interno_agent))
+        with self._lock:
+            entry = self._agents.get(key)
+            if entry is None:
+                agent = MainAgent(memory_manager=memory_manager, interno_agent=interno_agent)
+                # Guardamos las referencias para que los id() no se reutilicen.
+                entry = (memory_manager, interno_agent, agent)
+                self._agents[key] = entry
+            return entry[2]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._agents.clear()
 
-                # Guarda el intercambio aunque haya error para no perder contexto
-                try:
-                    if self.memory_manager:
-                        self.memory_manager.save(chat_id, "user", user_input)
-                        self.memory_manager.save(chat_id, "assistant", fallback_msg)
-                except Exception:
-                    log.debug("No se pudo guardar en memoria tras excepción", exc_info=True)
 
-                # Mensaje determinista → evita duplicados por variaciones aleatorias
-                return fallback_msg
+main_agent_factory = MainAgentFactory()
 
 
 def create_main_agent(
     memory_manager: Optional[MemoryManager] = None,
     send_callback: Optional[Callable] = None,
     interno_agent: Optional[InternoAgent] = None,
-) -> MainAgent:
-    return MainAgent(
-        memory_manager=memory_manager,
-        send_message_callback=send_callback,
-        interno_agent=interno_agent,
-    )
+) -> BoundMainAgent:
+    agent = main_agent_factory.get(memory_manager=memory_manager, interno_agent=interno_agent)
+    return BoundMainAgent(agent, send_callback=send_callback)
@@ -1,7 +1,29 @@
 import asyncio
+import itertools
 import os
 import logging
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+import anyio
+from langchain_core.tools import BaseTool, StructuredTool
 from langchain_mcp_adapters.client import MultiServerMCPClient
+from mcp import ClientSession
+
+try:
+    # Internos del adaptador (versión fijada en requirements.txt). Si cambian, se usa el
+    # camino público de MultiServerMCPClient: sin pool de sesiones, con catálogo cacheado.
+    from langchain_mcp_adapters.sessions import create_session
+    from langchain_mcp_adapters.tools import _convert_call_tool_result, _list_all_tools
+except ImportError:  # pragma: no cover - depende de la versión instalada
+    create_session = _convert_call_tool_result = _list_all_tools = None
+ADAPTER_INTERNALS_AVAILABLE = _list_all_tools is not None
+
+from core.flight_recorder import span
+from core.metrics import record_mcp_call
+from core.speculation import commit_barrier, readonly_mcp_server
+from core.utils.env import env_bool
 
 # =====================================================
 # 🔧 CONFIGURACIÓN BÁSICA
@@ -31,23 +53,328 @@ def _build_client() -> MultiServerMCPClient:
 # Inicializar el cliente multi-servidor
 mcp_client = _build_client()
 
+# Catálogo de tools cacheado por servidor + pool de sesiones persistentes
+MCP_TOOLS_CACHE_TTL = float(os.getenv("MCP_TOOLS_CACHE_TTL", "300"))
+# Pasado el TTL se sirve el catálogo anterior mientras se refresca en segundo plano,
+# hasta este máximo; a partir de ahí se espera al refresco.
+MCP_TOOLS_CACHE_MAX_STALE = float(os.getenv("MCP_TOOLS_CACHE_MAX_STALE", "3600"))
+MCP_SESSION_POOL_SIZE = max(1, int(os.getenv("MCP_SESSION_POOL_SIZE", "2")))
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "120"))
+MCP_SESSION_POOL_ENABLED = (
+    env_bool("MCP_SESSION_POOL_ENABLED", True)
+    and ADAPTER_INTERNALS_AVAILABLE
+)
+if not ADAPTER_INTERNALS_AVAILABLE:
+    logger.warning("⚠️ langchain_mcp_adapters sin los internos esperados: MCP sin pool de sesiones.")
+
+
+# =====================================================
+# 🔌 POOL DE SESIONES PERSISTENTES
+# =====================================================
+def _is_session_terminated(exc: BaseException) -> bool:
+    if isinstance(exc, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream)):
+        return True
+    msg = str(exc)
+    return "session terminated" in msg.lower()
+
+
+class _PooledSession:
+    """
+    Sesión MCP de larga duración.
+    El contexto de la sesión (task groups de anyio) debe abrirse y cerrarse en la
+    misma tarea, así que vive en una tarea propietaria; el resto de tareas solo
+    envían peticiones por la sesión ya inicializada.
+    """
+
+    def __init__(self, server_name: str, connection: dict):
+        self.server_name = server_name
+        self.connection = connection
+        self.session: Optional[ClientSession] = None
+        self.loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._task = self.loop.create_task(self._run(), name=f"mcp-session-{server_name}")
+
+    async def _run(self) -> None:
+        connection = dict(self.connection)
+        session_kwargs = dict(connection.get("session_kwargs") or {})
+        session_kwargs.setdefault("read_timeout_seconds", timedelta(seconds=MCP_CALL_TIMEOUT))
+        connection["session_kwargs"] = session_kwargs
+        try:
+            async with create_session(connection) as session:
+                await session.initialize()
+                self.session = session
+                self._ready.set()
+                await self._stop.wait()
+        except BaseException as exc:  # noqa: BLE001 - se propaga a quien espera la sesión
+            self._error = exc
+        finally:
+            self.session = None
+            self._ready.set()
+
+    @property
+    def alive(self) -> bool:
+        return not self._task.done() and not self._stop.is_set()
+
+    async def get(self) -> ClientSession:
+        await self._ready.wait()
+        if self.session is None:
+            raise self._error or RuntimeError(f"Sesión MCP {self.server_name} no disponible")
+        return self.session
+
+    async def close(self) -> None:
+        self._stop.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=5)
+        except Exception:
+            self._task.cancel()
+
+    def close_soon(self) -> bool:
+        """
+        Pide el cierre desde otro loop: la tarea propietaria sale del contexto de la sesión
+        (y cierra el transporte) en su propio loop. False si ese loop ya está cerrado.
+        """
+        if self._task.done():
+            return True
+        if self.loop.is_closed():
+            return False
+        self.loop.call_soon_threadsafe(self._stop.set)
+        return True
+
+
+class McpSessionPool:
+    """Sesiones MCP reutilizables por servidor (round-robin) ligadas al event loop principal."""
+
+    def __init__(self, size: int = MCP_SESSION_POOL_SIZE):
+        self.size = size
+        self._slots: Dict[str, List[Optional[_PooledSession]]] = {}
+        self._counters: Dict[str, itertools.count] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {
+            "sessions_created": 0,
+            "sessions_recycled": 0,
+            "sessions_orphaned": 0,
+            "calls": 0,
+            "fallback_calls": 0,
+        }
+
+    def _usable_here(self) -> bool:
+        """
+        El pool es del loop que lo usó primero. Si ese loop sigue en marcha (p.ej. el de
+        uvicorn visto desde `_sync_run` en otro hilo) se usa una sesión efímera; si ya no
+        corre, el pool pasa al loop actual y las sesiones anteriores se cierran en el suyo.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return True
+        if self._loop is not None and not self._loop.is_closed() and self._loop.is_running():
+            return False
+        self._release_slots()
+        self._loop = loop
+        return True
+
+    def _release_slots(self) -> None:
+        for server_name, slots in self._slots.items():
+            for pooled in slots:
+                if pooled is None:
+                    continue
+                if not pooled.close_soon():
+                    # Su loop se cerró sin cancelar la tarea: no hay dónde cerrar el transporte.
+                    self.stats["sessions_orphaned"] += 1
+                    logger.warning("⚠️ Sesión MCP de %s huérfana (su event loop ya está cerrado)", server_name)
+        self._slots.clear()
+
+    def _slot_for(self, server_name: str) -> int:
+        counter = self._counters.setdefault(server_name, itertools.count())
+        return next(counter) % self.size
+
+    def _session(self, server_name: str, slot: int) -> _PooledSession:
+        slots = self._slots.setdefault(server_name, [None] * self.size)
+        pooled = slots[slot]
+        if pooled is None or not pooled.alive:
+            pooled = _PooledSession(server_name, mcp_connections[server_name])
+            slots[slot] = pooled
+            self.stats["sessions_created"] += 1
+        return pooled
+
+    async def _discard(self, server_name: str, slot: int, pooled: _PooledSession) -> None:
+        slots = self._slots.get(server_name) or []
+        if slot < len(slots) and slots[slot] is pooled:
+            slots[slot] = None
+        self.stats["sessions_recycled"] += 1
+        await pooled.close()
+
+    async def run(self, server_name: str, operation):
+        """
+        Ejecuta `operation(session)` sobre una sesión del pool.
+        Si la sesión se cerró ("Session terminated") se recrea y se reintenta una vez.
+        Desde loops secundarios (p.ej. `_sync_run`) se usa una sesión efímera.
+        """
+        if not MCP_SESSION_POOL_ENABLED or not self._usable_here():
+            self.stats["fallback_calls"] += 1
+            async with create_session(mcp_connections[server_name]) as session:
+                await session.initialize()
+                return await operation(session)
+
+        self.stats["calls"] += 1
+        slot = self._slot_for(server_name)
+        for attempt in range(2):
+            pooled = self._session(server_name, slot)
+            try:
+                session = await pooled.get()
+                return await operation(session)
+            except Exception as exc:
+                if attempt == 0 and (_is_session_terminated(exc) or pooled.session is None):
+                    logger.warning(
+                        "⚠️ MCP sesión terminada (%s). Recreando sesión del pool: %s",
+                        server_name,
+                        exc,
+                    )
+                    await self._discard(server_name, slot, pooled)
+                    continue
+                raise
+
+    async def aclose(self) -> None:
+        if self._loop is not asyncio.get_running_loop():
+            self._release_slots()
+            return
+        for server_name, slots in list(self._slots.items()):
+            for pooled in slots:
+                if pooled is not None:
+                    await pooled.close()
+        self._slots.clear()
+
+
+session_pool = McpSessionPool()
+
+
+# =====================================================
+# 🗂️ CATÁLOGO DE TOOLS CACHEADO
+# =====================================================
+def _to_langchain_tool(server_name: str, tool: Any) -> BaseTool:
+    """Igual que el adaptador oficial, pero resolviendo la sesión en el pool al llamar."""
+
+    readonly = readonly_mcp_server(server_name, tool.annotations)
+
+    async def call_tool(**arguments: Dict[str, Any]):
+        if not readonly:
+            await commit_barrier(f"mcp.{tool.name}")
+        started = time.perf_counter()
+        ok = False
+        try:
+            with span(f"mcp.{tool.name}", server=server_name):
+                result = await session_pool.run(
+                    server_name,
+                    lambda session: session.call_tool(tool.name, arguments),
+                )
+                converted = _convert_call_tool_result(result)
+            ok = True
+            return converted
+        finally:
+            record_mcp_call(server_name, tool.name, time.perf_counter() - started, ok)
+
+    return StructuredTool(
+        name=tool.name,
+        description=tool.description or "",
+        args_schema=tool.inputSchema,
+        coroutine=call_tool,
+        response_format="content_and_artifact",
+        metadata=tool.annotations.model_dump() if tool.annotations else None,
+    )
+
+
+class ToolCatalogCache:
+    """Caché TTL del catálogo `list_tools` por servidor con refresco en segundo plano."""
+
+    def __init__(self, ttl: float = MCP_TOOLS_CACHE_TTL, max_stale: float = MCP_TOOLS_CACHE_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max(max_stale, ttl)
+        self._entries: Dict[str, tuple[float, List[BaseTool]]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+    async def _fetch(self, server_name: str) -> List[BaseTool]:
+        if ADAPTER_INTERNALS_AVAILABLE:
+            mcp_tools = await session_pool.run(server_name, _list_all_tools)
+            tools = [_to_langchain_tool(server_name, tool) for tool in mcp_tools]
+        else:
+            # Camino público: cada llamada de tool abre su propia sesión.
+            tools = await mcp_client.get_tools(server_name=server_name)
+        self._entries[server_name] = (time.monotonic(), tools)
+        self.stats["refreshes"] += 1
+        logger.debug("[MCP] Catálogo de %s actualizado (%s tools)", server_name, len(tools))
+        return tools
+
+    def _refresh_task(self, server_name: str) -> asyncio.Task:
+        task = self._inflight.get(server_name)
+        loop = asyncio.get_running_loop()
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(self._fetch(server_name), name=f"mcp-catalog-{server_name}")
+            self._inflight[server_name] = task
+
+            def _done(t: asyncio.Task) -> None:
+                if self._inflight.get(server_name) is t:
+                    self._inflight.pop(server_name, None)
+                if not t.cancelled() and t.exception() is not None:
+                    self.stats["refresh_errors"] += 1
+
+            task.add_done_callback(_done)
+        return task
+
+    async def get(self, server_name: str) -> List[BaseTool]:
+        entry = self._entries.get(server_name)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                return entry[1]
+            if age < self.max_stale:
+                self.stats["stale_hits"] += 1
+                self._refresh_task(server_name)
+                return entry[1]
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._refresh_task(server_name))
+
+    def invalidate(self, server_name: Optional[str] = None) -> None:
+        if server_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(server_name, None)
+
+
+tool_catalog = ToolCatalogCache()
+
+
+def get_mcp_cache_stats() -> Dict[str, Any]:
+    return {
+        "catalog": dict(tool_catalog.stats),
+        "sessions": dict(session_pool.stats),
+        "cached_servers": sorted(tool_catalog._entries.keys()),
+    }
+
+
+async def shutdown_mcp_sessions() -> None:
+    await session_pool.aclose()
+
+
 # =====================================================
 # 🧩 FUNCIONES AUXILIARES
 # =====================================================
 async def get_tools(server_name: str, retries: int = 1, retry_delay: float = 0.4):
     """
     Wrapper resiliente para obtener tools desde MCP.
-    Reintenta y recrea el cliente si la sesión se cierra inesperadamente.
+    Sirve el catálogo cacheado por servidor; las tools devueltas ejecutan sobre
+    el pool de sesiones persistentes (una sola ida y vuelta por llamada).
     """
     global mcp_client
     last_exc = None
     for attempt in range(retries + 1):
         try:
-            return await mcp_client.get_tools(server_name=server_name)
+            return await tool_catalog.get(server_name)
         except Exception as exc:
             last_exc = exc
-            msg = str(exc)
-            if "Session terminated" in msg or "session terminated" in msg:
+            if _is_session_terminated(exc):
                 logger.warning("⚠️ MCP sesión terminada (%s). Reiniciando cliente (intento %s/%s).", server_name, attempt + 1, retries + 1)
                 mcp_client = _build_client()
                 await asyncio.sleep(retry_delay)
@@ -1,9 +1,12 @@
 import asyncio
+import heapq
+import os
 import time
 import re
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Tuple
 from core.db import (
     get_conversation_history,
     is_chat_visible_in_list,
@@ -11,14 +14,120 @@ from core.db import (
     get_last_property_id_for_conversation,
     get_last_property_id_for_original_chat,
     upsert_chat_reservation,
+    async_get_conversation_history,
+    async_get_last_property_id_for_conversation,
+    async_get_last_property_id_for_original_chat,
+    async_save_message,
+    async_upsert_chat_reservation,
+    run_db_call,
 )
 from core.template_structured import (
     build_template_sent_marker,
     extract_template_sent_metadata,
 )
+from core.metrics import HISTORY_CACHE_READS_SAVED_TOTAL, HISTORY_CACHE_TOTAL
+from core.speculation import commit_barrier, defer_until_commit
+from core.ttl_cache import TTLCache
+from core.utils.env import env_bool
 
 log = logging.getLogger("MemoryManager")
 
+# Flags de identidad/enrutado que sobreviven a la expulsión de una conversación inactiva:
+# se archivan (solo valores escalares) y se restauran en el siguiente acceso.
+PERSISTENT_FLAGS = frozenset(
+    {
+        "property_id",
+        "property_name",
+        "instance_id",
+        "instance_hotel_code",
+        "instance_number",
+        "instance_url",
+        "last_memory_id",
+        "guest_lang",
+        "guest_lang_confidence",
+        "owner_lang",
+        "wa_sender_phone_id",
+        "wa_sender_locked",
+        "whatsapp_phone_id",
+        "wa_context_instance_id",
+        "wa_context_property_id",
+        "reservation_locator",
+        "folio_id",
+        "checkin",
+        "checkout",
+        "client_name",
+        "guest_number",
+        "default_channel",
+        "superintendente_owner_id",
+    }
+)
+FLAG_ARCHIVE_TTL_SECONDS = float(os.getenv("FLAG_ARCHIVE_TTL_SECONDS", str(7 * 24 * 3600)))
+FLAG_ARCHIVE_MAX_ENTRIES = int(os.getenv("FLAG_ARCHIVE_MAX_ENTRIES", "200000"))
+
+# Caché de historial de Supabase por conversación (ver `_HistoryEntry`).
+HISTORY_CACHE_ENABLED = env_bool("HISTORY_CACHE_ENABLED", True)
+HISTORY_CACHE_MAX_AGE_SECONDS = float(os.getenv("HISTORY_CACHE_MAX_AGE_SECONDS", "300"))
+HISTORY_CACHE_FETCH_LIMIT = int(os.getenv("HISTORY_CACHE_FETCH_LIMIT", "40"))
+
+
+def _history_ts(msg: Dict[str, Any]) -> float:
+    ts = msg.get("created_at")
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    if isinstance(ts, datetime):
+        return ts.timestamp()
+    try:
+        return datetime.fromisoformat(str(ts)).timestamp()
+    except Exception:
+        return time.time()
+
+
+def _sorted_pairs(msgs: List[Dict[str, Any]], keys: Optional[List[float]] = None) -> List[Tuple[float, Dict[str, Any]]]:
+    """(timestamp, mensaje) en orden; solo ordena si la lista no venía ya ordenada."""
+    if keys is None:
+        keys = [_history_ts(msg) for msg in msgs]
+    pairs = list(zip(keys, msgs))
+    if any(pairs[i][0] > pairs[i + 1][0] for i in range(len(pairs) - 1)):
+        pairs.sort(key=lambda pair: pair[0])
+    return pairs
+
+
+@dataclass
+class _HistoryEntry:
+    """
+    Filas de historial de Supabase de una conversación, leídas una vez y mantenidas por
+    escritura directa (`save`/`asave`). Equivalen a repetir la consulta mientras:
+    - los filtros (`query`) no cambien,
+    - no se pida más de `fetch_limit` filas (salvo que ya estén todas: `complete`),
+    - no pase HISTORY_CACHE_MAX_AGE_SECONDS (escrituras de otros procesos).
+    La consulta devuelve las más antiguas primero (`order asc + limit`): con la lista
+    llena, un mensaje nuevo no cambiaría el resultado.
+    """
+
+    query: Tuple[Any, ...]
+    rows: List[Dict[str, Any]]
+    keys: List[float]
+    fetch_limit: int
+    fallback: bool
+    db_reads: int
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    def complete(self) -> bool:
+        return len(self.rows) < self.fetch_limit
+
+    def serves(self, query: Tuple[Any, ...], limit: int, max_age: float) -> bool:
+        if query != self.query or time.monotonic() - self.loaded_at > max_age:
+            return False
+        return limit <= self.fetch_limit or self.complete()
+
+    def matches_row(self, conversation_id: str, property_id: Any, original_chat_id: Any, table: str) -> bool:
+        db_conversation_id, entry_property_id, entry_original, entry_table = self.query
+        if table != entry_table or conversation_id != db_conversation_id:
+            return False
+        if entry_property_id is not None and str(property_id) != str(entry_property_id):
+            return False
+        return entry_original is None or str(original_chat_id or "") == entry_original
+
 
 class MemoryManager:
     """
@@ -28,11 +137,32 @@ class MemoryManager:
     - Guarda y recupera mensajes de la tabla `chat_history` en Supabase
     - Mezcla automáticamente mensajes recientes de RAM + DB
     - 🆕 Añade soporte para flags de estado (ej. escalación activa)
+    - RAM y flags con TTL + tope LRU (core/ttl_cache.py); los flags persistentes de una
+      conversación expulsada se archivan y se restauran al volver a usarla
     """
 
     def __init__(self, max_runtime_messages: int = 40, db_history_days: int = 7):
-        self.runtime_memory: Dict[str, List[Dict[str, Any]]] = {}
-        self.state_flags: Dict[str, Dict[str, Any]] = {}  # 🆕 flags de sesión por chat_id
+        self.runtime_memory: TTLCache = TTLCache("runtime_memory")
+        self.state_flags: TTLCache = TTLCache("state_flags", on_evict=self._archive_flags)  # 🆕 flags de sesión por chat_id
+        self._flag_archive = TTLCache(
+            "state_flags_archive",
+            max_entries=FLAG_ARCHIVE_MAX_ENTRIES,
+            ttl_seconds=FLAG_ARCHIVE_TTL_SECONDS,
+        )
+        # Contador de escrituras en DB por conversación: invalida lecturas precargadas.
+        self._history_versions = TTLCache("history_versions")
+        self._history_cache: TTLCache = TTLCache("history_cache")
+        self.history_cache_enabled = HISTORY_CACHE_ENABLED
+        self._history_stats = {
+            "lookups": 0,
+            "hits": 0,
+            "loads": 0,
+            "db_reads": 0,
+            "reads_saved": 0,
+            "write_through": 0,
+            "invalidations": 0,
+            "messages": 0,
+        }
         self.max_runtime_messages = max_runtime_messages
         self.db_history_days = db_history_days
 
@@ -95,52 +225,39 @@ class MemoryManager:
                 return str(last_mem).replace("+", "").strip()
         return None
 
-    def _resolve_property_id(self, conversation_id: str):
-        prop_id = self.get_flag(conversation_id, "property_id") or self.get_flag(
+    def _flag_property_id(self, conversation_id: str):
+        return self.get_flag(conversation_id, "property_id") or self.get_flag(
             conversation_id,
             "pms_property_id",
         )
-        if prop_id is None:
-            # 1) Fallback por historial (conversation/original_chat_id)
-            try:
-                hint = self.get_last_property_id_hint(conversation_id)
-            except Exception:
-                hint = None
-            if hint is not None:
-                try:
-                    self.set_flag(conversation_id, "property_id", hint)
-                except Exception:
-                    pass
-                return hint
 
-            # 2) Fallback por instancia cuando existe una única property asociada
-            try:
-                instance_id = self.get_flag(conversation_id, "instance_id") or self.get_flag(
-                    conversation_id,
-                    "instance_hotel_code",
-                )
-                if instance_id:
-                    from core.instance_context import fetch_properties_by_code, DEFAULT_PROPERTY_TABLE
-
-                    table = self.get_flag(conversation_id, "property_table") or DEFAULT_PROPERTY_TABLE
-                    rows = fetch_properties_by_code(str(table), str(instance_id)) if table else []
-                    if isinstance(rows, list) and rows:
-                        prop_ids = {
-                            (row.get("property_id") if row.get("property_id") is not None else row.get("id"))
-                            for row in rows
-                            if isinstance(row, dict)
-                            and ((row.get("property_id") is not None) or (row.get("id") is not None))
-                        }
-                        if len(prop_ids) == 1:
-                            inferred = next(iter(prop_ids))
-                            try:
-                                self.set_flag(conversation_id, "property_id", inferred)
-                            except Exception:
-                                pass
-                            return inferred
-            except Exception:
-                pass
-            return None
+    def _infer_property_id_from_instance(self, conversation_id: str):
+        """Fallback por instancia cuando existe una única property asociada (no fija flags)."""
+        try:
+            instance_id = self.get_flag(conversation_id, "instance_id") or self.get_flag(
+                conversation_id,
+                "instance_hotel_code",
+            )
+            if instance_id:
+                from core.instance_context import fetch_properties_by_code, DEFAULT_PROPERTY_TABLE
+
+                table = self.get_flag(conversation_id, "property_table") or DEFAULT_PROPERTY_TABLE
+                rows = fetch_properties_by_code(str(table), str(instance_id)) if table else []
+                if isinstance(rows, list) and rows:
+                    prop_ids = {
+                        (row.get("property_id") if row.get("property_id") is not None else row.get("id"))
+                        for row in rows
+                        if isinstance(row, dict)
+                        and ((row.get("property_id") is not None) or (row.get("id") is not None))
+                    }
+                    if len(prop_ids) == 1:
+                        return next(iter(prop_ids))
+        except Exception:
+            pass
+        return None
+
+    def _check_property_instance(self, conversation_id: str, prop_id):
+        """Valida un property_id de flags frente a la instancia del chat."""
         # Si es un chat compuesto (instancia:telefono) y no hay instance_id, no arrastrar property_id.
         try:
             if isinstance(conversation_id, str) and ":" in conversation_id:
@@ -193,6 +310,40 @@ class MemoryManager:
             return None
         return prop_id
 
+    def _remember_inferred_property_id(self, conversation_id: str, prop_id) -> None:
+        try:
+            self.set_flag(conversation_id, "property_id", prop_id)
+        except Exception:
+            pass
+
+    def _resolve_property_id(self, conversation_id: str):
+        prop_id = self._flag_property_id(conversation_id)
+        if prop_id is None:
+            # 1) Fallback por historial (conversation/original_chat_id)
+            try:
+                hint = self.get_last_property_id_hint(conversation_id)
+            except Exception:
+                hint = None
+            # 2) Fallback por instancia cuando existe una única property asociada
+            if hint is None:
+                hint = self._infer_property_id_from_instance(conversation_id)
+            if hint is not None:
+                self._remember_inferred_property_id(conversation_id, hint)
+            return hint
+        return self._check_property_instance(conversation_id, prop_id)
+
+    async def _aresolve_property_id(self, conversation_id: str):
+        """Versión async de `_resolve_property_id` (consultas fuera del event loop)."""
+        prop_id = self._flag_property_id(conversation_id)
+        if prop_id is None:
+            hint = await self.aget_last_property_id_hint(conversation_id)
+            if hint is None:
+                hint = await run_db_call(self._infer_property_id_from_instance, conversation_id)
+            if hint is not None:
+                self._remember_inferred_property_id(conversation_id, hint)
+            return hint
+        return await run_db_call(self._check_property_instance, conversation_id, prop_id)
+
     def _resolve_history_table(self, conversation_id: str) -> str:
         table = self.get_flag(conversation_id, "history_table")
         return str(table).strip() if table else "chat_history"
@@ -251,12 +402,39 @@ class MemoryManager:
         except Exception:
             return None
 
+    async def aget_last_property_id_hint(self, conversation_id: str, limit: int = 30) -> Optional[int]:
+        """Versión async de `get_last_property_id_hint`."""
+        try:
+            table = self._resolve_history_table(conversation_id)
+            if isinstance(conversation_id, str) and ":" in conversation_id:
+                prop = await async_get_last_property_id_for_original_chat(
+                    conversation_id,
+                    table=table,
+                    limit=limit,
+                )
+            else:
+                db_conversation_id = self._resolve_db_conversation_id(conversation_id)
+                prop = await async_get_last_property_id_for_conversation(
+                    db_conversation_id,
+                    table=table,
+                    limit=limit,
+                )
+            if prop is None:
+                return None
+            return int(prop)
+        except Exception:
+            return None
+
     def has_history(self, conversation_id: str, limit: int = 1) -> bool:
         """
         Devuelve True si hay historial (RAM o DB) para el conversation_id.
         """
         try:
-            if self.runtime_memory.get(self._clean_id(conversation_id)):
+            cid = self._clean_id(conversation_id)
+            if self.runtime_memory.get(cid):
+                return True
+            cached = self._history_cache.peek(cid)
+            if cached is not None and cached.rows:
                 return True
             db_conversation_id = self._resolve_db_conversation_id(conversation_id)
             table = self._resolve_history_table(conversation_id)
@@ -280,99 +458,317 @@ class MemoryManager:
         cid = self._clean_id(conversation_id)
 
         try:
-            # Mensajes en RAM
-            local_msgs = self.runtime_memory.get(cid, [])
+            query = self._history_query(conversation_id, self._resolve_property_id(conversation_id))
+            entry = self._cached_history(cid, query, limit)
+            if entry is None:
+                entry = self._load_history(cid, query, limit)
+            return self._merge_history(conversation_id, entry.rows[:limit], limit, db_keys=entry.keys[:limit])
 
-            # Mensajes en DB (últimos X días)
-            since = datetime.utcnow() - timedelta(days=self.db_history_days)
-            db_conversation_id = self._resolve_db_conversation_id(conversation_id)
-            property_id = self._resolve_property_id(conversation_id)
-            history_table = self._resolve_history_table(conversation_id)
-            original_chat_id = self._resolve_original_chat_id(conversation_id)
-            db_msgs = (
-                get_conversation_history(
-                    db_conversation_id,
-                    limit=limit,
-                    since=since,
-                    property_id=property_id,
-                    original_chat_id=original_chat_id,
-                    table=history_table,
-                )
-                or []
-            )
-            if property_id is not None and not db_msgs:
-                # Fallback: si no hay mensajes con property_id, reintenta sin filtro.
-                db_msgs = (
-                    get_conversation_history(
-                        db_conversation_id,
-                        limit=limit,
-                        since=since,
-                        property_id=None,
-                        original_chat_id=original_chat_id,
-                        table=history_table,
-                    )
-                    or []
-                )
+        except Exception as e:
+            log.error(f"⚠️ Error recuperando contexto de {cid}: {e}", exc_info=True)
+            return []
 
-            # Fusionar ambos
-            combined = db_msgs + local_msgs
+    async def aget_memory(self, conversation_id: str, limit: int = 40) -> List[Dict[str, Any]]:
+        """Versión async de `get_memory`: las lecturas de Supabase no bloquean el event loop."""
+        cid = self._clean_id(conversation_id)
 
-            # Ordenar por fecha
-            def parse_ts(msg):
-                ts = msg.get("created_at")
-                if isinstance(ts, (int, float)):
-                    return float(ts)
-                if isinstance(ts, datetime):
-                    return ts.timestamp()
-                try:
-                    return datetime.fromisoformat(str(ts)).timestamp()
-                except Exception:
-                    return time.time()
+        try:
+            entry = await self._aget_history_entry(conversation_id, limit)
+            return self._merge_history(conversation_id, entry.rows[:limit], limit, db_keys=entry.keys[:limit])
 
-            combined_sorted = sorted(combined, key=parse_ts)
-            recent = combined_sorted[-limit:]
+        except Exception as e:
+            log.error(f"⚠️ Error recuperando contexto de {cid}: {e}", exc_info=True)
+            return []
 
-            # Si faltan datos persistentes, intenta inferirlos del historial reciente.
-            try:
-                folio_flag = self.get_flag(conversation_id, "folio_id")
-                checkin_flag = self.get_flag(conversation_id, "checkin")
-                checkout_flag = self.get_flag(conversation_id, "checkout")
-                if not (folio_flag and checkin_flag and checkout_flag):
-                    for msg in reversed(recent):
-                        content = msg.get("content") or ""
-                        if not isinstance(content, str):
-                            continue
-                        if not folio_flag:
-                            m = re.search(r"(localizador|folio(?:_id)?|reserva)\s*[:#]?\s*([A-Za-z0-9-]{4,})", content, re.IGNORECASE)
-                            if m:
-                                folio_flag = m.group(2)
-                                self.set_flag(conversation_id, "folio_id", folio_flag)
-                        if not checkin_flag:
-                            m = re.search(r"(entrada|check[- ]?in)\s*[:#]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})", content, re.IGNORECASE)
-                            if m:
-                                checkin_flag = m.group(2)
-                                self.set_flag(conversation_id, "checkin", checkin_flag)
-                        if not checkout_flag:
-                            m = re.search(r"(salida|check[- ]?out)\s*[:#]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})", content, re.IGNORECASE)
-                            if m:
-                                checkout_flag = m.group(2)
-                                self.set_flag(conversation_id, "checkout", checkout_flag)
-                        if folio_flag and checkin_flag and checkout_flag:
-                            break
-            except Exception:
-                pass
+    async def aget_db_history(self, conversation_id: str, limit: int = 40) -> List[Dict[str, Any]]:
+        """
+        Solo la parte de Supabase de `aget_memory` (sin RAM). Propaga errores.
+        Permite precargar filas y fusionarlas más tarde con la RAM del momento
+        (`history_from_rows`).
+        """
+        entry = await self._aget_history_entry(conversation_id, limit)
+        return entry.rows[:limit]
 
-            log.info(
-                f"🧠 Contexto cargado para {cid}: {len(recent)} mensajes "
-                f"(RAM={len(local_msgs)}, DB={len(db_msgs)})"
-            )
+    # ----------------------------------------------------------------------
+    # Caché de historial (filas de Supabase por conversación)
+    # ----------------------------------------------------------------------
+    def _history_query(self, conversation_id: str, property_id: Any) -> Tuple[Any, ...]:
+        """Filtros de la consulta de historial: (conversation_id en DB, property_id, original_chat_id, tabla)."""
+        return (
+            self._resolve_db_conversation_id(conversation_id),
+            property_id,
+            self._resolve_original_chat_id(conversation_id),
+            self._resolve_history_table(conversation_id),
+        )
+
+    def _cached_history(self, cid: str, query: Tuple[Any, ...], limit: int) -> Optional[_HistoryEntry]:
+        self._history_stats["lookups"] += 1
+        if not self.history_cache_enabled:
+            return None
+        entry = self._history_cache.get(cid)
+        if entry is None or not entry.serves(query, limit, HISTORY_CACHE_MAX_AGE_SECONDS):
+            HISTORY_CACHE_TOTAL.inc(result="miss")
+            return None
+        self._history_stats["hits"] += 1
+        self._history_stats["reads_saved"] += entry.db_reads
+        HISTORY_CACHE_TOTAL.inc(result="hit")
+        HISTORY_CACHE_READS_SAVED_TOTAL.inc(entry.db_reads)
+        return entry
+
+    def _history_reads(self, query: Tuple[Any, ...], limit: int):
+        """Argumentos de las lecturas de Supabase (la segunda, sin property_id, es el fallback)."""
+        db_conversation_id, property_id, original_chat_id, history_table = query
+        since = datetime.utcnow() - timedelta(days=self.db_history_days)
+        base = {
+            "limit": limit,
+            "since": since,
+            "original_chat_id": original_chat_id,
+            "table": history_table,
+        }
+        yield db_conversation_id, {**base, "property_id": property_id}
+        if property_id is not None:
+            yield db_conversation_id, {**base, "property_id": None}
+
+    def _store_history(
+        self,
+        cid: str,
+        query: Tuple[Any, ...],
+        rows: List[Dict[str, Any]],
+        fetch_limit: int,
+        fallback: bool,
+        db_reads: int,
+    ) -> _HistoryEntry:
+        pairs = _sorted_pairs(rows)
+        entry = _HistoryEntry(
+            query=query,
+            rows=[msg for _, msg in pairs],
+            keys=[key for key, _ in pairs],
+            fetch_limit=fetch_limit,
+            fallback=fallback,
+            db_reads=db_reads,
+        )
+        self._history_stats["loads"] += 1
+        self._history_stats["db_reads"] += db_reads
+        # Vacío no se guarda: `get_conversation_history` devuelve [] también si la lectura falla.
+        if self.history_cache_enabled and entry.rows:
+            self._history_cache[cid] = entry
+        return entry
+
+    def _load_history(self, cid: str, query: Tuple[Any, ...], limit: int) -> _HistoryEntry:
+        fetch_limit = max(limit, HISTORY_CACHE_FETCH_LIMIT)
+        rows: List[Dict[str, Any]] = []
+        reads = 0
+        for db_conversation_id, kwargs in self._history_reads(query, fetch_limit):
+            # Fallback: si no hay mensajes con property_id, reintenta sin filtro.
+            rows = get_conversation_history(db_conversation_id, **kwargs) or []
+            reads += 1
+            if rows:
+                break
+        return self._store_history(cid, query, rows, fetch_limit, reads > 1, reads)
+
+    async def _aget_history_entry(self, conversation_id: str, limit: int) -> _HistoryEntry:
+        cid = self._clean_id(conversation_id)
+        query = self._history_query(conversation_id, await self._aresolve_property_id(conversation_id))
+        entry = self._cached_history(cid, query, limit)
+        if entry is not None:
+            return entry
+        fetch_limit = max(limit, HISTORY_CACHE_FETCH_LIMIT)
+        rows: List[Dict[str, Any]] = []
+        reads = 0
+        for db_conversation_id, kwargs in self._history_reads(query, fetch_limit):
+            rows = await async_get_conversation_history(db_conversation_id, **kwargs) or []
+            reads += 1
+            if rows:
+                break
+        return self._store_history(cid, query, rows, fetch_limit, reads > 1, reads)
+
+    def history_filters(self, conversation_id: str) -> Dict[str, Any]:
+        """Filtros de la consulta de historial (salvo property_id) para cargadores externos."""
+        db_conversation_id, _, original_chat_id, table = self._history_query(conversation_id, None)
+        return {"conversation_id": db_conversation_id, "original_chat_id": original_chat_id, "table": table}
+
+    def seed_history(
+        self,
+        conversation_id: str,
+        property_id: Any,
+        rows: List[Dict[str, Any]],
+        fetch_limit: int,
+        *,
+        fallback: bool = False,
+        history_version: Optional[int] = None,
+    ) -> bool:
+        """
+        Guarda en la caché filas leídas por otro cargador (p.ej. la RPC de contexto de
+        conversación) con los mismos filtros. No pisa una entrada existente ni filas
+        leídas antes de una escritura posterior (`history_version`).
+        """
+        cid = self._clean_id(conversation_id)
+        if not self.history_cache_enabled or not rows or self._history_cache.peek(cid) is not None:
+            return False
+        if history_version is not None and history_version != self.history_version(cid):
+            return False
+        pairs = _sorted_pairs([dict(row) for row in rows])
+        self._history_cache[cid] = _HistoryEntry(
+            query=self._history_query(conversation_id, property_id),
+            rows=[msg for _, msg in pairs],
+            keys=[key for key, _ in pairs],
+            fetch_limit=fetch_limit,
+            fallback=fallback,
+            db_reads=2 if fallback else 1,
+        )
+        return True
+
+    def _history_write_through(self, conversation_id: str, persist_kwargs: Dict[str, Any], ok: bool) -> None:
+        """Refleja en la caché el mensaje recién persistido (como lo devolvería una nueva lectura)."""
+        cid = self._clean_id(conversation_id)
+        if persist_kwargs.get("role") in {"guest", "user"}:
+            self._history_stats["messages"] += 1
+        entry = self._history_cache.peek(cid)
+        if entry is None:
+            return
+        if not ok or entry.fallback:
+            # Sin garantía de cómo queda la próxima lectura: se vuelve a consultar.
+            self.invalidate_history(cid)
+            return
+        row_conversation_id = str(persist_kwargs.get("conversation_id") or "").replace("+", "").strip()
+        row_original = str(persist_kwargs.get("original_chat_id") or "").replace("+", "").strip()
+        if not entry.matches_row(
+            row_conversation_id,
+            persist_kwargs.get("property_id"),
+            row_original or row_conversation_id,
+            persist_kwargs.get("table") or "chat_history",
+        ) or not entry.complete():
+            return
+        row = {
+            "role": persist_kwargs.get("role"),
+            "content": persist_kwargs.get("content"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "structured_payload": persist_kwargs.get("structured_payload"),
+        }
+        key = _history_ts(row)
+        # Listas nuevas: un lector concurrente (pool de hilos) nunca ve una a medias.
+        entry.rows = entry.rows + [row]
+        entry.keys = entry.keys + [max(key, entry.keys[-1]) if entry.keys else key]
+        self._history_stats["write_through"] += 1
 
-            return recent
+    def invalidate_history(self, *conversation_ids: str) -> int:
+        """
+        Descarta el historial en caché de las conversaciones indicadas (id de memoria, de DB
+        u original_chat_id). Usar tras archivar/ocultar un chat o cambios fuera de `save`.
+        """
+        targets = {self._clean_id(cid) for cid in conversation_ids if cid}
+        if not targets:
+            return 0
+        keys = [
+            key
+            for key, entry in list(self._history_cache.items())
+            if key in targets or entry.query[0] in targets or entry.query[2] in targets
+        ]
+        for key in keys:
+            self._history_cache.pop(key, None)
+        self._history_stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def history_cache_stats(self) -> Dict[str, Any]:
+        """Aciertos de la caché de historial y lecturas de Supabase ahorradas por mensaje entrante."""
+        stats = dict(self._history_stats)
+        stats["enabled"] = self.history_cache_enabled
+        stats["entries"] = len(self._history_cache)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else None
+        stats["db_reads_per_message"] = (
+            round(stats["db_reads"] / stats["messages"], 3) if stats["messages"] else None
+        )
+        stats["reads_saved_per_message"] = (
+            round(stats["reads_saved"] / stats["messages"], 3) if stats["messages"] else None
+        )
+        return stats
 
+    def history_from_rows(
+        self,
+        conversation_id: str,
+        db_msgs: List[Dict[str, Any]],
+        limit: int = 40,
+        as_messages: bool = False,
+    ):
+        """Equivale a `aget_memory` (o `aget_memory_as_messages`) con filas de DB ya leídas."""
+        try:
+            recent = self._merge_history(conversation_id, list(db_msgs), limit)
+            return self._to_langchain_messages(conversation_id, recent) if as_messages else recent
         except Exception as e:
-            log.error(f"⚠️ Error recuperando contexto de {cid}: {e}", exc_info=True)
+            log.error(f"⚠️ Error fusionando historial precargado de {conversation_id}: {e}", exc_info=True)
             return []
 
+    def history_version(self, conversation_id: str) -> int:
+        """Número de escrituras en DB hechas por este proceso para la conversación."""
+        version = self._history_versions.get(self._clean_id(conversation_id))
+        return version if version is not None else 0
+
+    def _bump_history_version(self, conversation_id: str) -> None:
+        cid = self._clean_id(conversation_id)
+        self._history_versions[cid] = self.history_version(cid) + 1
+
+    def _merge_history(
+        self,
+        conversation_id: str,
+        db_msgs: List[Dict[str, Any]],
+        limit: int,
+        db_keys: Optional[List[float]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Fusiona historial de DB con la memoria en RAM y refresca flags de reserva."""
+        cid = self._clean_id(conversation_id)
+
+        # Mensajes en RAM
+        local_msgs = self.runtime_memory.get(cid, [])
+
+        # Fusionar por fecha: ambas listas ya vienen ordenadas (mezcla lineal, estable:
+        # DB antes que RAM en empate, como el sort anterior).
+        combined_sorted = [
+            msg
+            for _, msg in heapq.merge(
+                _sorted_pairs(db_msgs, db_keys),
+                _sorted_pairs(local_msgs),
+                key=lambda pair: pair[0],
+            )
+        ]
+        recent = combined_sorted[-limit:]
+
+        # Si faltan datos persistentes, intenta inferirlos del historial reciente.
+        try:
+            folio_flag = self.get_flag(conversation_id, "folio_id")
+            checkin_flag = self.get_flag(conversation_id, "checkin")
+            checkout_flag = self.get_flag(conversation_id, "checkout")
+            if not (folio_flag and checkin_flag and checkout_flag):
+                for msg in reversed(recent):
+                    content = msg.get("content") or ""
+                    if not isinstance(content, str):
+                        continue
+                    if not folio_flag:
+                        m = re.search(r"(localizador|folio(?:_id)?|reserva)\s*[:#]?\s*([A-Za-z0-9-]{4,})", content, re.IGNORECASE)
+                        if m:
+                            folio_flag = m.group(2)
+                            self.set_flag(conversation_id, "folio_id", folio_flag)
+                    if not checkin_flag:
+                        m = re.search(r"(entrada|check[- ]?in)\s*[:#]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})", content, re.IGNORECASE)
+                        if m:
+                            checkin_flag = m.group(2)
+                            self.set_flag(conversation_id, "checkin", checkin_flag)
+                    if not checkout_flag:
+                        m = re.search(r"(salida|check[- ]?out)\s*[:#]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})", content, re.IGNORECASE)
+                        if m:
+                            checkout_flag = m.group(2)
+                            self.set_flag(conversation_id, "checkout", checkout_flag)
+                    if folio_flag and checkin_flag and checkout_flag:
+                        break
+        except Exception:
+            pass
+
+        log.info(
+            f"🧠 Contexto cargado para {cid}: {len(recent)} mensajes "
+            f"(RAM={len(local_msgs)}, DB={len(db_msgs)})"
+        )
+
+        return recent
+
     # ----------------------------------------------------------------------
     def save(
         self,
@@ -396,6 +792,156 @@ class MemoryManager:
         Roles base: user/assistant/system/tool. Se mapean a guest/bookai para persistencia.
         No añade etiquetas ni prefijos en el contenido.
         """
+        # Dentro de una ejecución especulativa no se puede esperar a la confirmación aquí:
+        # se guarda con `asave` una vez confirmada (o nunca, si se cancela).
+        if defer_until_commit(
+            "memory.save",
+            lambda: self.asave(
+                conversation_id,
+                role,
+                content,
+                escalation_id=escalation_id,
+                client_name=client_name,
+                user_id=user_id,
+                user_first_name=user_first_name,
+                user_last_name=user_last_name,
+                user_last_name2=user_last_name2,
+                channel=channel,
+                original_chat_id=original_chat_id,
+                bypass_force_guest_role=bypass_force_guest_role,
+                skip_recent_duplicate_guard=skip_recent_duplicate_guard,
+                structured_payload=structured_payload,
+            ),
+        ):
+            return
+        reservation_kwargs, persist_kwargs = self._prepare_save(
+            conversation_id,
+            role,
+            content,
+            escalation_id=escalation_id,
+            client_name=client_name,
+            user_id=user_id,
+            user_first_name=user_first_name,
+            user_last_name=user_last_name,
+            user_last_name2=user_last_name2,
+            channel=channel,
+            original_chat_id=original_chat_id,
+            bypass_force_guest_role=bypass_force_guest_role,
+            skip_recent_duplicate_guard=skip_recent_duplicate_guard,
+            structured_payload=structured_payload,
+        )
+        if persist_kwargs is None:
+            return
+        if reservation_kwargs:
+            try:
+                upsert_chat_reservation(**reservation_kwargs)
+                self._log_reservation_upsert(reservation_kwargs)
+            except Exception:
+                pass
+
+        # Guardar en Supabase
+        ok = False
+        try:
+            persist_kwargs["property_id"] = self._resolve_property_id(conversation_id)
+            save_message(**persist_kwargs)
+            ok = True
+            log.debug(f"💾 Guardado en Supabase: ({self._clean_id(conversation_id)}, {persist_kwargs['role']})")
+        except Exception as e:
+            log.warning(f"⚠️ Error guardando mensaje en Supabase: {e}")
+        finally:
+            self._bump_history_version(conversation_id)
+            self._history_write_through(conversation_id, persist_kwargs, ok)
+
+    # ----------------------------------------------------------------------
+    async def asave(
+        self,
+        conversation_id: str,
+        role: str,
+        content: str,
+        escalation_id: Optional[str] = None,
+        client_name: Optional[str] = None,
+        user_id: Optional[int | str] = None,
+        user_first_name: Optional[str] = None,
+        user_last_name: Optional[str] = None,
+        user_last_name2: Optional[str] = None,
+        channel: Optional[str] = None,
+        original_chat_id: Optional[str] = None,
+        bypass_force_guest_role: bool = False,
+        skip_recent_duplicate_guard: bool = False,
+        structured_payload: Optional[dict | list] = None,
+    ) -> None:
+        """Versión async de `save`: la escritura en Supabase no bloquea el event loop."""
+        await commit_barrier("memory.asave")
+        reservation_kwargs, persist_kwargs = self._prepare_save(
+            conversation_id,
+            role,
+            content,
+            escalation_id=escalation_id,
+            client_name=client_name,
+            user_id=user_id,
+            user_first_name=user_first_name,
+            user_last_name=user_last_name,
+            user_last_name2=user_last_name2,
+            channel=channel,
+            original_chat_id=original_chat_id,
+            bypass_force_guest_role=bypass_force_guest_role,
+            skip_recent_duplicate_guard=skip_recent_duplicate_guard,
+            structured_payload=structured_payload,
+        )
+        if persist_kwargs is None:
+            return
+        if reservation_kwargs:
+            try:
+                await async_upsert_chat_reservation(**reservation_kwargs)
+                self._log_reservation_upsert(reservation_kwargs)
+            except Exception:
+                pass
+
+        ok = False
+        try:
+            persist_kwargs["property_id"] = await self._aresolve_property_id(conversation_id)
+            await async_save_message(**persist_kwargs)
+            ok = True
+            log.debug(f"💾 Guardado en Supabase: ({self._clean_id(conversation_id)}, {persist_kwargs['role']})")
+        except Exception as e:
+            log.warning(f"⚠️ Error guardando mensaje en Supabase: {e}")
+        finally:
+            self._bump_history_version(conversation_id)
+            self._history_write_through(conversation_id, persist_kwargs, ok)
+
+    @staticmethod
+    def _log_reservation_upsert(reservation_kwargs: Dict[str, Any]) -> None:
+        log.info(
+            "🧾 memory upsert_chat_reservation chat_id=%s folio_id=%s checkin=%s checkout=%s",
+            reservation_kwargs.get("chat_id"),
+            reservation_kwargs.get("folio_id"),
+            reservation_kwargs.get("checkin"),
+            reservation_kwargs.get("checkout"),
+        )
+
+    # ----------------------------------------------------------------------
+    def _prepare_save(
+        self,
+        conversation_id: str,
+        role: str,
+        content: str,
+        escalation_id: Optional[str] = None,
+        client_name: Optional[str] = None,
+        user_id: Optional[int | str] = None,
+        user_first_name: Optional[str] = None,
+        user_last_name: Optional[str] = None,
+        user_last_name2: Optional[str] = None,
+        channel: Optional[str] = None,
+        original_chat_id: Optional[str] = None,
+        bypass_force_guest_role: bool = False,
+        skip_recent_duplicate_guard: bool = False,
+        structured_payload: Optional[dict | list] = None,
+    ) -> tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Normaliza el mensaje, actualiza flags y RAM, y devuelve los argumentos de persistencia:
+        (kwargs de upsert_chat_reservation o None, kwargs de save_message sin property_id).
+        Si el mensaje es un duplicado reciente devuelve (None, None).
+        """
         cid = self._clean_id(conversation_id)
         valid_roles = {"user", "assistant", "system", "tool", "guest", "bookai"}
         normalized_role = role if role in valid_roles else "assistant"
@@ -428,9 +974,10 @@ class MemoryManager:
             )
         ):
             log.info("↩️ Duplicado reciente ignorado chat_id=%s role=%s", cid, normalized_role)
-            return
+            return None, None
 
         # Si el mensaje trae datos de reserva, actualiza flags (sobrescribe con lo mas reciente).
+        reservation_kwargs: Optional[Dict[str, Any]] = None
         try:
             if content:
                 targets = [conversation_id]
@@ -464,40 +1011,30 @@ class MemoryManager:
                     and channel_to_store == "whatsapp"
                     and normalized_role == "guest"
                 ):
-                    try:
-                        resolved_chat_id = tail if isinstance(conversation_id, str) and ":" in conversation_id else conversation_id
-                        original_chat_id = None
-                        if isinstance(conversation_id, str) and ":" in conversation_id:
-                            original_chat_id = conversation_id
-                        else:
-                            last_mem = self.get_flag(conversation_id, "last_memory_id")
-                            if isinstance(last_mem, str) and ":" in last_mem:
-                                original_chat_id = last_mem
-
-                        instance_id = (
-                            self.get_flag(conversation_id, "instance_id")
-                            or self.get_flag(conversation_id, "instance_hotel_code")
-                        )
-                        upsert_chat_reservation(
-                            chat_id=resolved_chat_id,
-                            folio_id=str(folio_flag),
-                            checkin=checkin_flag,
-                            checkout=checkout_flag,
-                            property_id=self.get_flag(conversation_id, "property_id"),
-                            instance_id=instance_id,
-                            original_chat_id=original_chat_id,
-                            reservation_locator=locator_flag,
-                            source="message",
-                        )
-                        log.info(
-                            "🧾 memory upsert_chat_reservation chat_id=%s folio_id=%s checkin=%s checkout=%s",
-                            resolved_chat_id,
-                            folio_flag,
-                            checkin_flag,
-                            checkout_flag,
-                        )
-                    except Exception:
-                        pass
+                    resolved_chat_id = tail if isinstance(conversation_id, str) and ":" in conversation_id else conversation_id
+                    reservation_original_chat_id = None
+                    if isinstance(conversation_id, str) and ":" in conversation_id:
+                        reservation_original_chat_id = conversation_id
+                    else:
+                        last_mem = self.get_flag(conversation_id, "last_memory_id")
+                        if isinstance(last_mem, str) and ":" in last_mem:
+                            reservation_original_chat_id = last_mem
+
+                    instance_id = (
+                        self.get_flag(conversation_id, "instance_id")
+                        or self.get_flag(conversation_id, "instance_hotel_code")
+                    )
+                    reservation_kwargs = {
+                        "chat_id": resolved_chat_id,
+                        "folio_id": str(folio_flag),
+                        "checkin": checkin_flag,
+                        "checkout": checkout_flag,
+                        "property_id": self.get_flag(conversation_id, "property_id"),
+                        "instance_id": instance_id,
+                        "original_chat_id": reservation_original_chat_id,
+                        "reservation_locator": locator_flag,
+                        "source": "message",
+                    }
         except Exception:
             pass
 
@@ -547,29 +1084,22 @@ class MemoryManager:
             if guest_number:
                 resolved_original = self._normalize_phone(str(guest_number))
 
-        # Guardar en Supabase
-        try:
-            db_conversation_id = self._resolve_db_conversation_id(conversation_id)
-            property_id = self._resolve_property_id(conversation_id)
-            save_message(
-                db_conversation_id,
-                normalized_role,
-                entry["content"],
-                escalation_id=escalation_id,
-                client_name=client_name if is_guest else None,
-                user_id=user_id,
-                user_first_name=user_first_name,
-                user_last_name=user_last_name,
-                user_last_name2=user_last_name2,
-                channel=channel_to_store,
-                property_id=property_id,
-                original_chat_id=resolved_original or cid,
-                structured_payload=structured_payload,
-                table=self._resolve_history_table(conversation_id),
-            )
-            log.debug(f"💾 Guardado en Supabase: ({cid}, {normalized_role})")
-        except Exception as e:
-            log.warning(f"⚠️ Error guardando mensaje en Supabase: {e}")
+        persist_kwargs = {
+            "conversation_id": self._resolve_db_conversation_id(conversation_id),
+            "role": normalized_role,
+            "content": entry["content"],
+            "escalation_id": escalation_id,
+            "client_name": client_name if is_guest else None,
+            "user_id": user_id,
+            "user_first_name": user_first_name,
+            "user_last_name": user_last_name,
+            "user_last_name2": user_last_name2,
+            "channel": channel_to_store,
+            "original_chat_id": resolved_original or cid,
+            "structured_payload": structured_payload,
+            "table": self._resolve_history_table(conversation_id),
+        }
+        return reservation_kwargs, persist_kwargs
 
     # ----------------------------------------------------------------------
     def add_runtime_message(
@@ -647,6 +1177,9 @@ class MemoryManager:
         if cid in self.state_flags:  # 🆕 limpiar flags también
             del self.state_flags[cid]
             log.info(f"🧹 Flags de estado limpiados para {cid}")
+        self._flag_archive.pop(cid, None)
+        self.invalidate_history(cid)
+        self._bump_history_version(cid)
 
     # ----------------------------------------------------------------------
     def update_memory(self, conversation_id: str, role: str, content: str) -> None:
@@ -661,54 +1194,89 @@ class MemoryManager:
         """
         🔄 Devuelve la memoria en formato LangChain (HumanMessage / AIMessage / SystemMessage).
         """
-        from langchain.schema import HumanMessage, AIMessage, SystemMessage
-
         try:
             raw_messages = self.get_memory(conversation_id, limit)
-            messages = []
-
-            for msg in raw_messages:
-                role = msg.get("role", "assistant")
-                content = msg.get("content", "")
-                template_meta = extract_template_sent_metadata(
-                    msg.get("structured_payload"),
-                    content,
-                )
-                template_marker = build_template_sent_marker(template_meta) if template_meta else None
-                content_text = str(content or "").strip()
-                if not content_text:
-                    if template_marker:
-                        messages.append(AIMessage(content=template_marker))
-                    continue
-
-                if role == "guest":
-                    messages.append(HumanMessage(content=content_text))
-                elif role == "user":
-                    # Mensajes del hotel/propietario: mantener rol user pero no como huésped.
-                    messages.append(SystemMessage(content=f"Hotel: {content_text}"))
-                elif role == "system":
-                    messages.append(SystemMessage(content=content_text))
-                else:
-                    messages.append(AIMessage(content=content_text))
-                if template_marker and not content_text.lower().startswith("[template_sent]"):
-                    messages.append(AIMessage(content=template_marker))
-
-            log.debug(
-                f"🧩 get_memory_as_messages → {len(messages)} mensajes convertidos para {conversation_id}"
-            )
-            return messages
+            return self._to_langchain_messages(conversation_id, raw_messages)
+        except Exception as e:
+            log.error(f"⚠️ Error al convertir memoria a mensajes LangChain: {e}", exc_info=True)
+            return []
 
+    async def aget_memory_as_messages(self, conversation_id: str, limit: int = 30):
+        """Versión async de `get_memory_as_messages`."""
+        try:
+            raw_messages = await self.aget_memory(conversation_id, limit)
+            return self._to_langchain_messages(conversation_id, raw_messages)
         except Exception as e:
             log.error(f"⚠️ Error al convertir memoria a mensajes LangChain: {e}", exc_info=True)
             return []
 
+    def _to_langchain_messages(self, conversation_id: str, raw_messages: List[Dict[str, Any]]):
+        from langchain.schema import HumanMessage, AIMessage, SystemMessage
+
+        messages = []
+        for msg in raw_messages:
+            role = msg.get("role", "assistant")
+            content = msg.get("content", "")
+            template_meta = extract_template_sent_metadata(
+                msg.get("structured_payload"),
+                content,
+            )
+            template_marker = build_template_sent_marker(template_meta) if template_meta else None
+            content_text = str(content or "").strip()
+            if not content_text:
+                if template_marker:
+                    messages.append(AIMessage(content=template_marker))
+                continue
+
+            if role == "guest":
+                messages.append(HumanMessage(content=content_text))
+            elif role == "user":
+                # Mensajes del hotel/propietario: mantener rol user pero no como huésped.
+                messages.append(SystemMessage(content=f"Hotel: {content_text}"))
+            elif role == "system":
+                messages.append(SystemMessage(content=content_text))
+            else:
+                messages.append(AIMessage(content=content_text))
+            if template_marker and not content_text.lower().startswith("[template_sent]"):
+                messages.append(AIMessage(content=template_marker))
+
+        log.debug(
+            f"🧩 get_memory_as_messages → {len(messages)} mensajes convertidos para {conversation_id}"
+        )
+        return messages
+
     # ======================================================================
     # 🆕  MÉTODOS NUEVOS: Flags persistentes (estado de escalación, etc.)
     # ======================================================================
+    def _archive_flags(self, cid: str, flags: Any, reason: str) -> None:
+        """on_evict de `state_flags`: guarda los flags persistentes de la conversación expulsada."""
+        if not isinstance(flags, dict):
+            return
+        keep = {
+            name: value
+            for name, value in flags.items()
+            if name in PERSISTENT_FLAGS and isinstance(value, (str, int, float, bool))
+        }
+        if keep:
+            self._flag_archive[cid] = keep
+
+    def _flags(self, cid: str, create: bool = False) -> Optional[Dict[str, Any]]:
+        """Flags vivos de `cid`, restaurando los archivados si la conversación fue expulsada."""
+        flags = self.state_flags.get(cid)
+        if flags is None:
+            archived = self._flag_archive.pop(cid, None)
+            if archived:
+                flags = dict(archived)
+                self.state_flags[cid] = flags
+            elif create:
+                flags = {}
+                self.state_flags[cid] = flags
+        return flags
+
     def set_flag(self, conversation_id: str, flag_name: str, value: Any = True) -> None:
         """Marca un flag de estado (ej. escalación activa)."""
         cid = self._clean_id(conversation_id)
-        self.state_flags.setdefault(cid, {})[flag_name] = value
+        self._flags(cid, create=True)[flag_name] = value
         if flag_name == "property_id" and value is not None:
             pending_keys: list[str] = []
             if cid:
@@ -853,11 +1421,12 @@ class MemoryManager:
     def get_flag(self, conversation_id: str, flag_name: str) -> Optional[Any]:
         """Recupera un flag de estado (None si no existe)."""
         cid = self._clean_id(conversation_id)
-        return self.state_flags.get(cid, {}).get(flag_name)
+        return (self._flags(cid) or {}).get(flag_name)
 
     def clear_flag(self, conversation_id: str, flag_name: str) -> None:
         """Elimina un flag de estado."""
         cid = self._clean_id(conversation_id)
-        if cid in self.state_flags and flag_name in self.state_flags[cid]:
-            del self.state_flags[cid][flag_name]
+        flags = self._flags(cid)
+        if flags and flag_name in flags:
+            del flags[flag_name]
             log.debug(f"🧹 Flag '{flag_name}' eliminado para {cid}")
@@ -1,13 +1,49 @@
+"""
+💾 Backup de mensajes (tabla `message_backup`)
+======================================================================================
+Copia de cada mensaje entrante/saliente para auditoría. No está en el camino crítico:
+`schedule_message_backup` encola y vuelve al instante (nunca bloquea el event loop).
+
+Un único `BatchWriter` acotado escribe los backups por lotes (insert multi-fila):
+- Cola de MESSAGE_BACKUP_QUEUE_MAX elementos; al llenarse se aplica
+  MESSAGE_BACKUP_OVERFLOW (drop_new/drop_oldest) y lo descartado se vuelca a disco.
+- Reintentos con backoff exponencial y jitter (MESSAGE_BACKUP_RETRIES); agotados, el
+  lote se vuelca a MESSAGE_BACKUP_SPILL_PATH (JSONL). Vacío = sin volcado (se pierde).
+- Tras un lote escrito con éxito se reinserta lo volcado (como mucho cada
+  MESSAGE_BACKUP_REPLAY_INTERVAL_SECONDS).
+
+Métricas: `bookai_message_backup_queue_depth`, `bookai_message_backup_lag_seconds` y
+`bookai_message_backup_rows_total{status}` (written/dropped/spilled/replayed/failed).
+"""
+
 from __future__ import annotations
 
+import json
 import logging
 import os
-from threading import Thread
-from typing import Any
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from core.batch_writer import BatchWriter, PartialBatchError
+from core.metrics import MESSAGE_BACKUP_LAG_SECONDS, MESSAGE_BACKUP_QUEUE_DEPTH, MESSAGE_BACKUP_ROWS_TOTAL
 
 log = logging.getLogger("MessageBackup")
 
 DEFAULT_BACKUP_TABLE = os.getenv("MESSAGE_BACKUP_TABLE", "message_backup")
+MESSAGE_BACKUP_QUEUE_MAX = int(os.getenv("MESSAGE_BACKUP_QUEUE_MAX", "5000"))
+MESSAGE_BACKUP_OVERFLOW = os.getenv("MESSAGE_BACKUP_OVERFLOW", "drop_new").strip().lower()
+MESSAGE_BACKUP_BATCH_MS = float(os.getenv("MESSAGE_BACKUP_BATCH_MS", "200"))
+MESSAGE_BACKUP_BATCH_MAX = int(os.getenv("MESSAGE_BACKUP_BATCH_MAX", "200"))
+MESSAGE_BACKUP_RETRIES = int(os.getenv("MESSAGE_BACKUP_RETRIES", "3"))
+MESSAGE_BACKUP_RETRY_BASE_MS = float(os.getenv("MESSAGE_BACKUP_RETRY_BASE_MS", "500"))
+MESSAGE_BACKUP_SPILL_PATH = os.getenv(
+    "MESSAGE_BACKUP_SPILL_PATH",
+    os.path.join(tempfile.gettempdir(), "bookai_message_backup_spill.jsonl"),
+).strip()
+MESSAGE_BACKUP_REPLAY_INTERVAL_SECONDS = float(os.getenv("MESSAGE_BACKUP_REPLAY_INTERVAL_SECONDS", "30"))
 
 
 def _clean_text(value: Any) -> str | None:
@@ -32,7 +68,7 @@ def _normalize_payload(payload: Any) -> dict | list | None:
     return {"value": payload}
 
 
-def safe_backup_message(
+def build_backup_payload(
     *,
     conversation_id: Any = None,
     original_chat_id: Any = None,
@@ -45,68 +81,275 @@ def safe_backup_message(
     external_message_id: Any = None,
     backup_payload: Any = None,
     backup_source: Any = None,
+) -> dict[str, Any]:
+    """Fila de `message_backup` con los campos normalizados (omite los vacíos)."""
+    direction_value = _clean_text(direction) or "outbound"
+    content_value = "" if content is None else str(content)
+    payload: dict[str, Any] = {
+        "direction": direction_value,
+        "content": content_value,
+        "backup_source": _clean_text(backup_source) or "unknown",
+    }
+
+    conversation_value = _clean_identifier(conversation_id)
+    if conversation_value:
+        payload["conversation_id"] = conversation_value
+
+    original_value = _clean_identifier(original_chat_id)
+    if original_value:
+        payload["original_chat_id"] = original_value
+
+    channel_value = _clean_text(channel)
+    if channel_value:
+        payload["channel"] = channel_value
+
+    property_value = _clean_text(property_id)
+    if property_value:
+        payload["property_id"] = property_value
+
+    instance_value = _clean_text(instance_id)
+    if instance_value:
+        payload["instance_id"] = instance_value
+
+    role_value = _clean_text(role)
+    if role_value:
+        payload["role"] = role_value
+
+    external_value = _clean_text(external_message_id)
+    if external_value:
+        payload["external_message_id"] = external_value
+
+    normalized_backup_payload = _normalize_payload(backup_payload)
+    if normalized_backup_payload is not None:
+        payload["backup_payload"] = normalized_backup_payload
+    return payload
+
+
+def _default_client() -> Any:
+    from core.db import supabase as default_supabase
+
+    return default_supabase
+
+
+def safe_backup_message(
+    *,
     supabase_client: Any = None,
     table: str | None = None,
+    **fields: Any,
 ) -> None:
+    """Inserta el backup de forma síncrona (una petición). Preferir `schedule_message_backup`."""
     try:
-        client = supabase_client
-        if client is None:
-            from core.db import supabase as default_supabase
+        client = supabase_client if supabase_client is not None else _default_client()
+        client.table(table or DEFAULT_BACKUP_TABLE).insert(build_backup_payload(**fields)).execute()
+    except Exception as exc:
+        log.warning("⚠️ No se pudo guardar backup de mensaje: %s", exc, exc_info=True)
 
-            client = default_supabase
 
-        direction_value = _clean_text(direction) or "outbound"
-        content_value = "" if content is None else str(content)
-        payload: dict[str, Any] = {
-            "direction": direction_value,
-            "content": content_value,
-            "backup_source": _clean_text(backup_source) or "unknown",
-        }
+# =============================================================
+# 🧵 Escritor acotado con volcado a disco
+# =============================================================
+class MessageBackupWriter:
+    """Cola acotada + hilo escritor por lotes; lo que no se puede escribir va a un JSONL local."""
 
-        conversation_value = _clean_identifier(conversation_id)
-        if conversation_value:
-            payload["conversation_id"] = conversation_value
+    def __init__(
+        self,
+        *,
+        client: Any = None,
+        max_queue: int = MESSAGE_BACKUP_QUEUE_MAX,
+        overflow: str = MESSAGE_BACKUP_OVERFLOW,
+        batch_ms: float = MESSAGE_BACKUP_BATCH_MS,
+        max_batch: int = MESSAGE_BACKUP_BATCH_MAX,
+        retries: int = MESSAGE_BACKUP_RETRIES,
+        retry_base_ms: float = MESSAGE_BACKUP_RETRY_BASE_MS,
+        spill_path: str = MESSAGE_BACKUP_SPILL_PATH,
+        replay_interval_seconds: float = MESSAGE_BACKUP_REPLAY_INTERVAL_SECONDS,
+    ):
+        if overflow not in {"drop_new", "drop_oldest"}:
+            # "block" no vale aquí: se encola desde el event loop.
+            log.warning("⚠️ MESSAGE_BACKUP_OVERFLOW=%s no soportado; se usa drop_new", overflow)
+            overflow = "drop_new"
+        self._client = client
+        self.spill_path = spill_path or None
+        self.replay_interval = max(0.0, float(replay_interval_seconds))
+        self._spill_lock = threading.Lock()
+        self._last_replay = 0.0
+        self._stats = {"spilled": 0, "replayed": 0, "lost": 0, "replay_errors": 0}
+        self._writer = BatchWriter(
+            "message_backup",
+            self._write_batch,
+            batch_ms=batch_ms,
+            max_batch=max_batch,
+            max_queue=max_queue,
+            overflow=overflow,
+            on_drop=self._on_drop,
+            retries=retries,
+            retry_base_ms=retry_base_ms,
+            on_failure=self._on_failure,
+            on_written=self._on_written,
+        )
 
-        original_value = _clean_identifier(original_chat_id)
-        if original_value:
-            payload["original_chat_id"] = original_value
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def submit(self, table: str, payload: dict) -> bool:
+        accepted = self._writer.submit((table, payload))
+        MESSAGE_BACKUP_QUEUE_DEPTH.set(self._writer.stats()["depth"])
+        return accepted
 
-        channel_value = _clean_text(channel)
-        if channel_value:
-            payload["channel"] = channel_value
+    def flush(self, timeout: float = 10.0) -> bool:
+        return self._writer.flush(timeout)
 
-        property_value = _clean_text(property_id)
-        if property_value:
-            payload["property_id"] = property_value
+    def close(self, timeout: float = 10.0) -> bool:
+        return self._writer.close(timeout)
 
-        instance_value = _clean_text(instance_id)
-        if instance_value:
-            payload["instance_id"] = instance_value
+    def stats(self) -> Dict[str, Any]:
+        stats = self._writer.stats()
+        stats.update(self._stats)
+        stats["spill_path"] = self.spill_path
+        stats["spill_pending"] = self._spill_pending()
+        return stats
 
-        role_value = _clean_text(role)
-        if role_value:
-            payload["role"] = role_value
+    # ------------------------------------------------------------------
+    # Escritura (hilo del BatchWriter)
+    # ------------------------------------------------------------------
+    def _insert(self, items: List[Tuple[str, dict]]) -> None:
+        """Un insert multi-fila por (tabla, columnas): PostgREST exige las mismas claves.
 
-        external_value = _clean_text(external_message_id)
-        if external_value:
-            payload["external_message_id"] = external_value
+        Cada grupo es una petición independiente: si uno falla, `PartialBatchError` lleva
+        solo los grupos sin escribir para no reintentar ni volcar filas ya insertadas.
+        """
+        groups: Dict[Tuple[str, frozenset], List[Tuple[str, dict]]] = defaultdict(list)
+        for item in items:
+            table, payload = item
+            groups[(table, frozenset(payload))].append(item)
+        client = self._client if self._client is not None else _default_client()
+        pending = list(groups.values())
+        while pending:
+            group = pending[0]
+            rows = [payload for _, payload in group]
+            try:
+                client.table(group[0][0]).insert(rows if len(rows) > 1 else rows[0]).execute()
+            except Exception as exc:
+                if len(pending) == len(groups):
+                    raise
+                raise PartialBatchError([item for remaining in pending for item in remaining], exc) from exc
+            pending.pop(0)
 
-        normalized_backup_payload = _normalize_payload(backup_payload)
-        if normalized_backup_payload is not None:
-            payload["backup_payload"] = normalized_backup_payload
+    def _write_batch(self, batch: List[Tuple[str, dict]]) -> None:
+        self._insert(batch)
 
-        client.table(table or DEFAULT_BACKUP_TABLE).insert(payload).execute()
-    except Exception as exc:
-        log.warning("⚠️ No se pudo guardar backup de mensaje: %s", exc, exc_info=True)
+    def _on_written(self, size: int, lag_seconds: float) -> None:
+        MESSAGE_BACKUP_ROWS_TOTAL.inc(size, status="written")
+        MESSAGE_BACKUP_LAG_SECONDS.observe(lag_seconds)
+        MESSAGE_BACKUP_QUEUE_DEPTH.set(self._writer.stats()["depth"])
+        # Supabase responde: buen momento para reinsertar lo volcado.
+        if self.spill_path and time.monotonic() - self._last_replay >= self.replay_interval:
+            self._last_replay = time.monotonic()
+            self.replay_spill()
+
+    def _on_drop(self, items: List[Tuple[str, dict]]) -> None:
+        MESSAGE_BACKUP_ROWS_TOTAL.inc(len(items), status="dropped")
+        self._spill(items)
+
+    def _on_failure(self, batch: List[Tuple[str, dict]]) -> None:
+        MESSAGE_BACKUP_ROWS_TOTAL.inc(len(batch), status="failed")
+        self._spill(batch)
 
+    # ------------------------------------------------------------------
+    # Volcado a disco
+    # ------------------------------------------------------------------
+    def _spill(self, items: List[Tuple[str, dict]]) -> None:
+        if not items:
+            return
+        if not self.spill_path:
+            self._stats["lost"] += len(items)
+            log.warning("⚠️ %s backups de mensaje perdidos (sin MESSAGE_BACKUP_SPILL_PATH)", len(items))
+            return
+        lines = "".join(
+            json.dumps({"table": table, "payload": payload}, ensure_ascii=False, default=str) + "\n"
+            for table, payload in items
+        )
+        try:
+            with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as fh:
+                fh.write(lines)
+            self._stats["spilled"] += len(items)
+            MESSAGE_BACKUP_ROWS_TOTAL.inc(len(items), status="spilled")
+        except Exception as exc:
+            self._stats["lost"] += len(items)
+            log.error("⚠️ No se pudo volcar backups de mensaje a %s: %s", self.spill_path, exc, exc_info=True)
 
-def schedule_message_backup(**kwargs: Any) -> None:
+    def _spill_pending(self) -> bool:
+        if not self.spill_path:
+            return False
+        return any(os.path.exists(path) for path in (self.spill_path, self.spill_path + ".replay"))
+
+    def replay_spill(self) -> int:
+        """Reinserta lo volcado a disco en lotes. Lo que vuelva a fallar se queda en el fichero."""
+        if not self.spill_path:
+            return 0
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            # Un `.replay` previo (p.ej. reinicio a mitad) se procesa antes que el volcado nuevo.
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return 0
+                os.replace(self.spill_path, replay_path)
+        items: List[Tuple[str, dict]] = []
+        try:
+            with open(replay_path, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                        items.append((record["table"], record["payload"]))
+                    except Exception:
+                        log.warning("⚠️ Línea inválida en %s descartada", replay_path)
+        except Exception as exc:
+            log.error("⚠️ No se pudo leer %s: %s", replay_path, exc, exc_info=True)
+            return 0
+
+        replayed = 0
+        chunk = self._writer.max_batch
+        for start in range(0, len(items), chunk):
+            batch = items[start:start + chunk]
+            try:
+                self._insert(batch)
+            except Exception as exc:
+                unwritten = exc.remaining if isinstance(exc, PartialBatchError) else batch
+                replayed += len(batch) - len(unwritten)
+                self._stats["replay_errors"] += 1
+                log.warning("⚠️ Reinserción de backups interrumpida (%s); se reintentará", exc)
+                self._spill(unwritten + items[start + chunk:])
+                break
+            replayed += len(batch)
+        try:
+            os.remove(replay_path)
+        except OSError:
+            pass
+        if replayed:
+            self._stats["replayed"] += replayed
+            MESSAGE_BACKUP_ROWS_TOTAL.inc(replayed, status="replayed")
+            log.info("💾 %s backups de mensaje reinsertados desde %s", replayed, replay_path)
+        return replayed
+
+
+message_backup_writer = MessageBackupWriter()
+
+
+def schedule_message_backup(*, supabase_client: Any = None, table: str | None = None, **fields: Any) -> None:
+    """Encola el backup del mensaje (no bloquea). Con un cliente propio se escribe en un hilo aparte."""
     try:
-        Thread(
-            target=safe_backup_message,
-            kwargs=kwargs,
-            daemon=True,
-            name="message-backup",
-        ).start()
+        if supabase_client is not None:
+            threading.Thread(
+                target=safe_backup_message,
+                kwargs={"supabase_client": supabase_client, "table": table, **fields},
+                daemon=True,
+                name="message-backup",
+            ).start()
+            return
+        message_backup_writer.submit(table or DEFAULT_BACKUP_TABLE, build_backup_payload(**fields))
     except Exception as exc:
         log.warning("⚠️ No se pudo planificar backup de mensaje: %s", exc, exc_info=True)
+
+
+def get_message_backup_stats() -> Dict[str, Any]:
+    return message_backup_writer.stats()
@@ -1,19 +1,79 @@
 import asyncio
 import logging
+import os
+import re
+import time
 from dataclasses import dataclass, field
-from typing import Callable, Awaitable, Dict, List, Optional, Tuple
+from typing import Callable, Awaitable, List, Optional, Tuple
+
+from core.metrics import (
+    BUFFER_DEBOUNCE_DECISIONS_TOTAL,
+    BUFFER_DEBOUNCE_EXTENDED_SECONDS_TOTAL,
+    BUFFER_DEBOUNCE_SAVED_SECONDS_TOTAL,
+    BUFFER_WAIT_SECONDS,
+)
+from core.speculation import SpeculativeRun, speculation_stats
+from core.timer_wheel import TimerWheel, timer_wheel
+from core.ttl_cache import TTLCache
+from core.utils.env import env_bool
 
 log = logging.getLogger("MessageBufferManager")
 
+# =============================================================
+# ⏳ Debounce adaptativo (opt-in)
+# =============================================================
+MESSAGE_BUFFER_ADAPTIVE = env_bool("MESSAGE_BUFFER_ADAPTIVE", False)
+MESSAGE_BUFFER_MIN_SECONDS = float(os.getenv("MESSAGE_BUFFER_MIN_SECONDS", "2.5"))
+MESSAGE_BUFFER_MAX_SECONDS = float(os.getenv("MESSAGE_BUFFER_MAX_SECONDS", "45"))
+MESSAGE_BUFFER_COMPLETE_CHARS = int(os.getenv("MESSAGE_BUFFER_COMPLETE_CHARS", "60"))
+# Arranca el bloque antes de que venza la espera si parece completo (ver core/speculation.py).
+MESSAGE_BUFFER_SPECULATIVE = env_bool("MESSAGE_BUFFER_SPECULATIVE", False)
+
+_GAP_EWMA_ALPHA = 0.3
+_QUESTION_MIN_CHARS = 10
+_SENTENCE_MIN_CHARS = 30
+_INCOMPLETE_ENDINGS = (",", ":", ";", "-", "...", "…", "(")
+# Conectores que, al final de un mensaje, indican que el huésped sigue escribiendo.
+_TRAILING_CONNECTORS = {
+    "y", "e", "o", "u", "pero", "que", "porque", "para", "por", "con", "sin", "de", "del", "en",
+    "a", "al", "el", "la", "los", "las", "un", "una", "si", "como", "cuando", "también", "ademas", "además",
+    "and", "or", "but", "because", "so", "with", "for", "to", "the", "of", "if", "also",
+    "et", "ou", "mais", "avec", "pour", "und", "oder", "aber", "mit", "ma", "per",
+}
+_LAST_WORD_RE = re.compile(r"([^\W\d_]+)\W*$", re.UNICODE)
+
+
+def looks_complete(block: str) -> bool:
+    """
+    Heurística de mensaje "terminado": pregunta cerrada, frase con punto final o bloque
+    largo, sin conector ni puntuación colgante al final.
+    """
+    text = (block or "").strip()
+    if not text or text.endswith(_INCOMPLETE_ENDINGS):
+        return False
+    match = _LAST_WORD_RE.search(text)
+    if match and match.group(1).lower() in _TRAILING_CONNECTORS:
+        return False
+    if text.endswith(("?", "？")):
+        return len(text) >= _QUESTION_MIN_CHARS
+    if text.endswith((".", "!", "！")):
+        return len(text) >= _SENTENCE_MIN_CHARS
+    return len(text) >= MESSAGE_BUFFER_COMPLETE_CHARS
+
 
 @dataclass
 class ConversationState:
     messages: List[str] = field(default_factory=list)
-    timer_task: Optional[asyncio.Task] = None
     processing_task: Optional[asyncio.Task] = None
     pending_blocks: List[Tuple[str, int]] = field(default_factory=list)
     lock: asyncio.Lock = field(default_factory=asyncio.Lock)
     version: int = 0  # aumenta con cada mensaje para invalidar procesos antiguos
+    first_message_at: Optional[float] = None  # llegada del primer mensaje del bloque en curso
+    last_message_at: Optional[float] = None
+    gap_ewma: Optional[float] = None  # hueco típico entre mensajes de esta conversación
+    debounce_decision: str = "fixed"
+    debounce_delay: float = 0.0
+    speculation: Optional[SpeculativeRun] = None  # ejecución adelantada del bloque en curso
 
 
 class MessageBufferManager:
@@ -23,75 +83,274 @@ class MessageBufferManager:
       ✅ Reinicia temporizador con cada nuevo mensaje
       ✅ Combina mensajes como bloque coherente (con saltos de línea)
       ✅ Llama al callback tras inactividad de `idle_seconds`
+
+    Los temporizadores de inactividad viven en el timer wheel compartido
+    (core/timer_wheel.py): cada mensaje reprograma la entrada de su conversación
+    en O(1) en vez de cancelar y crear una Task.
+
+    En modo adaptativo (MESSAGE_BUFFER_ADAPTIVE) la espera depende del mensaje y del
+    ritmo aprendido de cada conversación (ver `_debounce_delay`).
+
+    En modo especulativo (MESSAGE_BUFFER_SPECULATIVE) un bloque que parece completo se
+    empieza a procesar en cuanto llega; se confirma si vence la espera con la misma
+    `state.version` y se cancela si entra otro mensaje.
     """
 
-    def __init__(self, idle_seconds: float = 15.0):
+    def __init__(
+        self,
+        idle_seconds: float = 15.0,
+        scheduler: Optional[TimerWheel] = None,
+        adaptive: Optional[bool] = None,
+        min_seconds: float = MESSAGE_BUFFER_MIN_SECONDS,
+        max_seconds: float = MESSAGE_BUFFER_MAX_SECONDS,
+        speculative: Optional[bool] = None,
+    ):
         self.idle_seconds = float(idle_seconds)
-        self._convs: Dict[str, ConversationState] = {}
+        self.speculative = MESSAGE_BUFFER_SPECULATIVE if speculative is None else bool(speculative)
+        self._convs: TTLCache = TTLCache("buffer_conversations", can_evict=self._idle_state)
+        self._scheduler = scheduler if scheduler is not None else timer_wheel
+        self.adaptive = MESSAGE_BUFFER_ADAPTIVE if adaptive is None else bool(adaptive)
+        self.min_seconds = min(float(min_seconds), self.idle_seconds)
+        self.max_seconds = max(float(max_seconds), self.idle_seconds)
+
+    def _timer_key(self, conversation_id: str) -> Tuple[str, int, str]:
+        return ("buffer", id(self), conversation_id)
+
+    @staticmethod
+    def _idle_state(_cid: str, state: ConversationState) -> bool:
+        """Solo se expulsan conversaciones sin mensajes, bloques ni procesamiento en curso."""
+        return not (
+            state.messages
+            or state.pending_blocks
+            or state.lock.locked()
+            or (state.processing_task and not state.processing_task.done())
+        )
 
     def _get_state(self, cid: str) -> ConversationState:
-        if cid not in self._convs:
-            self._convs[cid] = ConversationState()
-        return self._convs[cid]
+        state = self._convs.get(cid)
+        if state is None:
+            state = ConversationState()
+            self._convs[cid] = state
+        return state
 
     async def add_message(
         self,
         conversation_id: str,
         text: str,
         process_callback: Callable[[str, str, int], Awaitable[None]],
+        on_first_message: Optional[Callable[[str], object]] = None,
     ):
         """
         Añade un mensaje al buffer y reinicia el temporizador.
         Si no hay más mensajes después de `idle_seconds`, se procesa el bloque combinado.
+        `on_first_message(conversation_id)` se llama (síncrono) con el primer mensaje de
+        cada bloque: aprovecha la espera para precargar contexto.
         """
         state = self._get_state(conversation_id)
 
         async with state.lock:
+            now = time.monotonic()
+            if not state.messages:
+                state.first_message_at = now
+                if on_first_message is not None:
+                    try:
+                        on_first_message(conversation_id)
+                    except Exception as exc:
+                        log.warning("⚠️ Error en hook de primer mensaje para %s: %s", conversation_id, exc)
+            self._learn_gap(state, now)
             state.messages.append(text.strip())
             state.version += 1
             current_version = state.version
+            delay, decision = self._debounce_delay(state, now)
+            state.debounce_delay = delay
+            state.debounce_decision = decision
 
-            # Cancelar temporizador previo
-            if state.timer_task and not state.timer_task.done():
-                state.timer_task.cancel()
-
-            # Nuevo temporizador
-            state.timer_task = asyncio.create_task(
-                self._start_timer(conversation_id, current_version, process_callback)
+            # Reprogramar el temporizador de inactividad (reemplaza al previo)
+            self._scheduler.call_later(
+                self._timer_key(conversation_id),
+                delay,
+                self._on_idle,
+                conversation_id,
+                current_version,
+                process_callback,
             )
 
+            # Un mensaje nuevo invalida la ejecución adelantada de la versión anterior.
+            self._cancel_speculation(state)
+            if self.speculative:
+                self._maybe_speculate(conversation_id, state, current_version, process_callback)
+
         log.info(f"🧩 Buffer actualizado ({len(state.messages)} msgs) para {conversation_id}")
 
-    async def _start_timer(
+    def _learn_gap(self, state: ConversationState, now: float) -> None:
+        """EWMA de los huecos entre mensajes seguidos (incluye los que llegan justo tras un envío)."""
+        if state.last_message_at is not None:
+            gap = now - state.last_message_at
+            if gap <= self.max_seconds:
+                if state.gap_ewma is None:
+                    state.gap_ewma = gap
+                else:
+                    state.gap_ewma = _GAP_EWMA_ALPHA * gap + (1 - _GAP_EWMA_ALPHA) * state.gap_ewma
+        state.last_message_at = now
+
+    def _debounce_delay(self, state: ConversationState, now: float) -> Tuple[float, str]:
+        """
+        Espera hasta procesar el bloque y decisión tomada:
+          - fixed: modo clásico, siempre `idle_seconds`
+          - early: el bloque parece completo → espera mínima (o el hueco típico del huésped)
+          - extended: ráfaga rápida (varios mensajes, hueco típico corto) → espera más
+            que `idle_seconds`, hasta `max_seconds`
+          - learned: se ajusta al ritmo aprendido; un mensaje suelto de un huésped que
+            tarda en escribir el siguiente no espera la ventana completa
+          - capped: recortado por el máximo absoluto desde el primer mensaje
+        """
+        base = self.idle_seconds
+        if not self.adaptive:
+            return base, "fixed"
+
+        gap = state.gap_ewma
+        if looks_complete("\n".join(state.messages)):
+            delay = self.min_seconds
+            if gap is not None:
+                delay = max(self.min_seconds, min(base, gap * 1.5))
+            decision = "early"
+        elif gap is None:
+            delay, decision = base, "fixed"
+        elif len(state.messages) > 1 and gap * 2 <= base:
+            # El huésped sigue escribiendo: se deja margen para un par de mensajes más.
+            delay, decision = min(self.max_seconds, base + gap * 2), "extended"
+        elif len(state.messages) == 1 and gap * 2 > base:
+            # Su siguiente mensaje llegaría tarde de todos modos: media ventana.
+            delay, decision = max(self.min_seconds, base / 2), "learned"
+        else:
+            delay, decision = max(self.min_seconds, min(base, gap * 3)), "learned"
+
+        if state.first_message_at is not None:
+            remaining = self.max_seconds - (now - state.first_message_at)
+            if delay > remaining:
+                delay, decision = max(0.0, remaining), "capped"
+        return delay, decision
+
+    def _on_idle(
+        self,
+        conversation_id: str,
+        version: int,
+        process_callback: Callable[[str, str, int], Awaitable[None]],
+    ) -> Awaitable[None]:
+        """Vence el temporizador de inactividad (el timer wheel lanza la corrutina como Task)."""
+        return self._flush(conversation_id, version, process_callback)
+
+    async def _flush(
         self,
         conversation_id: str,
         version: int,
         process_callback: Callable[[str, str, int], Awaitable[None]],
     ):
-        """Espera `idle_seconds`. Si no llegan más mensajes, procesa el bloque."""
-        try:
-            await asyncio.sleep(self.idle_seconds)
-            state = self._get_state(conversation_id)
+        """Sin mensajes nuevos en `idle_seconds`: combina y encola el bloque."""
+        state = self._get_state(conversation_id)
 
-            async with state.lock:
-                if version != state.version:
-                    return  # hubo nuevos mensajes → cancelar
+        async with state.lock:
+            if version != state.version:
+                return  # hubo nuevos mensajes → cancelar
+
+            messages = list(state.messages)
+            state.messages.clear()
+            if not messages:
+                return
+            if state.first_message_at is not None:
+                BUFFER_WAIT_SECONDS.observe(time.monotonic() - state.first_message_at)
+                state.first_message_at = None
+            self._record_debounce(state)
 
-                messages = list(state.messages)
-                state.messages.clear()
-                state.timer_task = None
-                if not messages:
-                    return
+            run = state.speculation
+            state.speculation = None
+            if run is not None and run.version == version:
+                # Acierto: la ejecución adelantada ya es la definitiva.
+                speculation_stats.committed(run)
+                run.commit()
+                if not run.task.done():
+                    state.processing_task = run.task
+                else:
+                    self._launch_next(conversation_id, process_callback, state)
+                return
+            if run is not None:
+                self._abort_speculation(run)
 
-                # 🔹 Combinar mensajes con saltos de línea y limpieza
-                combined = self._combine_messages(messages)
+            # 🔹 Combinar mensajes con saltos de línea y limpieza
+            combined = self._combine_messages(messages)
 
-                # Encolar bloque para procesarlo en orden de llegada
-                state.pending_blocks.append((combined, version))
-                self._launch_next(conversation_id, process_callback, state)
+            # Encolar bloque para procesarlo en orden de llegada
+            state.pending_blocks.append((combined, version))
+            self._launch_next(conversation_id, process_callback, state)
+
+    # ------------------------------------------------------------------
+    # Especulación
+    # ------------------------------------------------------------------
+    def _maybe_speculate(
+        self,
+        conversation_id: str,
+        state: ConversationState,
+        version: int,
+        process_callback: Callable[[str, str, int], Awaitable[None]],
+    ) -> None:
+        """Adelanta el bloque si parece completo y no hay otro en curso o en cola (orden)."""
+        if state.pending_blocks or (state.processing_task and not state.processing_task.done()):
+            return
+        if not looks_complete("\n".join(state.messages)):
+            return
+        combined = self._combine_messages(state.messages)
+        run = SpeculativeRun(conversation_id, version)
+        run.task = asyncio.create_task(
+            self._run_speculative(conversation_id, combined, version, process_callback, run)
+        )
+        state.speculation = run
+        speculation_stats.started()
+        log.info("🎲 Especulando bloque v%s para %s", version, conversation_id)
 
+    async def _run_speculative(
+        self,
+        conversation_id: str,
+        combined: str,
+        version: int,
+        process_callback: Callable[[str, str, int], Awaitable[None]],
+        run: SpeculativeRun,
+    ):
+        """Como `_run_block`, pero parada en las barreras de efectos hasta que se confirme."""
+        run.activate()
+        try:
+            await process_callback(conversation_id, combined, version)
         except asyncio.CancelledError:
-            return  # Timer cancelado, llega mensaje nuevo
+            return
+        except Exception as e:
+            log.error(f"⚠️ Error procesando bloque especulativo {conversation_id}: {e}", exc_info=True)
+        finally:
+            if run.committed:
+                state = self._get_state(conversation_id)
+                async with state.lock:
+                    if state.processing_task is run.task:
+                        state.processing_task = None
+                    self._launch_next(conversation_id, process_callback, state)
+
+    def _cancel_speculation(self, state: ConversationState) -> None:
+        run = state.speculation
+        state.speculation = None
+        if run is not None:
+            self._abort_speculation(run)
+
+    @staticmethod
+    def _abort_speculation(run: SpeculativeRun) -> None:
+        if run.committed or run.aborted:
+            return
+        run.abort()
+        speculation_stats.cancelled(run)
+
+    def _record_debounce(self, state: ConversationState) -> None:
+        BUFFER_DEBOUNCE_DECISIONS_TOTAL.inc(decision=state.debounce_decision)
+        saved = self.idle_seconds - state.debounce_delay
+        if saved > 0:
+            BUFFER_DEBOUNCE_SAVED_SECONDS_TOTAL.inc(saved)
+        elif saved < 0:
+            BUFFER_DEBOUNCE_EXTENDED_SECONDS_TOTAL.inc(-saved)
 
     def _launch_next(
         self,
@@ -168,11 +427,11 @@ class MessageBufferManager:
         async with state.lock:
             dropped = bool(state.messages or state.pending_blocks)
             state.messages.clear()
+            state.first_message_at = None
             state.pending_blocks.clear()
 
-            if state.timer_task and not state.timer_task.done():
-                state.timer_task.cancel()
-            state.timer_task = None
+            self._scheduler.cancel(self._timer_key(conversation_id))
+            self._cancel_speculation(state)
 
             if cancel_processing and state.processing_task and not state.processing_task.done():
                 state.processing_task.cancel()
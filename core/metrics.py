@@ -0,0 +1,465 @@
+"""
+📈 Métricas estilo Prometheus (sin dependencias externas)
+======================================================================================
+Registro mínimo de contadores, gauges e histogramas con etiquetas, thread-safe (los
+accesos a Supabase corren en el pool de hilos) y serializado en el formato de texto
+de Prometheus (0.0.4) que expone `GET /metrics` en main.py.
+
+Métricas instrumentadas:
+- bookai_pipeline_stage_seconds{stage}: espera en buffer, supervisor input, MainAgent,
+  supervisor output, envío por canal y pipeline completo.
+- bookai_buffer_debounce_*: decisiones del debounce adaptativo y segundos ahorrados/añadidos.
+- bookai_agent_tool_seconds{tool,status}: cada tool de sub-agente del MainAgent.
+- bookai_llm_requests_total / bookai_llm_request_seconds / bookai_llm_tokens_total por tier.
+- bookai_mcp_calls_total / bookai_mcp_call_seconds por tool MCP.
+- bookai_supabase_queries_total / bookai_supabase_query_seconds por tabla.
+- bookai_event_loop_lag_seconds / bookai_event_loop_stalls_total{blocker}: watchdog del
+  event loop (core/loop_watchdog.py, opt-in).
+
+METRICS_ENABLED=false desactiva el registro (las llamadas pasan a ser no-ops).
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from core.utils.env import env_bool
+
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+
+# Buckets en segundos: de accesos a BD (ms) a turnos completos del agente (decenas de s).
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0,
+)
+# La espera en buffer es del orden de `idle_seconds` (segundos a minutos).
+BUFFER_BUCKETS: Tuple[float, ...] = (0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 120.0, 300.0)
+# El lag sano del event loop es de ms; los bloqueos que buscamos, de cientos de ms a segundos.
+LOOP_LAG_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape_label(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# =============================================================
+# 📊 Tipos de métrica
+# =============================================================
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etiquetas esperadas {self.labelnames}, recibidas {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if not METRICS_ENABLED or amount < 0:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        if "le" in self.labelnames:
+            raise ValueError("'le' está reservado para los buckets del histograma")
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        # Por serie: [conteos por bucket (no acumulados) + overflow, suma]
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = ([0] * (len(self.buckets) + 1), [0.0])
+                self._series[key] = series
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observa la duración (s) del bloque, también si lanza excepción."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        lines: List[str] = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{plain} {_format_value(total)}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+# =============================================================
+# 🗂️ Registro
+# =============================================================
+class MetricsRegistry:
+    """Colección de métricas con nombre único, serializable a texto Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Métrica ya registrada con otra definición: {metric.name}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render_metrics() -> str:
+    return registry.render()
+
+
+# =============================================================
+# 📌 Métricas de la aplicación
+# =============================================================
+PIPELINE_STAGE_SECONDS = registry.histogram(
+    "bookai_pipeline_stage_seconds",
+    "Duración de cada etapa del procesamiento de mensajes.",
+    ("stage",),
+)
+BUFFER_WAIT_SECONDS = registry.histogram(
+    "bookai_buffer_wait_seconds",
+    "Tiempo desde el primer mensaje del bloque hasta que se despacha al pipeline.",
+    buckets=BUFFER_BUCKETS,
+)
+BUFFER_DEBOUNCE_DECISIONS_TOTAL = registry.counter(
+    "bookai_buffer_debounce_decisions_total",
+    "Bloques despachados por el buffer según la decisión de espera (fixed/early/extended/learned/capped).",
+    ("decision",),
+)
+BUFFER_DEBOUNCE_SAVED_SECONDS_TOTAL = registry.counter(
+    "bookai_buffer_debounce_saved_seconds_total",
+    "Segundos de espera ahorrados frente a idle_seconds por el debounce adaptativo.",
+)
+BUFFER_DEBOUNCE_EXTENDED_SECONDS_TOTAL = registry.counter(
+    "bookai_buffer_debounce_extended_seconds_total",
+    "Segundos de espera añadidos sobre idle_seconds al alargar la ventana en ráfagas.",
+)
+SPECULATION_RUNS_TOTAL = registry.counter(
+    "bookai_speculation_runs_total",
+    "Ejecuciones especulativas del buffer por resultado (committed = acierto, cancelled = llegó otro mensaje).",
+    ("outcome",),
+)
+SPECULATION_WASTED_TOKENS_TOTAL = registry.counter(
+    "bookai_speculation_wasted_tokens_total",
+    "Tokens LLM consumidos por ejecuciones especulativas canceladas (prompt/completion).",
+    ("kind",),
+)
+CONTEXT_PREFETCH_TOTAL = registry.counter(
+    "bookai_context_prefetch_total",
+    "Snapshots de contexto precargados durante la espera del buffer, por resultado al consumirlos (hit/stale/miss/error) y cargas en línea sin precarga (loaded).",
+    ("result",),
+)
+CONVERSATION_CONTEXT_LOADS_TOTAL = registry.counter(
+    "bookai_conversation_context_loads_total",
+    "Contextos de conversación cargados por origen (rpc = una petición, queries = consultas sueltas, fake).",
+    ("source",),
+)
+HISTORY_CACHE_TOTAL = registry.counter(
+    "bookai_history_cache_total",
+    "Consultas de historial de conversación servidas desde la caché de MemoryManager (hit) o desde Supabase (miss).",
+    ("result",),
+)
+HISTORY_CACHE_READS_SAVED_TOTAL = registry.counter(
+    "bookai_history_cache_reads_saved_total",
+    "Lecturas de chat_history en Supabase evitadas por la caché de historial (incluye el fallback sin property_id).",
+)
+MESSAGE_BACKUP_QUEUE_DEPTH = registry.gauge(
+    "bookai_message_backup_queue_depth",
+    "Backups de mensajes encolados pendientes de escribir en Supabase.",
+)
+MESSAGE_BACKUP_LAG_SECONDS = registry.histogram(
+    "bookai_message_backup_lag_seconds",
+    "Espera en cola del backup más antiguo de cada lote escrito.",
+)
+MESSAGE_BACKUP_ROWS_TOTAL = registry.counter(
+    "bookai_message_backup_rows_total",
+    "Filas de message_backup por destino (written/dropped/spilled/replayed/failed).",
+    ("status",),
+)
+INSTANCE_REGISTRY_LOOKUPS_TOTAL = registry.counter(
+    "bookai_instance_registry_lookups_total",
+    "Búsquedas de instancias/properties servidas desde el registro en memoria (hit) o que caen a Supabase (miss/bypass).",
+    ("kind", "result"),
+)
+AGENT_TOOL_SECONDS = registry.histogram(
+    "bookai_agent_tool_seconds",
+    "Duración de las tools de sub-agente invocadas por el MainAgent.",
+    ("tool", "status"),
+)
+LLM_REQUESTS_TOTAL = registry.counter(
+    "bookai_llm_requests_total",
+    "Peticiones HTTP al proveedor LLM por tier.",
+    ("tier", "status"),
+)
+LLM_REQUEST_SECONDS = registry.histogram(
+    "bookai_llm_request_seconds",
+    "Latencia hasta cabeceras de respuesta del proveedor LLM por tier.",
+    ("tier",),
+)
+LLM_TOKENS_TOTAL = registry.counter(
+    "bookai_llm_tokens_total",
+    "Tokens consumidos por tier (prompt/completion).",
+    ("tier", "kind"),
+)
+MCP_CALLS_TOTAL = registry.counter(
+    "bookai_mcp_calls_total",
+    "Llamadas a tools MCP.",
+    ("server", "tool", "status"),
+)
+MCP_CALL_SECONDS = registry.histogram(
+    "bookai_mcp_call_seconds",
+    "Duración de las llamadas a tools MCP.",
+    ("tool",),
+)
+SUPABASE_QUERIES_TOTAL = registry.counter(
+    "bookai_supabase_queries_total",
+    "Consultas PostgREST a Supabase con respuesta, por tabla y operación.",
+    ("table", "operation", "status"),
+)
+SUPABASE_QUERY_SECONDS = registry.histogram(
+    "bookai_supabase_query_seconds",
+    "Latencia hasta cabeceras de respuesta de las consultas a Supabase por tabla.",
+    ("table",),
+)
+EVENT_LOOP_LAG_SECONDS = registry.histogram(
+    "bookai_event_loop_lag_seconds",
+    "Retraso del event loop medido por el watchdog.",
+    buckets=LOOP_LAG_BUCKETS,
+)
+EVENT_LOOP_STALLS_TOTAL = registry.counter(
+    "bookai_event_loop_stalls_total",
+    "Bloqueos del event loop por encima del umbral, por función bloqueante muestreada.",
+    ("blocker",),
+)
+
+
+def time_stage(stage: str):
+    """`with time_stage("supervisor_input"): ...` → observa la etapa del pipeline."""
+    return PIPELINE_STAGE_SECONDS.time(stage=stage)
+
+
+def record_llm_request(tier: str, elapsed_s: float, ok: bool) -> None:
+    LLM_REQUESTS_TOTAL.inc(tier=tier, status="ok" if ok else "error")
+    LLM_REQUEST_SECONDS.observe(elapsed_s, tier=tier)
+
+
+def record_llm_tokens(tier: str, prompt_tokens: int, completion_tokens: int) -> None:
+    if prompt_tokens:
+        LLM_TOKENS_TOTAL.inc(prompt_tokens, tier=tier, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS_TOTAL.inc(completion_tokens, tier=tier, kind="completion")
+
+
+def record_mcp_call(server: str, tool: str, elapsed_s: float, ok: bool) -> None:
+    MCP_CALLS_TOTAL.inc(server=server or "", tool=tool, status="ok" if ok else "error")
+    MCP_CALL_SECONDS.observe(elapsed_s, tool=tool)
+
+
+# =============================================================
+# 🗄️ Supabase (hooks httpx del cliente PostgREST)
+# =============================================================
+_OPERATIONS = {"GET": "select", "HEAD": "select", "POST": "insert", "PATCH": "update", "PUT": "upsert", "DELETE": "delete"}
+_STARTED_EXT = "bookai_metrics_started"
+
+
+def postgrest_target(method: str, url: Any, prefer: str = "") -> Tuple[str, str]:
+    """(tabla, operación) de una petición PostgREST (`/rest/v1/<tabla>` o `/rest/v1/rpc/<fn>`)."""
+    path = urlsplit(str(url)).path
+    parts = [part for part in path.split("/") if part]
+    if "v1" in parts:
+        parts = parts[parts.index("v1") + 1:]
+    if not parts:
+        return "unknown", _OPERATIONS.get(method.upper(), method.lower())
+    if parts[0] == "rpc" and len(parts) > 1:
+        return f"rpc:{parts[1]}", "rpc"
+    operation = _OPERATIONS.get(method.upper(), method.lower())
+    if operation == "insert" and "resolution=" in (prefer or ""):
+        operation = "upsert"
+    return parts[0], operation
+
+
+def _on_postgrest_request(request: Any) -> None:
+    request.extensions[_STARTED_EXT] = time.perf_counter()
+
+
+def _on_postgrest_response(response: Any) -> None:
+    request = response.request
+    started = request.extensions.get(_STARTED_EXT)
+    table, operation = postgrest_target(request.method, request.url, request.headers.get("prefer", ""))
+    status = "ok" if response.status_code < 400 else "error"
+    SUPABASE_QUERIES_TOTAL.inc(table=table, operation=operation, status=status)
+    if started is not None:
+        SUPABASE_QUERY_SECONDS.observe(time.perf_counter() - started, table=table)
+
+
+def instrument_supabase(client: Any) -> bool:
+    """Registra los hooks de métricas en la sesión httpx PostgREST del cliente Supabase."""
+    if not METRICS_ENABLED:
+        return False
+    session = getattr(getattr(client, "postgrest", None), "session", None)
+    hooks = getattr(session, "event_hooks", None)
+    if not isinstance(hooks, dict):
+        return False
+    if _on_postgrest_request not in hooks.setdefault("request", []):
+        hooks["request"].append(_on_postgrest_request)
+        hooks.setdefault("response", []).append(_on_postgrest_response)
+    return True
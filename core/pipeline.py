@@ -6,15 +6,21 @@ import asyncio
 import json
 import logging
 import re
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Any, Optional
 
 from core.config import ModelConfig, ModelTier, Settings
-from core.db import is_chat_visible_in_list
+from core.context_prefetch import ContextSnapshot, context_prefetcher
+from core.db import async_is_chat_visible_in_list
+from core.flight_recorder import annotate_trace, span, trace_message
 from core.language_manager import language_manager
 from core.main_agent import NO_GUEST_REPLY, create_main_agent
+from core.metrics import PIPELINE_STAGE_SECONDS, time_stage
+from core.stage_graph import StageGraph
 from core.instance_context import hydrate_dynamic_context
 from core.escalation_db import get_latest_pending_escalation
+from core.utils.env import env_bool
 from core.whatsapp_healthcheck import (
     detect_whatsapp_healthcheck,
     execute_whatsapp_healthcheck,
@@ -23,6 +29,11 @@ from core.whatsapp_healthcheck import (
 log = logging.getLogger("Pipeline")
 SUPER_OFFER_FLAG = "super_offer_pending"
 _HUMAN_ESCALATION_COOLDOWN_MIN = 15
+# Etapas previas al MainAgent en paralelo (false = encadenadas, comportamiento anterior).
+PIPELINE_PARALLEL_PRE_AGENT = env_bool("PIPELINE_PARALLEL_PRE_AGENT", True)
+# Guardrails post-generación en una sola llamada (false = un LLM por control, para A/B).
+PIPELINE_UNIFIED_GUARDRAIL = env_bool("PIPELINE_UNIFIED_GUARDRAIL", True)
+
 def _clean_chat_id(value: str) -> str:
     return re.sub(r"\D", "", str(value or "")).strip()
 
@@ -131,7 +142,7 @@ async def _llm_response_promises_human_escalation(
         return _response_promises_human_escalation(assistant_response)
 
 
-def _has_recent_pending_escalation(mem_id: str, state) -> bool:
+def _has_recent_pending_escalation(mem_id: str, state, snapshot: ContextSnapshot | None = None) -> bool:
     if not mem_id:
         return False
     try:
@@ -139,7 +150,9 @@ def _has_recent_pending_escalation(mem_id: str, state) -> bool:
         mm = getattr(state, "memory_manager", None)
         if mm:
             property_id = mm.get_flag(mem_id, "property_id")
-        latest = get_latest_pending_escalation(mem_id, property_id=property_id)
+        prefetched, latest = snapshot.escalation_for(property_id) if snapshot else (False, None)
+        if not prefetched:
+            latest = get_latest_pending_escalation(mem_id, property_id=property_id)
         if not latest:
             return False
         ts_raw = str(latest.get("timestamp") or "").strip()
@@ -265,20 +278,7 @@ async def _align_response_with_human_escalation_state(
     candidate = _sanitize_guest_facing_response(assistant_response)
     if not candidate:
         return "", False
-    tone = ""
-    mm = getattr(state, "memory_manager", None)
-    if mm:
-        for chat_id in chat_ids or []:
-            try:
-                resolved = str(mm.get_flag(chat_id, "tone") or "").strip()
-            except Exception:
-                resolved = ""
-            if resolved:
-                tone = resolved
-                break
-    if _has_real_human_escalation(state, *(chat_ids or [])):
-        return candidate, False
-    if not _may_reference_human_escalation(candidate):
+    if not _needs_human_promise_check(state, candidate, chat_ids):
         return candidate, False
 
     promises_human = await _llm_response_promises_human_escalation(
@@ -289,13 +289,54 @@ async def _align_response_with_human_escalation_state(
     if not promises_human and not _response_promises_human_escalation(candidate):
         return candidate, False
 
-    rewritten = await _llm_rewrite_honest_non_escalated_response(
+    return await _rewrite_unbacked_human_promise(
         llm,
+        state=state,
         user_message=user_message,
-        assistant_response=candidate,
+        candidate=candidate,
         target_lang=target_lang,
-        tone=tone,
-    )
+        chat_ids=chat_ids,
+    ), True
+
+
+def _needs_human_promise_check(state: Any, candidate: str, chat_ids: list[str]) -> bool:
+    if _has_real_human_escalation(state, *(chat_ids or [])):
+        return False
+    return _may_reference_human_escalation(candidate)
+
+
+def _resolve_tone(state: Any, chat_ids: list[str]) -> str:
+    mm = getattr(state, "memory_manager", None)
+    if mm:
+        for chat_id in chat_ids or []:
+            try:
+                resolved = str(mm.get_flag(chat_id, "tone") or "").strip()
+            except Exception:
+                resolved = ""
+            if resolved:
+                return resolved
+    return ""
+
+
+async def _rewrite_unbacked_human_promise(
+    llm: Any,
+    *,
+    state: Any,
+    user_message: str,
+    candidate: str,
+    target_lang: str,
+    chat_ids: list[str],
+    rewritten: str = "",
+) -> str:
+    tone = _resolve_tone(state, chat_ids)
+    if not rewritten:
+        rewritten = await _llm_rewrite_honest_non_escalated_response(
+            llm,
+            user_message=user_message,
+            assistant_response=candidate,
+            target_lang=target_lang,
+            tone=tone,
+        )
     if not rewritten:
         lowered_tone = str(tone or "").lower()
         if (
@@ -313,7 +354,34 @@ async def _align_response_with_human_escalation_state(
                 "Ahora mismo no tengo una gestión humana activa para confirmarte ese dato. "
                 "¿Quieres que lo consulte?"
             )
-    return rewritten.strip(), True
+    return rewritten.strip()
+
+
+async def _align_response_with_unified_verdict(
+    llm: Any,
+    *,
+    state: Any,
+    user_message: str,
+    assistant_response: str,
+    target_lang: str,
+    chat_ids: list[str],
+    verdict: dict[str, Any],
+) -> tuple[str, bool]:
+    """Como `_align_response_with_human_escalation_state`, pero con el veredicto ya calculado."""
+    candidate = _sanitize_guest_facing_response(assistant_response)
+    if not candidate or "promesa_humana" not in (verdict.get("checks") or []):
+        return candidate, False
+    if not verdict.get("promises_human_escalation") and not _response_promises_human_escalation(candidate):
+        return candidate, False
+    return await _rewrite_unbacked_human_promise(
+        llm,
+        state=state,
+        user_message=user_message,
+        candidate=candidate,
+        target_lang=target_lang,
+        chat_ids=chat_ids,
+        rewritten=_sanitize_guest_facing_response(verdict.get("rewrite") or ""),
+    ), True
 
 
 def _sanitize_guest_facing_response(text: str) -> str:
@@ -840,7 +908,53 @@ async def process_user_message(
       2. Main Agent
       3. Supervisor Output
       4. Escalación → InternoAgent
+
+    Queda registrado en el flight recorder (traza propia o span de la del canal).
     """
+    with trace_message("process_user_message", memory_id or chat_id, chat_id, channel=channel):
+        annotate_trace(instance_id=_trace_instance_id(state, memory_id or chat_id, chat_id))
+        return await _process_user_message(
+            user_message,
+            chat_id,
+            state,
+            hotel_name=hotel_name,
+            channel=channel,
+            instance_number=instance_number,
+            memory_id=memory_id,
+            property_id=property_id,
+        )
+
+
+def _trace_instance_id(state, *chat_ids: str | None) -> str | None:
+    """Instancia del chat para acotar quién puede leer sus trazas."""
+    memory = getattr(state, "memory_manager", None)
+    if not memory:
+        return None
+    for key in chat_ids:
+        if not key:
+            continue
+        try:
+            inst = memory.get_flag(key, "instance_id") or memory.get_flag(key, "instance_hotel_code")
+        except Exception:
+            inst = None
+        if inst is not None and str(inst).strip():
+            return str(inst).strip()
+    return None
+
+
+async def _process_user_message(
+    user_message: str,
+    chat_id: str,
+    state,
+    hotel_name: str = "Hotel",
+    channel: str = "whatsapp",
+    instance_number: str | None = None,
+    memory_id: str | None = None,
+    property_id: str | int | None = None,
+) -> str | None:
+    pre_agent: StageGraph | None = None
+    snapshot: ContextSnapshot | None = None  # contexto precargado durante la espera del buffer
+    pipeline_started = time.perf_counter()
     try:
         mem_id = memory_id or chat_id
         escalation_chat_id = mem_id or chat_id
@@ -848,26 +962,20 @@ async def process_user_message(
         initial_property_id = property_id
         chat_list_chat_id = _clean_chat_id(chat_id) or str(chat_id or "") or str(mem_id or "")
         chat_list_original_id = str(mem_id or chat_id or "").strip() or None
-        chat_visible_before = is_chat_visible_in_list(
-            chat_list_chat_id,
-            property_id=initial_property_id,
-            channel=channel,
-            original_chat_id=chat_list_original_id,
-        )
         main_agent_invoked = False
         log.info("📨 Nuevo mensaje de %s: %s", chat_id, user_message[:150])
         guest_lang = "es"
         guest_lang_confidence = 0.0
         healthcheck = detect_whatsapp_healthcheck(user_message)
 
-        def _recent_guest_messages(limit: int = 6) -> list[str]:
+        async def _recent_guest_messages(limit: int = 6) -> list[str]:
             if not state.memory_manager:
                 return []
             try:
-                raw_history = state.memory_manager.get_memory(mem_id, limit=max(limit * 4, 12)) or []
+                raw_history = await _recent_history(max(limit * 4, 12)) or []
             except TypeError:
                 try:
-                    raw_history = state.memory_manager.get_memory(mem_id) or []
+                    raw_history = await state.memory_manager.aget_memory(mem_id) or []
                 except Exception:
                     raw_history = []
             except Exception:
@@ -899,22 +1007,25 @@ async def process_user_message(
                     except Exception:
                         pass
             state.memory_manager.set_flag(mem_id, "default_channel", channel)
+
+        async def _resolve_guest_language(recent_guest_messages: list[str]) -> tuple[str, float]:
+            lang, confidence = "es", 0.0
             try:
                 prev_lang = state.memory_manager.get_flag(mem_id, "guest_lang")
                 prev_confidence = state.memory_manager.get_flag(mem_id, "guest_lang_confidence")
-                guest_lang, guest_lang_confidence = language_manager.resolve_response_language(
+                lang, confidence = await language_manager.aresolve_response_language(
                     latest_guest_message=user_message,
-                    recent_guest_messages=_recent_guest_messages(),
+                    recent_guest_messages=recent_guest_messages,
                     guest_language_hint=prev_lang,
                     guest_language_confidence=prev_confidence,
                     last_resolved_language=prev_lang,
                 )
-                guest_lang_confidence = max(0.0, min(1.0, guest_lang_confidence))
+                confidence = max(0.0, min(1.0, confidence))
                 for lang_key in {str(mem_id or "").strip(), str(chat_id or "").strip()}:
                     if not lang_key:
                         continue
-                    state.memory_manager.set_flag(lang_key, "guest_lang", guest_lang)
-                    state.memory_manager.set_flag(lang_key, "guest_lang_confidence", guest_lang_confidence)
+                    state.memory_manager.set_flag(lang_key, "guest_lang", lang)
+                    state.memory_manager.set_flag(lang_key, "guest_lang_confidence", confidence)
                     state.memory_manager.set_flag(
                         lang_key,
                         "guest_lang_last_message",
@@ -922,23 +1033,72 @@ async def process_user_message(
                     )
             except Exception as exc:
                 log.debug("No se pudo detectar/guardar guest_lang en pipeline: %s", exc)
+            return lang, confidence
+
+        async def _chat_visible_in_list() -> bool:
+            if snapshot is not None:
+                prefetched, visible = snapshot.visible_for(
+                    chat_list_chat_id,
+                    initial_property_id,
+                    channel,
+                    chat_list_original_id,
+                )
+                if prefetched:
+                    return bool(visible)
+            return await async_is_chat_visible_in_list(
+                chat_list_chat_id,
+                property_id=initial_property_id,
+                channel=channel,
+                original_chat_id=chat_list_original_id,
+            )
+
+        async def _validate_input() -> dict:
+            with time_stage("supervisor_input"), span("supervisor_input"):
+                return await state.supervisor_input.validate(user_message)
 
-        def _ensure_guest_language(text: str) -> str:
+        async def _load_history() -> list:
+            try:
+                if snapshot is not None:
+                    prefetched = snapshot.history(state.memory_manager, 30, as_messages=True)
+                    if prefetched is not None:
+                        return prefetched
+                return await state.memory_manager.aget_memory_as_messages(mem_id)
+            except Exception as exc:
+                log.warning("⚠️ No se pudo obtener memoria: %s", exc)
+                return []
+
+        async def _recent_history(limit: int) -> list:
+            if not state.memory_manager:
+                return []
+            if snapshot is not None:
+                prefetched = snapshot.history(state.memory_manager, limit)
+                if prefetched is not None:
+                    return prefetched
+            return await state.memory_manager.aget_memory(mem_id, limit=limit)
+
+        async def _ensure_guest_language(text: str) -> str:
             if not text:
                 return text
             if guest_lang == "es":
                 return text
             try:
-                return language_manager.ensure_language(text, guest_lang)
+                return await language_manager.aensure_language(text, guest_lang)
             except Exception:
                 return text
 
-        def _persist_guest_message() -> None:
+        async def _persist_guest_message() -> None:
             nonlocal guest_message_persisted, property_id
             if guest_message_persisted:
                 return
             try:
-                state.memory_manager.save(
+                # La visibilidad previa se resuelve antes de insertar la fila del huésped:
+                # si la etapa leyera después, vería el chat ya visible y no se emitiría el alta.
+                try:
+                    chat_visible_before = await pre_agent.get("chat_visible")
+                except Exception as exc:
+                    log.debug("No se pudo comprobar visibilidad previa del chat: %s", exc)
+                    chat_visible_before = True
+                await state.memory_manager.asave(
                     mem_id,
                     role="user",
                     content=user_message,
@@ -1066,7 +1226,7 @@ async def process_user_message(
                                         chat_payload["client_language"] = guest_lang
                                         chat_payload["client_language_confidence"] = guest_lang_confidence
                                         list_payload["chat"] = chat_payload
-                                    chat_visible_after = is_chat_visible_in_list(
+                                    chat_visible_after = await async_is_chat_visible_in_list(
                                         chat_list_chat_id,
                                         property_id=resolved_property_id,
                                         channel=channel,
@@ -1105,7 +1265,74 @@ async def process_user_message(
             except Exception as exc:
                 log.warning("No se pudo persistir mensaje del huésped en pipeline: %s", exc)
 
-        if healthcheck and healthcheck.get("path") in {"ia", "complete"}:
+        clean_id = re.sub(r"\D", "", str(chat_id or "")).strip() or str(chat_id or "")
+        bookai_enabled = _resolve_bookai_enabled(
+            state,
+            chat_id=str(chat_id or ""),
+            mem_id=str(mem_id or ""),
+            clean_id=clean_id,
+            property_id=property_id,
+        )
+        healthcheck_bypass = bool(healthcheck and healthcheck.get("path") in {"ia", "complete"})
+        full_flow = not healthcheck_bypass and bookai_enabled is not False
+
+        pending_offer, pending_offer_key = (None, None)
+        semantic_llm = None
+        if full_flow:
+            pending_offer, pending_offer_key = _load_active_super_offer(state.memory_manager, mem_id, chat_id)
+            if pending_offer:
+                if not _is_message_related_to_pending_offer(user_message, pending_offer):
+                    log.info("OfferGuard: mensaje no relacionado con oferta pendiente, se ignora pending_offer en este turno.")
+                    pending_offer = None
+                    pending_offer_key = None
+            if pending_offer:
+                try:
+                    semantic_llm = ModelConfig.get_llm(ModelTier.INTERNAL)
+                except Exception:
+                    semantic_llm = None
+
+        # ------------------------------------------------------------------
+        # Etapas previas al MainAgent (grafo de dependencias).
+        # Arrancan a la vez; el flujo espera cada resultado solo cuando lo necesita:
+        #   chat_visible ─────────────────────────────→ persistencia del huésped
+        #   recent_guest_messages → guest_lang ───────→ idioma de respuesta
+        #   supervisor_input ─────────────────────────→ rechazo / escalación
+        #   history, recent_history, locator_history ─→ reglas rápidas + MainAgent
+        #   offer_intent (si hay oferta pendiente) ───→ escalación por oferta
+        # ------------------------------------------------------------------
+        if state.memory_manager:
+            with span("context_prefetch.take"):
+                snapshot = await context_prefetcher.take(state, mem_id)
+            if snapshot is None:
+                # Sin precarga válida: el mismo contexto en una sola petición, en línea.
+                with span("context_prefetch.load"):
+                    snapshot = await context_prefetcher.load(state, mem_id, instance_number)
+
+        pre_agent = StageGraph("pre_agent", parallel=PIPELINE_PARALLEL_PRE_AGENT)
+        pre_agent.add("chat_visible", _chat_visible_in_list)
+        if state.memory_manager:
+            pre_agent.add("recent_guest_messages", _recent_guest_messages)
+            pre_agent.add("guest_lang", _resolve_guest_language, deps=("recent_guest_messages",))
+        if full_flow:
+            pre_agent.add("supervisor_input", _validate_input)
+            pre_agent.add("history", _load_history)
+            pre_agent.add("recent_history", lambda: _recent_history(8))
+            pre_agent.add("locator_history", lambda: _recent_history(30))
+            if pending_offer:
+                pre_agent.add(
+                    "offer_intent",
+                    lambda: _classify_guest_offer_intent(
+                        semantic_llm,
+                        user_message=user_message,
+                        pending_offer=pending_offer,
+                    ),
+                )
+        pre_agent.start()
+
+        if "guest_lang" in pre_agent:
+            guest_lang, guest_lang_confidence = await pre_agent.get("guest_lang")
+
+        if healthcheck_bypass:
             path = str(healthcheck.get("path") or "").strip() or "unknown"
             matched_keyword = str(healthcheck.get("matched_keyword") or "").strip() or "unknown"
             has_real_meta_inbound = False
@@ -1135,28 +1362,21 @@ async def process_user_message(
             )
 
 
-        clean_id = re.sub(r"\D", "", str(chat_id or "")).strip() or str(chat_id or "")
-        bookai_enabled = _resolve_bookai_enabled(
-            state,
-            chat_id=str(chat_id or ""),
-            mem_id=str(mem_id or ""),
-            clean_id=clean_id,
-            property_id=property_id,
-        )
         if bookai_enabled is False:
             try:
-                _persist_guest_message()
+                await _persist_guest_message()
             except Exception as exc:
                 log.warning("No se pudo guardar mensaje con BookAI apagado: %s", exc)
             log.info("🤫 BookAI desactivado para %s; se omite respuesta automática.", clean_id)
             return None
 
-        input_validation = await state.supervisor_input.validate(user_message)
+        input_validation = await pre_agent.get("supervisor_input")
         estado_in = input_validation.get("estado", "Aprobado")
         motivo_in = input_validation.get("motivo", "")
 
         if estado_in.lower() not in ["aprobado", "ok", "aceptable"]:
-            _persist_guest_message()
+            pre_agent.cancel("history", "recent_history", "locator_history", "offer_intent")
+            await _persist_guest_message()
             log.warning("🚨 Mensaje rechazado por Supervisor Input: %s", motivo_in)
             await state.interno_agent.escalate(
                 guest_chat_id=escalation_chat_id,
@@ -1168,23 +1388,7 @@ async def process_user_message(
             )
             return None
 
-        try:
-            history = state.memory_manager.get_memory_as_messages(mem_id)
-        except Exception as exc:
-            log.warning("⚠️ No se pudo obtener memoria: %s", exc)
-            history = []
-        pending_offer, pending_offer_key = _load_active_super_offer(state.memory_manager, mem_id, chat_id)
-        semantic_llm = None
-        if pending_offer:
-            if not _is_message_related_to_pending_offer(user_message, pending_offer):
-                log.info("OfferGuard: mensaje no relacionado con oferta pendiente, se ignora pending_offer en este turno.")
-                pending_offer = None
-                pending_offer_key = None
-        if pending_offer:
-            try:
-                semantic_llm = ModelConfig.get_llm(ModelTier.INTERNAL)
-            except Exception:
-                semantic_llm = None
+        history = await pre_agent.get("history")
         guardrail_llm = semantic_llm
         guardrail_llm_loaded = semantic_llm is not None
 
@@ -1204,7 +1408,7 @@ async def process_user_message(
         forced_offer_escalation = False
         try:
             recent_summary = False
-            raw_hist = state.memory_manager.get_memory(mem_id, limit=8) if state.memory_manager else []
+            raw_hist = await pre_agent.get("recent_history")
             for msg in raw_hist or []:
                 role = (msg.get("role") or "").lower()
                 if role not in {"assistant", "bookai"}:
@@ -1220,10 +1424,10 @@ async def process_user_message(
                 re.IGNORECASE,
             )
             if recent_summary and confirmation:
-                response_raw = _ensure_guest_language("¡Perfecto! Queda confirmada. Si necesitas algo más, dímelo.")
+                response_raw = await _ensure_guest_language("¡Perfecto! Queda confirmada. Si necesitas algo más, dímelo.")
                 try:
-                    _persist_guest_message()
-                    state.memory_manager.save(
+                    await _persist_guest_message()
+                    await state.memory_manager.asave(
                         mem_id,
                         role="assistant",
                         content=response_raw,
@@ -1239,7 +1443,7 @@ async def process_user_message(
         if state.memory_manager:
             try:
                 localizador = state.memory_manager.get_flag(mem_id, "reservation_locator") or localizador
-                raw_hist = state.memory_manager.get_memory(mem_id, limit=30) or []
+                raw_hist = await pre_agent.get("locator_history") or []
                 for msg in raw_hist:
                     content = (msg.get("content") or "")
                     if not isinstance(content, str):
@@ -1271,10 +1475,10 @@ async def process_user_message(
             )
         )
         if not response_raw and asks_localizador and localizador and not wants_details:
-            response_raw = _ensure_guest_language(f"El localizador de tu reserva es {localizador}.")
+            response_raw = await _ensure_guest_language(f"El localizador de tu reserva es {localizador}.")
             try:
-                _persist_guest_message()
-                state.memory_manager.save(
+                await _persist_guest_message()
+                await state.memory_manager.asave(
                     mem_id,
                     role="assistant",
                     content=response_raw,
@@ -1302,7 +1506,7 @@ async def process_user_message(
                         "Inciso reescrito para evitar promesa humana sin escalación real (chat_id=%s).",
                         mem_id,
                     )
-                final_msg = _ensure_guest_language(aligned_msg or clean_msg)
+                final_msg = await _ensure_guest_language(aligned_msg or clean_msg)
                 final_msg = _sanitize_guest_facing_response(final_msg)
                 if not final_msg:
                     return
@@ -1316,20 +1520,20 @@ async def process_user_message(
                 log.error("❌ Error enviando inciso: %s", exc)
 
         try:
-            hydrate_dynamic_context(
-                state=state,
-                chat_id=mem_id,
-                instance_number=instance_number,
-            )
+            # Ya hidratado en segundo plano durante la espera del buffer.
+            if snapshot is None or not snapshot.hydrated or snapshot.instance_number != instance_number:
+                hydrate_dynamic_context(
+                    state=state,
+                    chat_id=mem_id,
+                    instance_number=instance_number,
+                )
         except Exception as exc:
             log.warning("No se pudo hidratar contexto dinamico: %s", exc)
 
+        if response_raw:
+            pre_agent.cancel("offer_intent")
         if not response_raw and pending_offer:
-            intent_eval = await _classify_guest_offer_intent(
-                semantic_llm,
-                user_message=user_message,
-                pending_offer=pending_offer,
-            )
+            intent_eval = await pre_agent.get("offer_intent")
             if (
                 intent_eval.get("intent") == "ask_offer_details"
                 and _safe_float(intent_eval.get("confidence"), 0.0) >= 0.65
@@ -1357,19 +1561,19 @@ async def process_user_message(
                     ),
                     property_id=property_id,
                 )
-                response_raw = _ensure_guest_language(
+                response_raw = await _ensure_guest_language(
                     "Gracias por escribirnos. Estamos revisando el horario, lugar y condiciones "
                     "de esta cortesía para confirmártelo en breve."
                 )
                 forced_offer_escalation = True
                 try:
-                    _persist_guest_message()
-                    state.memory_manager.save(mem_id, role="assistant", content=response_raw, channel=channel)
+                    await _persist_guest_message()
+                    await state.memory_manager.asave(mem_id, role="assistant", content=response_raw, channel=channel)
                 except Exception as exc:
                     log.warning("No se pudo guardar respuesta de escalación por oferta pendiente: %s", exc)
 
         if not response_raw and _message_requests_human_intervention(user_message):
-            if not _has_recent_pending_escalation(mem_id, state):
+            if not _has_recent_pending_escalation(mem_id, state, snapshot):
                 await state.interno_agent.escalate(
                     guest_chat_id=escalation_chat_id,
                     guest_message=user_message,
@@ -1378,15 +1582,17 @@ async def process_user_message(
                     context="Escalación forzada por petición explícita de manager/recepción/humano.",
                     property_id=property_id,
                 )
-            response_raw = _ensure_guest_language(
+            response_raw = await _ensure_guest_language(
                 "Voy a consultarlo y te informaré en cuanto tenga respuesta."
             )
             try:
-                _persist_guest_message()
-                state.memory_manager.save(mem_id, role="assistant", content=response_raw, channel=channel)
+                await _persist_guest_message()
+                await state.memory_manager.asave(mem_id, role="assistant", content=response_raw, channel=channel)
             except Exception as exc:
                 log.warning("No se pudo guardar respuesta de escalación forzada: %s", exc)
 
+        log.debug("⏱️ Etapas previas (%s): %s", mem_id, pre_agent.summary())
+
         if not response_raw:
             main_agent = create_main_agent(
                 memory_manager=state.memory_manager,
@@ -1395,12 +1601,13 @@ async def process_user_message(
             )
             main_agent_invoked = True
 
-            response_raw = await main_agent.ainvoke(
-                user_input=user_message,
-                chat_id=mem_id,
-                hotel_name=hotel_name,
-                chat_history=history,
-            )
+            with time_stage("main_agent"), span("main_agent"):
+                response_raw = await main_agent.ainvoke(
+                    user_input=user_message,
+                    chat_id=mem_id,
+                    hotel_name=hotel_name,
+                    chat_history=history,
+                )
             if response_raw == NO_GUEST_REPLY:
                 log.info("🔇 Respuesta silenciosa (solo interno) para chat_id=%s", mem_id)
                 return None
@@ -1417,12 +1624,12 @@ async def process_user_message(
             return None
 
         if not main_agent_invoked:
-            _persist_guest_message()
+            await _persist_guest_message()
 
         response_raw = _sanitize_guest_facing_response(response_raw.strip())
         # Fuerza el idioma final de salida al idioma detectado del último mensaje del huésped.
         # Evita respuestas en español cuando el huésped escribe en pt/fr/de, etc.
-        response_raw = _ensure_guest_language(response_raw)
+        response_raw = await _ensure_guest_language(response_raw)
         response_raw = _sanitize_guest_facing_response(response_raw)
         if not response_raw:
             await state.interno_agent.escalate(
@@ -1434,13 +1641,35 @@ async def process_user_message(
                 property_id=property_id,
             )
             return None
-        if pending_offer and response_raw and not forced_offer_escalation:
-            consistency = await _check_offer_response_consistency(
-                semantic_llm,
-                user_message=user_message,
-                pending_offer=pending_offer,
-                agent_response=response_raw,
-            )
+        # ------------------------------------------------------------------
+        # Guardrails post-generación. En modo unificado, la promesa humana, la
+        # consistencia con la oferta y la auditoría de salida salen de una sola
+        # llamada; si falla se usa el camino clásico (un LLM por control).
+        # ------------------------------------------------------------------
+        offer_check = bool(pending_offer and response_raw and not forced_offer_escalation)
+        guardrail_verdict = None
+        if PIPELINE_UNIFIED_GUARDRAIL:
+            promise_check = _needs_human_promise_check(state, response_raw, [mem_id, chat_id])
+            if offer_check or promise_check:
+                with time_stage("supervisor_output"), span("supervisor_output"):
+                    guardrail_verdict = await state.supervisor_output.evaluate(
+                        user_input=user_message,
+                        agent_response=response_raw,
+                        chat_id=mem_id,
+                        target_lang=guest_lang,
+                        check_human_promise=promise_check,
+                        pending_offer=pending_offer if offer_check else None,
+                    )
+        if offer_check:
+            if guardrail_verdict is not None:
+                consistency = guardrail_verdict["offer"]
+            else:
+                consistency = await _check_offer_response_consistency(
+                    semantic_llm,
+                    user_message=user_message,
+                    pending_offer=pending_offer,
+                    agent_response=response_raw,
+                )
             if (
                 not consistency.get("is_consistent", True)
                 and _safe_float(consistency.get("confidence"), 0.0) >= 0.70
@@ -1464,28 +1693,41 @@ async def process_user_message(
                     ),
                     property_id=property_id,
                 )
-                response_raw = _ensure_guest_language(
+                response_raw = await _ensure_guest_language(
                     "Estamos revisando los detalles exactos de esta cortesía para darte una "
                     "confirmación correcta en breve."
                 )
                 try:
-                    state.memory_manager.save(mem_id, role="assistant", content=response_raw, channel=channel)
+                    await state.memory_manager.asave(mem_id, role="assistant", content=response_raw, channel=channel)
                 except Exception as exc:
                     log.warning("No se pudo guardar fallback por guardrail de oferta: %s", exc)
-        aligned_response, was_rewritten = await _align_response_with_human_escalation_state(
-            _get_guardrail_llm(),
-            state=state,
-            user_message=user_message,
-            assistant_response=response_raw,
-            target_lang=guest_lang,
-            chat_ids=[mem_id, chat_id],
-        )
+                # La respuesta cambió: el veredicto unificado ya no aplica.
+                guardrail_verdict = None
+        if guardrail_verdict is not None:
+            aligned_response, was_rewritten = await _align_response_with_unified_verdict(
+                _get_guardrail_llm(),
+                state=state,
+                user_message=user_message,
+                assistant_response=response_raw,
+                target_lang=guest_lang,
+                chat_ids=[mem_id, chat_id],
+                verdict=guardrail_verdict,
+            )
+        else:
+            aligned_response, was_rewritten = await _align_response_with_human_escalation_state(
+                _get_guardrail_llm(),
+                state=state,
+                user_message=user_message,
+                assistant_response=response_raw,
+                target_lang=guest_lang,
+                chat_ids=[mem_id, chat_id],
+            )
         if was_rewritten:
             log.warning(
                 "Respuesta reescrita para evitar promesa humana sin respaldo backend (chat_id=%s).",
                 mem_id,
             )
-        response_raw = _ensure_guest_language(aligned_response or response_raw)
+        response_raw = await _ensure_guest_language(aligned_response or response_raw)
         response_raw = _sanitize_guest_facing_response(response_raw)
         if not response_raw:
             await state.interno_agent.escalate(
@@ -1499,10 +1741,22 @@ async def process_user_message(
             return None
         log.info("🤖 Respuesta del MainAgent: %s", response_raw[:300])
 
-        output_validation = await state.supervisor_output.validate(
-            user_input=user_message,
-            agent_response=response_raw,
-            chat_id=mem_id,
+        # La auditoría unificada solo vale si auditó el texto exacto que se envía
+        # (tras idioma y saneado); si difiere, se audita la respuesta final aparte.
+        audited_response = (guardrail_verdict or {}).get("audited_response")
+        if guardrail_verdict is not None and (audited_response or "").strip() == response_raw.strip():
+            output_validation = guardrail_verdict["audit"]
+        else:
+            with time_stage("supervisor_output"), span("supervisor_output"):
+                output_validation = await state.supervisor_output.validate(
+                    user_input=user_message,
+                    agent_response=response_raw,
+                    chat_id=mem_id,
+                )
+        log.info(
+            "🛡️ Guardrails post-generación (%s): modo=%s",
+            mem_id,
+            "unificado" if guardrail_verdict is not None else "separado",
         )
         estado_out = (output_validation.get("estado", "Aprobado") or "").lower()
         motivo_out = output_validation.get("motivo", "")
@@ -1512,7 +1766,7 @@ async def process_user_message(
 
             hist_text = ""
             try:
-                raw_hist = state.memory_manager.get_memory(mem_id, limit=6)
+                raw_hist = await state.memory_manager.aget_memory(mem_id, limit=6)
                 if raw_hist:
                     lines = []
                     for m in raw_hist:
@@ -1598,3 +1852,7 @@ async def process_user_message(
             property_id=property_id,
         )
         return None
+    finally:
+        if pre_agent is not None:
+            pre_agent.cancel()
+        PIPELINE_STAGE_SECONDS.observe(time.perf_counter() - pipeline_started, stage="pipeline")
@@ -0,0 +1,264 @@
+"""
+🔑 Caché de tokens de acceso al PMS
+======================================================================================
+La tool MCP `buscar_token` devuelve una `key` válida durante mucho más tiempo que un
+mensaje. Aquí se cachea por `instance_url` para no pagar esa llamada en cada consulta
+de disponibilidad, reserva o folio:
+
+- Caducidad: se respeta `expires_in` / `expires_at` (o el `exp` del JWT) si vienen en
+  la respuesta; si no, se usa PMS_TOKEN_TTL. Se renueva con un margen de seguridad.
+- Single-flight: peticiones concurrentes para la misma instancia comparten un único
+  `buscar_token`.
+- Invalidación: si una llamada posterior al PMS devuelve un error de autenticación se
+  descarta el token y se pide uno nuevo (una sola vez).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from core.utils.env import env_bool
+
+log = logging.getLogger("PmsTokenCache")
+
+PMS_TOKEN_TTL = float(os.getenv("PMS_TOKEN_TTL", "900"))
+PMS_TOKEN_EXPIRY_MARGIN = float(os.getenv("PMS_TOKEN_EXPIRY_MARGIN", "30"))
+PMS_TOKEN_CACHE_ENABLED = env_bool("PMS_TOKEN_CACHE_ENABLED", True)
+
+_DEFAULT_KEY = "__default__"
+
+_AUTH_ERROR_RE = re.compile(
+    r"unauthori[sz]ed|forbidden|invalid[_ ]?(?:token|key|api[_ ]?key)|"
+    r"(?:token|jwt|key)[_ ]?(?:expired|caducad[oa]|inv[aá]lid[oa]|no v[aá]lid[oa])|"
+    r"expired[_ ]?token|no autorizado|acceso denegado|"
+    r"(?:status(?:_?code)?|code|error|http)\W{0,3}(?:401|403)\b|\b(?:401|403) (?:unauthorized|forbidden)",
+    re.IGNORECASE,
+)
+
+
+# =============================================================
+# 🧩 Helpers de parseo
+# =============================================================
+def _jwt_exp(token: str) -> Optional[float]:
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        padded = parts[1] + "=" * (-len(parts[1]) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        exp = claims.get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+
+def _as_epoch(value: Any) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        # Milisegundos → segundos
+        return float(value) / 1000 if value > 1e11 else float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+
+def parse_token_response(raw: Any) -> Tuple[Optional[str], Optional[float]]:
+    """Extrae (token, expira_en_epoch) de la respuesta de `buscar_token`."""
+    data = json.loads(raw) if isinstance(raw, str) else raw
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if not isinstance(data, dict):
+        return None, None
+
+    token = data.get("key")
+    if not token:
+        return None, None
+    token = str(token).strip()
+
+    expires_at = None
+    for field in ("expires_in", "expiresIn"):
+        try:
+            if data.get(field) not in (None, ""):
+                expires_at = time.time() + float(data[field])
+                break
+        except (TypeError, ValueError):
+            continue
+    if expires_at is None:
+        for field in ("expires_at", "expiresAt", "expiry", "expiration", "exp"):
+            expires_at = _as_epoch(data.get(field))
+            if expires_at:
+                break
+    if expires_at is None:
+        expires_at = _jwt_exp(token)
+    return token, expires_at
+
+
+def is_pms_auth_error(value: Any) -> bool:
+    """Detecta si una respuesta/excepción del PMS indica token inválido o caducado."""
+    if value is None:
+        return False
+    if isinstance(value, BaseException):
+        return bool(_AUTH_ERROR_RE.search(str(value)))
+    if isinstance(value, list):
+        return len(value) == 1 and is_pms_auth_error(value[0])
+    if isinstance(value, dict):
+        for field in ("status", "statusCode", "status_code", "code"):
+            if str(value.get(field, "")).strip() in {"401", "403"}:
+                return True
+        for field in ("error", "message", "detail", "msg"):
+            if isinstance(value.get(field), str) and _AUTH_ERROR_RE.search(value[field]):
+                return True
+        return False
+    if isinstance(value, str):
+        text = value.strip()
+        # Las respuestas válidas (listados de habitaciones, folios...) son largas.
+        if not text or len(text) > 2000:
+            return False
+        if text[:1] in "[{":
+            try:
+                return is_pms_auth_error(json.loads(text))
+            except json.JSONDecodeError:
+                pass
+        return bool(_AUTH_ERROR_RE.search(text))
+    return False
+
+
+# =============================================================
+# 🔑 Caché
+# =============================================================
+class PmsTokenCache:
+    """Tokens PMS por instance_url con caducidad y refresco single-flight."""
+
+    def __init__(self, default_ttl: float = PMS_TOKEN_TTL, margin: float = PMS_TOKEN_EXPIRY_MARGIN):
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "fetches": 0, "fetch_errors": 0, "invalidations": 0}
+
+    @staticmethod
+    def _key(instance_url: Optional[str]) -> str:
+        return (instance_url or "").strip().rstrip("/") or _DEFAULT_KEY
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def peek(self, instance_url: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(self._key(instance_url))
+        if entry and entry[1] - self.margin > time.time():
+            return entry[0]
+        return None
+
+    async def _fetch(self, key: str, token_tool: Any, instance_url: Optional[str]) -> str:
+        payload = {"instance_url": instance_url} if instance_url else {}
+        self._count("fetches")
+        token_raw = await token_tool.ainvoke(payload)
+        token, expires_at = parse_token_response(token_raw)
+        if not token:
+            raise ValueError("buscar_token no devolvió 'key'")
+        now = time.time()
+        if not expires_at or expires_at <= now:
+            expires_at = now + self.default_ttl
+        if PMS_TOKEN_CACHE_ENABLED:
+            with self._lock:
+                self._entries[key] = (token, expires_at)
+        log.debug("🔑 Token PMS renovado para %s (válido %.0fs)", key, expires_at - now)
+        return token
+
+    async def get(self, token_tool: Any, instance_url: Optional[str] = None) -> str:
+        """Devuelve un token vigente; lanza excepción si `buscar_token` falla."""
+        cached = self.peek(instance_url) if PMS_TOKEN_CACHE_ENABLED else None
+        if cached:
+            self._count("hits")
+            return cached
+        self._count("misses")
+
+        key = self._key(instance_url)
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(key)
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(self._fetch(key, token_tool, instance_url))
+            self._inflight[key] = task
+
+            def _done(t: asyncio.Task) -> None:
+                if self._inflight.get(key) is t:
+                    self._inflight.pop(key, None)
+                if not t.cancelled() and t.exception() is not None:
+                    self._count("fetch_errors")
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    def invalidate(self, instance_url: Optional[str] = None, token: Optional[str] = None) -> None:
+        """
+        Descarta el token de la instancia. Si se indica `token`, solo se descarta cuando
+        sigue siendo el cacheado (evita tirar uno recién renovado por otra petición).
+        """
+        key = self._key(instance_url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (token is None or entry[0] == token):
+                self._entries.pop(key, None)
+                self._stats["invalidations"] += 1
+                log.info("🔑 Token PMS invalidado para %s", key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "cached_instances": len(self._entries)}
+
+
+pms_token_cache = PmsTokenCache()
+
+
+async def get_pms_token(token_tool: Any, instance_url: Optional[str] = None) -> str:
+    return await pms_token_cache.get(token_tool, instance_url)
+
+
+def invalidate_pms_token(instance_url: Optional[str] = None, token: Optional[str] = None) -> None:
+    pms_token_cache.invalidate(instance_url, token)
+
+
+async def invoke_with_pms_token(
+    token_tool: Any,
+    instance_url: Optional[str],
+    call: Callable[[str], Awaitable[Any]],
+    token: Optional[str] = None,
+) -> Any:
+    """
+    Ejecuta `call(token)` con el token cacheado. Si el PMS responde con error de
+    autenticación se invalida el token y se reintenta una vez con uno nuevo.
+    Solo para llamadas idempotentes (consultas).
+    """
+    token = token or await get_pms_token(token_tool, instance_url)
+    try:
+        result = await call(token)
+    except Exception as exc:
+        if not is_pms_auth_error(exc):
+            raise
+        log.warning("🔑 Error de autenticación en PMS (%s); renovando token.", exc)
+    else:
+        if not is_pms_auth_error(result):
+            return result
+        log.warning("🔑 El PMS rechazó el token; renovando y reintentando.")
+
+    invalidate_pms_token(instance_url, token)
+    fresh = await get_pms_token(token_tool, instance_url)
+    return await call(fresh)
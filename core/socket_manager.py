@@ -7,6 +7,8 @@ import logging
 from typing import Any, Iterable
 
 from core.config import Settings
+from core.flight_recorder import span
+from core.speculation import commit_barrier
 
 log = logging.getLogger("SocketManager")
 _GLOBAL_SOCKET_MANAGER = None
@@ -309,6 +311,17 @@ class SocketManager:
     ) -> None:
         if not self.enabled or not self.sio:
             return
+        await commit_barrier("socket.emit")
+        with span("socket.emit", event=event):
+            await self._emit(event, data, rooms=rooms, instance_id=instance_id)
+
+    async def _emit(
+        self,
+        event: str,
+        data: dict[str, Any],
+        rooms: str | Iterable[str] | None = None,
+        instance_id: str | None = None,
+    ) -> None:
         data = self._normalize_chat_message_payload(event, data)
         log.debug("Socket emit event=%s rooms=%s", event, rooms)
         if rooms is None:
@@ -0,0 +1,221 @@
+"""
+🎲 Ejecución especulativa del agente durante la espera del buffer
+======================================================================================
+Con MESSAGE_BUFFER_SPECULATIVE=true, cuando el bloque del buffer parece completo
+(`looks_complete`) el `MessageBufferManager` lanza el procesamiento del bloque sin esperar
+a que venza la ventana de inactividad. La ejecución especulativa corre igual que la real
+(LLM, sub-agentes, MCP de lectura) pero se detiene en la primera barrera de efectos:
+
+- `commit_barrier(label)`: la esperan los puntos con efectos visibles (guardar en
+  historial, enviar por canal, emitir por socket, escalar, tools MCP de escritura).
+  Fuera de una ejecución especulativa no hace nada.
+- `defer_until_commit(label, factory)`: lo mismo para efectos que se lanzan desde código
+  síncrono (p.ej. `MemoryManager.save`), que no puede esperar: el efecto se aplaza a una
+  Task en el loop de la ejecución y se descarta si se cancela.
+
+Si la ventana se cierra sin mensajes nuevos (misma `state.version`), el buffer confirma
+la ejecución (`commit`) y continúa desde donde estaba. Si llega un mensaje nuevo se
+cancela: no ha tenido efectos, y lo que cargó de cachés compartidas (p.ej. la caché de
+disponibilidad) queda caliente para la ejecución definitiva.
+
+Métricas: `bookai_speculation_runs_total{outcome}` y
+`bookai_speculation_wasted_tokens_total{kind}`; resumen en `GET /health/speculation`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from core.metrics import SPECULATION_RUNS_TOTAL, SPECULATION_WASTED_TOKENS_TOTAL
+
+log = logging.getLogger("Speculation")
+
+# Servidores MCP de solo lectura: sus tools no esperan a la confirmación.
+SPECULATION_READONLY_MCP_SERVERS = frozenset(
+    name.strip()
+    for name in os.getenv("SPECULATION_READONLY_MCP_SERVERS", "DispoPreciosAgent,InfoAgent").split(",")
+    if name.strip()
+)
+
+_current: contextvars.ContextVar[Optional["SpeculativeRun"]] = contextvars.ContextVar(
+    "bookai_speculative_run", default=None
+)
+
+
+class SpeculativeRun:
+    """Una ejecución especulativa de un bloque: versión del buffer, confirmación y coste."""
+
+    def __init__(self, conversation_id: str, version: int):
+        self.conversation_id = conversation_id
+        self.version = version
+        self.started_at = time.monotonic()
+        self.committed = False
+        self.aborted = False
+        self.waiting_on: Optional[str] = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.deferred: set = set()
+        self._commit = asyncio.Event()
+
+    def activate(self) -> None:
+        """Marca la Task actual (y las que cree) como especulativa."""
+        self.loop = asyncio.get_running_loop()
+        _current.set(self)
+
+    def commit(self) -> None:
+        self.committed = True
+        self._commit.set()
+
+    def abort(self) -> None:
+        """Cancela la ejecución; las Tasks hijas paradas en una barrera también se cancelan."""
+        self.aborted = True
+        self._commit.set()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def head_start(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+def is_speculative() -> bool:
+    run = _current.get()
+    return run is not None and not run.committed
+
+
+async def _wait_for_commit(run: SpeculativeRun, label: str) -> bool:
+    if run.waiting_on is None:
+        run.waiting_on = label
+        speculation_stats.barrier(label)
+    await run._commit.wait()
+    return run.committed
+
+
+async def commit_barrier(label: str) -> None:
+    """Detiene una ejecución especulativa hasta su confirmación (antes de un efecto visible)."""
+    run = _current.get()
+    if run is None or run.committed:
+        return
+    if not await _wait_for_commit(run, label):
+        raise asyncio.CancelledError()
+
+
+async def _run_after_commit(run: SpeculativeRun, label: str, factory: Callable[[], Awaitable[Any]]) -> None:
+    if not await _wait_for_commit(run, label):
+        return
+    try:
+        await factory()
+    except Exception as exc:
+        log.warning("⚠️ Efecto aplazado %s fallido tras confirmar: %s", label, exc)
+
+
+def defer_until_commit(label: str, factory: Callable[[], Awaitable[Any]]) -> bool:
+    """
+    `commit_barrier` para código síncrono. Dentro de una ejecución especulativa programa
+    `factory()` para después de la confirmación (en el loop de la ejecución) y devuelve
+    True; fuera de ella devuelve False y el llamador aplica el efecto en el acto.
+    """
+    run = _current.get()
+    if run is None or run.committed:
+        return False
+
+    def _schedule() -> None:
+        task = run.loop.create_task(_run_after_commit(run, label, factory))
+        run.deferred.add(task)
+        task.add_done_callback(run.deferred.discard)
+
+    try:
+        current_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        current_loop = None
+    if current_loop is run.loop:
+        _schedule()
+    elif run.loop is not None and not run.loop.is_closed():
+        # Desde otro hilo (p.ej. `_sync_run`): la Task se crea en el loop de la ejecución.
+        run.loop.call_soon_threadsafe(_schedule)
+    else:
+        log.warning("⚠️ Efecto %s descartado: la ejecución especulativa ya no tiene loop", label)
+    return True
+
+
+def readonly_mcp_server(server_name: str, annotations: Any = None) -> bool:
+    if server_name in SPECULATION_READONLY_MCP_SERVERS:
+        return True
+    return bool(getattr(annotations, "readOnlyHint", False))
+
+
+def note_llm_tokens(prompt_tokens: int, completion_tokens: int) -> None:
+    """Acumula tokens en la ejecución especulativa en curso (si la hay)."""
+    run = _current.get()
+    if run is not None and not run.committed:
+        run.prompt_tokens += prompt_tokens
+        run.completion_tokens += completion_tokens
+
+
+class SpeculationStats:
+    """Contadores de aciertos (confirmadas) y desperdicio (canceladas) de la especulación."""
+
+    def __init__(self):
+        self._stats = {
+            "started": 0,
+            "committed": 0,
+            "cancelled": 0,
+            "wasted_prompt_tokens": 0,
+            "wasted_completion_tokens": 0,
+            "head_start_seconds": 0.0,
+        }
+        self._barriers: Counter = Counter()
+
+    def started(self) -> None:
+        self._stats["started"] += 1
+
+    def barrier(self, label: str) -> None:
+        self._barriers[label] += 1
+
+    def committed(self, run: SpeculativeRun) -> None:
+        self._stats["committed"] += 1
+        self._stats["head_start_seconds"] += run.head_start()
+        SPECULATION_RUNS_TOTAL.inc(outcome="committed")
+
+    def cancelled(self, run: SpeculativeRun) -> None:
+        self._stats["cancelled"] += 1
+        self._stats["wasted_prompt_tokens"] += run.prompt_tokens
+        self._stats["wasted_completion_tokens"] += run.completion_tokens
+        SPECULATION_RUNS_TOTAL.inc(outcome="cancelled")
+        if run.prompt_tokens:
+            SPECULATION_WASTED_TOKENS_TOTAL.inc(run.prompt_tokens, kind="prompt")
+        if run.completion_tokens:
+            SPECULATION_WASTED_TOKENS_TOTAL.inc(run.completion_tokens, kind="completion")
+        log.info(
+            "🎲 Especulación cancelada %s v%s (tokens desperdiciados: %s+%s, parada en %s)",
+            run.conversation_id,
+            run.version,
+            run.prompt_tokens,
+            run.completion_tokens,
+            run.waiting_on or "-",
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        decided = stats["committed"] + stats["cancelled"]
+        stats["hit_rate"] = round(stats["committed"] / decided, 4) if decided else None
+        stats["avg_head_start_seconds"] = (
+            round(stats["head_start_seconds"] / stats["committed"], 3) if stats["committed"] else None
+        )
+        stats["head_start_seconds"] = round(stats["head_start_seconds"], 3)
+        stats["barriers"] = dict(self._barriers.most_common(10))
+        return stats
+
+
+speculation_stats = SpeculationStats()
+
+
+def get_speculation_stats() -> Dict[str, Any]:
+    return speculation_stats.stats()
@@ -0,0 +1,128 @@
+"""
+🕸️ Grafo de etapas asíncronas
+======================================================================================
+Pequeño planificador para las etapas previas al MainAgent: cada etapa declara de
+qué otras depende (y recibe sus resultados como argumentos), todas arrancan a la
+vez y cada una espera solo a sus dependencias. El flujo consume los resultados con
+`get()` en el orden que necesite y cancela las etapas que dejan de ser útiles.
+
+Con `parallel=False` las etapas se encadenan en orden de alta (camino secuencial
+clásico), útil para comparar latencias o desactivar la concurrencia.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.flight_recorder import span
+
+log = logging.getLogger("StageGraph")
+
+
+class StageGraph:
+    """Etapas async con dependencias explícitas, arranque conjunto y cancelación por etapa."""
+
+    def __init__(self, name: str, *, parallel: bool = True):
+        self.name = name
+        self.parallel = parallel
+        self._stages: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.timings_ms: Dict[str, float] = {}
+        self._started_at: Optional[float] = None
+
+    def add(self, name: str, fn: Callable[..., Awaitable[Any]], *, deps: Iterable[str] = ()) -> "StageGraph":
+        """Registra `fn(*resultados_de_deps)` como etapa `name`."""
+        deps = tuple(deps)
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Etapa '{name}' depende de etapas no registradas: {missing}")
+        if name in self._stages:
+            raise ValueError(f"Etapa duplicada: {name}")
+        self._stages[name] = (fn, deps)
+        return self
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._stages
+
+    async def _run_stage(self, name: str, previous: Optional[str]) -> Any:
+        fn, deps = self._stages[name]
+        if not self.parallel and previous is not None:
+            # Modo secuencial: espera a la etapa anterior aunque no dependa de ella.
+            prev_task = self._tasks[previous]
+            try:
+                await asyncio.shield(prev_task)
+            except asyncio.CancelledError:
+                if not prev_task.cancelled():
+                    raise
+            except Exception:
+                pass
+        # shield: cancelar una etapa no debe cancelar sus dependencias (pueden tener otros consumidores).
+        args = [await asyncio.shield(self._tasks[dep]) for dep in deps]
+        started = time.perf_counter()
+        try:
+            with span(f"{self.name}.{name}"):
+                return await fn(*args)
+        finally:
+            self.timings_ms[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    def start(self) -> "StageGraph":
+        """Lanza todas las etapas registradas (idempotente)."""
+        if self._started_at is not None:
+            return self
+        self._started_at = time.perf_counter()
+        previous = None
+        for name in self._stages:
+            task = asyncio.create_task(self._run_stage(name, previous), name=f"{self.name}:{name}")
+            task.add_done_callback(self._consume_exception)
+            self._tasks[name] = task
+            previous = name
+        return self
+
+    @staticmethod
+    def _consume_exception(task: asyncio.Task) -> None:
+        # Evita avisos de "exception was never retrieved" en etapas canceladas o descartadas.
+        if not task.cancelled():
+            task.exception()
+
+    async def get(self, name: str) -> Any:
+        """
+        Resultado de la etapa (propaga su excepción o CancelledError).
+        Las etapas solo se cancelan con `cancel()`, no al cancelar a quien espera.
+        """
+        self.start()
+        return await asyncio.shield(self._tasks[name])
+
+    async def gather(self, *names: str) -> List[Any]:
+        self.start()
+        return list(await asyncio.gather(*(asyncio.shield(self._tasks[name]) for name in names)))
+
+    def cancel(self, *names: str) -> List[str]:
+        """Cancela las etapas indicadas (o todas las pendientes) y devuelve cuáles se cancelaron."""
+        return self._cancel(names or tuple(self._tasks))
+
+    def cancel_except(self, *keep: str) -> List[str]:
+        return self._cancel([name for name in self._tasks if name not in keep])
+
+    def _cancel(self, names: Iterable[str]) -> List[str]:
+        cancelled = []
+        for name in names:
+            task = self._tasks.get(name)
+            if task is not None and not task.done():
+                task.cancel()
+                cancelled.append(name)
+        if cancelled:
+            log.debug("[%s] etapas canceladas: %s", self.name, cancelled)
+        return cancelled
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (time.perf_counter() - self._started_at) * 1000 if self._started_at else 0.0
+        return {
+            "graph": self.name,
+            "parallel": self.parallel,
+            "elapsed_ms": round(elapsed, 2),
+            "stages_ms": dict(self.timings_ms),
+            "cancelled": [name for name, task in self._tasks.items() if task.cancelled()],
+        }
@@ -0,0 +1,269 @@
+"""
+⏲️ Timer wheel jerárquico
+======================================================================================
+Un único planificador para todos los temporizadores "por clave" del proceso (debounce
+del buffer de WhatsApp, limpiezas diferidas de flags...). En lugar de una Task dormida
+por temporizador, las entradas se guardan en ruedas de slots y un solo `TimerHandle`
+del loop avanza la rueda tick a tick.
+
+- `schedule(key, deadline, callback, *args)` / `call_later(key, delay, ...)`: programa
+  (o reemplaza) el temporizador de `key`. `deadline` usa el reloj de `loop.time()`.
+- `reschedule(key, deadline)`: mueve la entrada en O(1) conservando el callback.
+- `cancel(key)`: O(1).
+- Los callbacks se ejecutan en el loop; si devuelven un awaitable se lanza como Task.
+
+Niveles: 256 slots de TIMER_WHEEL_TICK_MS y tres niveles de 64 slots que se van
+"derramando" (cascade) al nivel inferior. Precisión: un tick (por defecto 50 ms).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+import math
+import os
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+log = logging.getLogger("TimerWheel")
+
+TIMER_WHEEL_TICK_MS = float(os.getenv("TIMER_WHEEL_TICK_MS", "50"))
+
+_LEVEL0_BITS = 8
+_LEVEL_BITS = 6
+_LEVELS = 4  # 256 * 64^3 ticks ≈ 38 días con ticks de 50 ms
+
+
+class _Timer:
+    __slots__ = ("key", "expires", "callback", "args", "slot", "level")
+
+    def __init__(self, key: Hashable, expires: int, callback: Callable[..., Any], args: Tuple[Any, ...]):
+        self.key = key
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.slot: Optional[Dict[Hashable, "_Timer"]] = None
+        self.level = 0
+
+
+class TimerWheel:
+    """Temporizadores por clave con reprogramación y cancelación O(1) sobre un único handle."""
+
+    def __init__(self, tick_ms: float = TIMER_WHEEL_TICK_MS, name: str = "timers"):
+        self.name = name
+        self.tick = max(0.001, tick_ms / 1000)
+        sizes = [1 << _LEVEL0_BITS] + [1 << _LEVEL_BITS] * (_LEVELS - 1)
+        self._wheels: List[List[Dict[Hashable, _Timer]]] = [[{} for _ in range(size)] for size in sizes]
+        self._shifts = [0] + [_LEVEL0_BITS + _LEVEL_BITS * i for i in range(_LEVELS - 1)]
+        self._spans = [1 << (_LEVEL0_BITS + _LEVEL_BITS * i) for i in range(_LEVELS)]
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._level_counts = [0] * _LEVELS
+        self._current = 0
+        self._origin = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._armed_tick = 0
+        self._running_tasks: Set[asyncio.Task] = set()
+        self._stats = {"scheduled": 0, "rescheduled": 0, "cancelled": 0, "fired": 0, "errors": 0, "cascaded": 0}
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def time(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def schedule(self, key: Hashable, deadline: float, callback: Callable[..., Any], *args: Any) -> None:
+        """Programa `callback(*args)` para `deadline` (reloj del loop); reemplaza el de `key`."""
+        self._bind_loop()
+        timer = self._timers.get(key)
+        if timer is not None:
+            self._unlink(timer)
+            self._stats["rescheduled"] += 1
+        else:
+            self._stats["scheduled"] += 1
+        timer = _Timer(key, self._tick_for(deadline), callback, args)
+        self._timers[key] = timer
+        self._place(timer)
+        self._arm()
+
+    def call_later(self, key: Hashable, delay: float, callback: Callable[..., Any], *args: Any) -> None:
+        self.schedule(key, self.time() + max(0.0, float(delay)), callback, *args)
+
+    def reschedule(self, key: Hashable, deadline: float) -> bool:
+        """Mueve el temporizador de `key` a `deadline`. False si no existe."""
+        timer = self._timers.get(key)
+        if timer is None:
+            return False
+        self._bind_loop()
+        self._unlink(timer)
+        timer.expires = self._tick_for(deadline)
+        self._place(timer)
+        self._stats["rescheduled"] += 1
+        self._arm()
+        return True
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        self._unlink(timer)
+        self._stats["cancelled"] += 1
+        if not self._timers:
+            self._disarm()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "name": self.name,
+            "pending": len(self._timers),
+            "running_callbacks": len(self._running_tasks),
+            "tick_ms": self.tick * 1000,
+        }
+
+    # ------------------------------------------------------------------
+    # Rueda
+    # ------------------------------------------------------------------
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            if not self._timers:
+                # Rueda vacía y parada: se pone al día sin recorrer los ticks ociosos.
+                self._current = max(self._current, int((loop.time() - self._origin) / self.tick))
+            return
+        # Primer uso (o nuevo loop, p.ej. en tests): el reloj de referencia cambia.
+        self._disarm()
+        self._loop = loop
+        self._origin = loop.time()
+        self._current = 0
+        for timer in list(self._timers.values()):
+            self._unlink(timer)
+            timer.expires = 0
+            self._place(timer)
+
+    def _tick_for(self, deadline: float) -> int:
+        ticks = math.ceil((deadline - self._origin) / self.tick - 1e-9)
+        return max(self._current + 1, ticks)
+
+    def _place(self, timer: _Timer) -> None:
+        delta = timer.expires - self._current
+        if delta <= 0:
+            timer.expires = self._current + 1
+            delta = 1
+        for level in range(_LEVELS):
+            if delta < self._spans[level] or level == _LEVELS - 1:
+                expires = timer.expires
+                if level == _LEVELS - 1 and delta >= self._spans[level]:
+                    # Fuera de rango: se aparca en el último slot y se recoloca al derramar.
+                    expires = self._current + self._spans[level] - 1
+                wheel = self._wheels[level]
+                slot = wheel[(expires >> self._shifts[level]) & (len(wheel) - 1)]
+                slot[timer.key] = timer
+                timer.slot = slot
+                timer.level = level
+                self._level_counts[level] += 1
+                return
+
+    def _unlink(self, timer: _Timer) -> None:
+        if timer.slot is not None:
+            timer.slot.pop(timer.key, None)
+            timer.slot = None
+            self._level_counts[timer.level] -= 1
+
+    def _next_busy_tick(self) -> int:
+        """Próximo tick con trabajo posible: el siguiente, o el próximo derrame si el nivel 0 está vacío."""
+        if self._level_counts[0]:
+            return self._current + 1
+        return ((self._current >> _LEVEL0_BITS) + 1) << _LEVEL0_BITS
+
+    def _arm(self) -> None:
+        if not self._timers or self._loop is None:
+            return
+        tick = self._next_busy_tick()
+        if self._handle is not None:
+            if self._armed_tick <= tick:
+                return
+            # Había un salto largo programado y ha entrado trabajo antes: se adelanta.
+            self._handle.cancel()
+        self._armed_tick = tick
+        self._handle = self._loop.call_at(self._origin + tick * self.tick, self._advance)
+
+    def _disarm(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _advance(self) -> None:
+        self._handle = None
+        target = int((self._loop.time() - self._origin) / self.tick + 1e-9)
+        while self._current < target and self._timers:
+            # Los ticks sin nada en el nivel 0 se saltan hasta el próximo derrame.
+            self._current = min(target, self._next_busy_tick()) - 1
+            self._step()
+        if self._current < target:
+            self._current = target
+        self._arm()
+
+    def _step(self) -> None:
+        self._current += 1
+        index = self._current & ((1 << _LEVEL0_BITS) - 1)
+        if index == 0:
+            for level in range(1, _LEVELS):
+                level_index = (self._current >> self._shifts[level]) & ((1 << _LEVEL_BITS) - 1)
+                self._cascade(level, level_index)
+                if level_index != 0:
+                    break
+        slot = self._wheels[0][index]
+        if not slot:
+            return
+        due = list(slot.values())
+        for timer in due:
+            if self._timers.get(timer.key) is not timer:
+                continue  # reprogramado o cancelado por un callback de este mismo tick
+            self._unlink(timer)
+            if timer.expires > self._current:
+                self._place(timer)
+                continue
+            self._timers.pop(timer.key, None)
+            self._fire(timer)
+
+    def _cascade(self, level: int, index: int) -> None:
+        slot = self._wheels[level][index]
+        if not slot:
+            return
+        moved = list(slot.values())
+        for timer in moved:
+            self._unlink(timer)
+            self._place(timer)
+        self._stats["cascaded"] += len(moved)
+
+    def _fire(self, timer: _Timer) -> None:
+        self._stats["fired"] += 1
+        try:
+            result = timer.callback(*timer.args)
+        except Exception as exc:
+            self._stats["errors"] += 1
+            log.error("⚠️ Error en temporizador %s (%s): %s", timer.key, self.name, exc, exc_info=True)
+            return
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._running_tasks.add(task)
+            task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._running_tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            self._stats["errors"] += 1
+            log.error("⚠️ Error en temporizador async (%s): %s", self.name, exc, exc_info=exc)
+
+
+timer_wheel = TimerWheel()
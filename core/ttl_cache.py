@@ -0,0 +1,256 @@
+"""
+🧺 Contenedor TTL + LRU para estado por conversación
+======================================================================================
+Sustituye a los `dict` que crecían sin límite (buffer, memoria en RAM, flags, locks,
+anti-duplicados de envío, idioma por chat). Es un `MutableMapping`, así que el código
+que los usa como diccionario sigue funcionando.
+
+- TTL deslizante: cada lectura/escritura renueva la entrada; las inactivas caducan.
+- Tope de entradas: al superarlo se expulsa la menos usada (LRU).
+- `can_evict(key, value)`: protege entradas en uso (p.ej. un lock tomado o un buffer
+  con mensajes pendientes); se saltan y se reintentan más tarde.
+- `on_evict(key, value, reason)`: callback tras expulsar (p.ej. archivar flags que deben
+  sobrevivir). `reason` ∈ {"expired", "size"}. No se llama en borrados explícitos.
+- Estadísticas por contenedor (`stats()`) y globales (`get_ttl_cache_stats()`), que se
+  exponen en `GET /health/memory`.
+
+Valores por defecto: CONVERSATION_STATE_TTL_SECONDS (6 h) y
+CONVERSATION_STATE_MAX_ENTRIES (20000).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+log = logging.getLogger("TTLCache")
+
+CONVERSATION_STATE_TTL_SECONDS = float(os.getenv("CONVERSATION_STATE_TTL_SECONDS", str(6 * 3600)))
+CONVERSATION_STATE_MAX_ENTRIES = int(os.getenv("CONVERSATION_STATE_MAX_ENTRIES", "20000"))
+
+# Expiradas que se recogen de paso en cada escritura (barrido amortizado).
+_PURGE_PER_WRITE = 8
+_SIZE_SAMPLE = 32
+
+# Mapping no es hashable (__eq__ por contenido): el registro va por id().
+_caches: "weakref.WeakValueDictionary[int, TTLCache]" = weakref.WeakValueDictionary()
+
+
+def _deep_sizeof(value: Any, depth: int = 0) -> int:
+    """Tamaño aproximado (bytes) de estructuras simples: dict/list/tuple/set anidados."""
+    size = sys.getsizeof(value)
+    if depth >= 3:
+        return size
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k, depth + 1) + _deep_sizeof(v, depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(item, depth + 1) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += _deep_sizeof(vars(value), depth + 1)
+    return size
+
+
+class TTLCache(MutableMapping):
+    """Diccionario con TTL deslizante, tope LRU, callbacks de expulsión y estadísticas."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        max_entries: int = CONVERSATION_STATE_MAX_ENTRIES,
+        ttl_seconds: Optional[float] = CONVERSATION_STATE_TTL_SECONDS,
+        on_evict: Optional[Callable[[Hashable, Any, str], None]] = None,
+        can_evict: Optional[Callable[[Hashable, Any], bool]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds) if ttl_seconds and ttl_seconds > 0 else None
+        self._on_evict = on_evict
+        self._can_evict = can_evict
+        self._clock = clock
+        # key → (valor, último acceso); el orden es el de uso (LRU al principio).
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evicted_size": 0, "pinned_skips": 0, "evict_errors": 0}
+        _caches[id(self)] = self
+
+    # ------------------------------------------------------------------
+    # MutableMapping
+    # ------------------------------------------------------------------
+    def __getitem__(self, key: Hashable) -> Any:
+        evicted = None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                raise KeyError(key)
+            now = self._clock()
+            if not self._alive(key, item, now):
+                evicted = (key, self._data.pop(key)[0], "expired")
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+            else:
+                self._data[key] = (item[0], now)
+                self._data.move_to_end(key)
+                self._stats["hits"] += 1
+                return item[0]
+        self._notify([evicted])
+        raise KeyError(key)
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, self._clock())
+            self._data.move_to_end(key)
+            evicted = self._purge_locked(limit=_PURGE_PER_WRITE)
+            evicted.extend(self._enforce_size_locked())
+        self._notify(evicted)
+
+    def __delitem__(self, key: Hashable) -> None:
+        with self._lock:
+            del self._data[key]
+
+    def __iter__(self) -> Iterator[Hashable]:
+        # Instantánea: permite modificar el contenedor mientras se recorre (sin renovar TTL).
+        with self._lock:
+            now = self._clock()
+            keys = [key for key, item in self._data.items() if self._alive(key, item, now)]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and self._alive(key, item, self._clock())
+
+    def __repr__(self) -> str:
+        return f"TTLCache(name={self.name!r}, entries={len(self._data)}, max_entries={self.max_entries})"
+
+    # ------------------------------------------------------------------
+    # Extras
+    # ------------------------------------------------------------------
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Lee sin renovar el TTL ni cambiar el orden LRU."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or not self._alive(key, item, self._clock()):
+                return default
+            return item[0]
+
+    def purge_expired(self) -> int:
+        """Expulsa todas las entradas caducadas; devuelve cuántas."""
+        with self._lock:
+            evicted = self._purge_locked(limit=None)
+        self._notify(evicted)
+        return len(evicted)
+
+    def stats(self, sample_size: int = _SIZE_SAMPLE) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._data)
+            sample = [value for value, _ in list(self._data.values())[-sample_size:]] if sample_size else []
+            stats = dict(self._stats)
+        approx_bytes = 0
+        if sample:
+            approx_bytes = int(sum(_deep_sizeof(value) for value in sample) / len(sample) * entries)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "name": self.name,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "approx_bytes": approx_bytes,
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else None,
+            **stats,
+        }
+
+    # ------------------------------------------------------------------
+    # Interno
+    # ------------------------------------------------------------------
+    def _is_expired(self, key: Hashable, item: Tuple[Any, float], now: float) -> bool:
+        return self.ttl is not None and now - item[1] > self.ttl
+
+    def _alive(self, key: Hashable, item: Tuple[Any, float], now: float) -> bool:
+        """Vigente: no caducada, o caducada pero protegida por `can_evict`."""
+        return not self._is_expired(key, item, now) or not self._evictable(key, item[0])
+
+    def _evictable(self, key: Hashable, value: Any) -> bool:
+        if self._can_evict is None:
+            return True
+        try:
+            return bool(self._can_evict(key, value))
+        except Exception:
+            return False
+
+    def _purge_locked(self, limit: Optional[int]) -> List[Tuple[Hashable, Any, str]]:
+        if self.ttl is None:
+            return []
+        now = self._clock()
+        evicted: List[Tuple[Hashable, Any, str]] = []
+        skipped = 0
+        while self._data and (limit is None or len(evicted) < limit) and skipped < len(self._data):
+            key, item = next(iter(self._data.items()))
+            if not self._is_expired(key, item, now):
+                break
+            if not self._evictable(key, item[0]):
+                # En uso: se renueva y se manda al final para no bloquear el barrido.
+                self._data[key] = (item[0], now)
+                self._data.move_to_end(key)
+                self._stats["pinned_skips"] += 1
+                skipped += 1
+                continue
+            self._data.popitem(last=False)
+            self._stats["expired"] += 1
+            evicted.append((key, item[0], "expired"))
+        return evicted
+
+    def _enforce_size_locked(self) -> List[Tuple[Hashable, Any, str]]:
+        evicted: List[Tuple[Hashable, Any, str]] = []
+        attempts = len(self._data)
+        while len(self._data) > self.max_entries and attempts > 0:
+            attempts -= 1
+            key, item = next(iter(self._data.items()))
+            if not self._evictable(key, item[0]):
+                self._data.move_to_end(key)
+                self._stats["pinned_skips"] += 1
+                continue
+            self._data.popitem(last=False)
+            self._stats["evicted_size"] += 1
+            evicted.append((key, item[0], "size"))
+        return evicted
+
+    def _notify(self, evicted: List[Optional[Tuple[Hashable, Any, str]]]) -> None:
+        if self._on_evict is None:
+            return
+        for entry in evicted:
+            if entry is None:
+                continue
+            key, value, reason = entry
+            try:
+                self._on_evict(key, value, reason)
+            except Exception as exc:
+                self._stats["evict_errors"] += 1
+                log.warning("[%s] Error en on_evict para %s: %s", self.name, key, exc)
+
+
+def get_ttl_cache_stats() -> List[Dict[str, Any]]:
+    """Estadísticas de todos los contenedores vivos del proceso."""
+    return sorted((cache.stats() for cache in list(_caches.values())), key=lambda item: item["name"])
+
+
+def process_rss_bytes() -> Optional[int]:
+    """RSS actual del proceso (Linux); None si no se puede leer."""
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
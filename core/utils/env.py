@@ -0,0 +1,10 @@
+"""Lectura de variables de entorno compartida (sin dependencias: la usan también core.metrics y core.llm_pool)."""
+
+import os
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return str(raw).strip().lower() in {"1", "true", "yes", "on", "si", "sí"}
@@ -0,0 +1,185 @@
+"""
+🔎 Reranker léxico para fragmentos de la base de conocimientos
+======================================================================================
+BM25 sobre los fragmentos candidatos devueltos por el MCP, con normalización
+español/inglés: minúsculas, sin acentos, sinónimos habituales de hotel
+(check-in/llegada, check-out/salida, parking/aparcamiento...) y un stemming mínimo
+de plurales. Corre en microsegundos y sustituye al rerank por LLM; este queda como
+fallback opcional cuando las puntuaciones están demasiado igualadas.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Peso extra por proporción de términos de la pregunta presentes en el fragmento.
+COVERAGE_WEIGHT = 0.5
+
+_PHRASES: Tuple[Tuple[str, str], ...] = (
+    (r"check[\s\-_]*in", "checkin"),
+    (r"check[\s\-_]*out", "checkout"),
+    (r"wi[\s\-]*fi", "wifi"),
+    (r"late checkout", "checkout tarde"),
+    (r"early checkin", "checkin temprano"),
+)
+
+# Forma canónica de cada término (tras quitar acentos y plurales).
+_SYNONYMS: Dict[str, str] = {
+    # Entrada / salida
+    "llegada": "checkin",
+    "entrada": "checkin",
+    "arrival": "checkin",
+    "salida": "checkout",
+    "departure": "checkout",
+    # Aparcamiento
+    "aparcamiento": "parking",
+    "aparcar": "parking",
+    "estacionamiento": "parking",
+    "garaje": "parking",
+    "garage": "parking",
+    "car": "coche",
+    # Comidas
+    "breakfast": "desayuno",
+    "desayunar": "desayuno",
+    "comer": "comida",
+    "cenar": "cena",
+    "lunch": "comida",
+    "dinner": "cena",
+    "restaurant": "restaurante",
+    # Servicios
+    "internet": "wifi",
+    "pool": "piscina",
+    "swimming": "piscina",
+    "gym": "gimnasio",
+    "pet": "mascota",
+    "dog": "mascota",
+    "perro": "mascota",
+    "cat": "mascota",
+    "gato": "mascota",
+    "towel": "toalla",
+    "room": "habitacion",
+    "rooms": "habitacion",
+    "price": "precio",
+    "cost": "precio",
+    "coste": "precio",
+    "tarifa": "precio",
+    "airport": "aeropuerto",
+    "beach": "playa",
+    "luggage": "equipaje",
+    "maleta": "equipaje",
+    "baggage": "equipaje",
+    "consigna": "equipaje",
+    "cancel": "cancelacion",
+    "cancellation": "cancelacion",
+    "cancelar": "cancelacion",
+    # Tiempo
+    "hour": "hora",
+    "time": "hora",
+    "horario": "hora",
+    "schedule": "hora",
+    "open": "abierto",
+    "abre": "abierto",
+}
+
+_STOPWORDS = frozenset(
+    """
+    a al algo algun alguna alguno ante como con cual cuando de del desde donde durante e el ella
+    en entre era es esa ese esta este esto estos hay la las le les lo los mas me mi mis muy nos
+    o os para pero poco por porque puedo puede que se si sin sobre son su sus tambien te tiene
+    tienen tu tus un una uno unos y ya yo hotel
+    about an and any are as at be by can could do does for from have how i in is it me my of
+    on or our please the there this to what when where which will with would you your
+    """.split()
+)
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _stem(word: str) -> str:
+    if word.isdigit() or len(word) <= 3:
+        return word
+    if word.endswith("es") and len(word) > 5 and word[-3] not in "aeiou":
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos normalizados (sin stopwords) de `text`."""
+    normalized = fold_accents((text or "").lower())
+    for pattern, replacement in _PHRASES:
+        normalized = re.sub(pattern, replacement, normalized)
+    terms: List[str] = []
+    for word in _WORD_RE.findall(normalized):
+        if word in _STOPWORDS:
+            continue
+        word = _SYNONYMS.get(word, word)
+        word = _stem(word)
+        terms.append(_SYNONYMS.get(word, word))
+    return terms
+
+
+def bm25_scores(query: str, chunks: Sequence[str]) -> List[float]:
+    """Puntuación BM25 (+ cobertura) de cada fragmento respecto a la pregunta."""
+    query_terms = list(dict.fromkeys(tokenize(query)))
+    if not chunks:
+        return []
+    if not query_terms:
+        return [0.0] * len(chunks)
+
+    docs = [Counter(tokenize(chunk)) for chunk in chunks]
+    lengths = [sum(doc.values()) for doc in docs]
+    avg_len = (sum(lengths) / len(lengths)) or 1.0
+    total = len(docs)
+    doc_freq = {term: sum(1 for doc in docs if term in doc) for term in query_terms}
+
+    scores: List[float] = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        matched = 0
+        for term in query_terms:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            matched += 1
+            n = doc_freq[term]
+            idf = math.log(1 + (total - n + 0.5) / (n + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+        score += COVERAGE_WEIGHT * matched / len(query_terms)
+        scores.append(score)
+    return scores
+
+
+def rank_chunks(query: str, chunks: Sequence[str]) -> List[Tuple[int, float]]:
+    """
+    Índices de `chunks` ordenados por relevancia, con su puntuación.
+    A igualdad de puntuación se conserva el orden del recuperador.
+    """
+    scores = bm25_scores(query, chunks)
+    return sorted(enumerate(scores), key=lambda item: (-item[1], item[0]))
+
+
+def is_ambiguous(ranked: Iterable[Tuple[int, float]], top_k: int, min_gap: float = 0.1) -> bool:
+    """
+    True si el corte del top_k no está claro: ninguna coincidencia léxica o el último
+    seleccionado y el primero descartado difieren menos de `min_gap` (relativo).
+    """
+    scores = [score for _, score in ranked]
+    if len(scores) <= top_k:
+        return False
+    if scores[0] <= 0:
+        return True
+    inside, outside = scores[top_k - 1], scores[top_k]
+    return (inside - outside) / scores[0] < min_gap
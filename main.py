@@ -8,6 +8,7 @@ import warnings
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from core.app_state import AppState
 from core.pipeline import process_user_message  # re-export para compatibilidad
@@ -16,8 +17,23 @@ from channels_wrapper.whatsapp.webhook_whatsapp import register_whatsapp_routes
 from api.template_routes import register_template_routes
 from api.chatter_routes import register_chatter_routes
 from api.superintendente_routes import register_superintendente_routes
-from core.config import Settings
+from api.trace_routes import register_trace_routes
+from core.availability_cache import get_availability_cache_stats
+from core.config import ModelConfig, Settings
+from core.context_prefetch import context_prefetcher
+from core.conversation_context import get_conversation_context_stats
+from core.db import get_chat_history_writer_stats, shutdown_db_executor
+from core.instance_registry import get_instance_registry_stats, instance_registry
+from core.kb_retrieval_cache import get_kb_retrieval_stats
+from core.llm_pool import shutdown_llm_pool
+from core.loop_watchdog import LOOP_WATCHDOG_ENABLED, loop_watchdog
+from core.mcp_client import get_mcp_cache_stats, shutdown_mcp_sessions
+from core.message_backup import get_message_backup_stats, message_backup_writer
+from core.metrics import PROMETHEUS_CONTENT_TYPE, render_metrics
+from core.pms_token_cache import pms_token_cache
 from core.socket_manager import SocketManager, set_global_socket_manager
+from core.speculation import get_speculation_stats
+from core.ttl_cache import get_ttl_cache_stats, process_rss_bytes
 
 # =============================================================
 # CONFIG GLOBAL / LOGGING
@@ -116,6 +132,7 @@ register_telegram_routes(app, state)
 register_template_routes(app, state)
 register_chatter_routes(app, state)
 register_superintendente_routes(app, state)
+register_trace_routes(app, state)
 
 # =============================================================
 # HEALTHCHECK
@@ -131,6 +148,87 @@ async def health_check():
     }
 
 
+@app.get("/health/llm-pool")
+async def llm_pool_health():
+    """Uso del pool HTTP compartido de los LLM (por tier) para dimensionarlo."""
+    return ModelConfig.pool_stats()
+
+
+@app.get("/health/mcp")
+async def mcp_health():
+    """Aciertos de las cachés MCP (catálogo, tokens PMS, disponibilidad, KB) y uso del pool de sesiones."""
+    return {
+        **get_mcp_cache_stats(),
+        "pms_tokens": pms_token_cache.stats(),
+        "availability": get_availability_cache_stats(),
+        "kb_retrieval": get_kb_retrieval_stats(),
+    }
+
+
+@app.get("/health/memory")
+async def memory_health():
+    """RSS del proceso, ocupación de los contenedores TTL y aciertos de la caché de historial."""
+    return {
+        "rss_bytes": process_rss_bytes(),
+        "caches": get_ttl_cache_stats(),
+        "history_cache": state.memory_manager.history_cache_stats(),
+    }
+
+
+@app.get("/health/loop")
+async def loop_health():
+    """Percentiles de lag del event loop y funciones que lo bloquearon (LOOP_WATCHDOG_ENABLED)."""
+    return loop_watchdog.stats()
+
+
+@app.get("/health/speculation")
+async def speculation_health():
+    """Aciertos y tokens desperdiciados de la ejecución especulativa del buffer (MESSAGE_BUFFER_SPECULATIVE)."""
+    return get_speculation_stats()
+
+
+@app.get("/health/context")
+async def context_health():
+    """Precarga de contexto durante el buffer y peticiones por carga del contexto de conversación."""
+    return {"prefetch": context_prefetcher.stats(), "loader": get_conversation_context_stats()}
+
+
+@app.get("/health/writers")
+async def writers_health():
+    """Colas de escritura en segundo plano (chat_history, message_backup): profundidad, lag y volcados."""
+    return {"chat_history": get_chat_history_writer_stats(), "message_backup": get_message_backup_stats()}
+
+
+@app.get("/health/registry")
+async def registry_health():
+    """Registro en memoria de instancias/properties: tamaño, antigüedad y aciertos por búsqueda."""
+    return get_instance_registry_stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto Prometheus (etapas del pipeline, LLM, MCP, Supabase)."""
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    if LOOP_WATCHDOG_ENABLED:
+        await loop_watchdog.start()
+    await instance_registry.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_background_workers():
+    await loop_watchdog.stop()
+    await instance_registry.stop()
+    shutdown_db_executor(wait=False)
+    if not message_backup_writer.close(timeout=5):
+        log.warning("⚠️ La cola de message_backup no se vació a tiempo en el shutdown")
+    await shutdown_llm_pool()
+    await shutdown_mcp_sessions()
+
+
 # =============================================================
 # LOCAL DEV
 # =============================================================
@@ -0,0 +1,166 @@
+-- =====================================================================================
+-- 🧾 bookai_conversation_context: contexto de un turno en una sola llamada
+-- =====================================================================================
+-- Lo usa core/conversation_context.py (CONVERSATION_CONTEXT_RPC). Devuelve filas "en
+-- bruto"; las reglas de selección (reserva activa, escalación pendiente) se aplican en
+-- Python igual que con las consultas sueltas. Si la función no existe, el backend cae a
+-- las consultas de siempre.
+--
+-- p_history_table: tabla de historial (chat_history o la del superintendente) para la
+-- pista de property y el historial. La visibilidad en el listado usa siempre chat_history,
+-- igual que is_chat_visible_in_list.
+
+drop function if exists public.bookai_conversation_context(
+    text, text, text, text, text, text, integer, timestamptz, text, text, text[], text
+);
+
+create or replace function public.bookai_conversation_context(
+    p_conversation_id text,
+    p_original_chat_id text default null,
+    p_hint_original_chat_id text default null,
+    p_property_id text default null,
+    p_instance_id text default null,
+    p_channel text default 'whatsapp',
+    p_history_limit integer default 40,
+    p_since timestamptz default null,
+    p_reservation_chat_id text default null,
+    p_reservation_original_chat_id text default null,
+    p_escalation_chat_ids text[] default '{}',
+    p_escalation_like text default null,
+    p_history_table text default 'chat_history'
+)
+returns jsonb
+language plpgsql
+stable
+as $$
+declare
+    v_hint text;
+    v_property text;
+    v_history jsonb;
+    v_history_sql text;
+    v_fallback boolean := false;
+    v_visible boolean := false;
+    v_summary_original text;
+    v_summary_found boolean := false;
+begin
+    -- Pista de property_id: último property_id no vacío del historial.
+    execute format(
+        $q$
+        select ch.property_id::text
+          from %I ch
+         where (
+                ($1::text is not null and ch.original_chat_id = $1)
+             or ($1::text is null and ch.conversation_id = $2)
+               )
+           and ch.property_id is not null
+           and ch.property_id::text <> ''
+         order by ch.created_at desc
+         limit 1
+        $q$,
+        p_history_table
+    )
+      into v_hint
+     using p_hint_original_chat_id, p_conversation_id;
+
+    v_property := coalesce(nullif(p_property_id, ''), v_hint);
+
+    -- Historial (más antiguos primero, como get_conversation_history) con fallback sin property.
+    v_history_sql := format(
+        $q$
+        select coalesce(jsonb_agg(to_jsonb(h) order by h.created_at), '[]'::jsonb)
+          from (
+                select ch.role, ch.content, ch.created_at, ch.structured_payload
+                  from %I ch
+                 where ch.conversation_id = $1
+                   and ($2::text is null or ch.property_id::text = $2)
+                   and ($3::text is null or ch.original_chat_id = $3)
+                   and ($4::timestamptz is null or ch.created_at >= $4)
+                 order by ch.created_at asc
+                 limit $5
+               ) h
+        $q$,
+        p_history_table
+    );
+
+    execute v_history_sql
+      into v_history
+     using p_conversation_id, v_property, p_original_chat_id, p_since, p_history_limit;
+
+    if v_property is not null and jsonb_array_length(v_history) = 0 then
+        v_fallback := true;
+        execute v_history_sql
+          into v_history
+         using p_conversation_id, null::text, p_original_chat_id, p_since, p_history_limit;
+    end if;
+
+    -- Visibilidad en el listado (misma lógica que is_chat_visible_in_list).
+    if v_property is not null then
+        select coalesce(clm.original_chat_id, p_original_chat_id), true
+          into v_summary_original, v_summary_found
+          from chat_last_message clm
+         where clm.conversation_id = p_conversation_id
+           and clm.property_id::text = v_property
+           and clm.channel = p_channel
+         order by clm.created_at desc
+         limit 1;
+
+        if not coalesce(v_summary_found, false) and p_original_chat_id is not null then
+            select coalesce(clm.original_chat_id, p_original_chat_id), true
+              into v_summary_original, v_summary_found
+              from chat_last_message clm
+             where clm.original_chat_id = p_original_chat_id
+               and clm.property_id::text = v_property
+               and clm.channel = p_channel
+             order by clm.created_at desc
+             limit 1;
+        end if;
+
+        v_visible := coalesce(v_summary_found, false) and not exists (
+            select 1
+              from chat_history ch
+             where ch.property_id::text = v_property
+               and ch.channel = p_channel
+               and (ch.archived_at is not null or ch.hidden_at is not null)
+               and (
+                    ch.conversation_id = p_conversation_id
+                 or (v_summary_original is not null and ch.original_chat_id = v_summary_original)
+                   )
+        );
+    end if;
+
+    return jsonb_build_object(
+        'property_id', v_property,
+        'property_hint', v_hint,
+        'history', v_history,
+        'history_fallback', v_fallback,
+        'visible', v_visible,
+        'reservations', coalesce((
+            select jsonb_agg(to_jsonb(r) order by r.updated_at desc)
+              from (
+                    select *
+                      from chat_reservations cr
+                     where cr.chat_id = p_reservation_chat_id
+                       and (p_instance_id is null or cr.instance_id = p_instance_id)
+                       and (p_reservation_original_chat_id is null or cr.original_chat_id = p_reservation_original_chat_id)
+                     order by cr.updated_at desc
+                     limit 20
+                   ) r
+        ), '[]'::jsonb),
+        'escalations', coalesce((
+            select jsonb_agg(to_jsonb(e) order by e."timestamp" desc)
+              from (
+                    select *
+                      from escalations es
+                     where es.manager_confirmed = false
+                       and (
+                            es.guest_chat_id = any(p_escalation_chat_ids)
+                         or (p_escalation_like is not null and es.guest_chat_id like p_escalation_like)
+                           )
+                       and (nullif(p_property_id, '') is null or es.property_id::text = p_property_id)
+                     order by es."timestamp" desc
+                     limit 20
+                   ) e
+        ), '[]'::jsonb)
+    );
+end;
+$$;
@@ -0,0 +1,86 @@
+"""
+🧪 Fakes compartidos por los tests
+======================================================================================
+`FakeSupabase` imita la cadena del cliente de Supabase que usa el repo
+(`table().select().eq().order().limit().range().execute()` e `insert().execute()`):
+
+- Lecturas: devuelven las filas de `tables[nombre]` (sin aplicar filtros `eq`/`or_`/`order`),
+  recortadas por `range`/`limit`. Cuentan en `selects` y `reads` (tabla leída).
+- Escrituras: se guardan en `inserts` tal cual (fila o lista de filas); `rows()` las aplana.
+- `gate` (Event) retiene cada `execute`; `down` o `fail_when(payload)` hacen fallar los inserts.
+- Con `strict_tables=True`, pedir una tabla que no está en `tables` lanza RuntimeError.
+"""
+
+import threading
+
+
+class _FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.payload = None
+        self.bounds = None
+        self.max_rows = None
+
+    def insert(self, payload):
+        self.payload = payload
+        return self
+
+    def select(self, *_args, **_kwargs):
+        return self
+
+    def eq(self, *_args):
+        return self
+
+    def or_(self, *_args):
+        return self
+
+    def order(self, *_args, **_kwargs):
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def execute(self):
+        self.client.gate.wait(2)
+        if self.payload is not None:
+            if self.client.down or self.client.fail_when(self.payload):
+                raise ConnectionError("supabase caído")
+            self.client.inserts.append(self.payload)
+            return type("Resp", (), {"data": []})()
+
+        self.client.selects += 1
+        self.client.reads.append(self.table)
+        rows = list(self.client.tables.get(self.table, []))
+        if self.bounds is not None:
+            start, end = self.bounds
+            rows = rows[start:end + 1]
+        if self.max_rows is not None:
+            rows = rows[: self.max_rows]
+        return type("Resp", (), {"data": rows})()
+
+
+class FakeSupabase:
+    def __init__(self, tables=None, strict_tables=False):
+        self.tables = tables or {}
+        self.strict_tables = strict_tables
+        self.inserts = []
+        self.selects = 0
+        self.reads = []
+        self.down = False
+        self.fail_when = lambda payload: False
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def table(self, name):
+        if self.strict_tables and name not in self.tables:
+            raise RuntimeError(f"tabla desconocida {name}")
+        return _FakeQuery(self, name)
+
+    def rows(self):
+        return [row for payload in self.inserts for row in (payload if isinstance(payload, list) else [payload])]
@@ -0,0 +1,41 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.agent_context import bind_turn, current_chat_id
+from tools.sub_agent_tool_wrapper import create_sub_agent_tool
+
+
+class _RecordingSubAgent:
+    def __init__(self):
+        self.calls = []
+
+    async def handle(self, pregunta: str, chat_id: str, chat_history=None) -> str:
+        await asyncio.sleep(0.01)
+        self.calls.append((chat_id, current_chat_id()))
+        return f"ok {chat_id}"
+
+
+def test_shared_sub_agent_tool_resolves_chat_from_bound_turn():
+    sub_agent = _RecordingSubAgent()
+    tool = create_sub_agent_tool(
+        name="disponibilidad_precios",
+        description="test",
+        sub_agent=sub_agent,
+        memory_manager=None,
+    )
+
+    async def _turn(chat_id: str) -> str:
+        with bind_turn(chat_id, hotel_name="Hotel"):
+            return await tool.ainvoke({"query": f"pregunta {chat_id}"})
+
+    async def _run():
+        return await asyncio.gather(_turn("111"), _turn("222"))
+
+    outputs = asyncio.run(_run())
+
+    assert outputs == ["ok 111", "ok 222"]
+    assert sorted(sub_agent.calls) == [("111", "111"), ("222", "222")]
+    assert current_chat_id() == ""
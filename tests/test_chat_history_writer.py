@@ -0,0 +1,99 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import core.db as db
+from conftest import FakeSupabase
+from core.batch_writer import BatchWriter
+
+
+def test_batch_writer_batches_in_order_and_supports_read_your_writes():
+    written = []
+    gate = threading.Event()
+
+    def flush(batch):
+        gate.wait(1)
+        written.append(list(batch))
+
+    writer = BatchWriter("test", flush, batch_ms=20, max_batch=50, keys=lambda item: (item[0],))
+    for i in range(10):
+        writer.submit(("chat-a" if i % 2 == 0 else "chat-b", i))
+    assert writer.pending("chat-a") == 5
+    gate.set()
+    assert writer.wait_for("chat-a", "chat-b", timeout=2)
+    assert [item[1] for batch in written for item in batch] == list(range(10))
+    assert len(written) < 10
+    assert writer.close(timeout=2)
+    writer.submit(("chat-a", 99))  # tras el cierre: escritura inmediata
+    assert written[-1] == [("chat-a", 99)]
+
+
+def test_save_message_write_behind_uses_multi_row_insert_and_visibility_cache(monkeypatch):
+    fake = FakeSupabase({"chat_history": [{"archived_at": "2026-01-01T00:00:00+00:00", "hidden_at": None}]})
+    monkeypatch.setattr(db, "supabase", fake)
+    monkeypatch.setattr(db, "CHAT_HISTORY_WRITE_BEHIND", True)
+    db.invalidate_chat_visibility("34600000009")
+
+    for n in range(6):
+        db.save_message("34600000009", "guest" if n % 2 == 0 else "bookai", f"mensaje {n}", property_id=5)
+    assert db.wait_for_chat_history("34600000009")
+
+    rows = fake.rows()
+    assert [row["content"] for row in rows] == [f"mensaje {n}" for n in range(6)]
+    assert all(row["archived_at"] == "2026-01-01T00:00:00+00:00" for row in rows)
+    created = [row["created_at"] for row in rows]
+    assert created == sorted(created) and len(set(created)) == 6
+    assert any(isinstance(payload, list) for payload in fake.inserts)
+    # Una sola consulta de estado para todo el chat.
+    assert fake.selects == 1
+
+    db.invalidate_chat_visibility("34600000009")
+    db.save_message("34600000009", "guest", "otra", property_id=5)
+    db.wait_for_chat_history("34600000009")
+    assert fake.selects == 2
+
+
+def test_async_wait_for_chat_history_keeps_the_loop_running(monkeypatch):
+    gate = threading.Event()
+    writer = BatchWriter("test-async-wait", lambda batch: gate.wait(1), batch_ms=1, keys=lambda item: (item,))
+    monkeypatch.setattr(db, "chat_history_writer", writer)
+    writer.submit("34600000010")
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while not gate.is_set():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.create_task(ticker())
+        asyncio.get_running_loop().call_later(0.1, gate.set)
+        assert await db.async_wait_for_chat_history("34600000010", timeout=2)
+        await ticking
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
+    assert asyncio.run(db.async_wait_for_chat_history("34600000010"))  # nada pendiente: vuelve al instante
+    assert writer.close(timeout=2)
+
+
+def test_visibility_check_waits_for_queued_rows(monkeypatch):
+    fake = FakeSupabase({"chat_last_message": []})
+
+    def flush(batch):
+        time.sleep(0.05)
+        # Como el trigger de chat_history: el resumen del listado aparece al insertar.
+        fake.tables["chat_last_message"].extend({"conversation_id": item, "original_chat_id": None} for item in batch)
+
+    writer = BatchWriter("test-visibility-wait", flush, batch_ms=1, keys=lambda item: (item,))
+    monkeypatch.setattr(db, "supabase", fake)
+    monkeypatch.setattr(db, "chat_history_writer", writer)
+    writer.submit("34600000011")
+    assert db.is_chat_visible_in_list("34600000011", property_id=5)
+    assert writer.close(timeout=2)
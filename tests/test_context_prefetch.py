@@ -0,0 +1,142 @@
+import asyncio
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import core.context_prefetch as context_prefetch
+import core.conversation_context as conversation_context
+from core.context_prefetch import ContextPrefetcher, current_snapshot
+from core.conversation_context import ConversationContextLoader, InMemoryContextBackend
+from core.memory_manager import MemoryManager
+
+
+def _fake_backend(monkeypatch, calls):
+    async def fake_run_db_call(func, *args, **kwargs):
+        calls.append(getattr(func, "__name__", "load"))
+        return func(*args, **kwargs)
+
+    def hydrate_dynamic_context(*, state, chat_id, instance_number=None):
+        state.memory_manager.set_flag(chat_id, "instance_id", "inst-1")
+
+    class _SlowFake(InMemoryContextBackend):
+        def load(self, request):
+            calls.append("history")
+            time.sleep(0.01)
+            return super().load(request)
+
+    backend = _SlowFake(
+        {
+            "chat_history": [
+                {
+                    "conversation_id": "34600000001",
+                    "original_chat_id": None,
+                    "property_id": None,
+                    "role": "guest",
+                    "content": "mensaje en DB",
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                }
+            ],
+            "chat_reservations": [
+                {"chat_id": "34600000001", "folio_id": "F123", "instance_id": "inst-1", "updated_at": "2026-01-01"}
+            ],
+        }
+    )
+    monkeypatch.setattr(context_prefetch, "run_db_call", fake_run_db_call)
+    monkeypatch.setattr(conversation_context, "run_db_call", fake_run_db_call)
+    monkeypatch.setattr(context_prefetch, "hydrate_dynamic_context", hydrate_dynamic_context)
+    return ConversationContextLoader(backend=backend)
+
+
+def test_prefetch_hit_merges_current_ram(monkeypatch):
+    calls = []
+    loader = _fake_backend(monkeypatch, calls)
+    state = SimpleNamespace(memory_manager=MemoryManager())
+    prefetcher = ContextPrefetcher(enabled=True, max_age_seconds=60, loader=loader)
+
+    async def scenario():
+        assert prefetcher.prefetch(state, "34600000001", instance_number="34900")
+        # Segundo mensaje del mismo bloque: se reutiliza la precarga en vuelo.
+        assert not prefetcher.prefetch(state, "34600000001", instance_number="34900")
+        state.memory_manager.add_runtime_message("34600000001", "user", "mensaje en RAM")
+        snapshot = await prefetcher.take(state, "34600000001")
+        assert snapshot is not None and snapshot.hydrated
+        assert current_snapshot("34600000001") is snapshot
+        history = snapshot.history(state.memory_manager, 8)
+        assert [msg["content"] for msg in history] == ["mensaje en DB", "mensaje en RAM"]
+        assert snapshot.reservation_for("inst-1")[1]["folio_id"] == "F123"
+        assert snapshot.reservation_for("otra") == (False, None)
+        assert snapshot.escalation_for(None) == (True, None)
+        # Ya consumido: la siguiente recogida no encuentra nada.
+        assert await prefetcher.take(state, "34600000001") is None
+
+    asyncio.run(scenario())
+    assert calls.count("history") == 1
+    stats = prefetcher.stats()
+    assert (stats["started"], stats["coalesced"], stats["hit"], stats["miss"]) == (1, 1, 1, 1)
+
+
+def test_prefetch_discarded_when_history_changed(monkeypatch):
+    loader = _fake_backend(monkeypatch, [])
+    mm = MemoryManager()
+    state = SimpleNamespace(memory_manager=mm)
+    prefetcher = ContextPrefetcher(enabled=True, max_age_seconds=60, loader=loader)
+
+    async def scenario():
+        prefetcher.prefetch(state, "34600000002")
+        await asyncio.sleep(0.05)
+        mm._bump_history_version("34600000002")  # p.ej. una respuesta guardada mientras tanto
+        assert await prefetcher.take(state, "34600000002") is None
+
+        prefetcher.prefetch(state, "34600000002")
+        await asyncio.sleep(0.05)
+        mm.set_flag("34600000002", "property_id", 77)
+        assert await prefetcher.take(state, "34600000002") is None
+
+    asyncio.run(scenario())
+    assert prefetcher.stats()["stale"] == 2
+
+
+def test_miss_loads_context_inline_in_one_round_trip(monkeypatch):
+    calls = []
+    loader = _fake_backend(monkeypatch, calls)
+    state = SimpleNamespace(memory_manager=MemoryManager())
+    prefetcher = ContextPrefetcher(enabled=True, max_age_seconds=60, loader=loader)
+
+    async def scenario():
+        assert await prefetcher.take(state, "34600000001") is None
+        snapshot = await prefetcher.load(state, "34600000001", instance_number="34900")
+        assert snapshot is not None and snapshot.hydrated
+        assert current_snapshot("34600000001") is snapshot
+        assert [msg["content"] for msg in snapshot.history(state.memory_manager, 8)] == ["mensaje en DB"]
+        assert snapshot.reservation_for("inst-1")[1]["folio_id"] == "F123"
+
+    asyncio.run(scenario())
+    assert calls.count("history") == 1
+    assert loader.stats()["round_trips"] == 1
+    stats = prefetcher.stats()
+    assert (stats["miss"], stats["loaded"]) == (1, 1)
+
+
+def test_chained_block_does_not_inherit_previous_snapshot(monkeypatch):
+    loader = _fake_backend(monkeypatch, [])
+    state = SimpleNamespace(memory_manager=MemoryManager())
+    prefetcher = ContextPrefetcher(enabled=True, max_age_seconds=60, loader=loader, load_on_miss=False)
+
+    async def second_block():
+        # Sin precarga para el bloque siguiente (lo lanza el `finally` del anterior).
+        assert await prefetcher.take(state, "34600000001") is None
+        assert await prefetcher.load(state, "34600000001") is None
+        return current_snapshot("34600000001")
+
+    async def first_block():
+        prefetcher.prefetch(state, "34600000001")
+        assert await prefetcher.take(state, "34600000001") is not None
+        assert current_snapshot("34600000001") is not None
+        # Como `_launch_next`: la Task nueva copia el contexto de la actual.
+        return await asyncio.create_task(second_block())
+
+    assert asyncio.run(first_block()) is None
@@ -0,0 +1,164 @@
+import asyncio
+import dataclasses
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import core.conversation_context as conversation_context
+import core.db as db
+from core.batch_writer import BatchWriter
+from core.conversation_context import (
+    ConversationContextLoader,
+    ConversationContextRequest,
+    InMemoryContextBackend,
+)
+
+
+def _ts(minutes_ago: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)).isoformat()
+
+
+async def _inline_db_call(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def _tables():
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+    return {
+        "chat_history": [
+            {"conversation_id": "34600000021", "original_chat_id": "inst:34600000021", "property_id": 9,
+             "channel": "whatsapp", "role": "guest", "content": "hola", "created_at": _ts(10)},
+            {"conversation_id": "34600000021", "original_chat_id": "inst:34600000021", "property_id": 9,
+             "channel": "whatsapp", "role": "bookai", "content": "¡bienvenido!", "created_at": _ts(9)},
+        ],
+        "chat_last_message": [
+            {"conversation_id": "34600000021", "original_chat_id": "inst:34600000021", "property_id": 9,
+             "channel": "whatsapp", "created_at": _ts(9)},
+        ],
+        "chat_reservations": [
+            {"chat_id": "34600000021", "folio_id": "OLD", "checkin": "2020-01-01", "instance_id": "inst",
+             "updated_at": "2026-03-01"},
+            {"chat_id": "34600000021", "folio_id": "NEXT", "checkin": tomorrow, "instance_id": "inst",
+             "updated_at": "2026-01-01"},
+        ],
+        "escalations": [
+            {"guest_chat_id": "inst:34600000021", "manager_confirmed": False, "sent_to_guest": True,
+             "timestamp": _ts(1), "property_id": 9},
+            {"guest_chat_id": "34600000021", "manager_confirmed": False, "sent_to_guest": False,
+             "timestamp": _ts(5), "property_id": 9, "escalation_id": "esc-1"},
+        ],
+    }
+
+
+def _request(**overrides):
+    base = dict(
+        conversation_id="34600000021",
+        original_chat_id="inst:34600000021",
+        memory_id="inst:34600000021",
+        instance_id="inst",
+    )
+    base.update(overrides)
+    return ConversationContextRequest(**base)
+
+
+def test_loader_single_round_trip_immutable_snapshot(monkeypatch):
+    monkeypatch.setattr(conversation_context, "run_db_call", _inline_db_call)
+    backend = InMemoryContextBackend(_tables())
+    loader = ConversationContextLoader(backend=backend)
+
+    context = asyncio.run(loader.load(_request()))
+    assert backend.calls == 1 and context.round_trips == 1 and context.source == "fake"
+    assert context.property_hint == 9 and context.property_id == 9
+    assert [row["content"] for row in context.history] == ["hola", "¡bienvenido!"]
+    assert context.visible_for("34600000021", 9, "whatsapp", "inst:34600000021") == (True, True)
+    assert context.visible_for("34600000021", 10, "whatsapp", "inst:34600000021") == (False, None)
+    assert context.reservation["folio_id"] == "NEXT"
+    assert context.escalation["escalation_id"] == "esc-1"
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        context.visible = False
+    with pytest.raises(TypeError):
+        context.history[0]["content"] = "cambiado"
+    rows = context.history_rows()
+    rows[0]["content"] = "copia"
+    assert context.history[0]["content"] == "hola"
+
+    # La tabla de historial viaja a la RPC y el backend en memoria la respeta.
+    assert _request(history_table="superintendent_history").rpc_params()["p_history_table"] == "superintendent_history"
+    other = asyncio.run(loader.load(_request(history_table="superintendent_history")))
+    assert other.history == () and other.property_hint is None
+
+    # Archivar el chat lo saca del listado.
+    backend.tables["chat_history"][0]["archived_at"] = _ts(0)
+    assert asyncio.run(loader.load(_request())).visible is False
+
+
+def test_loader_falls_back_to_queries_when_backend_fails(monkeypatch):
+    monkeypatch.setattr(conversation_context, "run_db_call", _inline_db_call)
+
+    class _Query:
+        def __getattr__(self, _name):
+            return lambda *args, **kwargs: self
+
+        def execute(self):
+            return type("Resp", (), {"data": []})()
+
+    class _Supabase:
+        def table(self, _name):
+            return _Query()
+
+    async def history(conversation_id, property_id=None, **_kwargs):
+        return [{"role": "guest", "content": "desde consultas", "created_at": _ts(1)}]
+
+    monkeypatch.setattr(conversation_context, "supabase", _Supabase())
+    monkeypatch.setattr(conversation_context, "async_get_conversation_history", history)
+    monkeypatch.setattr(conversation_context, "get_last_property_id_for_original_chat", lambda *a, **k: 9)
+    monkeypatch.setattr(conversation_context, "is_chat_visible_in_list", lambda *a, **k: True)
+
+    class _Down:
+        name = "rpc"
+        calls = 0
+
+        def load(self, request):
+            self.calls += 1
+            raise RuntimeError("Could not find the function bookai_conversation_context")
+
+    backend = _Down()
+    loader = ConversationContextLoader(backend=backend, retry_seconds=60)
+    first = asyncio.run(loader.load(_request()))
+    second = asyncio.run(loader.load(_request()))
+    assert backend.calls == 1  # no se reintenta hasta pasado retry_seconds
+    assert first.source == second.source == "queries"
+    assert first.property_id == 9 and first.visible is True
+    assert [row["content"] for row in first.history] == ["desde consultas"]
+    assert first.round_trips > 1
+    assert loader.stats()["backend_errors"] == 1
+
+
+def test_loader_waits_for_queued_history_rows(monkeypatch):
+    monkeypatch.setattr(conversation_context, "run_db_call", _inline_db_call)
+    backend = InMemoryContextBackend(_tables())
+    row = {"conversation_id": "34600000021", "original_chat_id": "inst:34600000021", "property_id": 9,
+           "channel": "whatsapp", "role": "guest", "content": "en cola", "created_at": _ts(0)}
+
+    def flush(batch):
+        time.sleep(0.05)
+        backend.tables["chat_history"].extend(data for _table, data in batch)
+
+    writer = BatchWriter(
+        "test-context-wait",
+        flush,
+        batch_ms=1,
+        keys=lambda item: (item[1]["conversation_id"], item[1]["original_chat_id"]),
+    )
+    monkeypatch.setattr(db, "chat_history_writer", writer)
+    writer.submit(("chat_history", row))
+
+    context = asyncio.run(ConversationContextLoader(backend=backend).load(_request()))
+    assert [row["content"] for row in context.history] == ["hola", "¡bienvenido!", "en cola"]
+    assert writer.close(timeout=2)
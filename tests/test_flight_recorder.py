@@ -0,0 +1,66 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.flight_recorder import FlightRecorder
+
+
+def test_spans_nest_across_tasks_and_ring_is_bounded():
+    rec = FlightRecorder(size=2, sink_spec="", enabled=True)
+
+    async def _tool(name: str):
+        with rec.span(f"tool.{name}"):
+            with rec.span("llm.gpt"):
+                await asyncio.sleep(0.01)
+
+    async def _block(chat_id: str):
+        with rec.trace("whatsapp.buffered_block", chat_id):
+            with rec.span("main_agent"):
+                await asyncio.gather(_tool("a"), _tool("b"))
+
+    async def _run():
+        for chat_id in ("+34 600 111 222", "34600111333", "34600111222"):
+            await _block(chat_id)
+
+    asyncio.run(_run())
+
+    assert rec.stats()["ring_size"] == 2
+    traces = rec.for_chat("34600111222")
+    assert len(traces) == 1
+    spans = {span["name"]: span for span in traces[0]["spans"] if span["name"] != "llm.gpt"}
+    assert spans["main_agent"]["depth"] == 0
+    assert spans["tool.a"]["parent_id"] == spans["main_agent"]["id"]
+    llm_spans = [span for span in traces[0]["spans"] if span["name"] == "llm.gpt"]
+    assert {span["parent_id"] for span in llm_spans} == {spans["tool.a"]["id"], spans["tool.b"]["id"]}
+    assert all(span["depth"] == 2 for span in llm_spans)
+
+
+def test_sqlite_sink_serves_traces_evicted_from_ring(tmp_path):
+    rec = FlightRecorder(size=1, sink_spec=f"sqlite:{tmp_path / 'traces.db'}", enabled=True)
+
+    for chat_id in ("34600000001", "34600000002"):
+        with rec.trace("process_user_message", chat_id):
+            with rec.span("main_agent"):
+                pass
+
+    traces = rec.for_chat("+34 600 000 001")
+    assert len(traces) == 1
+    assert traces[0]["spans"][0]["name"] == "main_agent"
+    assert rec.stats()["sink_writes"] == 2
+
+
+def test_traces_are_scoped_to_the_token_instance():
+    rec = FlightRecorder(size=10, sink_spec="", enabled=True)
+
+    for chat_id, instance_id in (("34600000001", "hotel-a"), ("34600000001", "hotel-b"), ("34600000001", None)):
+        with rec.trace("process_user_message", chat_id) as trace:
+            trace.annotate({"instance_id": instance_id})
+
+    assert len(rec.for_chat("34600000001")) == 3
+    own = rec.for_chat("34600000001", instance_id="hotel-a")
+    assert [item["attrs"]["instance_id"] for item in own] == ["hotel-a"]
+    other = rec.for_chat("34600000001", instance_id="hotel-b")[0]["trace_id"]
+    assert rec.get(other, instance_id="hotel-a") is None
+    assert rec.get(other)["trace_id"] == other
@@ -0,0 +1,106 @@
+import asyncio
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import core.memory_manager as memory_manager
+from core.memory_manager import MemoryManager
+
+
+class _FakeHistoryDB:
+    def __init__(self):
+        self.rows = []
+        self.reads = 0
+
+    def add(self, content, property_id, role="guest"):
+        self.rows.append(
+            {
+                "conversation_id": "34600000011",
+                "property_id": property_id,
+                "role": role,
+                "content": content,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "structured_payload": None,
+            }
+        )
+
+    def get_conversation_history(self, conversation_id, limit=10, since=None, property_id=None, **_kwargs):
+        self.reads += 1
+        rows = [
+            row
+            for row in self.rows
+            if row["conversation_id"] == conversation_id
+            and (property_id is None or str(row["property_id"]) == str(property_id))
+        ]
+        return [dict(row) for row in rows[:limit]]
+
+    async def async_get_conversation_history(self, *args, **kwargs):
+        return self.get_conversation_history(*args, **kwargs)
+
+    def save_message(self, conversation_id, role, content, property_id=None, **_kwargs):
+        self.add(content, property_id, role=role)
+
+
+def _patch(monkeypatch, fake):
+    monkeypatch.setattr(memory_manager, "get_conversation_history", fake.get_conversation_history)
+    monkeypatch.setattr(memory_manager, "async_get_conversation_history", fake.async_get_conversation_history)
+    monkeypatch.setattr(memory_manager, "save_message", fake.save_message)
+    monkeypatch.setattr(memory_manager, "HISTORY_CACHE_FETCH_LIMIT", 40)
+
+
+def _contents(msgs):
+    return [msg["content"] for msg in msgs]
+
+
+def test_history_cache_loads_once_and_writes_through(monkeypatch):
+    fake = _FakeHistoryDB()
+    _patch(monkeypatch, fake)
+    fake.add("hola", 5)
+    fake.add("respuesta", 5, role="bookai")
+    mm = MemoryManager()
+    mm.set_flag("34600000011", "property_id", 5)
+
+    assert _contents(mm.get_memory("34600000011", 10)) == ["hola", "respuesta"]
+    mm.add_runtime_message("34600000011", "user", "en RAM")
+    mm.save("34600000011", "user", "¿tenéis parking?", channel="whatsapp")
+    cached = asyncio.run(mm.aget_memory("34600000011", 10))
+    assert fake.reads == 1
+
+    stats = mm.history_cache_stats()
+    assert (stats["loads"], stats["hits"], stats["write_through"], stats["reads_saved"]) == (1, 1, 1, 1)
+    assert stats["reads_saved_per_message"] == 1.0
+
+    # Mismo resultado que repetir la consulta (sin caché).
+    mm.history_cache_enabled = False
+    assert _contents(cached) == _contents(mm.get_memory("34600000011", 10))
+    mm.history_cache_enabled = True
+
+    mm.clear("34600000011")
+    mm.set_flag("34600000011", "property_id", 5)
+    mm.get_memory("34600000011", 10)
+    assert fake.reads == 3
+
+
+def test_history_cache_fallback_and_invalidation(monkeypatch):
+    fake = _FakeHistoryDB()
+    _patch(monkeypatch, fake)
+    fake.add("mensaje sin property", None)
+    mm = MemoryManager()
+    mm.set_flag("34600000011", "property_id", 7)
+
+    assert _contents(mm.get_memory("34600000011", 5)) == ["mensaje sin property"]
+    assert fake.reads == 2  # filtrada vacía + fallback sin property_id
+    mm.get_memory("34600000011", 5)
+    assert fake.reads == 2 and mm.history_cache_stats()["reads_saved"] == 2
+
+    # Un guardado sobre un resultado de fallback no se puede reflejar: se relee.
+    mm.save("34600000011", "user", "nuevo", channel="whatsapp")
+    assert _contents(mm.get_memory("34600000011", 5))[-1] == "nuevo"
+    assert fake.reads == 3
+
+    # Archivar/ocultar el chat invalida por id de DB.
+    assert mm.invalidate_history("34600000011") == 1
+    mm.get_memory("34600000011", 5)
+    assert fake.reads == 4
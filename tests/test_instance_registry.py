@@ -0,0 +1,103 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import core.instance_context as instance_context
+from conftest import FakeSupabase
+from core.instance_registry import InstanceRegistry
+
+
+_INSTANCES = [
+    {"instance_id": "inst-a", "whatsapp_number": "+34 900 000 001", "whatsapp_phone_id": "111", "tabla": "hotels_a"},
+    {"instance_id": "https://a.example.com/api", "whatsapp_number": "34900000002", "whatsapp_phone_id": "222"},
+]
+_HOTELS = [
+    {"id": 1, "property_id": 10, "name": "Hotel Ponferrada Centro", "instance_id": "inst-a"},
+    {"id": 2, "property_id": 10, "name": "Hostal Ponferrada", "instance_url": "https://a.example.com/api"},
+    {"id": 3, "property_id": 30, "name": "Alda Vigo", "property_name": "Alda Vigo Puerto", "instance_id": "inst-a"},
+]
+
+
+def _registry():
+    fake = FakeSupabase({"instances": _INSTANCES, "properties": [], "hotels_a": _HOTELS}, strict_tables=True)
+    registry = InstanceRegistry(
+        enabled=True,
+        client=fake,
+        property_tables=lambda instances: ["properties", "hotels_a"],
+    )
+    assert registry.refresh()
+    return registry, fake
+
+
+def test_registry_indexes_instances_and_properties():
+    registry, fake = _registry()
+    assert sorted(fake.reads) == ["hotels_a", "instances", "properties"]
+
+    assert registry.instance_by_number("34900000001")["instance_id"] == "inst-a"
+    assert registry.instance_by_number("+34 900-000-002")["whatsapp_phone_id"] == "222"
+    assert registry.instance_by_phone_id(" 222 ")["instance_id"].startswith("https://")
+    assert registry.instance_by_code("inst-a")["whatsapp_phone_id"] == "111"
+    assert registry.instance_by_code("desconocida") is None
+
+    assert [row["id"] for row in registry.properties_by_column("hotels_a", "property_id", "10")] == [1, 2]
+    assert registry.properties_by_column("hotels_a", "id", 3)[0]["name"] == "Alda Vigo"
+    assert [row["id"] for row in registry.properties_by_instance("hotels_a", "inst-a")] == [1, 3]
+    # Por hostname de la instance_url.
+    assert [row["id"] for row in registry.properties_by_instance("hotels_a", "https://a.example.com/otra")] == [2]
+    assert registry.property_by_name("hotels_a", "Alda Vigo")["id"] == 3
+
+    # Coincidencia parcial como ilike '%q%' en name/property_name.
+    assert [row["id"] for row in registry.properties_by_query("hotels_a", "ponf")] == [1, 2]
+    assert [row["id"] for row in registry.properties_by_query("hotels_a", "vigo puer")] == [3]
+    assert [row["id"] for row in registry.properties_by_query("hotels_a", "ponferrada", limit=1)] == [1]
+    assert registry.properties_by_query("hotels_a", "lugo") is None
+    # Tabla no cargada: el registro no responde.
+    assert registry.properties_by_query("otra_tabla", "ponf") is None
+
+    # Las filas devueltas son copias.
+    registry.instance_by_code("inst-a")["whatsapp_phone_id"] = "x"
+    assert registry.instance_by_code("inst-a")["whatsapp_phone_id"] == "111"
+
+    stats = registry.stats()
+    assert stats["instances"] == 2 and stats["property_tables"] == {"properties": 0, "hotels_a": 3}
+    assert stats["lookups"]["instance_by_code"] == {"hit": 3, "miss": 1}
+    assert stats["lookups"]["properties_by_query"]["bypass"] == 1
+
+
+def test_fetchers_answer_from_registry_without_supabase(monkeypatch):
+    registry, fake = _registry()
+
+    class _NoSupabase:
+        def table(self, name):
+            raise AssertionError(f"consulta inesperada a {name}")
+
+    monkeypatch.setattr(instance_context, "instance_registry", registry)
+    monkeypatch.setattr(instance_context, "supabase", _NoSupabase())
+
+    assert instance_context.fetch_instance_by_number("+34900000001")["instance_id"] == "inst-a"
+    assert instance_context.fetch_instance_by_phone_id("111")["instance_id"] == "inst-a"
+    assert instance_context.fetch_instance_by_code("inst-a")["whatsapp_number"] == "+34 900 000 001"
+    assert instance_context.fetch_property_by_id("hotels_a", 10, "https://a.example.com/x")["id"] == 2
+    assert instance_context.fetch_property_by_id("hotels_a", 10, "inst-a")["id"] == 1
+    assert instance_context.fetch_property_by_id("hotels_a", 3)["property_id"] == 30
+    assert [row["id"] for row in instance_context.fetch_properties_by_code("hotels_a", "inst-a")] == [1, 3]
+    assert len(instance_context.fetch_properties_by_query("hotels_a", "ponferrada")) == 2
+    assert instance_context.fetch_property_by_name("hotels_a", "Hostal Ponferrada")["id"] == 2
+
+
+def test_registry_keeps_previous_snapshot_on_failed_refresh_and_skips_large_tables():
+    registry, fake = _registry()
+    del fake.tables["instances"]
+    assert not registry.refresh()
+    assert registry.instance_by_code("inst-a")["whatsapp_phone_id"] == "111"
+    assert registry.stats()["refresh_errors"] == 1
+
+    fake.tables["instances"] = _INSTANCES
+    registry.max_rows = 2
+    assert registry.refresh()
+    assert "hotels_a" not in registry.stats()["property_tables"]
+    assert registry.properties_by_instance("hotels_a", "inst-a") is None
+
+    registry.invalidate()
+    assert registry.instance_by_code("inst-a") is None
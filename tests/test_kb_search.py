@@ -0,0 +1,101 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from agents import info_agent
+from agents.info_agent import KBSearchTool
+from core.kb_retrieval_cache import KBRetrievalCache
+
+
+class _FakeKBTool:
+    name = "base_conocimientos"
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.inputs = []
+
+    async def ainvoke(self, payload):
+        self.inputs.append(payload["input"])
+        await asyncio.sleep(0.05)
+        return self.answers.get(payload["input"], "No se encontró información.")
+
+
+class _FakeLanguageManager:
+    async def adetect_language(self, text, prev_lang=None):
+        await asyncio.sleep(0.02)
+        return "en"
+
+    async def atranslate_if_needed(self, text, source, target):
+        await asyncio.sleep(0.02)
+        return "¿A qué hora es el checkout?"
+
+
+def test_kb_variants_run_concurrently_and_first_valid_wins(monkeypatch):
+    kb_tool = _FakeKBTool({"¿A qué hora es el checkout?": "El checkout es hasta las 12:00 del mediodía."})
+
+    async def _fake_get_tools(server_name):
+        return [kb_tool]
+
+    monkeypatch.setattr(info_agent, "get_tools", _fake_get_tools)
+    monkeypatch.setattr(info_agent, "language_manager", _FakeLanguageManager())
+    monkeypatch.setattr(info_agent, "kb_retrieval_cache", KBRetrievalCache())
+
+    started = time.perf_counter()
+    result = asyncio.run(KBSearchTool()._arun("What time is checkout?"))
+    elapsed = time.perf_counter() - started
+
+    assert result == "El checkout es hasta las 12:00 del mediodía."
+    assert "What time is checkout?" in kb_tool.inputs
+    # Traducción (0.04s) + una sola ida y vuelta a la KB, no cuatro en serie.
+    assert elapsed < 0.15
+
+
+def test_lexical_rerank_matches_spanish_chunks_for_english_synonyms():
+    chunks = [
+        "Parking privado en el propio edificio: 15 € por noche.",
+        "Desayuno buffet de 7:30 a 10:30.",
+        "Wi-Fi gratuito en todo el hotel.",
+        "Check-out: hasta las 12:00 del mediodía.",
+        "Se admiten mascotas de hasta 10 kg.",
+    ]
+
+    top = asyncio.run(KBSearchTool()._rerank_chunks("What time is check out? And breakfast?", chunks, top_k=2))
+
+    assert top == [chunks[3], chunks[1]]
+
+
+class _FakeMemory:
+    def get_flag(self, chat_id, key):
+        return {"instance_url": "https://pms.test", "property_id": 7, "kb": "Hotel-Test"}.get(key)
+
+
+def test_kb_results_are_cached_per_property_until_invalidated(monkeypatch):
+    kb_tool = _FakeKBTool({"¿Hay parking?": "Parking privado en el edificio: 15 € por noche."})
+    cache = KBRetrievalCache()
+
+    async def _fake_get_tools(server_name):
+        return [kb_tool]
+
+    monkeypatch.setattr(info_agent, "get_tools", _fake_get_tools)
+    monkeypatch.setattr(info_agent, "language_manager", _FakeLanguageManager())
+    monkeypatch.setattr(info_agent, "kb_retrieval_cache", cache)
+    tool = KBSearchTool(memory_manager=_FakeMemory(), chat_id="34600000000")
+
+    async def _run():
+        first = await tool._arun("¿Hay parking?")
+        calls_after_first = len(kb_tool.inputs)
+        second = await tool._arun("hay  PARKING")
+        calls_after_second = len(kb_tool.inputs)
+        cache.invalidate(property_id=7)
+        await tool._arun("¿Hay parking?")
+        return first, second, calls_after_first, calls_after_second
+
+    first, second, calls_after_first, calls_after_second = asyncio.run(_run())
+
+    assert first == second == "Parking privado en el edificio: 15 € por noche."
+    assert calls_after_second == calls_after_first
+    assert len(kb_tool.inputs) > calls_after_second
+    assert cache.stats()["hits"] == 1
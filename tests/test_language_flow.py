@@ -15,8 +15,20 @@ class _FakeLanguageManager:
     def detect_language(self, text: str, prev_lang: str | None = None) -> str:
         return self.detected_lang
 
+    def resolve_response_language(self, latest_guest_message: str, **kwargs) -> tuple[str, float]:
+        return self.detected_lang, 0.9
+
     def ensure_language(self, text: str, lang_code: str) -> str:
-        return f"[{lang_code}] {text}"
+        prefix = f"[{lang_code}] "
+        if text.startswith(prefix):
+            return text
+        return f"{prefix}{text}"
+
+    async def aresolve_response_language(self, latest_guest_message: str, **kwargs) -> tuple[str, float]:
+        return self.resolve_response_language(latest_guest_message, **kwargs)
+
+    async def aensure_language(self, text: str, lang_code: str) -> str:
+        return self.ensure_language(text, lang_code)
 
 
 class _FakeSupervisor:
@@ -51,12 +63,21 @@ class _FakeMemory:
             }
         )
 
+    async def asave(self, conversation_id, role, content, channel=None, **kwargs):
+        self.save(conversation_id, role, content, channel=channel)
+
     def get_memory(self, conversation_id, limit=20):
         return self._history[-limit:]
 
+    async def aget_memory(self, conversation_id, limit=20):
+        return self.get_memory(conversation_id, limit=limit)
+
     def get_memory_as_messages(self, conversation_id):
         return []
 
+    async def aget_memory_as_messages(self, conversation_id, limit=30):
+        return self.get_memory_as_messages(conversation_id)
+
 
 class _FakeState:
     def __init__(self, memory):
@@ -78,6 +99,7 @@ def _load_pipeline_with_stubs(detected_lang: str, agent_reply: str = "ok"):
 
     fake_main_agent_mod = types.ModuleType("core.main_agent")
     fake_main_agent_mod.create_main_agent = lambda **kwargs: _DummyMainAgent()
+    fake_main_agent_mod.NO_GUEST_REPLY = "__NO_GUEST_REPLY__"
 
     fake_instance_mod = types.ModuleType("core.instance_context")
     fake_instance_mod.hydrate_dynamic_context = lambda **kwargs: None
@@ -104,7 +126,7 @@ def test_pipeline_persists_guest_lang_before_main_agent_flow():
         )
     )
 
-    assert out == "Main response"
+    assert out == "[en] Main response"
     assert memory.get_flag("34600111222", "guest_lang") == "en"
 
 
@@ -0,0 +1,33 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.loop_watchdog import LoopWatchdog
+
+
+def _blocking_sync_call():
+    time.sleep(0.4)
+
+
+def test_watchdog_names_blocking_call_and_reports_lag_percentiles():
+    async def _run():
+        watchdog = LoopWatchdog(interval_ms=20, threshold_ms=100, sample_ms=10)
+        await watchdog.start()
+        try:
+            await asyncio.sleep(0.1)
+            _blocking_sync_call()
+            await asyncio.sleep(0.1)
+        finally:
+            await watchdog.stop()
+        return watchdog.stats()
+
+    stats = asyncio.run(_run())
+
+    assert stats["stalls"] == 1
+    # time.sleep es C: no tiene frame propio, así que el bloqueo se atribuye al llamador.
+    assert stats["top_blockers"][0]["blocker"] == "tests.test_loop_watchdog._blocking_sync_call"
+    assert stats["lag_ms"]["max"] >= 250
+    assert stats["lag_ms"]["p50"] < 100
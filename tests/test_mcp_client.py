@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("ENDPOINT_MCP", "http://localhost:8001")
+
+from mcp.types import Tool
+
+from core import availability_cache, mcp_client, pms_token_cache
+
+
+class _FakePool:
+    def __init__(self):
+        self.list_calls = 0
+
+    async def run(self, server_name, operation):
+        self.list_calls += 1
+        await asyncio.sleep(0.01)
+        return [Tool(name=f"buscar_token_{self.list_calls}", inputSchema={"type": "object"})]
+
+
+def test_tool_catalog_is_cached_and_refreshed_in_background(monkeypatch):
+    pool = _FakePool()
+    monkeypatch.setattr(mcp_client, "session_pool", pool)
+    catalog = mcp_client.ToolCatalogCache(ttl=60, max_stale=3600)
+
+    async def _run():
+        first = await asyncio.gather(*(catalog.get("InfoAgent") for _ in range(5)))
+        cached = await catalog.get("InfoAgent")
+
+        # Catálogo caducado: se sirve el anterior y se refresca una sola vez en segundo plano.
+        fetched_at, tools = catalog._entries["InfoAgent"]
+        catalog._entries["InfoAgent"] = (fetched_at - 120, tools)
+        stale = await asyncio.gather(*(catalog.get("InfoAgent") for _ in range(3)))
+        await asyncio.sleep(0.05)
+        refreshed = await catalog.get("InfoAgent")
+        return first, cached, stale, refreshed
+
+    first, cached, stale, refreshed = asyncio.run(_run())
+
+    assert pool.list_calls == 2
+    assert {t[0].name for t in first} == {"buscar_token_1"}
+    assert cached[0].name == "buscar_token_1"
+    assert all(t[0].name == "buscar_token_1" for t in stale)
+    assert refreshed[0].name == "buscar_token_2"
+    assert catalog.stats["misses"] == 5
+    assert catalog.stats["stale_hits"] == 3
+
+
+class _FakeTokenTool:
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, payload):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return json.dumps([{"key": f"tok-{self.calls}", "expires_in": 3600}])
+
+
+def test_pms_token_is_cached_single_flight_and_renewed_on_auth_error(monkeypatch):
+    token_tool = _FakeTokenTool()
+    cache = pms_token_cache.PmsTokenCache()
+    monkeypatch.setattr(pms_token_cache, "pms_token_cache", cache)
+    pms_calls = []
+
+    async def _pms_call(key):
+        pms_calls.append(key)
+        if key == "tok-1":
+            return '{"status": 401, "message": "Unauthorized"}'
+        return '[{"room": "Doble"}]'
+
+    async def _run():
+        tokens = await asyncio.gather(*(cache.get(token_tool, "https://pms.test") for _ in range(5)))
+        result = await pms_token_cache.invoke_with_pms_token(token_tool, "https://pms.test/", _pms_call)
+        return tokens, result
+
+    tokens, result = asyncio.run(_run())
+
+    assert tokens == ["tok-1"] * 5
+    assert result == '[{"room": "Doble"}]'
+    assert pms_calls == ["tok-1", "tok-2"]
+    assert token_tool.calls == 2
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_availability_cache_coalesces_identical_requests():
+    cache = availability_cache.AvailabilityCache(ttl=60)
+    loads = []
+
+    async def _loader():
+        loads.append(1)
+        await asyncio.sleep(0.02)
+        return [{"room": "Doble", "price": 120}]
+
+    key = availability_cache.availability_key("https://pms.test/", 7, "2026-08-01T00:00:00", "2026-08-03", 2)
+
+    async def _run():
+        burst = await asyncio.gather(*(cache.get_or_load(key, _loader) for _ in range(20)))
+        again = await cache.get_or_load(key, _loader)
+        return burst, again
+
+    burst, again = asyncio.run(_run())
+
+    assert len(loads) == 1
+    assert all(rooms == [{"room": "Doble", "price": 120}] for rooms in burst)
+    assert again is burst[0]
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 19, 1)
+
+
+class _FakeSlot:
+    def __init__(self, closable):
+        self.closable = closable
+        self.close_requested = False
+
+    def close_soon(self):
+        self.close_requested = True
+        return self.closable
+
+
+def test_session_pool_closes_slots_of_a_previous_loop_before_rebinding():
+    pool = mcp_client.McpSessionPool(size=2)
+    old_loop = asyncio.new_event_loop()
+    old_loop.close()
+    pool._loop = old_loop
+    slots = [_FakeSlot(True), _FakeSlot(False)]
+    pool._slots["InfoAgent"] = [slots[0], None]
+    pool._slots["DispoPreciosAgent"] = [slots[1], None]
+
+    async def _run():
+        return pool._usable_here(), pool._loop is asyncio.get_running_loop()
+
+    assert asyncio.run(_run()) == (True, True)
+    assert all(slot.close_requested for slot in slots)
+    assert pool._slots == {}
+    assert pool.stats["sessions_orphaned"] == 1
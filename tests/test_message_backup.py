@@ -0,0 +1,86 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from conftest import FakeSupabase
+from core.message_backup import MessageBackupWriter
+
+
+def test_backup_writer_spills_overflow_and_failures_then_replays(tmp_path):
+    fake = FakeSupabase()
+    spill = tmp_path / "spill.jsonl"
+    writer = MessageBackupWriter(
+        client=fake,
+        max_queue=3,
+        batch_ms=5,
+        max_batch=2,
+        retries=1,
+        retry_base_ms=1,
+        spill_path=str(spill),
+        replay_interval_seconds=0,
+    )
+
+    # Supabase lento: cola (3) + lote en curso (2) llenos; lo que desborda va a disco sin bloquear.
+    fake.gate.clear()
+    accepted = [writer.submit("message_backup", {"content": f"m{n}", "direction": "inbound"}) for n in range(10)]
+    assert accepted.count(False) >= 5
+    assert len(spill.read_text().splitlines()) == accepted.count(False)
+    fake.gate.set()
+    assert writer.flush(timeout=2)
+
+    # Supabase caído: tras los reintentos el lote también se vuelca.
+    fake.down = True
+    writer.submit("message_backup", {"content": "caído", "direction": "outbound"})
+    assert writer.flush(timeout=2)
+    assert json.loads(spill.read_text().splitlines()[-1])["payload"]["content"] == "caído"
+
+    # Vuelve Supabase: el siguiente lote escrito reinserta todo lo volcado.
+    fake.down = False
+    writer.submit("message_backup", {"content": "final", "direction": "outbound"})
+    assert writer.flush(timeout=2)
+    contents = sorted(row["content"] for row in fake.rows())
+    assert contents == sorted([f"m{n}" for n in range(10)] + ["caído", "final"])
+    assert any(isinstance(payload, list) for payload in fake.inserts)
+    assert not spill.exists()
+
+    stats = writer.stats()
+    assert stats["dropped"] == accepted.count(False)
+    assert stats["failed"] == 1 and stats["retries"] == 1
+    assert stats["replayed"] == accepted.count(False) + 1
+    assert writer.close(timeout=2)
+
+
+def test_backup_writer_retries_and_spills_only_unwritten_groups(tmp_path):
+    fake = FakeSupabase()
+    spill = tmp_path / "spill.jsonl"
+    writer = MessageBackupWriter(
+        client=fake,
+        batch_ms=50,
+        max_batch=10,
+        retries=1,
+        retry_base_ms=1,
+        spill_path=str(spill),
+        replay_interval_seconds=0,
+    )
+
+    # Dos grupos de columnas en el mismo lote: el segundo (con `role`) falla siempre.
+    fake.fail_when = lambda payload: any("role" in row for row in (payload if isinstance(payload, list) else [payload]))
+    for content in ("a1", "a2", "a3"):
+        writer.submit("message_backup", {"content": content, "direction": "inbound"})
+    writer.submit("message_backup", {"content": "b", "direction": "outbound", "role": "assistant"})
+    assert writer.flush(timeout=2)
+
+    assert sorted(row["content"] for row in fake.rows()) == ["a1", "a2", "a3"]
+    assert [json.loads(line)["payload"]["content"] for line in spill.read_text().splitlines()] == ["b"]
+    stats = writer.stats()
+    assert stats["written"] == 3 and stats["failed"] == 1 and stats["retries"] == 1
+
+    # Al reinsertar solo entra "b": ninguna fila del primer grupo se duplica.
+    fake.fail_when = lambda payload: False
+    writer.submit("message_backup", {"content": "c", "direction": "inbound"})
+    assert writer.flush(timeout=2)
+    assert sorted(row["content"] for row in fake.rows()) == ["a1", "a2", "a3", "b", "c"]
+    assert not spill.exists()
+    assert writer.close(timeout=2)
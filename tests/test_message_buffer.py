@@ -0,0 +1,110 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.memory_manager import MemoryManager
+from core.message_buffer import ConversationState, MessageBufferManager, looks_complete
+from core.speculation import commit_barrier, note_llm_tokens, speculation_stats
+from core.timer_wheel import TimerWheel
+
+
+def test_looks_complete_heuristics():
+    assert looks_complete("¿Tenéis parking en el hotel?")
+    assert looks_complete("Quería saber si el desayuno está incluido en la tarifa.")
+    assert not looks_complete("hola")
+    assert not looks_complete("quería preguntaros por el parking y")
+    assert not looks_complete("Tengo dos dudas:")
+    assert not looks_complete("ok?")
+
+
+def test_adaptive_debounce_decisions():
+    buffer = MessageBufferManager(idle_seconds=15, adaptive=True, min_seconds=2, max_seconds=40)
+
+    complete = ConversationState(messages=["¿A qué hora es el check-in?"], first_message_at=0.0)
+    assert buffer._debounce_delay(complete, now=0.0) == (2, "early")
+
+    # Huésped que suele mandar un segundo mensaje a los ~4 s: se espera a ese hueco.
+    complete.gap_ewma = 4.0
+    assert buffer._debounce_delay(complete, now=0.0) == (6.0, "early")
+
+    # Ráfaga rápida (un mensaje cada ~2 s): se alarga la ventana hasta el máximo absoluto.
+    burst = ConversationState(messages=["hola", "mira", "una cosa"], first_message_at=0.0, gap_ewma=2.0)
+    assert buffer._debounce_delay(burst, now=5.0) == (19.0, "extended")
+    assert buffer._debounce_delay(burst, now=30.0) == (10.0, "capped")
+
+    # Mensaje suelto de un huésped pausado: no se espera la ventana completa.
+    slow = ConversationState(messages=["hola"], first_message_at=0.0, gap_ewma=12.0)
+    assert buffer._debounce_delay(slow, now=0.0) == (7.5, "learned")
+
+    fixed = MessageBufferManager(idle_seconds=15, adaptive=False)
+    assert fixed._debounce_delay(complete, now=0.0) == (15.0, "fixed")
+
+
+def test_speculative_run_commits_or_cancels_on_new_message():
+    started, effects = [], []
+
+    async def process(cid, combined, version):
+        started.append(combined)
+        note_llm_tokens(100, 20)
+        await asyncio.sleep(0.01)
+        await commit_barrier("channel.send")
+        effects.append((combined, version))
+
+    async def scenario():
+        buffer = MessageBufferManager(idle_seconds=0.1, scheduler=TimerWheel(tick_ms=5), speculative=True)
+        # Bloque completo: arranca ya, pero el envío espera a que venza la ventana.
+        await buffer.add_message("a", "¿A qué hora es el check-in?", process)
+        await asyncio.sleep(0.05)
+        assert started == ["¿A qué hora es el check-in?"] and effects == []
+        await asyncio.sleep(0.15)
+        assert effects == [("¿A qué hora es el check-in?", 1)]
+
+        # Llega otro mensaje: la especulación se cancela sin efectos y el bloque final va junto.
+        await buffer.add_message("b", "¿Tenéis parking en el hotel?", process)
+        await asyncio.sleep(0.03)
+        await buffer.add_message("b", "y cuánto cuesta", process)
+        await asyncio.sleep(0.2)
+        return effects
+
+    before = speculation_stats.stats()
+    effects = asyncio.run(scenario())
+    after = speculation_stats.stats()
+    assert effects[1:] == [("¿Tenéis parking en el hotel?\ny cuánto cuesta", 2)]
+    assert after["committed"] - before["committed"] == 1
+    assert after["cancelled"] - before["cancelled"] == 1
+    assert after["wasted_prompt_tokens"] - before["wasted_prompt_tokens"] == 100
+
+
+def test_sync_save_in_speculative_run_waits_for_commit():
+    saved = []
+    memory = MemoryManager()
+
+    async def fake_asave(conversation_id, role, content, **_kwargs):
+        saved.append((conversation_id, content))
+
+    memory.asave = fake_asave
+    memory._prepare_save = lambda *args, **kwargs: (None, None)  # guardado directo: sin Supabase
+
+    async def process(cid, combined, version):
+        await asyncio.sleep(0.01)
+        memory.save(cid, "assistant", f"v{version}")  # p.ej. `update_memory` de un agente
+
+    async def scenario():
+        buffer = MessageBufferManager(idle_seconds=0.1, scheduler=TimerWheel(tick_ms=5), speculative=True)
+        await buffer.add_message("a", "¿A qué hora es el check-in?", process)
+        await asyncio.sleep(0.05)
+        assert saved == []  # especulando: aún sin efectos
+        await asyncio.sleep(0.15)
+        assert saved == [("a", "v1")]
+
+        # Cancelada por un mensaje nuevo: su guardado no llega a hacerse (el bloque final
+        # no es especulativo y guarda directamente).
+        await buffer.add_message("b", "¿Tenéis parking en el hotel?", process)
+        await asyncio.sleep(0.05)
+        await buffer.add_message("b", "y cuánto cuesta", process)
+        await asyncio.sleep(0.25)
+
+    asyncio.run(scenario())
+    assert saved == [("a", "v1")]
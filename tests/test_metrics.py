@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core import metrics
+from core.metrics import MetricsRegistry
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    calls = registry.counter("test_calls_total", "Llamadas.", ("tool",))
+    latency = registry.histogram("test_latency_seconds", "Latencia.", ("stage",), buckets=(0.1, 1.0))
+
+    calls.inc(tool='buscar "token"')
+    calls.inc(2, tool='buscar "token"')
+    latency.observe(0.05, stage="main_agent")
+    latency.observe(0.5, stage="main_agent")
+    latency.observe(3, stage="main_agent")
+
+    text = registry.render()
+    assert "# TYPE test_calls_total counter" in text
+    assert 'test_calls_total{tool="buscar \\"token\\""} 3' in text
+    assert 'test_latency_seconds_bucket{stage="main_agent",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="main_agent",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="main_agent",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{stage="main_agent"} 3' in text
+    assert 'test_latency_seconds_sum{stage="main_agent"} 3.55' in text
+
+
+def test_supabase_queries_are_counted_per_table():
+    session = httpx.Client(
+        base_url="http://supabase.local/rest/v1",
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json=[])),
+    )
+    client = SimpleNamespace(postgrest=SimpleNamespace(session=session))
+    assert metrics.instrument_supabase(client)
+    assert metrics.instrument_supabase(client)  # idempotente
+    assert len(session.event_hooks["request"]) == 1
+
+    before = metrics.SUPABASE_QUERIES_TOTAL.value(table="chat_history", operation="select", status="ok")
+    session.get("/chat_history", params={"select": "*"})
+    session.post("/rpc/get_context", json={})
+
+    assert metrics.SUPABASE_QUERIES_TOTAL.value(table="chat_history", operation="select", status="ok") == before + 1
+    assert metrics.SUPABASE_QUERIES_TOTAL.value(table="rpc:get_context", operation="rpc", status="ok") >= 1
+    assert metrics.postgrest_target("POST", "http://x/rest/v1/chat_history", "resolution=merge-duplicates") == (
+        "chat_history",
+        "upsert",
+    )
@@ -0,0 +1,43 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.stage_graph import StageGraph
+
+
+def test_stage_graph_runs_independent_stages_concurrently_and_cancels():
+    async def _run():
+        calls = []
+
+        async def _slow(name, value, delay=0.05):
+            calls.append(name)
+            await asyncio.sleep(delay)
+            return value
+
+        graph = StageGraph("test")
+        graph.add("a", lambda: _slow("a", 1))
+        graph.add("b", lambda: _slow("b", 2))
+        graph.add("sum", lambda a, b: _slow("sum", a + b, 0), deps=("a", "b"))
+        graph.add("unused", lambda: _slow("unused", 0, 5))
+
+        started = time.perf_counter()
+        assert await graph.get("sum") == 3
+        elapsed = time.perf_counter() - started
+        assert elapsed < 0.09
+
+        assert graph.cancel("unused") == ["unused"]
+        await asyncio.sleep(0)
+        assert graph.summary()["cancelled"] == ["unused"]
+        assert await graph.gather("a", "b") == [1, 2]
+
+        sequential = StageGraph("seq", parallel=False)
+        sequential.add("a", lambda: _slow("a", 1))
+        sequential.add("b", lambda: _slow("b", 2))
+        started = time.perf_counter()
+        assert await sequential.get("b") == 2
+        assert time.perf_counter() - started >= 0.1
+
+    asyncio.run(_run())
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from agents import supervisor_output_agent
+from agents.supervisor_output_agent import SupervisorOutputAgent
+
+
+class _FakeLLM:
+    def __init__(self, payload):
+        self.payload = payload
+        self.calls = 0
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        content = self.payload if isinstance(self.payload, str) else json.dumps(self.payload, ensure_ascii=False)
+        return SimpleNamespace(content=content)
+
+
+def test_evaluate_returns_all_verdicts_from_one_call(monkeypatch):
+    fake = _FakeLLM(
+        {
+            "promises_human_escalation": True,
+            "promise_confidence": 0.9,
+            "rewrite": "Ahora mismo no puedo confirmarlo. ¿Quieres que lo consulte?",
+            "offer_consistent": False,
+            "offer_reason": "Inventa un spa gratuito",
+            "offer_confidence": 0.8,
+            "estado": "Revisión Necesaria",
+            "motivo": "Matiz menor",
+        }
+    )
+    monkeypatch.setattr(supervisor_output_agent, "llm", fake)
+    agent = SupervisorOutputAgent()
+
+    verdict = asyncio.run(
+        agent.evaluate(
+            "¿Me incluís el spa?",
+            "Se lo pregunto a recepción y te confirmo en breve.",
+            target_lang="es",
+            check_human_promise=True,
+            pending_offer={"type": "upgrade"},
+        )
+    )
+
+    assert fake.calls == 1
+    assert verdict["promises_human_escalation"] is True
+    assert verdict["audited_response"] == verdict["rewrite"]
+    assert verdict["offer"] == {"is_consistent": False, "reason": "Inventa un spa gratuito", "confidence": 0.8}
+    assert verdict["audit"]["estado"] == "Aprobado"
+
+    monkeypatch.setattr(supervisor_output_agent, "llm", _FakeLLM({"estado": "Rechazado", "motivo": "Fuera de contexto"}))
+    verdict = asyncio.run(agent.evaluate("¿Tienen spa?", "El desayuno es de 7 a 10."))
+    assert verdict["audit"]["estado"] == "Rechazado"
+    assert verdict["audit"]["motivo"] == "Fuera de contexto"
+    assert verdict["rewrite"] == ""
+
+    monkeypatch.setattr(supervisor_output_agent, "llm", _FakeLLM("Estado: Aprobado"))
+    assert asyncio.run(agent.evaluate("Hola", "Hola, ¿en qué puedo ayudarte?")) is None
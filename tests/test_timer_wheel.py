@@ -0,0 +1,60 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.message_buffer import MessageBufferManager
+from core.timer_wheel import TimerWheel
+
+
+def test_timer_wheel_reschedule_cancel_and_async_callbacks():
+    async def _run():
+        wheel = TimerWheel(tick_ms=5)
+        loop = asyncio.get_running_loop()
+        fired = {}
+
+        async def _async_cb(key):
+            fired[key] = loop.time()
+
+        start = loop.time()
+        wheel.call_later("a", 0.05, lambda: fired.setdefault("a", loop.time()))
+        wheel.call_later("b", 0.05, _async_cb, "b")
+        wheel.call_later("c", 0.05, lambda: fired.setdefault("c", loop.time()))
+        # Más allá del primer nivel (256 ticks): tiene que derramarse desde el nivel 1.
+        wheel.call_later("d", 1.5, lambda: fired.setdefault("d", loop.time()))
+        assert wheel.reschedule("a", start + 0.15)
+        assert wheel.cancel("c")
+        await asyncio.sleep(1.6)
+        return start, fired, wheel.stats()
+
+    start, fired, stats = asyncio.run(_run())
+
+    assert set(fired) == {"a", "b", "d"}
+    assert 0.05 <= fired["b"] - start < 0.12
+    assert 0.15 <= fired["a"] - start < 0.25
+    assert 1.5 <= fired["d"] - start < 1.6
+    assert stats["pending"] == 0 and stats["cascaded"] >= 1
+
+
+def test_message_buffer_debounces_on_shared_wheel():
+    async def _run():
+        wheel = TimerWheel(tick_ms=5)
+        buffer = MessageBufferManager(idle_seconds=0.05, scheduler=wheel)
+        blocks = []
+
+        async def _process(cid, combined, version):
+            blocks.append((cid, combined, version))
+
+        for text in ("hola", "quiero reservar", "para mañana"):
+            await buffer.add_message("34600000001", text, _process)
+            await asyncio.sleep(0.02)
+        await buffer.add_message("34600000002", "descartado", _process)
+        await buffer.discard_conversation("34600000002")
+        await asyncio.sleep(0.15)
+        return blocks, wheel.stats()
+
+    blocks, stats = asyncio.run(_run())
+
+    assert blocks == [("34600000001", "hola\nquiero reservar\npara mañana", 3)]
+    assert stats["pending"] == 0 and stats["fired"] == 1
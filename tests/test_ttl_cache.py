@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.memory_manager import MemoryManager
+from core.ttl_cache import TTLCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_lru_pinning_and_eviction_callbacks():
+    clock = _Clock()
+    evicted = []
+    cache = TTLCache(
+        "test",
+        max_entries=3,
+        ttl_seconds=10,
+        clock=clock,
+        on_evict=lambda key, value, reason: evicted.append((key, reason)),
+        can_evict=lambda key, value: value != "busy",
+    )
+    cache["a"] = "busy"
+    cache["b"] = 1
+    cache["c"] = 2
+    clock.now = 5
+    assert cache["b"] == 1  # renueva b
+    cache["d"] = 3  # tope: sale la LRU no protegida (c), "a" está en uso
+    assert ("c", "size") in evicted and "a" in cache
+
+    clock.now = 20
+    assert "b" not in cache and cache.get("d") is None
+    assert cache.purge_expired() == 1  # b caducada; a en uso se conserva
+    assert "a" in cache and ("b", "expired") in evicted
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["evicted_size"] == 1 and stats["pinned_skips"] >= 1
+
+
+def test_memory_manager_restores_persistent_flags_after_eviction():
+    memory = MemoryManager()
+    memory.state_flags = TTLCache("state_flags_test", max_entries=1, on_evict=memory._archive_flags)
+
+    memory.set_flag("+34600000001", "property_id", 12)
+    memory.set_flag("34600000001", "escalation_in_progress", True)
+    memory.set_flag("34600000002", "guest_lang", "en")  # expulsa al primer chat
+
+    assert "34600000001" not in memory.state_flags
+    assert memory.get_flag("34600000001", "property_id") == 12
+    assert memory.get_flag("34600000001", "escalation_in_progress") is None
+    assert memory.get_flag("34600000002", "guest_lang") == "en"
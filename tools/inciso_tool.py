@@ -9,10 +9,11 @@ en segundo plano (por ejemplo, mientras consulta un dato pendiente).
 import logging
 import time
 import asyncio
-from typing import Optional
 from pydantic import BaseModel, Field
 from langchain.tools import StructuredTool
 
+from core.agent_context import current_turn, turn_scratch
+
 log = logging.getLogger("IncisoTool")
 
 
@@ -44,24 +45,38 @@ class IncisoTool:
         self.cooldown_seconds = cooldown_seconds
 
         # 🔒 Estado interno para evitar SPAM dentro del mismo chain
-        self._last_sent_at: Optional[float] = None
-        self._last_message: Optional[str] = None
-        self._send_count = 0  # 🔢 Protección adicional contra loops
+        # (si hay un turno del MainAgent enlazado, el estado vive en el turno).
+        self._local_state = {"last_sent_at": None, "last_message": None, "send_count": 0}
 
         log.info("✅ IncisoTool inicializado correctamente")
 
+    def _state(self) -> dict:
+        scratch = turn_scratch("inciso")
+        if scratch is None:
+            return self._local_state
+        if not scratch:
+            scratch.update({"last_sent_at": None, "last_message": None, "send_count": 0})
+        return scratch
+
+    def _resolve_callback(self):
+        if self.send_callback:
+            return self.send_callback
+        turn = current_turn()
+        return turn.send_callback if turn else None
+
     # --------------------------------------------------
     def _can_send(self, mensaje: str) -> bool:
         """Decide si se puede enviar un nuevo inciso o se suprime por cooldown o límite."""
+        state = self._state()
         # Máximo 2 incisos por sesión de agente
-        if self._send_count >= 2:
+        if state["send_count"] >= 2:
             log.warning("🚫 Límite de incisos alcanzado (2). Se ignora nuevo intento.")
             return False
 
-        if self._last_sent_at is None:
+        if state["last_sent_at"] is None:
             return True
 
-        elapsed = time.time() - self._last_sent_at
+        elapsed = time.time() - state["last_sent_at"]
 
         # 1️⃣ Si ha pasado muy poco tiempo, no mandamos nada.
         if elapsed < self.cooldown_seconds:
@@ -72,7 +87,7 @@ class IncisoTool:
             return False
 
         # 2️⃣ Si es el mismo mensaje literal, no lo repetimos.
-        if self._last_message and self._last_message.strip() == mensaje.strip():
+        if state["last_message"] and state["last_message"].strip() == mensaje.strip():
             log.debug("🔁 Inciso duplicado detectado, suprimido.")
             return False
 
@@ -93,7 +108,8 @@ class IncisoTool:
                 log.debug(f"🧩 Inciso suprimido (duplicado o cooldown): {mensaje}")
                 return "🟢 Inciso ya enviado — no repetir."
 
-            if not self.send_callback:
+            send_callback = self._resolve_callback()
+            if not send_callback:
                 log.warning("⚠️ No hay callback configurado para enviar inciso")
                 return (
                     "⚠️ Mensaje guardado pero no se pudo enviar "
@@ -101,20 +117,21 @@ class IncisoTool:
                 )
 
             # ✅ Enviar realmente el mensaje (soporta async y sync)
-            if asyncio.iscoroutinefunction(self.send_callback):
+            if asyncio.iscoroutinefunction(send_callback):
                 try:
                     loop = asyncio.get_running_loop()
-                    loop.create_task(self.send_callback(mensaje))
+                    loop.create_task(send_callback(mensaje))
                 except RuntimeError:
                     # No hay loop activo: ejecutamos sincrónicamente
-                    asyncio.run(self.send_callback(mensaje))
+                    asyncio.run(send_callback(mensaje))
             else:
-                self.send_callback(mensaje)
+                send_callback(mensaje)
 
             # 📦 Actualizar estado interno
-            self._last_sent_at = time.time()
-            self._last_message = mensaje
-            self._send_count += 1
+            state = self._state()
+            state["last_sent_at"] = time.time()
+            state["last_message"] = mensaje
+            state["send_count"] += 1
 
             log.info(f"📤 Inciso enviado al usuario: {mensaje[:80]}...")
             return f"✅ Mensaje intermedio enviado al usuario: '{mensaje}'"
@@ -879,13 +879,17 @@ async def confirmar_y_enviar(escalation_id: str, confirmed: bool, adjustments: s
             final_text_out = final_text_internal
             if guest_lang and guest_lang != "es":
                 try:
-                    final_text_out = language_manager.ensure_language(final_text_internal, guest_lang).strip() or final_text_internal
+                    final_text_out = (
+                        await language_manager.aensure_language(final_text_internal, guest_lang)
+                    ).strip() or final_text_internal
                 except Exception:
                     try:
-                        final_text_out = language_manager.translate_if_needed(
-                            final_text_internal,
-                            "es",
-                            guest_lang,
+                        final_text_out = (
+                            await language_manager.atranslate_if_needed(
+                                final_text_internal,
+                                "es",
+                                guest_lang,
+                            )
                         ).strip() or final_text_internal
                     except Exception:
                         final_text_out = final_text_internal
@@ -11,7 +11,14 @@ from langchain.tools import StructuredTool
 from pydantic import BaseModel, Field
 
 from core.mcp_client import get_tools
+from core.availability_cache import availability_cache
 from core.db import upsert_chat_reservation
+from core.pms_token_cache import (
+    get_pms_token,
+    invalidate_pms_token,
+    invoke_with_pms_token,
+    is_pms_auth_error,
+)
 
 log = logging.getLogger("OnboardingTools")
 
@@ -231,31 +238,45 @@ async def _obtener_token(
     *,
     instance_url: Optional[str] = None,
 ) -> Tuple[Optional[str], Optional[str]]:
-    """Reutiliza la tool 'buscar_token' expuesta por MCP."""
+    """Reutiliza la tool 'buscar_token' expuesta por MCP (token cacheado por instance_url)."""
     try:
         token_tool = _find_tool(tools, ["buscar_token"])
         if not token_tool:
             return None, "No se encontro la tool 'buscar_token' en MCP."
 
-        payload: dict[str, Any] = {}
-        if instance_url:
-            payload["instance_url"] = instance_url
-
-        token_raw = await token_tool.ainvoke(payload)
-        token_data = json.loads(token_raw) if isinstance(token_raw, str) else token_raw
-        token = (
-            token_data[0].get("key") if isinstance(token_data, list) else token_data.get("key")
-        )
+        try:
+            token = await get_pms_token(token_tool, instance_url)
+        except ValueError:
+            token = None
 
         if not token:
             return None, "No se pudo obtener el token de acceso."
 
-        return str(token).strip(), None
+        return token, None
     except Exception as exc:  # pragma: no cover - fallbacks de red
         log.error("Error obteniendo token desde MCP: %s", exc, exc_info=True)
         return None, f"Error obteniendo token desde MCP: {exc}"
 
 
+async def _invoke_with_token(
+    tools: list[Any],
+    token: str,
+    instance_url: Optional[str],
+    tool: Any,
+    payload: dict[str, Any],
+) -> Any:
+    """Consulta idempotente al PMS: si rechaza el token, se renueva y se reintenta una vez."""
+    token_tool = _find_tool(tools, ["buscar_token"])
+    if not token_tool:
+        return await tool.ainvoke({**payload, "key": token})
+    return await invoke_with_pms_token(
+        token_tool,
+        instance_url,
+        lambda key: tool.ainvoke({**payload, "key": key}),
+        token=token,
+    )
+
+
 def create_room_type_tool(memory_manager=None, chat_id: str = ""):
     class RoomTypeInput(BaseModel):
         property_id: Optional[int] = Field(
@@ -309,7 +330,7 @@ def create_room_type_tool(memory_manager=None, chat_id: str = ""):
             payload["property_id"] = pms_property_id
 
         try:
-            raw = await type_tool.ainvoke(payload)
+            raw = await _invoke_with_token(tools, token, instance_url, type_tool, payload)
             parsed = _safe_parse_json(raw, "tipos de habitacion")
             if parsed is None:
                 return "⚠️ No pude leer la lista de tipos de habitación (respuesta vacía o inválida)."
@@ -404,7 +425,7 @@ def create_reservation_tool(memory_manager=None, chat_id: str = ""):
         if instance_url:
             payload["instance_url"] = instance_url
             payload["property_id"] = pms_property_id
-        raw = await type_tool.ainvoke(payload)
+        raw = await _invoke_with_token(tools, token, instance_url, type_tool, payload)
         parsed = _safe_parse_json(raw, "resolver roomTypeId")
         items = parsed if isinstance(parsed, list) else []
 
@@ -541,6 +562,12 @@ def create_reservation_tool(memory_manager=None, chat_id: str = ""):
             if normalized_chat:
                 payload["chat_id"] = str(normalized_chat)
             raw = await reserva_tool.ainvoke(payload)
+            if is_pms_auth_error(raw):
+                # No se reintenta (no idempotente): el siguiente intento pedirá token nuevo.
+                invalidate_pms_token(instance_url, token)
+            else:
+                # La reserva cambia el inventario: descarta la disponibilidad cacheada.
+                availability_cache.invalidate(instance_url, pms_property_id)
             if raw is None:
                 log.error("Reserva devolvio respuesta vacia")
                 return "❌ No se obtuvo respuesta del PMS."
@@ -711,6 +738,8 @@ def create_reservation_tool(memory_manager=None, chat_id: str = ""):
 
             return response_text
         except Exception as exc:  # pragma: no cover - fallbacks de red
+            if is_pms_auth_error(exc):
+                invalidate_pms_token(instance_url, token)
             log.error("Error creando reserva: %s", exc, exc_info=True)
             return f"❌ Error creando la reserva: {exc}"
 
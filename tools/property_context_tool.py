@@ -16,6 +16,7 @@ from typing import Optional, Any
 from pydantic import BaseModel, Field
 from langchain.tools import StructuredTool
 
+from core.agent_context import current_chat_id
 from core.instance_context import (
     DEFAULT_PROPERTY_TABLE,
     fetch_property_by_code,
@@ -130,8 +131,13 @@ class PropertyContextTool:
 
     def __init__(self, memory_manager=None, chat_id: str = ""):
         self.memory_manager = memory_manager
-        self.chat_id = chat_id
-        log.info("✅ PropertyContextTool inicializado para chat %s", chat_id)
+        self._chat_id = chat_id
+        log.info("✅ PropertyContextTool inicializado para chat %s", chat_id or "(turno enlazado)")
+
+    @property
+    def chat_id(self) -> str:
+        # Sin chat fijo, la tool es compartida y usa el chat del turno en curso.
+        return self._chat_id or current_chat_id()
 
     def _resolve_table(self, property_table: Optional[str]) -> str:
         if property_table:
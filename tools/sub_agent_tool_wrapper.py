@@ -5,13 +5,17 @@ from __future__ import annotations
 import asyncio
 import logging
 import re
+import time
 from datetime import datetime
 from inspect import iscoroutinefunction, signature
 from typing import Any, Type
 
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
+from core.agent_context import current_turn
 from core.config import ModelConfig, ModelTier
+from core.flight_recorder import span
+from core.metrics import AGENT_TOOL_SECONDS
 
 log = logging.getLogger("SubAgentTool")
 
@@ -44,7 +48,8 @@ class SubAgentTool(BaseTool):
 
     sub_agent: Any
     memory_manager: Any
-    chat_id: str
+    # Vacíos → se resuelven desde el turno enlazado (tool compartida entre chats).
+    chat_id: str = ""
     hotel_name: str = ""
 
     args_schema: Type[BaseModel] = SubAgentToolInput
@@ -63,6 +68,18 @@ class SubAgentTool(BaseTool):
             raw = raw.split(":")[-1].strip()
         return re.sub(r"\D", "", raw).strip() or raw
 
+    def _turn_chat_id(self) -> str:
+        if self.chat_id:
+            return self.chat_id
+        turn = current_turn()
+        return turn.chat_id if turn else ""
+
+    def _turn_hotel_name(self) -> str:
+        if self.hotel_name:
+            return self.hotel_name
+        turn = current_turn()
+        return turn.hotel_name if turn else ""
+
     async def _is_query_aligned(self, canonical_question: str, tool_query: str) -> bool:
         canonical = self._normalize_text(canonical_question)
         query = self._normalize_text(tool_query)
@@ -101,6 +118,35 @@ class SubAgentTool(BaseTool):
         motivo: str | None = None,
         tipo: str | None = None,
     ) -> str:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            with span(f"tool.{self.name}") as tool_span:
+                result = await self._invoke_sub_agent(
+                    query=query,
+                    pregunta=pregunta,
+                    mensaje_cliente=mensaje_cliente,
+                    motivo=motivo,
+                    tipo=tipo,
+                )
+                if not result.startswith(f"Error procesando consulta en {self.name}:"):
+                    status = "ok"
+                elif tool_span is not None:
+                    tool_span.status = "error"
+            return result
+        finally:
+            AGENT_TOOL_SECONDS.observe(time.perf_counter() - started, tool=self.name, status=status)
+
+    async def _invoke_sub_agent(
+        self,
+        query: str | None = None,
+        pregunta: str | None = None,
+        mensaje_cliente: str | None = None,
+        motivo: str | None = None,
+        tipo: str | None = None,
+    ) -> str:
+        chat_id = self._turn_chat_id()
+        hotel_name = self._turn_hotel_name()
         try:
             # Prioriza siempre la pregunta completa del huésped para no perder contexto.
             effective_query = (pregunta or "").strip() or (query or "").strip() or (mensaje_cliente or "").strip()
@@ -110,16 +156,16 @@ class SubAgentTool(BaseTool):
             log.info("SubAgentTool._arun: %s - query: %s", self.name, effective_query[:50])
 
             chat_history = None
-            if self.memory_manager and self.chat_id:
+            if self.memory_manager and chat_id:
                 try:
                     chat_history = self.memory_manager.get_memory_as_messages(
-                        conversation_id=self.chat_id,
+                        conversation_id=chat_id,
                         limit=20,
                     )
                 except Exception as mm_err:
                     log.warning(
                         "No se pudo recuperar chat_history para %s: %s",
-                        self.chat_id,
+                        chat_id,
                         mm_err,
                     )
 
@@ -146,13 +192,13 @@ class SubAgentTool(BaseTool):
                 reason = motivo or "Consulta del huésped gestionada por MainAgent"
                 escalation_type = tipo or "manual"
                 result = await self.sub_agent.handle_guest_escalation(
-                    chat_id=self.chat_id,
+                    chat_id=chat_id,
                     guest_message=effective_query,
                     reason=reason,
                     escalation_type=escalation_type,
                     context=(
-                        f"Escalación manual desde MainAgent ({self.hotel_name})"
-                        if self.hotel_name
+                        f"Escalación manual desde MainAgent ({hotel_name})"
+                        if hotel_name
                         else "Escalación manual desde MainAgent"
                     ),
                 )
@@ -161,7 +207,7 @@ class SubAgentTool(BaseTool):
             elif hasattr(self.sub_agent, "handle"):
                 result = await self.sub_agent.handle(
                     pregunta=effective_query,
-                    chat_id=self.chat_id,
+                    chat_id=chat_id,
                     chat_history=chat_history,
                 )
 
@@ -169,7 +215,7 @@ class SubAgentTool(BaseTool):
             elif hasattr(self.sub_agent, "ainvoke"):
                 invoke_kwargs = {
                     "user_input": effective_query,
-                    "chat_id": self.chat_id,
+                    "chat_id": chat_id,
                     "escalation_context": "MAIN_AGENT_TOOL",
                 }
 
@@ -182,7 +228,7 @@ class SubAgentTool(BaseTool):
                     invoke_kwargs["chat_history"] = chat_history
 
                 if "escalation_payload" in params or "auto_notify" in params:
-                    normalized_chat_id = self._normalize_chat_id(self.chat_id)
+                    normalized_chat_id = self._normalize_chat_id(chat_id)
                     payload = {
                         "escalation_id": f"esc_{normalized_chat_id}_{int(datetime.utcnow().timestamp())}",
                         "guest_chat_id": normalized_chat_id,
@@ -190,8 +236,8 @@ class SubAgentTool(BaseTool):
                         "escalation_type": tipo or "manual",
                         "reason": motivo or "Solicitud del huésped desde MainAgent",
                         "context": (
-                            f"Escalación manual desde MainAgent ({self.hotel_name})"
-                            if self.hotel_name
+                            f"Escalación manual desde MainAgent ({hotel_name})"
+                            if hotel_name
                             else "Escalación manual desde MainAgent"
                         ),
                     }
@@ -211,14 +257,14 @@ class SubAgentTool(BaseTool):
                     result = await invoke_callable(
                         effective_query,
                         chat_history=chat_history,
-                        chat_id=self.chat_id,
+                        chat_id=chat_id,
                     )
                 else:
                     result = await asyncio.to_thread(
                         invoke_callable,
                         effective_query,
                         chat_history=chat_history,
-                        chat_id=self.chat_id,
+                        chat_id=chat_id,
                     )
             else:
                 raise ValueError(
@@ -272,7 +318,7 @@ def create_sub_agent_tool(
     description: str,
     sub_agent: Any,
     memory_manager: Any,
-    chat_id: str,
+    chat_id: str = "",
     hotel_name: str = "",
 ) -> SubAgentTool:
     """Factory function para crear sub-agent tools."""
@@ -16,6 +16,7 @@ from pydantic import BaseModel, Field
 from core.db import get_conversation_history, get_active_chat_reservation
 from core.db import supabase
 from core.mcp_client import get_tools
+from core.pms_token_cache import get_pms_token, invoke_with_pms_token
 from core.instance_context import (
     DEFAULT_PROPERTY_TABLE,
     fetch_instance_by_code,
@@ -1739,29 +1740,40 @@ def create_remove_from_kb_tool(
 async def _obtener_token_mcp(tools: list[Any]) -> tuple[Optional[str], Optional[str]]:
     """
     Reutiliza la tool 'buscar_token' expuesta por MCP (igual que DispoPreciosAgent).
-    Devuelve (token, error). Si hay error, token es None.
+    El token se cachea (core.pms_token_cache). Devuelve (token, error). Si hay error, token es None.
     """
     try:
         token_tool = next((t for t in tools if t.name == "buscar_token"), None)
         if not token_tool:
             return None, "No se encontró la tool 'buscar_token' en MCP."
 
-        token_raw = await token_tool.ainvoke({})
-        token_data = json.loads(token_raw) if isinstance(token_raw, str) else token_raw
-        token = (
-            token_data[0].get("key") if isinstance(token_data, list)
-            else token_data.get("key")
-        )
+        try:
+            token = await get_pms_token(token_tool)
+        except ValueError:
+            token = None
 
         if not token:
             return None, "No se pudo obtener el token de acceso."
 
-        return str(token).strip(), None
+        return token, None
     except Exception as exc:
         log.error("Error obteniendo token desde MCP: %s", exc, exc_info=True)
         return None, f"Error obteniendo token desde MCP: {exc}"
 
 
+async def _consulta_pms_con_token(tools: list[Any], tool: Any, payload: dict[str, Any]) -> Any:
+    """Consulta al PMS renovando el token una vez si lo rechaza."""
+    token_tool = next((t for t in tools if t.name == "buscar_token"), None)
+    if not token_tool:
+        return await tool.ainvoke(payload)
+    return await invoke_with_pms_token(
+        token_tool,
+        None,
+        lambda key: tool.ainvoke({**payload, "key": key}),
+        token=payload.get("key"),
+    )
+
+
 def create_consulta_reserva_general_tool(memory_manager=None, chat_id: str = ""):
     async def _consulta_reserva_general(
         fecha_inicio: str,
@@ -1843,7 +1855,7 @@ def create_consulta_reserva_general_tool(memory_manager=None, chat_id: str = "")
             )
 
         try:
-            raw_response = await consulta_tool.ainvoke(payload)
+            raw_response = await _consulta_pms_con_token(tools, consulta_tool, payload)
             if raw_response is None:
                 log.error("Consulta de reservas devolvió respuesta vacía (raw_response=None)")
                 return "❌ No se pudo obtener respuesta del PMS (respuesta vacía)."
@@ -2086,7 +2098,7 @@ def create_consulta_reserva_persona_tool(memory_manager=None, chat_id: str = "")
             )
 
         try:
-            raw_response = await consulta_tool.ainvoke(payload)
+            raw_response = await _consulta_pms_con_token(tools, consulta_tool, payload)
             parsed = json.loads(raw_response) if isinstance(raw_response, str) else raw_response
             if memory_manager and chat_id and isinstance(parsed, dict):
                 try:
@@ -10,7 +10,7 @@ import logging
 from typing import Optional
 from pydantic import BaseModel, Field
 from langchain.tools import StructuredTool
-from langchain_openai import ChatOpenAI
+from core.config import ModelConfig
 from core.utils.utils_prompt import load_prompt
 
 log = logging.getLogger("ThinkTool")
@@ -34,7 +34,7 @@ class ThinkTool:
         Args:
             model_name: Modelo de OpenAI a usar para la reflexión
         """
-        self.llm = ChatOpenAI(model=model_name, temperature=0.3)
+        self.llm = ModelConfig.get_custom_llm(model_name, 0.3, label="think")
         
         # Cargar prompt específico para Think
         try: